@@ -14,6 +14,7 @@ django_asgi_app = get_asgi_application()  # 先初始化Django，再导入Channe
 # 第三步：导入Channels路由（此时settings已加载，models可正常导入）
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
+import adb_manager.routing
 import script_center.routing
 # 注意：如果task_orchestration.routing不存在/未使用，注释掉这行！
 import task_orchestration.routing
@@ -23,7 +24,8 @@ application = ProtocolTypeRouter({
     "http": django_asgi_app,  # 已初始化的Django HTTP应用
     "websocket": AuthMiddlewareStack(
         URLRouter(
-            script_center.routing.websocket_urlpatterns
+            adb_manager.routing.websocket_urlpatterns
+            + script_center.routing.websocket_urlpatterns
             # 若task_orchestration无websocket路由，删除下面的拼接
             + task_orchestration.routing.websocket_urlpatterns
         )
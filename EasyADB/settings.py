@@ -209,10 +209,42 @@ if dynamic_python_path not in PYTHON_FALLBACK_PATHS:
 
 # Redis连接池配置（复用已有REDIS_HOST/REDIS_PORT/REDIS_DB）
 REDIS_SOCKET_TIMEOUT = int(os.getenv("REDIS_SOCKET_TIMEOUT", 2))
+# 连接池中连接空闲超过该秒数后使用前先检查；Redis可用时的探测间隔（秒）
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+# Redis不可用时重新探测的最大退避间隔（秒），期间使用进程内存降级存储
+REDIS_RETRY_BACKOFF_MAX = int(os.getenv("REDIS_RETRY_BACKOFF_MAX", 30))
+# 进程内L1缓存（设备状态等热点键）：有效期（秒，0为关闭）、失效广播频道、最大键数
+REDIS_L1_TTL = float(os.getenv("REDIS_L1_TTL", 1.0))
+REDIS_L1_CHANNEL = os.getenv("REDIS_L1_CHANNEL", "adb:l1:invalidate")
+REDIS_L1_MAX_KEYS = int(os.getenv("REDIS_L1_MAX_KEYS", 10000))
 
 # 脚本执行超时配置
 SCRIPT_EXECUTION_TIMEOUT = int(os.getenv("SCRIPT_EXECUTION_TIMEOUT", 3000))  # 50分钟
 
+# 执行日志合并写入：每隔多少毫秒、或缓冲超过多少字节时保存并推送一次
+SCRIPT_LOG_FLUSH_INTERVAL_MS = int(os.getenv("SCRIPT_LOG_FLUSH_INTERVAL_MS", 500))
+SCRIPT_LOG_FLUSH_BYTES = int(os.getenv("SCRIPT_LOG_FLUSH_BYTES", 65536))
+# 日志页面WebSocket连接时（未指定since）只发送每个输出流的最后多少字节
+SCRIPT_LOG_WS_TAIL_BYTES = int(os.getenv("SCRIPT_LOG_WS_TAIL_BYTES", 262144))
+
+# 执行输出存储（脚本/编排/步骤日志共用，见 common/log_store.py）：
+# 后端 file（本地分段文件）或 redis（运行中写 Redis Stream，结束后压缩到磁盘）、分段目录、单个分段大小、Stream键前缀、
+# 未压缩的 Stream 在最后一次追加多少秒后过期（执行进程异常退出、未能压缩的日志）
+EXEC_LOG_BACKEND = os.getenv("EXEC_LOG_BACKEND", "file")
+EXEC_LOG_ROOT = os.getenv("EXEC_LOG_ROOT", os.path.join(BASE_DIR, "exec_logs"))
+EXEC_LOG_SEGMENT_BYTES = int(os.getenv("EXEC_LOG_SEGMENT_BYTES", 4 * 1024 * 1024))
+EXEC_LOG_REDIS_PREFIX = os.getenv("EXEC_LOG_REDIS_PREFIX", "execlog:")
+EXEC_LOG_REDIS_TTL = int(os.getenv("EXEC_LOG_REDIS_TTL", 7 * 24 * 3600))
+
+# 脚本执行监督进程（见 script_center/supervisor.py）：开关、最多同时执行的脚本数、任务队列、状态键、
+# 心跳间隔（秒）、阻塞调用线程数
+SCRIPT_SUPERVISOR_ENABLED = os.getenv("SCRIPT_SUPERVISOR_ENABLED", "False").lower() == "true"
+SCRIPT_SUPERVISOR_MAX_RUNS = int(os.getenv("SCRIPT_SUPERVISOR_MAX_RUNS", 200))
+SCRIPT_SUPERVISOR_QUEUE = os.getenv("SCRIPT_SUPERVISOR_QUEUE", "script_supervisor:queue")
+SCRIPT_SUPERVISOR_STATE_KEY = os.getenv("SCRIPT_SUPERVISOR_STATE_KEY", "script_supervisor:state")
+SCRIPT_SUPERVISOR_HEARTBEAT = int(os.getenv("SCRIPT_SUPERVISOR_HEARTBEAT", 5))
+SCRIPT_SUPERVISOR_THREADS = int(os.getenv("SCRIPT_SUPERVISOR_THREADS", 32))
+
 # 进程终止相关配置（复用部分已有配置）
 SCRIPT_GRACEFUL_TERMINATE_WAIT = int(os.getenv("SCRIPT_GRACEFUL_TERMINATE_WAIT", 5))  # 优雅等待默认时间
 # （复用已有SCRIPT_STOP_WAIT_TIME、SCRIPT_PROCESS_TERMINATE_WAIT、SCRIPT_REDIS_STOP_FLAG_EXPIRE）
@@ -225,6 +257,8 @@ SCRIPT_REDIS_STOP_FLAG_PREFIX = os.getenv("SCRIPT_REDIS_STOP_FLAG_PREFIX", "airt
 # 日志与展示配置
 ORCH_LOG_FILE = os.getenv("ORCH_LOG_FILE", "orchestration_execution.log")
 ORCH_RECENT_LOGS_LIMIT = int(os.getenv("ORCH_RECENT_LOGS_LIMIT", 10))
+# 日志详情页每个输出（编排日志与每个步骤的 stdout/stderr）只展示最后多少字节
+ORCH_LOG_TAIL_BYTES = int(os.getenv("ORCH_LOG_TAIL_BYTES", 65536))
 
 # 执行超时与进程控制
 ORCH_STEP_TIMEOUT_BUFFER = int(os.getenv("ORCH_STEP_TIMEOUT_BUFFER", 10))
@@ -243,3 +277,89 @@ ORCH_LANG = os.getenv("ORCH_LANG", "en_US.UTF-8")
 
 # 其他配置
 ORCH_MOBILE_VALID_LENGTH = int(os.getenv("ORCH_MOBILE_VALID_LENGTH", 11))
+
+# ====================== ADB Manager 设备通信配置 ======================
+# 是否优先通过 adb server 协议（TCP 5037）执行命令，关闭后全部回退为 fork adb 可执行文件
+ADB_NATIVE_CLIENT = os.getenv("ADB_NATIVE_CLIENT", "True").lower() == "true"
+ADB_SERVER_HOST = os.getenv("ADB_SERVER_HOST", "127.0.0.1")
+ADB_SERVER_PORT = int(os.getenv("ADB_SERVER_PORT", 5037))
+# 协议客户端连接池：最大并发连接数 / 预建立的空闲连接数
+ADB_CLIENT_POOL_SIZE = int(os.getenv("ADB_CLIENT_POOL_SIZE", 16))
+ADB_CLIENT_POOL_IDLE = int(os.getenv("ADB_CLIENT_POOL_IDLE", 4))
+
+# 设备在线状态追踪（python manage.py track_devices 常驻进程，订阅 adb track-devices 推送）
+ADB_DEVICE_EVENT_CHANNEL = os.getenv("ADB_DEVICE_EVENT_CHANNEL", "adb:device:events")
+ADB_TRACKER_RECONNECT_MAX_WAIT = int(os.getenv("ADB_TRACKER_RECONNECT_MAX_WAIT", 30))
+# 设备状态有效期（秒）：超过该时间未续期的状态视为 stale（状态未知），执行任务时拒绝这些设备
+ADB_STATUS_TTL = int(os.getenv("ADB_STATUS_TTL", 180))
+# 设备状态心跳间隔（秒），需小于 ADB_STATUS_TTL
+ADB_STATUS_HEARTBEAT_INTERVAL = int(os.getenv("ADB_STATUS_HEARTBEAT_INTERVAL", 60))
+
+# 刷新所有设备时使用单次扫描对账（一次 adb devices -l，只重连缺失的网络设备），False 则逐台 adb connect
+ADB_FLEET_RECONCILE = os.getenv("ADB_FLEET_RECONCILE", "True").lower() == "true"
+
+# 一键连接/断开、逐台检查：后台线程池并发宽度、单台设备命令超时（秒）、任务状态在Redis中的保留时间（秒）
+ADB_BULK_MAX_WORKERS = int(os.getenv("ADB_BULK_MAX_WORKERS", 8))
+ADB_BULK_DEVICE_TIMEOUT = int(os.getenv("ADB_BULK_DEVICE_TIMEOUT", 10))
+ADB_BULK_JOB_TTL = int(os.getenv("ADB_BULK_JOB_TTL", 3600))
+# 逐台检查所有设备的全局截止时间（秒），超时未完成的设备记为检查超时
+ADB_CHECK_ALL_DEADLINE = int(os.getenv("ADB_CHECK_ALL_DEADLINE", 60))
+# 设备重连退避：首次失败后等待秒数（每次失败翻倍）、最长等待秒数、在线设备的探测间隔、
+# 随机抖动比例、状态翻转惩罚的半衰期（秒）
+ADB_RECONNECT_BACKOFF_BASE = int(os.getenv("ADB_RECONNECT_BACKOFF_BASE", 15))
+ADB_RECONNECT_BACKOFF_MAX = int(os.getenv("ADB_RECONNECT_BACKOFF_MAX", 3600))
+ADB_RECONNECT_HEALTHY_INTERVAL = int(os.getenv("ADB_RECONNECT_HEALTHY_INTERVAL", 300))
+ADB_RECONNECT_JITTER = float(os.getenv("ADB_RECONNECT_JITTER", 0.2))
+ADB_RECONNECT_FLAP_HALF_LIFE = int(os.getenv("ADB_RECONNECT_FLAP_HALF_LIFE", 600))
+# 局域网设备发现：并发探测数（受进程文件描述符上限限制）、单次探测超时（秒）、单次扫描最大地址数
+ADB_DISCOVERY_CONCURRENCY = int(os.getenv("ADB_DISCOVERY_CONCURRENCY", 512))
+ADB_DISCOVERY_PROBE_TIMEOUT = float(os.getenv("ADB_DISCOVERY_PROBE_TIMEOUT", 0.5))
+ADB_DISCOVERY_MAX_HOSTS = int(os.getenv("ADB_DISCOVERY_MAX_HOSTS", 65536))
+# CSV 批量导入设备：单次最大行数、bulk_create 每批写入行数
+ADB_IMPORT_MAX_ROWS = int(os.getenv("ADB_IMPORT_MAX_ROWS", 10000))
+ADB_IMPORT_BATCH_SIZE = int(os.getenv("ADB_IMPORT_BATCH_SIZE", 500))
+# 批量执行 shell 命令：单台设备默认超时 / 允许传入的最大超时（秒）
+ADB_FANOUT_DEVICE_TIMEOUT = int(os.getenv("ADB_FANOUT_DEVICE_TIMEOUT", 30))
+ADB_FANOUT_MAX_TIMEOUT = int(os.getenv("ADB_FANOUT_MAX_TIMEOUT", 300))
+# 设备详情探测（一次 adb shell 获取全部详情）的超时时间（秒）
+ADB_PROBE_TIMEOUT = int(os.getenv("ADB_PROBE_TIMEOUT", 15))
+# 设备操作日志异步批量写入：队列长度（满时丢弃）、每批条数、写入间隔（秒）；False 则同步写入
+ADB_OPLOG_ASYNC = os.getenv("ADB_OPLOG_ASYNC", "True").lower() == "true"
+ADB_OPLOG_QUEUE_SIZE = int(os.getenv("ADB_OPLOG_QUEUE_SIZE", 10000))
+ADB_OPLOG_BATCH_SIZE = int(os.getenv("ADB_OPLOG_BATCH_SIZE", 200))
+ADB_OPLOG_FLUSH_INTERVAL = float(os.getenv("ADB_OPLOG_FLUSH_INTERVAL", 1.0))
+# 设备屏幕实时画面：最大帧率、设备正在运行脚本时的帧率、画面长边最大像素（需安装 Pillow）、JPEG 质量、单次截图超时（秒）
+ADB_SCREEN_MAX_FPS = float(os.getenv("ADB_SCREEN_MAX_FPS", 5))
+ADB_SCREEN_BUSY_FPS = float(os.getenv("ADB_SCREEN_BUSY_FPS", 1))
+ADB_SCREEN_MAX_SIZE = int(os.getenv("ADB_SCREEN_MAX_SIZE", 720))
+ADB_SCREEN_JPEG_QUALITY = int(os.getenv("ADB_SCREEN_JPEG_QUALITY", 70))
+ADB_SCREEN_CAPTURE_TIMEOUT = int(os.getenv("ADB_SCREEN_CAPTURE_TIMEOUT", 10))
+# 文件浏览器目录索引：目录列表缓存时间（秒）、目录大小统计缓存时间（秒）、默认/最大每页条数
+ADB_DIR_INDEX_TTL = int(os.getenv("ADB_DIR_INDEX_TTL", 30))
+ADB_DIR_SWEEP_TTL = int(os.getenv("ADB_DIR_SWEEP_TTL", 300))
+ADB_DIR_PAGE_SIZE = int(os.getenv("ADB_DIR_PAGE_SIZE", 200))
+ADB_DIR_PAGE_SIZE_MAX = int(os.getenv("ADB_DIR_PAGE_SIZE_MAX", 1000))
+# 文件上传/下载：单次读写超时（秒）、传输期间占用设备名额的最长时间（秒）
+ADB_TRANSFER_TIMEOUT = int(os.getenv("ADB_TRANSFER_TIMEOUT", 30))
+ADB_TRANSFER_SLOT_TTL = int(os.getenv("ADB_TRANSFER_SLOT_TTL", 3600))
+# 设备只读属性（品牌/型号/系统版本等）缓存：免校验时间（秒），超过后用 boot_id 校验；缓存最长保留时间（秒）
+ADB_PROPERTY_CACHE_REVALIDATE = int(os.getenv("ADB_PROPERTY_CACHE_REVALIDATE", 300))
+ADB_PROPERTY_CACHE_TTL = int(os.getenv("ADB_PROPERTY_CACHE_TTL", 7 * 24 * 3600))
+
+# 单设备命令并发控制：interactive（界面操作）/ background（脚本、编排步骤）两个通道
+ADB_GOVERNOR_ENABLED = os.getenv("ADB_GOVERNOR_ENABLED", "True").lower() == "true"
+ADB_GOVERNOR_INTERACTIVE_MAX = int(os.getenv("ADB_GOVERNOR_INTERACTIVE_MAX", 3))
+# 设备正在运行脚本时，界面操作的最大并发数
+ADB_GOVERNOR_INTERACTIVE_MAX_WHILE_BUSY = int(os.getenv("ADB_GOVERNOR_INTERACTIVE_MAX_WHILE_BUSY", 1))
+ADB_GOVERNOR_BACKGROUND_MAX = int(os.getenv("ADB_GOVERNOR_BACKGROUND_MAX", 1))
+# 界面操作 / 后台任务获取名额的最长等待时间（秒）
+ADB_GOVERNOR_WAIT = int(os.getenv("ADB_GOVERNOR_WAIT", 10))
+ADB_GOVERNOR_BACKGROUND_WAIT = int(os.getenv("ADB_GOVERNOR_BACKGROUND_WAIT", 30))
+# 名额最长持有时间（秒），进程崩溃未释放时自动过期
+ADB_GOVERNOR_LEASE_TTL = int(os.getenv("ADB_GOVERNOR_LEASE_TTL", 120))
+
+# 设备执行租约：同一设备同时只运行一个脚本/编排任务，其余提交按优先级排队，释放后自动启动
+# 租约有效期（秒，执行期间自动续期，进程崩溃后过期）、续期间隔（秒）
+ADB_LEASE_ENABLED = os.getenv("ADB_LEASE_ENABLED", "True").lower() == "true"
+ADB_LEASE_TTL = int(os.getenv("ADB_LEASE_TTL", 120))
+ADB_LEASE_RENEW_INTERVAL = int(os.getenv("ADB_LEASE_RENEW_INTERVAL", 30))
@@ -0,0 +1,532 @@
+"""ADB Server 协议客户端
+
+直接通过 TCP（默认 127.0.0.1:5037）与 adb server 通信，替代每条命令都 fork 一个 adb 进程的做法。
+支持的服务：host:version / host:devices-l / host:connect / host:disconnect /
+host:transport:<serial> / shell: / shell,v2,raw: / exec: / sync: / host-serial:<serial>:*
+
+注意：adb server 在一次服务结束后会关闭连接，因此连接池复用的是「预先建立好的空闲连接」，
+并用信号量限制对 adb server 的并发连接数。
+"""
+import shlex
+import socket
+import struct
+import subprocess
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADB_SERVER_HOST = "127.0.0.1"
+DEFAULT_ADB_SERVER_PORT = 5037
+
+# shell v2 协议包类型
+SHELL_ID_STDIN = 0
+SHELL_ID_STDOUT = 1
+SHELL_ID_STDERR = 2
+SHELL_ID_EXIT = 3
+SHELL_ID_CLOSE_STDIN = 4
+
+# v1 shell 无退出码，通过哨兵行回传
+_V1_EXIT_SENTINEL = "__EASYADB_EXIT__:"
+
+# sync 协议：每个 DATA 包最大 64KB
+SYNC_DATA_MAX = 64 * 1024
+
+
+class AdbError(Exception):
+    """ADB 协议通用异常"""
+
+
+class AdbServerUnavailable(AdbError):
+    """adb server 无法连接（未启动/端口错误）"""
+
+
+class AdbCommandFailed(AdbError):
+    """adb server 返回 FAIL"""
+
+
+class AdbUnsupportedCommand(AdbError):
+    """命令无法通过协议客户端执行（需回退到 adb 可执行文件）"""
+
+
+class AdbConnectionClosed(AdbError):
+    """adb 连接被对端关闭"""
+
+
+class _ShellV2Unsupported(AdbError):
+    """设备不支持 shell_v2 协议"""
+
+
+class AdbConnectionPool:
+    """adb server 连接池（预建立空闲连接 + 限制最大并发连接数）"""
+
+    def __init__(self, host, port, max_size=16, max_idle=4, connect_timeout=2):
+        self.host = host
+        self.port = port
+        self.max_idle = max_idle
+        self.connect_timeout = connect_timeout
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _dial(self):
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        except OSError as e:
+            raise AdbServerUnavailable(f"无法连接adb server {self.host}:{self.port}：{e}")
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def acquire(self, timeout=None):
+        """获取一个连接（优先使用预建立的空闲连接），返回 (sock, 是否为复用的空闲连接)"""
+        if not self._slots.acquire(timeout=timeout):
+            raise AdbError("adb server 连接池已满，获取连接超时")
+        try:
+            with self._lock:
+                sock = self._idle.pop() if self._idle else None
+            if sock is not None:
+                return sock, True
+            return self._dial(), False
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, sock):
+        """归还连接：adb连接为一次性使用，直接关闭并补充一个空闲连接"""
+        try:
+            sock.close()
+        except OSError:
+            pass
+        finally:
+            self._slots.release()
+        self._refill()
+
+    def discard_idle(self):
+        """丢弃所有空闲连接（adb server 重启后调用）"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for sock in idle:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _refill(self):
+        with self._lock:
+            if len(self._idle) >= self.max_idle:
+                return
+        try:
+            sock = self._dial()
+        except AdbServerUnavailable:
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(sock)
+                return
+        sock.close()
+
+
+class AdbConnection:
+    """单次 adb 服务会话（上下文管理器，结束时自动归还连接池）"""
+
+    def __init__(self, pool, timeout=None):
+        self.pool = pool
+        self.timeout = timeout
+        self.sock = None
+        self._reused = False
+
+    def __enter__(self):
+        self.sock, self._reused = self.pool.acquire(timeout=self.timeout)
+        self.sock.settimeout(self.timeout)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.sock is not None:
+            self.pool.release(self.sock)
+            self.sock = None
+
+    # ---------- 底层读写 ----------
+    def send_request(self, service):
+        payload = service.encode("utf-8")
+        data = b"%04x" % len(payload) + payload
+        try:
+            self.sock.sendall(data)
+            self._read_status()
+        except (AdbConnectionClosed, ConnectionError):
+            if not self._reused:
+                raise
+            # 预建立的空闲连接可能已被server关闭（如adb server重启），换新连接重试一次
+            self._reused = False
+            self.pool.discard_idle()
+            self.sock.close()
+            self.sock = self.pool._dial()
+            self.sock.settimeout(self.timeout)
+            self.sock.sendall(data)
+            self._read_status()
+        # 首个请求成功后连接即视为已使用，后续请求失败不再重试
+        self._reused = False
+
+    def _read_status(self):
+        status = self.read_exact(4)
+        if status == b"OKAY":
+            return
+        if status == b"FAIL":
+            raise AdbCommandFailed(self.read_length_prefixed())
+        raise AdbError(f"adb server 返回未知状态：{status!r}")
+
+    def read_exact(self, size):
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            chunk = self.sock.recv(remaining)
+            if not chunk:
+                raise AdbConnectionClosed("adb 连接被提前关闭")
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b"".join(chunks)
+
+    def read_length_prefixed(self):
+        length = int(self.read_exact(4), 16)
+        return self.read_exact(length).decode("utf-8", errors="ignore") if length else ""
+
+    def read_all(self):
+        chunks = []
+        while True:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    def iter_chunks(self, chunk_size=65536):
+        while True:
+            chunk = self.sock.recv(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+class AdbClient:
+    """ADB Server 协议客户端"""
+
+    def __init__(self, host=DEFAULT_ADB_SERVER_HOST, port=DEFAULT_ADB_SERVER_PORT,
+                 pool_size=16, max_idle=4, connect_timeout=2):
+        self.pool = AdbConnectionPool(host, port, max_size=pool_size, max_idle=max_idle,
+                                      connect_timeout=connect_timeout)
+        self._shell_v2_support = {}
+        self._support_lock = threading.Lock()
+
+    def _connection(self, timeout=None):
+        return AdbConnection(self.pool, timeout=timeout)
+
+    # ===================== host 服务 =====================
+    def host_query(self, service, timeout=10):
+        """执行 host:* 查询服务，返回长度前缀的应答文本"""
+        with self._connection(timeout) as conn:
+            conn.send_request(service)
+            return conn.read_length_prefixed()
+
+    def version(self, timeout=5):
+        return int(self.host_query("host:version", timeout=timeout), 16)
+
+    def devices(self, long=True, timeout=10):
+        """获取设备列表：[{"serial", "status", "details"}]"""
+        raw = self.host_query("host:devices-l" if long else "host:devices", timeout=timeout)
+        return parse_devices_output(raw)
+
+    def connect(self, address, timeout=10):
+        return self.host_query(f"host:connect:{address}", timeout=timeout)
+
+    def disconnect(self, address, timeout=10):
+        return self.host_query(f"host:disconnect:{address}", timeout=timeout)
+
+    def get_serialno(self, serial, timeout=10):
+        return self.host_query(f"host-serial:{serial}:get-serialno", timeout=timeout)
+
+    def get_state(self, serial, timeout=10):
+        return self.host_query(f"host-serial:{serial}:get-state", timeout=timeout)
+
+    def wait_for_device(self, serial, timeout=10):
+        """等待设备上线（由 adb server 阻塞应答，超时由 socket 超时控制）"""
+        with self._connection(timeout) as conn:
+            conn.send_request(f"host-serial:{serial}:wait-for-any-device")
+            # wait-for 服务成功时会再返回一个 OKAY
+            conn._read_status()
+
+    def track_devices(self, long=True, connect_timeout=5):
+        """
+        订阅设备变化（host:track-devices-l），每次设备列表变化产出一份完整快照
+        连接会一直保持，直到 adb server 关闭或调用方停止迭代
+        """
+        with self._connection(connect_timeout) as conn:
+            conn.send_request("host:track-devices-l" if long else "host:track-devices")
+            # 订阅建立后阻塞等待推送，不设读超时
+            conn.sock.settimeout(None)
+            while True:
+                yield parse_devices_output(conn.read_length_prefixed())
+
+    # ===================== 设备服务 =====================
+    def _open_device_service(self, conn, serial, service):
+        conn.send_request(f"host:transport:{serial}")
+        conn.send_request(service)
+
+    def shell(self, serial, command, timeout=10):
+        """执行 shell 命令，返回 (returncode, stdout_bytes, stderr_bytes)"""
+        if self._shell_v2_support.get(serial, True):
+            try:
+                return self._shell_v2(serial, command, timeout)
+            except _ShellV2Unsupported:
+                # 设备不支持 shell_v2（旧安卓），记住结果后回退到 v1
+                with self._support_lock:
+                    self._shell_v2_support[serial] = False
+        return self._shell_v1(serial, command, timeout)
+
+    def _shell_v2(self, serial, command, timeout):
+        stdout, stderr = [], []
+        returncode = None
+        with self._connection(timeout) as conn:
+            conn.send_request(f"host:transport:{serial}")
+            try:
+                conn.send_request(f"shell,v2,raw:{command}")
+            except AdbCommandFailed as e:
+                raise _ShellV2Unsupported(str(e))
+            while True:
+                try:
+                    header = conn.read_exact(5)
+                except AdbConnectionClosed:
+                    break
+                packet_id, length = struct.unpack("<BI", header)
+                data = conn.read_exact(length) if length else b""
+                if packet_id == SHELL_ID_STDOUT:
+                    stdout.append(data)
+                elif packet_id == SHELL_ID_STDERR:
+                    stderr.append(data)
+                elif packet_id == SHELL_ID_EXIT:
+                    returncode = data[0] if data else 0
+                    break
+        if returncode is None:
+            # 未收到退出码就断开（设备掉线/adbd重启）：输出不完整，不能视为成功；
+            # 不抛异常，避免调用方回退到adb可执行文件把命令再执行一遍
+            stderr.append(b"error: shell connection closed before exit status\n")
+            returncode = 255
+        return returncode, b"".join(stdout), b"".join(stderr)
+
+    def _shell_v1(self, serial, command, timeout):
+        with self._connection(timeout) as conn:
+            self._open_device_service(conn, serial, f"shell:{command}; echo {_V1_EXIT_SENTINEL}$?")
+            output = conn.read_all()
+        output = output.replace(b"\r\n", b"\n")
+        returncode = 0
+        sentinel = _V1_EXIT_SENTINEL.encode()
+        pos = output.rfind(sentinel)
+        if pos != -1:
+            tail = output[pos + len(sentinel):]
+            code, _, rest = tail.partition(b"\n")
+            try:
+                returncode = int(code.strip())
+            except ValueError:
+                returncode = 0
+            output = output[:pos] + rest
+        return returncode, output, b""
+
+    def exec_out(self, serial, command, timeout=10):
+        """exec: 服务（二进制安全，无pty转换），返回完整字节"""
+        with self._connection(timeout) as conn:
+            self._open_device_service(conn, serial, f"exec:{command}")
+            return conn.read_all()
+
+    def exec_stream(self, serial, command, timeout=10, chunk_size=65536):
+        """exec: 服务的流式版本（逐块产出字节，不缓冲整个输出）"""
+        with self._connection(timeout) as conn:
+            self._open_device_service(conn, serial, f"exec:{command}")
+            yield from conn.iter_chunks(chunk_size)
+
+    # ===================== sync 文件传输 =====================
+    def _open_sync(self, conn, serial):
+        self._open_device_service(conn, serial, "sync:")
+
+    @staticmethod
+    def _sync_request(conn, command, path):
+        payload = path.encode("utf-8")
+        conn.sock.sendall(command + struct.pack("<I", len(payload)) + payload)
+
+    @staticmethod
+    def _sync_fail(conn, length):
+        message = conn.read_exact(length).decode("utf-8", errors="ignore") if length else ""
+        raise AdbCommandFailed(message or "sync 请求失败")
+
+    def stat(self, serial, path, timeout=10):
+        """
+        获取文件信息（sync STAT），返回 (mode, size, mtime)，文件不存在时 mode 为 0
+        注意：STAT v1 的 size 为 32 位，超过 4GB 的文件大小不准确
+        """
+        with self._connection(timeout) as conn:
+            self._open_sync(conn, serial)
+            self._sync_request(conn, b"STAT", path)
+            reply = conn.read_exact(16)
+            if reply[:4] != b"STAT":
+                raise AdbError(f"sync STAT 返回未知应答：{reply[:4]!r}")
+            conn.sock.sendall(b"QUIT" + struct.pack("<I", 0))
+            return struct.unpack("<III", reply[4:])
+
+    def pull_stream(self, serial, path, timeout=10):
+        """逐块拉取设备文件（sync RECV），每块最大 64KB，不缓冲整个文件"""
+        with self._connection(timeout) as conn:
+            self._open_sync(conn, serial)
+            self._sync_request(conn, b"RECV", path)
+            while True:
+                packet_id, length = struct.unpack("<4sI", conn.read_exact(8))
+                if packet_id == b"DATA":
+                    yield conn.read_exact(length)
+                elif packet_id == b"DONE":
+                    break
+                elif packet_id == b"FAIL":
+                    self._sync_fail(conn, length)
+                else:
+                    raise AdbError(f"sync RECV 返回未知应答：{packet_id!r}")
+            conn.sock.sendall(b"QUIT" + struct.pack("<I", 0))
+
+    def push_stream(self, serial, path, chunks, mode=0o644, mtime=None, timeout=10):
+        """
+        逐块推送数据到设备文件（sync SEND），chunks 为字节块的可迭代对象
+        :return: 写入的字节数
+        """
+        total = 0
+        with self._connection(timeout) as conn:
+            self._open_sync(conn, serial)
+            self._sync_request(conn, b"SEND", f"{path},{mode}")
+            for chunk in chunks:
+                for i in range(0, len(chunk), SYNC_DATA_MAX):
+                    data = chunk[i:i + SYNC_DATA_MAX]
+                    conn.sock.sendall(b"DATA" + struct.pack("<I", len(data)) + data)
+                    total += len(data)
+            conn.sock.sendall(b"DONE" + struct.pack("<I", int(mtime if mtime is not None else time.time())))
+            packet_id, length = struct.unpack("<4sI", conn.read_exact(8))
+            if packet_id == b"FAIL":
+                self._sync_fail(conn, length)
+            if packet_id != b"OKAY":
+                raise AdbError(f"sync SEND 返回未知应答：{packet_id!r}")
+            conn.sock.sendall(b"QUIT" + struct.pack("<I", 0))
+        return total
+
+    # ===================== adb CLI 参数兼容 =====================
+    def run_command(self, cmd, timeout=10):
+        """
+        将 adb 命令行参数（如 [adb, "-s", serial, "shell", "ls"]）翻译为协议调用
+        :return: subprocess.CompletedProcess（与 subprocess.run 的返回保持一致）
+        :raises AdbUnsupportedCommand: 无法通过协议执行，调用方应回退到 adb 可执行文件
+        """
+        args = list(cmd[1:])
+        serial = None
+        if len(args) >= 2 and args[0] == "-s":
+            serial = args[1]
+            args = args[2:]
+        if not args:
+            raise AdbUnsupportedCommand("空命令")
+
+        def done(stdout="", stderr="", returncode=0):
+            return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+
+        try:
+            return self._run_args(cmd, serial, args, timeout, done)
+        except AdbCommandFailed as e:
+            # 与 adb 可执行文件行为保持一致：错误信息写入 stderr，返回码为1
+            return done(stderr=f"error: {e}\n", returncode=1)
+
+    def _run_args(self, cmd, serial, args, timeout, done):
+        """按 adb 子命令分发到对应的协议调用"""
+        action, rest = args[0], args[1:]
+        if action == "wait-for-device" and serial:
+            self.wait_for_device(serial, timeout=timeout)
+            if not rest:
+                return done()
+            action, rest = rest[0], rest[1:]
+
+        if action == "devices" and serial is None and rest in ([], ["-l"]):
+            devices = self.devices(long=bool(rest), timeout=timeout)
+            return done(format_devices_output(devices))
+        if action == "connect" and serial is None and len(rest) == 1:
+            message = self.connect(rest[0], timeout=timeout)
+            return done(message + "\n", returncode=0 if "connected" in message else 1)
+        if action == "disconnect" and serial is None and len(rest) == 1:
+            message = self.disconnect(rest[0], timeout=timeout)
+            return done(message + "\n")
+        if serial is None:
+            raise AdbUnsupportedCommand(f"未指定设备的命令暂不支持协议执行：{action}")
+
+        if action == "get-serialno" and not rest:
+            return done(self.get_serialno(serial, timeout=timeout) + "\n")
+        if action == "get-state" and not rest:
+            return done(self.get_state(serial, timeout=timeout) + "\n")
+        if action == "shell" and rest:
+            returncode, out, err = self.shell(serial, " ".join(rest), timeout=timeout)
+            return done(_decode(out), _decode(err), returncode)
+        if action == "exec-out" and rest:
+            out = self.exec_out(serial, " ".join(rest), timeout=timeout)
+            return done(_decode(out))
+        raise AdbUnsupportedCommand(f"暂不支持协议执行的命令：{action}")
+
+
+def _decode(data):
+    return data.decode("utf-8", errors="ignore")
+
+
+def parse_devices_output(raw):
+    """解析 devices / devices-l 应答（也兼容 `adb devices -l` 命令行输出）"""
+    devices = []
+    for line in raw.splitlines():
+        line = line.strip()
+        if not line or line.startswith("List of devices") or line.startswith("*") or line.startswith("adb:"):
+            continue
+        parts = line.split(maxsplit=2)
+        if len(parts) >= 2:
+            devices.append({
+                "serial": parts[0].strip(),
+                "status": parts[1].strip(),
+                "details": parts[2].strip() if len(parts) >= 3 else ""
+            })
+    return devices
+
+
+def format_devices_output(devices):
+    """格式化为与 `adb devices -l` 一致的文本输出"""
+    lines = ["List of devices attached"]
+    for dev in devices:
+        line = f"{dev['serial']}\t{dev['status']}"
+        if dev.get("details"):
+            line += f" {dev['details']}"
+        lines.append(line)
+    return "\n".join(lines) + "\n\n"
+
+
+def quote_shell_arg(arg):
+    """设备端 sh 参数转义"""
+    return shlex.quote(str(arg))
+
+
+# ===================== 全局单例 =====================
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_adb_client():
+    """获取全局 ADB 协议客户端（按 settings 配置懒加载）"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from django.conf import settings
+                _client = AdbClient(
+                    host=getattr(settings, "ADB_SERVER_HOST", DEFAULT_ADB_SERVER_HOST),
+                    port=getattr(settings, "ADB_SERVER_PORT", DEFAULT_ADB_SERVER_PORT),
+                    pool_size=getattr(settings, "ADB_CLIENT_POOL_SIZE", 16),
+                    max_idle=getattr(settings, "ADB_CLIENT_POOL_IDLE", 4),
+                )
+    return _client
+
+
+def native_client_enabled():
+    """是否启用协议客户端（ADB_NATIVE_CLIENT=False 时全部走 adb 可执行文件）"""
+    from django.conf import settings
+    return getattr(settings, "ADB_NATIVE_CLIENT", True)
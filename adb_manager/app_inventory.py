@@ -0,0 +1,192 @@
+"""设备应用清单批量采集
+
+原实现每个应用单独执行 dumpsys package + resolve-activity（2×N 次 adb 调用）。这里改为：
+1. 一次 adb shell：pm list packages -3 -U --show-versioncode + query-activities 查询全部启动Activity；
+2. 应用名按包缓存（adb:device:app_meta:{connect_id}，字段为包名），只有新装/版本号变化的应用
+   才需要重新解析，且多个应用合并到一次 adb shell 中解析。
+"""
+import json
+import logging
+import re
+
+import redis
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_SENTINEL = "__EASYADB_APPS__"
+META_KEY_PREFIX = "adb:device:app_meta:"
+# 单次 adb shell 中解析应用名的最大包数（避免命令行过长）
+LABEL_BATCH_SIZE = 20
+
+PACKAGE_LINE = re.compile(r"^package:(?P<package>[\w.]+)(?P<rest>.*)$")
+COMPONENT = re.compile(r"^(?P<package>[\w.]+)/(?P<activity>[\w.$]+)$")
+LABEL_PATTERNS = (
+    re.compile(r"ApplicationInfo.*labelRes=0x[0-9a-f]+ nonLocalizedLabel=\"([^\"]+)\""),
+    re.compile(r"label=\"([^\"]+)\""),
+)
+
+
+def meta_key(connect_id):
+    return f"{META_KEY_PREFIX}{connect_id}"
+
+
+def build_inventory_script():
+    """包列表（含版本号）+ 全部启动Activity；旧系统不支持 --show-versioncode 时退回普通列表"""
+    return "; ".join([
+        "pm list packages -3 -U --show-versioncode 2>/dev/null || pm list packages -3",
+        f"echo {INVENTORY_SENTINEL}:launchers",
+        "cmd package query-activities --components -a android.intent.action.MAIN -c android.intent.category.LAUNCHER",
+    ])
+
+
+def parse_packages(output):
+    """解析 pm list packages 输出：{包名: versionCode}（不支持版本号时为空字符串）"""
+    packages = {}
+    for line in output.splitlines():
+        match = PACKAGE_LINE.match(line.strip())
+        if not match:
+            continue
+        version = re.search(r"versionCode:(\d+)", match.group("rest"))
+        packages[match.group("package")] = version.group(1) if version else ""
+    return packages
+
+
+def parse_launchers(output):
+    """解析 query-activities 输出：{包名: 启动Activity}（同一个包取第一个）"""
+    launchers = {}
+    for line in output.splitlines():
+        match = COMPONENT.match(line.strip())
+        if match and match.group("package") not in launchers:
+            launchers[match.group("package")] = match.group("activity")
+    return launchers
+
+
+def parse_label(output):
+    for pattern in LABEL_PATTERNS:
+        match = pattern.search(output)
+        if match:
+            return match.group(1).strip()
+    return ""
+
+
+def _split_sections(output, default):
+    sections, current = {default: []}, default
+    for line in output.splitlines():
+        line = line.rstrip("\r")
+        if line.startswith(f"{INVENTORY_SENTINEL}:"):
+            current = line.split(":", 1)[1].strip()
+            sections[current] = []
+            continue
+        sections[current].append(line)
+    return {name: "\n".join(lines) for name, lines in sections.items()}
+
+
+class AppInventoryCollector:
+    """单台设备的应用清单采集（应用名按包增量缓存）"""
+
+    def __init__(self, connect_id, client, execute, adb_path="adb"):
+        """
+        :param client: Redis 客户端（decode_responses=True）
+        :param execute: 执行 adb 命令的函数（签名同 views.execute_adb_command）
+        """
+        self.connect_id = connect_id
+        self.client = client
+        self.execute = execute
+        self.adb_path = adb_path
+
+    def _shell(self, script, timeout):
+        cmd = [self.adb_path, "-s", self.connect_id, "shell", script]
+        return self.execute(cmd, shell=False, timeout=timeout)
+
+    def _load_meta(self):
+        try:
+            raw = self.client.hgetall(meta_key(self.connect_id)) or {}
+        except redis.RedisError as e:
+            logger.warning(f"读取应用缓存失败（{self.connect_id}）：{str(e)}")
+            return {}
+        meta = {}
+        for package, value in raw.items():
+            try:
+                meta[package] = json.loads(value)
+            except ValueError:
+                continue
+        return meta
+
+    def _save_meta(self, updated, removed):
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            if updated:
+                pipe.hset(meta_key(self.connect_id), mapping={
+                    package: json.dumps(info, ensure_ascii=False) for package, info in updated.items()
+                })
+            if removed:
+                pipe.hdel(meta_key(self.connect_id), *removed)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"写入应用缓存失败（{self.connect_id}）：{str(e)}")
+
+    def resolve_labels(self, packages, timeout=30):
+        """
+        批量解析应用名：每批一次 adb shell，按包用分隔标记切分输出
+        :return: {包名: 应用名}，只包含输出中确实有该包分段的包（执行失败的批次不返回，下次采集时重试）
+        """
+        labels = {}
+        for i in range(0, len(packages), LABEL_BATCH_SIZE):
+            batch = packages[i:i + LABEL_BATCH_SIZE]
+            script = "; ".join(
+                f"echo {INVENTORY_SENTINEL}:{package}; dumpsys package {package} | grep -i label"
+                for package in batch
+            )
+            try:
+                result = self._shell(script, timeout)
+            except Exception as e:
+                logger.warning(f"批量解析应用名失败（{self.connect_id}）：{str(e)}")
+                continue
+            sections = _split_sections(result.stdout or "", "")
+            for package in batch:
+                if package in sections:
+                    labels[package] = parse_label(sections[package])
+        return labels
+
+    def collect(self, timeout=30):
+        """
+        采集应用清单，返回 (app_list, stats)
+        :raises RuntimeError: 包列表获取失败
+        """
+        result = self._shell(build_inventory_script(), timeout)
+        sections = _split_sections(result.stdout or "", "packages")
+        packages = parse_packages(sections.get("packages", ""))
+        if not packages and result.returncode != 0:
+            raise RuntimeError(result.stderr or result.stdout or "获取应用列表失败")
+        launchers = parse_launchers(sections.get("launchers", ""))
+
+        # 只有新装或版本号变化的应用需要重新解析应用名
+        meta = self._load_meta()
+        changed = [
+            package for package, version in packages.items()
+            if package not in meta or meta[package].get("version_code") != version
+        ]
+        labels = self.resolve_labels(changed, timeout) if changed else {}
+        # 解析失败的应用不写入缓存（否则包名会被当作应用名一直缓存到下次升级），本次先显示包名
+        updated = {
+            package: {"version_code": packages[package], "app_name": labels[package] or package}
+            for package in changed if package in labels
+        }
+        meta.update(updated)
+        removed = [package for package in meta if package not in packages]
+        self._save_meta(updated, removed)
+
+        app_list = [
+            {
+                "package_name": package,
+                "app_name": meta.get(package, {}).get("app_name") or package,
+                "version_code": version,
+                "launcher_activity": launchers.get(package, ""),
+            }
+            for package, version in packages.items()
+        ]
+        app_list.sort(key=lambda x: x["app_name"].lower())
+        stats = {"total": len(app_list), "resolved": len(updated), "unresolved": len(changed) - len(updated),
+                 "removed": len(removed)}
+        logger.info(f"应用清单采集完成（{self.connect_id}）：共{stats['total']}个，重新解析{stats['resolved']}个")
+        return app_list, stats
@@ -0,0 +1,321 @@
+"""批量设备操作任务（一键连接 / 一键断开 / 批量执行 shell 命令）
+
+请求只负责创建任务并立即返回任务ID，设备操作在后台（Celery 或后台线程）由固定宽度的线程池
+并发执行，每台设备的命令都有独立的超时时间；每完成一台设备就写入 Redis 并推送到 WebSocket 分组：
+    ws/adb_bulk_job/<job_id>/   -> {"type": "job_update", "data": {...}}
+任务结束时推送汇总：成功/失败数、耗时分位数、相同输出的设备分组。
+任务状态：GET bulk-job/<job_id>/
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections
+
+from .operation_log import write_operation_log
+from .status_store import get_status_store
+
+logger = logging.getLogger(__name__)
+
+JOB_KEY_PREFIX = "adb:bulk_job:"
+OPERATION_NAMES = {
+    "connect_all": "一键连接",
+    "disconnect_all": "一键断开",
+    "batch_shell": "批量执行命令",
+    "discover": "局域网扫描",
+}
+# 单台设备结果中保留的输出长度
+OUTPUT_PREVIEW_LIMIT = 2000
+# 汇总中保留的输出分组数
+OUTPUT_BUCKET_LIMIT = 20
+
+
+def job_key(job_id):
+    return f"{JOB_KEY_PREFIX}{job_id}"
+
+
+def job_results_key(job_id):
+    return f"{JOB_KEY_PREFIX}{job_id}:results"
+
+
+def job_group_name(job_id):
+    return f"adb_bulk_job_{job_id}"
+
+
+# ===================== 单台设备操作 =====================
+def connect_device(device, timeout, **params):
+    """连接单台设备（IP:端口用 connect，序列号用 wait-for-device 探测）"""
+    from .views import execute_adb_command, get_adb_path
+    adb_path = get_adb_path()
+    connect_id = device.connect_identifier
+    if ":" in connect_id:
+        cmd = [adb_path, "connect", connect_id]
+    else:
+        cmd = [adb_path, "-s", connect_id, "wait-for-device", "shell", "echo", "connected"]
+
+    # 批量操作的排队优先级低于界面上的单设备操作
+    result = execute_adb_command(cmd, timeout=timeout, shell=False, priority=-1)
+    if any(kw in result.stdout for kw in ["connected to", "connected", "echo connected"]) or result.returncode == 0:
+        get_status_store().set(connect_id, "online", result.stdout, "")
+        return True, "连接成功"
+    get_status_store().set(connect_id, "offline", stderr=result.stderr or result.stdout)
+    return False, f"连接失败 - {result.stderr or result.stdout}"
+
+
+def disconnect_device(device, timeout, **params):
+    """断开单台设备"""
+    from .views import execute_adb_command, get_adb_path
+    adb_path = get_adb_path()
+    connect_id = device.connect_identifier
+    if ":" in connect_id:
+        cmd = [adb_path, "disconnect", connect_id]
+    else:
+        cmd = [adb_path, "-s", connect_id, "disconnect"]
+
+    result = execute_adb_command(cmd, timeout=timeout, shell=False, priority=-1)
+    if "disconnected" in result.stdout or result.returncode == 0:
+        get_status_store().set(connect_id, "offline", result.stdout, "")
+        return True, "断开成功"
+    get_status_store().set(connect_id, "error", stderr=result.stderr or result.stdout)
+    return False, f"断开失败 - {result.stderr or result.stdout}"
+
+
+def shell_device(device, timeout, command="", **params):
+    """在单台设备上执行 shell 命令，输出作为结果信息"""
+    from .views import execute_adb_command, get_adb_path
+    cmd = [get_adb_path(), "-s", device.connect_identifier, "shell", command]
+    result = execute_adb_command(cmd, timeout=timeout, shell=False, priority=-1)
+    output = (result.stdout or "") + (result.stderr or "")
+    return result.returncode == 0, output.strip()[:OUTPUT_PREVIEW_LIMIT]
+
+
+OPERATIONS = {
+    "connect_all": connect_device,
+    "disconnect_all": disconnect_device,
+    "batch_shell": shell_device,
+}
+
+
+# ===================== 任务状态读写 =====================
+class BulkJob:
+    """单个批量任务：状态保存在 Redis Hash，逐台结果保存在 Redis List"""
+
+    def __init__(self, job_id, operation, client=None, params=None):
+        self.job_id = job_id
+        self.operation = operation
+        self.params = params or {}
+        self.client = client or get_status_store().client
+        self.channel_layer = get_channel_layer()
+        self.lock = threading.Lock()
+        self.done = 0
+        self.success_count = 0
+        self.fail_count = 0
+        self.latencies = []
+        self.buckets = {}
+
+    def init(self, total):
+        key = job_key(self.job_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.delete(job_results_key(self.job_id))
+        pipe.hset(key, mapping={
+            "job_id": self.job_id,
+            "operation": self.operation,
+            "status": "running",
+            "total": total,
+            "done": 0,
+            "success_count": 0,
+            "fail_count": 0,
+            "params": json.dumps(self.params, ensure_ascii=False),
+            "created_at": time.time(),
+        })
+        pipe.expire(key, settings.ADB_BULK_JOB_TTL)
+        pipe.execute()
+
+    def add_result(self, result):
+        """记录单台设备结果并推送"""
+        with self.lock:
+            self.done += 1
+            if result["success"]:
+                self.success_count += 1
+            else:
+                self.fail_count += 1
+            # latency_ms 为 None 表示未实际执行（如已存在而跳过），不计入耗时统计
+            if result.get("latency_ms") is not None:
+                self.latencies.append(result["latency_ms"])
+            # 相同输出的设备归为一组（按成功与否 + 输出内容）
+            digest = hashlib.md5(f"{result['success']}:{result['message']}".encode("utf-8")).hexdigest()
+            bucket = self.buckets.setdefault(digest, {"success": result["success"], "output": result["message"], "devices": []})
+            bucket["devices"].append(result["connect_id"] or result["device_name"])
+            progress = {"done": self.done, "success_count": self.success_count, "fail_count": self.fail_count}
+
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.rpush(job_results_key(self.job_id), json.dumps(result, ensure_ascii=False))
+            pipe.expire(job_results_key(self.job_id), settings.ADB_BULK_JOB_TTL)
+            pipe.hset(job_key(self.job_id), mapping=progress)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"写入批量任务结果失败（{self.job_id}）：{str(e)}")
+        self._send({"event": "device_result", "result": result, **progress})
+
+    def progress(self, message, **fields):
+        """推送阶段性进度（如扫描进度），fields 同时写入任务状态"""
+        try:
+            self.client.hset(job_key(self.job_id), mapping={"message": message, **fields})
+        except Exception as e:
+            logger.warning(f"写入批量任务进度失败（{self.job_id}）：{str(e)}")
+        self._send({"event": "progress", "message": message, **fields})
+
+    def latency_summary(self):
+        """耗时分位数（毫秒）"""
+        if not self.latencies:
+            return {}
+        ordered = sorted(self.latencies)
+
+        def percentile(p):
+            return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+        return {"p50": percentile(50), "p90": percentile(90), "p99": percentile(99), "max": ordered[-1]}
+
+    def output_buckets(self):
+        buckets = sorted(self.buckets.values(), key=lambda b: len(b["devices"]), reverse=True)
+        return [
+            {**bucket, "count": len(bucket["devices"])} for bucket in buckets[:OUTPUT_BUCKET_LIMIT]
+        ]
+
+    def finish(self):
+        summary = {
+            "status": "finished",
+            "done": self.done,
+            "success_count": self.success_count,
+            "fail_count": self.fail_count,
+            "latency_ms": self.latency_summary(),
+            "output_buckets": self.output_buckets(),
+            "finished_at": time.time(),
+        }
+        try:
+            self.client.hset(job_key(self.job_id), mapping={
+                key: json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+                for key, value in summary.items()
+            })
+        except Exception as e:
+            logger.warning(f"写入批量任务状态失败（{self.job_id}）：{str(e)}")
+        self._send({"event": "finished", **summary})
+        return summary
+
+    def _send(self, data):
+        try:
+            async_to_sync(self.channel_layer.group_send)(
+                job_group_name(self.job_id),
+                {"type": "job_update", "data": {"job_id": self.job_id, **data}}
+            )
+        except Exception as e:
+            logger.warning(f"推送批量任务进度失败（{self.job_id}）：{str(e)}")
+
+
+def get_job_state(job_id, client=None):
+    """读取任务状态与已完成的设备结果，任务不存在返回 None"""
+    client = client or get_status_store().client
+    pipe = client.pipeline(transaction=False)
+    pipe.hgetall(job_key(job_id))
+    pipe.lrange(job_results_key(job_id), 0, -1)
+    state, results = pipe.execute()
+    if not state:
+        return None
+    for field in ("total", "done", "success_count", "fail_count"):
+        state[field] = int(state.get(field) or 0)
+    for field in ("params", "latency_ms", "output_buckets"):
+        if state.get(field):
+            state[field] = json.loads(state[field])
+    state["results"] = [json.loads(item) for item in results]
+    return state
+
+
+# ===================== 执行 =====================
+def run_bulk_job(job_id, operation, device_ids, user_id=None, params=None, timeout=None):
+    """执行批量任务（Celery 任务与后台线程共用）"""
+    from .models import ADBDevice
+    close_old_connections()
+    job = BulkJob(job_id, operation, params=params)
+    operation = OPERATIONS[job.operation]
+    timeout = timeout or settings.ADB_BULK_DEVICE_TIMEOUT
+
+    def worker(device):
+        connect_id = device.connect_identifier
+        result = {"device_id": device.id, "device_name": device.device_name, "connect_id": connect_id}
+        if not connect_id:
+            return {**result, "success": False, "message": "未配置序列号/IP+端口", "latency_ms": 0}
+        start = time.time()
+        try:
+            success, message = operation(device, timeout, **job.params)
+        except Exception as e:
+            logger.error(f"{OPERATION_NAMES[job.operation]} - 设备{connect_id}异常：{str(e)}")
+            if job.operation != "batch_shell":
+                get_status_store().set(connect_id, "error", stderr=str(e))
+            success, message = False, f"操作异常 - {str(e)}"
+        return {**result, "success": success, "message": message, "latency_ms": int((time.time() - start) * 1000)}
+
+    result_logs = []
+    try:
+        devices = list(ADBDevice.objects.filter(id__in=device_ids))
+        with ThreadPoolExecutor(max_workers=settings.ADB_BULK_MAX_WORKERS) as executor:
+            futures = [executor.submit(worker, device) for device in devices]
+            for future in as_completed(futures):
+                result = future.result()
+                job.add_result(result)
+                result_logs.append(f"{'✅' if result['success'] else '❌'} {result['connect_id'] or result['device_name']}：{result['message']}")
+    except Exception as e:
+        logger.error(f"批量任务执行异常（{job.job_id}）：{str(e)}", exc_info=True)
+        result_logs.append(f"⚠️ 任务异常 - {str(e)}")
+
+    summary = job.finish()
+    if job.params.get("command"):
+        result_logs.insert(0, f"命令：{job.params['command']}")
+    details = (f"{OPERATION_NAMES[job.operation]}完成（任务ID：{job.job_id}）！"
+               f"成功{summary['success_count']}台，失败{summary['fail_count']}台。详情：{' | '.join(result_logs)}")
+    try:
+        write_operation_log(
+            device=None,
+            operation_type=job.operation,
+            user_id=user_id,
+            operation_result=True,
+            operation_details=details
+        )
+    except Exception as e:
+        logger.warning(f"记录批量任务日志失败（{job.job_id}）：{str(e)}")
+    finally:
+        close_old_connections()
+    logger.info(details)
+    return summary
+
+
+def start_bulk_job(operation, devices, user=None, params=None, timeout=None):
+    """创建批量任务并提交到 Celery（或后台线程），立即返回任务ID"""
+    if operation not in OPERATIONS:
+        raise ValueError(f"不支持的批量操作：{operation}")
+    device_ids = [device.id for device in devices]
+    job = BulkJob(uuid.uuid4().hex, operation, params=params)
+    job.init(len(device_ids))
+    args = (job.job_id, operation, device_ids, user.id if user else None, job.params, timeout)
+
+    if hasattr(settings, 'USE_CELERY') and settings.USE_CELERY:
+        from .tasks import run_bulk_job_task
+        run_bulk_job_task.delay(*args)
+        logger.info(f"已提交批量任务到Celery：{OPERATION_NAMES[operation]}（{job.job_id}），设备数：{len(device_ids)}")
+        return job.job_id
+
+    thread = threading.Thread(
+        target=run_bulk_job,
+        args=args,
+        daemon=True
+    )
+    thread.start()
+    logger.info(f"已启动批量任务：{OPERATION_NAMES[operation]}（{job.job_id}），设备数：{len(device_ids)}")
+    return job.job_id
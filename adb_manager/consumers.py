@@ -0,0 +1,80 @@
+# adb_manager/consumers.py
+import asyncio
+import json
+from urllib.parse import parse_qs
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.db import database_sync_to_async
+from .bulk_jobs import get_job_state, job_group_name
+from .screen_stream import iter_frames
+from .status_store import get_status_store
+
+
+class BulkJobConsumer(AsyncWebsocketConsumer):
+    """批量设备操作进度推送（一键连接 / 一键断开）"""
+    async def connect(self):
+        self.job_id = self.scope['url_route']['kwargs']['job_id']
+        self.job_group_name = job_group_name(self.job_id)
+
+        await self.channel_layer.group_add(
+            self.job_group_name,
+            self.channel_name
+        )
+        await self.accept()
+        # 连接成功后先推送一次当前进度（含已完成的设备结果）
+        state = await self.get_job_state()
+        await self.send_update({'event': 'snapshot', 'job_id': self.job_id, **(state or {'error': '任务不存在或已过期'})})
+
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(
+            self.job_group_name,
+            self.channel_name
+        )
+
+    async def job_update(self, event):
+        await self.send_update(event['data'])
+
+    async def send_update(self, data):
+        await self.send(text_data=json.dumps({
+            'type': 'job_update',
+            'data': data
+        }))
+
+    @database_sync_to_async
+    def get_job_state(self):
+        return get_job_state(self.job_id)
+
+
+class ScreenStreamConsumer(AsyncWebsocketConsumer):
+    """设备屏幕实时画面（二进制消息，每条一帧；同一台设备的观看者共享一个截图循环）"""
+    async def connect(self):
+        self.device_id = self.scope['url_route']['kwargs']['device_id']
+        self.sender = None
+        connect_id = await self.get_online_connect_id()
+        if not connect_id:
+            await self.close(code=4004)
+            return
+        await self.accept()
+        fps = parse_qs(self.scope.get('query_string', b'').decode()).get('fps', [None])[0]
+        self.sender = asyncio.ensure_future(self.send_frames(connect_id, fps))
+
+    async def disconnect(self, close_code):
+        if self.sender is not None:
+            self.sender.cancel()
+
+    async def send_frames(self, connect_id, fps):
+        frames = iter_frames(connect_id, fps)
+        try:
+            async for frame, _ in frames:
+                await self.send(bytes_data=frame)
+        finally:
+            await frames.aclose()
+
+    @database_sync_to_async
+    def get_online_connect_id(self):
+        from .models import ADBDevice
+        device = ADBDevice.objects.filter(id=self.device_id).first()
+        if device is None or not device.connect_identifier:
+            return None
+        if get_status_store().get_status(device.connect_identifier) != "online":
+            return None
+        return device.connect_identifier
@@ -0,0 +1,239 @@
+"""单设备命令并发控制（基于 Redis 的分通道信号量）
+
+每台设备两个通道：
+- interactive：Web 界面发起的短命令（列目录、应用列表、启动应用等）；
+- background：长时间占用设备的任务（Airtest 脚本、编排步骤）。
+每个通道有独立的最大并发数；设备被 background 通道占用时，interactive 通道的并发数
+降为 ADB_GOVERNOR_INTERACTIVE_MAX_WHILE_BUSY，避免界面操作拖慢正在运行的自动化脚本。
+同一通道内按优先级（数值越大越先）+ 排队先后获取名额，等待时长写入 Redis 指标。
+
+键名：
+    adb:device:gov:{connect_id}:{lane}:holders   ZSET 持有者 -> 过期时间（进程崩溃后自动释放）
+    adb:device:gov:{connect_id}:{lane}:waiters   ZSET 排队者 -> 排序值（优先级 + 排队时间）
+    adb:device:gov:{connect_id}:{lane}:alive     ZSET 排队者 -> 心跳过期时间
+    adb:device:gov:metrics:{lane}                HASH 获取次数/超时次数/累计与最大等待毫秒数
+"""
+import logging
+import time
+import uuid
+from contextlib import contextmanager
+
+import redis
+from django.conf import settings
+
+from .status_store import get_status_store
+
+logger = logging.getLogger(__name__)
+
+LANE_INTERACTIVE = "interactive"
+LANE_BACKGROUND = "background"
+LANES = (LANE_INTERACTIVE, LANE_BACKGROUND)
+
+KEY_PREFIX = "adb:device:gov:"
+METRICS_KEY_PREFIX = f"{KEY_PREFIX}metrics:"
+METRICS_SAMPLES = 1000
+POLL_INTERVAL = 0.05
+
+# 排队与获取名额（原子执行）
+# KEYS: holders, waiters, alive, background_holders
+# ARGV: token, now, ttl, limit, busy_limit, rank, alive_until
+_ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+redis.call('ZREMRANGEBYSCORE', KEYS[4], '-inf', now)
+local stale = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now)
+for _, member in ipairs(stale) do
+    redis.call('ZREM', KEYS[2], member)
+    redis.call('ZREM', KEYS[3], member)
+end
+redis.call('ZADD', KEYS[2], 'NX', tonumber(ARGV[6]), ARGV[1])
+redis.call('ZADD', KEYS[3], tonumber(ARGV[7]), ARGV[1])
+
+local limit = tonumber(ARGV[4])
+if KEYS[1] ~= KEYS[4] and redis.call('ZCARD', KEYS[4]) > 0 then
+    limit = tonumber(ARGV[5])
+end
+local free = limit - redis.call('ZCARD', KEYS[1])
+if free > 0 and redis.call('ZRANK', KEYS[2], ARGV[1]) < free then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[1])
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    redis.call('ZREM', KEYS[3], ARGV[1])
+    redis.call('PEXPIRE', KEYS[1], math.ceil(tonumber(ARGV[3]) * 1000))
+    return 1
+end
+redis.call('PEXPIRE', KEYS[2], 60000)
+redis.call('PEXPIRE', KEYS[3], 60000)
+return 0
+"""
+
+# 更新最大等待时长（比较与写入需原子执行，否则并发写入时最大值可能被较小值覆盖）
+# KEYS: metrics
+# ARGV: waited_ms
+_MAX_SCRIPT = """
+local current = tonumber(redis.call('HGET', KEYS[1], 'wait_ms_max') or '0')
+if tonumber(ARGV[1]) > current then
+    redis.call('HSET', KEYS[1], 'wait_ms_max', ARGV[1])
+end
+return 1
+"""
+
+
+class DeviceBusyError(Exception):
+    """等待设备命令名额超时"""
+
+
+def lane_key(connect_id, lane, kind):
+    return f"{KEY_PREFIX}{connect_id}:{lane}:{kind}"
+
+
+class DeviceGovernor:
+    """单设备命令并发控制"""
+
+    def __init__(self, client):
+        self.client = client
+        self._acquire = client.register_script(_ACQUIRE_SCRIPT)
+        self._update_max = client.register_script(_MAX_SCRIPT)
+
+    @staticmethod
+    def lane_limits(lane):
+        if lane == LANE_BACKGROUND:
+            return settings.ADB_GOVERNOR_BACKGROUND_MAX, settings.ADB_GOVERNOR_BACKGROUND_MAX
+        return settings.ADB_GOVERNOR_INTERACTIVE_MAX, settings.ADB_GOVERNOR_INTERACTIVE_MAX_WHILE_BUSY
+
+    def acquire(self, connect_id, lane=LANE_INTERACTIVE, priority=0, wait=None, ttl=None):
+        """
+        获取设备命令名额，返回令牌（用于 release）
+        :param priority: 同一通道内的优先级，数值越大越先获取
+        :param wait: 最长等待秒数，超时抛出 DeviceBusyError
+        :param ttl: 名额最长持有秒数（进程崩溃未释放时自动过期）
+        """
+        if lane not in LANES:
+            raise ValueError(f"未知的设备通道：{lane}")
+        wait = settings.ADB_GOVERNOR_WAIT if wait is None else wait
+        ttl = ttl or settings.ADB_GOVERNOR_LEASE_TTL
+        limit, busy_limit = self.lane_limits(lane)
+        token = uuid.uuid4().hex
+        keys = [
+            lane_key(connect_id, lane, "holders"),
+            lane_key(connect_id, lane, "waiters"),
+            lane_key(connect_id, lane, "alive"),
+            lane_key(connect_id, LANE_BACKGROUND, "holders"),
+        ]
+        start = time.time()
+        # 排序值：优先级高的在前，同优先级按排队时间先后
+        rank = -priority * 1e13 + start * 1000
+
+        while True:
+            now = time.time()
+            acquired = self._acquire(
+                keys=keys,
+                args=[token, now, ttl, limit, busy_limit, rank, now + max(POLL_INTERVAL * 20, 1)]
+            )
+            if acquired:
+                self._record(lane, now - start)
+                return token
+            if now - start >= wait:
+                self.client.zrem(keys[1], token)
+                self.client.zrem(keys[2], token)
+                self._record(lane, now - start, timeout=True)
+                raise DeviceBusyError(f"设备{connect_id}忙（{lane}通道等待超过{wait}秒）")
+            time.sleep(POLL_INTERVAL)
+
+    def holders(self, connect_id, lane):
+        """通道当前未过期的持有者数量"""
+        return self.client.zcount(lane_key(connect_id, lane, "holders"), time.time(), "+inf")
+
+    def release(self, connect_id, lane, token):
+        try:
+            self.client.zrem(lane_key(connect_id, lane, "holders"), token)
+        except redis.RedisError as e:
+            logger.warning(f"释放设备命令名额失败（{connect_id}）：{str(e)}")
+
+    # ===================== 指标 =====================
+    def _record(self, lane, waited, timeout=False):
+        waited_ms = int(waited * 1000)
+        key = f"{METRICS_KEY_PREFIX}{lane}"
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hincrby(key, "timeouts" if timeout else "acquired", 1)
+            pipe.hincrby(key, "wait_ms_total", waited_ms)
+            pipe.lpush(f"{key}:samples", waited_ms)
+            pipe.ltrim(f"{key}:samples", 0, METRICS_SAMPLES - 1)
+            self._update_max(keys=[key], args=[waited_ms], client=pipe)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"记录设备排队指标失败：{str(e)}")
+        if waited_ms >= 1000:
+            logger.info(f"设备命令排队等待 {waited_ms}ms（{lane}通道{'，已超时' if timeout else ''}）")
+
+    def metrics(self):
+        """各通道排队指标：次数、超时次数、平均/最大/P95 等待毫秒数"""
+        result = {}
+        for lane in LANES:
+            key = f"{METRICS_KEY_PREFIX}{lane}"
+            data = self.client.hgetall(key) or {}
+            samples = sorted(int(v) for v in self.client.lrange(f"{key}:samples", 0, -1))
+            acquired = int(data.get("acquired") or 0)
+            timeouts = int(data.get("timeouts") or 0)
+            total = acquired + timeouts
+            result[lane] = {
+                "acquired": acquired,
+                "timeouts": timeouts,
+                "wait_ms_avg": round(int(data.get("wait_ms_total") or 0) / total, 1) if total else 0,
+                "wait_ms_max": int(data.get("wait_ms_max") or 0),
+                "wait_ms_p95": samples[int(len(samples) * 0.95) - 1] if samples else 0,
+            }
+        return result
+
+
+_governor = None
+
+
+def get_governor():
+    global _governor
+    if _governor is None:
+        _governor = DeviceGovernor(get_status_store().client)
+    return _governor
+
+
+def acquire_slot(connect_id, lane=LANE_INTERACTIVE, priority=0, wait=None, ttl=None):
+    """
+    获取设备命令名额，返回令牌（交给 release_slot 释放）
+    未开启并发控制或 Redis 不可用时直接放行，返回 None
+    """
+    if not connect_id or not settings.ADB_GOVERNOR_ENABLED:
+        return None
+    try:
+        return get_governor().acquire(connect_id, lane, priority, wait, ttl)
+    except redis.RedisError as e:
+        logger.warning(f"设备并发控制不可用，直接执行：{str(e)}")
+        return None
+
+
+def release_slot(connect_id, lane, token):
+    if token is not None:
+        get_governor().release(connect_id, lane, token)
+
+
+def lane_busy(connect_id, lane=LANE_BACKGROUND):
+    """通道是否被占用（如设备正在运行脚本）；未开启并发控制或 Redis 不可用时返回 False"""
+    if not connect_id or not settings.ADB_GOVERNOR_ENABLED:
+        return False
+    try:
+        return get_governor().holders(connect_id, lane) > 0
+    except redis.RedisError as e:
+        logger.warning(f"读取设备通道占用情况失败（{connect_id}）：{str(e)}")
+        return False
+
+
+@contextmanager
+def device_slot(connect_id, lane=LANE_INTERACTIVE, priority=0, wait=None, ttl=None):
+    """
+    占用设备命令名额的上下文管理器
+    未开启并发控制或 Redis 不可用时直接放行（不影响命令执行）
+    """
+    token = acquire_slot(connect_id, lane, priority, wait, ttl)
+    try:
+        yield
+    finally:
+        release_slot(connect_id, lane, token)
@@ -0,0 +1,165 @@
+"""CSV 批量导入设备
+
+流程（导入页面 / import-devices/ 接口 / manage.py import_devices 共用）：
+1. 解析 CSV：表头可用字段名（device_name,device_ip,device_port,device_serial,is_active,user）
+   或表单中文标签（设备名称,设备IP,ADB端口,设备序列号,启用监控,关联用户）；
+2. 校验：逐行按 ADBDeviceImportForm（即 ADBDeviceForm 的规则）校验，不逐行查询数据库；
+3. 去重：一次查询取出已存在的序列号与 IP+端口，跳过已存在及文件内重复的行；
+4. 写入：bulk_create 分批插入；
+5. 可选验证：对新设备提交一个“一键连接”批量任务，并发验证连通性（进度见 ws/adb_bulk_job/<job_id>/）。
+"""
+import csv
+import io
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .bulk_jobs import start_bulk_job
+from .forms import ADBDeviceImportForm
+
+logger = logging.getLogger(__name__)
+
+# 中文表头 -> 字段名
+HEADER_ALIASES = {
+    "设备名称": "device_name",
+    "设备IP": "device_ip",
+    "ADB端口": "device_port",
+    "设备序列号": "device_serial",
+    "启用监控": "is_active",
+    "关联用户": "user",
+}
+FALSE_VALUES = ("0", "false", "no", "n", "off", "否", "禁用")
+
+
+def parse_csv(content):
+    """
+    解析 CSV 文本为 [(行号, {字段: 值})]（行号为文件中的行号，表头为第 1 行）
+    :raises ValueError: 缺少表头或超过 ADB_IMPORT_MAX_ROWS 行
+    """
+    if isinstance(content, bytes):
+        # 兼容 Excel 导出的带 BOM 的 UTF-8
+        content = content.decode("utf-8-sig")
+    reader = csv.DictReader(io.StringIO(content.lstrip("\ufeff")))
+    if not reader.fieldnames:
+        raise ValueError("CSV文件为空或缺少表头")
+    fields = [HEADER_ALIASES.get(name.strip(), name.strip()) for name in reader.fieldnames]
+    if "device_name" not in fields:
+        raise ValueError("CSV表头缺少 device_name（设备名称）列")
+
+    rows = []
+    for raw in reader:
+        line_no = reader.line_num
+        row = {field: (value or "").strip() for field, value in zip(fields, raw.values()) if field}
+        if not any(row.values()):
+            continue
+        rows.append((line_no, row))
+        if len(rows) > settings.ADB_IMPORT_MAX_ROWS:
+            raise ValueError(f"导入行数超过上限（{settings.ADB_IMPORT_MAX_ROWS}行）")
+    return rows
+
+
+def _form_data(row):
+    data = dict(row)
+    # 复选框语义：缺省启用，填写 0/false/否 等为不启用
+    data["is_active"] = "false" if row.get("is_active", "").lower() in FALSE_VALUES else "true"
+    return data
+
+
+def _resolve_users(rows):
+    """一次查询解析“关联用户”列（用户ID或用户名）"""
+    from user_auth.models import CustomUser
+    values = {row["user"] for _, row in rows if row.get("user")}
+    if not values:
+        return {}
+    ids = [int(value) for value in values if value.isdigit()]
+    users = CustomUser.objects.filter(Q(id__in=ids) | Q(username__in=values)).only("id", "username")
+    mapping = {}
+    for user in users:
+        mapping[str(user.id)] = user
+        mapping[user.username] = user
+    return mapping
+
+
+def import_devices(content, user=None, verify=False, dry_run=False):
+    """
+    批量导入设备
+    :param content: CSV 文本或字节
+    :param user: 未填写“关联用户”列时绑定的用户
+    :param verify: 导入后提交批量连接任务验证新设备连通性
+    :param dry_run: 只校验不写入
+    :return: {"total", "to_create", "created", "skipped": [...], "errors": [...], "job_id"}
+    :raises ValueError: CSV 格式错误
+    """
+    from .models import ADBDevice
+    rows = parse_csv(content)
+    users = _resolve_users(rows)
+
+    errors, candidates = [], []
+    for line_no, row in rows:
+        form = ADBDeviceImportForm(data=_form_data(row))
+        if not form.is_valid():
+            errors.append({"line": line_no, "errors": {field: list(messages) for field, messages in form.errors.items()}})
+            continue
+        device = form.save(commit=False)
+        if row.get("user"):
+            if row["user"] not in users:
+                errors.append({"line": line_no, "errors": {"user": [f"用户不存在：{row['user']}"]}})
+                continue
+            device.user = users[row["user"]]
+        elif user is not None:
+            device.user = user
+        device.device_serial = (device.device_serial or "").strip() or None
+        candidates.append((line_no, device))
+
+    # 一次查询取出可能冲突的已有设备
+    serials = {device.device_serial for _, device in candidates if device.device_serial}
+    ips = {device.device_ip for _, device in candidates if device.device_ip}
+    existing_serials, existing_addresses = set(), set()
+    if serials or ips:
+        for serial, ip, port in ADBDevice.objects.filter(
+            Q(device_serial__in=serials) | Q(device_ip__in=ips)
+        ).values_list("device_serial", "device_ip", "device_port"):
+            if serial:
+                existing_serials.add(serial)
+            if ip:
+                existing_addresses.add((ip, port))
+
+    skipped, new_devices = [], []
+    for line_no, device in candidates:
+        address = (device.device_ip, device.device_port) if device.device_ip else None
+        if device.device_serial and device.device_serial in existing_serials:
+            skipped.append({"line": line_no, "device": device.device_name, "reason": f"序列号已存在：{device.device_serial}"})
+            continue
+        if address and address in existing_addresses:
+            skipped.append({"line": line_no, "device": device.device_name, "reason": f"IP+端口已存在：{address[0]}:{address[1]}"})
+            continue
+        # 文件内重复的行只导入第一行
+        if device.device_serial:
+            existing_serials.add(device.device_serial)
+        if address:
+            existing_addresses.add(address)
+        new_devices.append(device)
+
+    result = {"total": len(rows), "to_create": len(new_devices), "created": 0,
+              "skipped": skipped, "errors": errors, "job_id": None}
+    if dry_run or not new_devices:
+        return result
+
+    with transaction.atomic():
+        created = ADBDevice.objects.bulk_create(new_devices, batch_size=settings.ADB_IMPORT_BATCH_SIZE)
+    result["created"] = len(created)
+    logger.info(f"批量导入设备：共{len(rows)}行，新增{len(created)}台，跳过{len(skipped)}行，错误{len(errors)}行")
+
+    if verify:
+        # 部分数据库 bulk_create 不回填主键，此时按序列号/IP+端口重新查询新设备
+        if any(device.pk is None for device in created):
+            created = list(ADBDevice.objects.filter(
+                Q(device_serial__in=[d.device_serial for d in created if d.device_serial])
+                | Q(device_ip__in=[d.device_ip for d in created if d.device_ip])
+            ).filter(created_at__gte=min(d.created_at for d in created)))
+        active = [device for device in created if device.is_active]
+        if active:
+            result["job_id"] = start_bulk_job("connect_all", active, user=user)
+    return result
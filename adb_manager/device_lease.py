@@ -0,0 +1,344 @@
+"""设备执行租约（同一台设备同时只运行一个脚本任务或编排任务）
+
+提交执行（脚本执行、编排执行、定时任务）时先为设备申请租约：
+- 设备空闲：获得租约，立即派发；
+- 设备被占用：任务进入该设备的等待队列（优先级高的在前，同优先级按提交先后），日志状态为 queued；
+  持有者释放租约时，队首任务原子地接手租约，并由对应的派发函数（LEASE_DISPATCHERS）自动启动。
+租约有效期 ADB_LEASE_TTL 秒，执行期间由进程内的续期线程每 ADB_LEASE_RENEW_INTERVAL 秒续期；
+进程崩溃未释放时租约过期，之后的提交或设备心跳任务（heartbeat_devices）会派发队首任务。
+未开启 ADB_LEASE_ENABLED 或 Redis 不可用时直接放行（与设备命令并发控制一致）。
+
+持有者 / 等待者标识为 "<类型>:<日志ID>"，如 script:12、orch:3。
+键名：
+    adb:device:lease:{connect_id}          STRING 当前持有者（带过期时间）
+    adb:device:lease:{connect_id}:queue    ZSET   等待者 -> 排序值（优先级 + 提交时间）
+    adb:device:lease:{connect_id}:jobs     HASH   等待者 -> 派发参数（JSON）
+    adb:device:lease:waiting               SET    有等待者的设备
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import redis
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .status_store import get_status_store
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "adb:device:lease:"
+WAITING_KEY = f"{KEY_PREFIX}waiting"
+
+# 手动提交优先于定时任务
+PRIORITY_SCHEDULED = 0
+PRIORITY_MANUAL = 10
+
+# 租约类型 -> 派发函数 fn(pk, payload)，返回是否已启动（False 时租约交给下一个等待者）
+LEASE_DISPATCHERS = {
+    "script": "script_center.views.start_queued_run",
+    "orch": "task_orchestration.views.start_queued_run",
+}
+
+# 申请租约：持有者续期 / 空闲且无人排队时获得 / 否则排队
+# KEYS: lease, queue, jobs, waiting
+# ARGV: owner, ttl_ms, rank, connect_id, payload
+# 返回 0 表示持有租约，否则为排队位置（从 1 开始）
+_ACQUIRE_SCRIPT = """
+local holder = redis.call('GET', KEYS[1])
+if holder == ARGV[1] then
+    redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    return 0
+end
+if not holder and redis.call('ZCARD', KEYS[2]) == 0 then
+    redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 0
+end
+redis.call('ZADD', KEYS[2], 'NX', tonumber(ARGV[3]), ARGV[1])
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[5])
+redis.call('SADD', KEYS[4], ARGV[4])
+return redis.call('ZRANK', KEYS[2], ARGV[1]) + 1
+"""
+
+# 释放租约（owner 为空时只检查过期的租约）并把租约交给队首等待者
+# KEYS: lease, queue, jobs, waiting
+# ARGV: owner, ttl_ms, connect_id
+# 返回 {新持有者, 派发参数}，没有交接时返回 nil
+_HANDOVER_SCRIPT = """
+local holder = redis.call('GET', KEYS[1])
+if ARGV[1] ~= '' and holder == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    holder = false
+end
+if holder then
+    return false
+end
+local head = redis.call('ZRANGE', KEYS[2], 0, 0)
+if #head == 0 then
+    redis.call('SREM', KEYS[4], ARGV[3])
+    return false
+end
+local payload = redis.call('HGET', KEYS[3], head[1]) or '{}'
+redis.call('ZREM', KEYS[2], head[1])
+redis.call('HDEL', KEYS[3], head[1])
+redis.call('SET', KEYS[1], head[1], 'PX', ARGV[2])
+if redis.call('ZCARD', KEYS[2]) == 0 then
+    redis.call('SREM', KEYS[4], ARGV[3])
+end
+return {head[1], payload}
+"""
+
+# 续期（只续期自己持有的租约）
+# KEYS: lease  ARGV: owner, ttl_ms
+_RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def lease_key(connect_id, kind=None):
+    return f"{KEY_PREFIX}{connect_id}:{kind}" if kind else f"{KEY_PREFIX}{connect_id}"
+
+
+def lease_owner(kind, pk):
+    return f"{kind}:{pk}"
+
+
+class DeviceLease:
+    """设备执行租约与等待队列"""
+
+    def __init__(self, client, ttl=120):
+        self.client = client
+        self.ttl = ttl
+        self._acquire = client.register_script(_ACQUIRE_SCRIPT)
+        self._handover = client.register_script(_HANDOVER_SCRIPT)
+        self._renew = client.register_script(_RENEW_SCRIPT)
+
+    def _keys(self, connect_id):
+        return [lease_key(connect_id), lease_key(connect_id, "queue"), lease_key(connect_id, "jobs"), WAITING_KEY]
+
+    def acquire(self, connect_id, owner, priority=0, payload=None):
+        """
+        申请租约
+        :param priority: 排队时的优先级，数值越大越先获得租约
+        :param payload: 排队时保存的派发参数（交给派发函数）
+        :return: 0 表示已持有租约，否则为排队位置（从 1 开始）
+        """
+        # 排序值：优先级高的在前，同优先级按提交时间先后
+        rank = -priority * 1e13 + time.time() * 1000
+        return int(self._acquire(
+            keys=self._keys(connect_id),
+            args=[owner, int(self.ttl * 1000), rank, connect_id, json.dumps(payload or {})]
+        ))
+
+    def renew(self, connect_id, owner):
+        return bool(self._renew(keys=[lease_key(connect_id)], args=[owner, int(self.ttl * 1000)]))
+
+    def handover(self, connect_id, owner=""):
+        """释放 owner 持有的租约（owner 为空时只处理已过期的租约），返回 (新持有者, 派发参数) 或 None"""
+        result = self._handover(keys=self._keys(connect_id), args=[owner, int(self.ttl * 1000), connect_id])
+        if not result:
+            return None
+        try:
+            return result[0], json.loads(result[1])
+        except ValueError:
+            return result[0], {}
+
+    def cancel(self, connect_id, owner):
+        """从等待队列中移除（已停止的排队任务）"""
+        pipe = self.client.pipeline(transaction=True)
+        pipe.zrem(lease_key(connect_id, "queue"), owner)
+        pipe.hdel(lease_key(connect_id, "jobs"), owner)
+        removed = pipe.execute()[0]
+        # 队列为空时由下一次 handover 清理 waiting 集合
+        return bool(removed)
+
+    def holder(self, connect_id):
+        return self.client.get(lease_key(connect_id))
+
+    def positions(self, items):
+        """批量查询排队位置：{(connect_id, owner): 位置}（未排队的不返回）"""
+        items = list(items)
+        if not items:
+            return {}
+        pipe = self.client.pipeline(transaction=False)
+        for connect_id, owner in items:
+            pipe.zrank(lease_key(connect_id, "queue"), owner)
+        return {item: rank + 1 for item, rank in zip(items, pipe.execute()) if rank is not None}
+
+    def waiting_devices(self):
+        return self.client.smembers(WAITING_KEY)
+
+
+# ===================== 全局单例 =====================
+_lease = None
+_lease_lock = threading.Lock()
+
+
+def get_device_lease():
+    """获取全局设备租约（复用设备状态存储的Redis连接）"""
+    global _lease
+    if _lease is None:
+        with _lease_lock:
+            if _lease is None:
+                _lease = DeviceLease(get_status_store().client, ttl=settings.ADB_LEASE_TTL)
+    return _lease
+
+
+# ===================== 续期线程 =====================
+class LeaseRenewer:
+    """进程内持有的租约统一由一个线程续期"""
+
+    def __init__(self, interval=30):
+        self.interval = interval
+        self.held = {}
+        self.lock = threading.Lock()
+        self._thread = None
+
+    def add(self, connect_id, owner):
+        with self.lock:
+            self.held[owner] = connect_id
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="device-lease-renewer", daemon=True)
+                self._thread.start()
+
+    def discard(self, owner):
+        with self.lock:
+            self.held.pop(owner, None)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                held = dict(self.held)
+            lease = get_device_lease()
+            for owner, connect_id in held.items():
+                try:
+                    if not lease.renew(connect_id, owner):
+                        logger.warning(f"设备{connect_id}的执行租约已不属于{owner}（租约过期后被其他任务获取）")
+                except redis.RedisError as e:
+                    logger.warning(f"续期设备{connect_id}执行租约失败：{str(e)}")
+
+
+_renewer = None
+
+
+def get_lease_renewer():
+    global _renewer
+    if _renewer is None:
+        with _lease_lock:
+            if _renewer is None:
+                _renewer = LeaseRenewer(settings.ADB_LEASE_RENEW_INTERVAL)
+    return _renewer
+
+
+# ===================== 对外接口 =====================
+def request_lease(connect_id, owner, priority=PRIORITY_MANUAL, payload=None):
+    """
+    申请设备租约，返回 0（已持有，可以立即执行）或排队位置
+    未开启租约或 Redis 不可用时直接放行，返回 0
+    """
+    if not connect_id or not settings.ADB_LEASE_ENABLED:
+        return 0
+    lease = get_device_lease()
+    try:
+        position = lease.acquire(connect_id, owner, priority, payload)
+    except redis.RedisError as e:
+        logger.warning(f"设备执行租约不可用，直接执行：{str(e)}")
+        return 0
+    if position and not lease.holder(connect_id):
+        # 原持有者已过期：把租约交给队首（是自己时直接执行）
+        _dispatch_loop(connect_id, "", requester=owner)
+        position = lease.positions([(connect_id, owner)]).get((connect_id, owner), 0)
+    return position
+
+
+def release_lease(connect_id, owner):
+    """释放租约，并派发该设备等待队列中的下一个任务"""
+    get_lease_renewer().discard(owner)
+    if not connect_id or not settings.ADB_LEASE_ENABLED:
+        return
+    _dispatch_loop(connect_id, owner)
+
+
+def dispatch_waiting(connect_id=None):
+    """租约已过期的设备：把租约交给队首等待者（connect_id 为空时检查所有有等待者的设备）"""
+    if not settings.ADB_LEASE_ENABLED:
+        return 0
+    try:
+        connect_ids = [connect_id] if connect_id else list(get_device_lease().waiting_devices())
+    except redis.RedisError as e:
+        logger.warning(f"读取设备等待队列失败：{str(e)}")
+        return 0
+    return sum(_dispatch_loop(cid, "") for cid in connect_ids)
+
+
+def _dispatch_loop(connect_id, owner, requester=None):
+    """
+    交接租约并启动新持有者；启动失败时继续交给下一个等待者。返回启动的任务数
+    :param requester: 正在申请租约的任务，租约交给它时不经派发函数（由调用方直接执行）
+    """
+    lease = get_device_lease()
+    while True:
+        try:
+            handed = lease.handover(connect_id, owner)
+        except redis.RedisError as e:
+            logger.warning(f"释放设备{connect_id}执行租约失败：{str(e)}")
+            return 0
+        if handed is None:
+            return 0
+        owner, payload = handed
+        if owner == requester:
+            return 0
+        kind, _, pk = owner.partition(":")
+        try:
+            started = import_string(LEASE_DISPATCHERS[kind])(int(pk), payload)
+        except Exception as e:
+            logger.error(f"派发设备{connect_id}排队任务{owner}失败：{str(e)}", exc_info=True)
+            started = False
+        if started:
+            logger.info(f"设备{connect_id}执行租约已交给排队任务{owner}")
+            return 1
+
+
+def cancel_lease_wait(connect_id, owner):
+    """从设备等待队列移除（停止排队中的任务）"""
+    if not connect_id or not settings.ADB_LEASE_ENABLED:
+        return False
+    try:
+        return get_device_lease().cancel(connect_id, owner)
+    except redis.RedisError as e:
+        logger.warning(f"移除设备{connect_id}排队任务{owner}失败：{str(e)}")
+        return False
+
+
+def queue_positions(items):
+    """批量查询排队位置：items 为 [(connect_id, owner)]，返回 {(connect_id, owner): 位置}"""
+    if not settings.ADB_LEASE_ENABLED:
+        return {}
+    try:
+        return get_device_lease().positions(items)
+    except redis.RedisError as e:
+        logger.warning(f"查询设备排队位置失败：{str(e)}")
+        return {}
+
+
+@contextmanager
+def hold_lease(connect_id, owner, priority=PRIORITY_MANUAL, payload=None):
+    """
+    执行期间持有设备租约（进入时确认/申请租约，期间自动续期，退出时释放并派发下一个等待者）
+    产出排队位置：0 表示已持有租约；否则任务已重新排队，调用方不应执行
+    """
+    position = request_lease(connect_id, owner, priority, payload)
+    if position:
+        yield position
+        return
+    get_lease_renewer().add(connect_id, owner)
+    try:
+        yield 0
+    finally:
+        release_lease(connect_id, owner)
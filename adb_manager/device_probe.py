@@ -0,0 +1,210 @@
+"""设备详情批量探测（一次 adb shell 获取全部详情）
+
+在设备上执行一条脚本：完整 getprop + dumpsys battery + ip addr show wlan0 + boot_id，
+各段之间用分隔标记隔开，一次往返拿到全部输出后统一解析。
+品牌/型号/系统版本等只读属性缓存到下次重启（见 property_cache），缓存命中时不再导出完整 getprop。
+"""
+import logging
+import re
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .property_cache import get_property_cache, boot_id_command, split_boot_id
+
+logger = logging.getLogger(__name__)
+
+PROBE_SENTINEL = "__EASYADB_PROBE__"
+PROBE_SECTIONS = (
+    ("battery", "dumpsys battery"),
+    ("wifi_ip", "ip addr show wlan0"),
+)
+# getprop 输出行：[ro.product.brand]: [Xiaomi]
+GETPROP_LINE = re.compile(r"^\[(?P<key>[^\]]+)\]:\s*\[(?P<value>.*)\]$")
+
+BATTERY_HEALTH_NUM_MAP = {
+    "1": "未知", "2": "良好", "3": "过热", "4": "损坏",
+    "5": "过压", "6": "未知故障", "7": "过冷"
+}
+BATTERY_HEALTH_STR_MAP = {
+    "GOOD": "良好", "OVERHEAT": "过热", "DEAD": "损坏",
+    "OVER_VOLTAGE": "过压", "UNSPECIFIED_FAILURE": "未知故障",
+    "COLD": "过冷", "UNKNOWN": "未知"
+}
+BATTERY_STATUS_NUM_MAP = {
+    "1": "未知", "2": "充电中", "3": "放电中",
+    "4": "未充电", "5": "已充满"
+}
+BATTERY_STATUS_STR_MAP = {
+    "CHARGING": "充电中", "DISCHARGING": "放电中",
+    "NOT_CHARGING": "未充电", "FULL": "已充满",
+    "UNKNOWN": "未知", "CONNECTED": "已连接电源（未充电）"
+}
+# getprop 备用电池属性的取值映射
+BATTERY_HEALTH_PROP_MAP = {"good": "良好", "bad": "损坏", "unknown": "未知"}
+BATTERY_STATUS_PROP_MAP = {"charging": "充电中", "discharging": "放电中", "full": "已充满", "not_charging": "未充电"}
+
+
+def build_probe_script(full_getprop=True):
+    """
+    拼接探测脚本：getprop; echo 标记:battery; dumpsys battery; echo 标记:wifi_ip; ip addr show wlan0; 读取 boot_id
+    :param full_getprop: 只读属性已缓存时只取电池相关属性，不再导出完整 getprop
+    """
+    parts = ["getprop" if full_getprop else "getprop | grep status.battery"]
+    for name, command in PROBE_SECTIONS:
+        parts.append(f"echo {PROBE_SENTINEL}:{name}")
+        parts.append(command)
+    parts.append(boot_id_command())
+    return "; ".join(parts)
+
+
+def split_probe_output(output):
+    """按分隔标记拆分探测输出：{"getprop": ..., "battery": ..., "wifi_ip": ...}"""
+    sections = {"getprop": []}
+    current = "getprop"
+    for line in output.splitlines():
+        line = line.rstrip("\r")
+        if line.startswith(f"{PROBE_SENTINEL}:"):
+            current = line.split(":", 1)[1].strip()
+            sections[current] = []
+            continue
+        sections[current].append(line)
+    return {name: "\n".join(lines).strip() for name, lines in sections.items()}
+
+
+def parse_getprop(output):
+    """解析完整 getprop 输出为字典"""
+    props = {}
+    for line in output.splitlines():
+        match = GETPROP_LINE.match(line.strip())
+        if match:
+            props[match.group("key")] = match.group("value")
+    return props
+
+
+def parse_battery(battery_info, props):
+    """解析 dumpsys battery，取不到时回退到 getprop 的 status.battery.* 属性"""
+    level = health = status = ""
+    if battery_info:
+        try:
+            level_match = re.search(r"level:\s*(\d+)", battery_info, re.IGNORECASE)
+            health_match = re.search(r"health:\s*(\d+|\w+)", battery_info, re.IGNORECASE)
+            status_match = re.search(r"status:\s*(\d+|\w+)", battery_info, re.IGNORECASE)
+
+            if level_match and level_match.group(1):
+                level = f"{level_match.group(1)}%"
+            health_val = health_match.group(1).upper() if (health_match and health_match.group(1)) else ""
+            health = BATTERY_HEALTH_NUM_MAP.get(health_val, BATTERY_HEALTH_STR_MAP.get(health_val, ""))
+            status_val = status_match.group(1).upper() if (status_match and status_match.group(1)) else ""
+            status = BATTERY_STATUS_NUM_MAP.get(status_val, BATTERY_STATUS_STR_MAP.get(status_val, ""))
+        except Exception as e:
+            logger.error(f"解析电池信息失败：{str(e)}")
+
+    # 备用电池信息（旧设备/部分厂商 dumpsys battery 不可用）
+    if not level or level == "未知":
+        backup = props.get("status.battery.level", "")
+        level = f"{backup}%" if backup else "未知"
+    if not health or health == "未知":
+        backup = props.get("status.battery.health", "")
+        health = BATTERY_HEALTH_PROP_MAP.get(backup.lower(), backup or "未知")
+    if not status or status == "未知":
+        backup = props.get("status.battery.state", "")
+        status = BATTERY_STATUS_PROP_MAP.get(backup.lower(), backup or "未知")
+    return level, health, status
+
+
+def parse_wifi_ip(output):
+    for line in output.splitlines():
+        if "inet " in line and "127.0.0.1" not in line:
+            return line.split("inet ")[1].split("/")[0].strip()
+    return "未连接WiFi/无IP"
+
+
+def parse_probe_output(stdout, cached_props=None):
+    """
+    解析探测输出为设备详情字段
+    :param cached_props: 缓存的只读属性（与本次取到的属性合并）
+    """
+    sections = split_probe_output(stdout)
+    props = {**(cached_props or {}), **parse_getprop(sections.get("getprop", ""))}
+    battery_level, battery_health, battery_status = parse_battery(sections.get("battery", ""), props)
+    return {
+        "brand": props.get("ro.product.brand") or "未知",
+        "model": props.get("ro.product.model") or "未知",
+        "system_version": props.get("ro.build.version.release") or "未知",
+        "serial": props.get("ro.serialno") or "",
+        "battery_level": battery_level,
+        "battery_health": battery_health,
+        "battery_status": battery_status,
+        "wifi_ip": parse_wifi_ip(sections.get("wifi_ip", "")),
+        "raw_commands": {
+            name: {"stdout": output, "stderr": ""} for name, output in sections.items() if name != "getprop"
+        },
+        "props": props,
+    }
+
+
+def probe_device(device, timeout=None, use_cache=True):
+    """探测单台设备详情（一次 adb shell，只读属性走开机周期缓存）"""
+    from .views import execute_adb_command, get_adb_path
+    connect_id = device.connect_identifier
+    timeout = timeout or settings.ADB_PROBE_TIMEOUT
+    result_data = {
+        "device_id": device.id,
+        "device_name": device.device_name,
+        "connect_id": connect_id,
+        "brand": "",
+        "model": "",
+        "system_version": "",
+        "serial": "",
+        "battery_level": "",
+        "battery_health": "",
+        "battery_status": "",
+        "wifi_ip": "",
+        "raw_commands": {}  # 保存原始命令输出（用于调试）
+    }
+
+    # 只读属性已缓存时脚本不再导出完整 getprop，结果中的 boot_id 用于校验缓存是否仍有效
+    cache = get_property_cache()
+    cached = cache.get_entry(connect_id) if use_cache else None
+    cmd = [get_adb_path(), "-s", connect_id, "shell", build_probe_script(full_getprop=cached is None)]
+    try:
+        result = execute_adb_command(cmd, shell=False, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        logger.error(f"设备{connect_id}详情探测超时")
+        result_data["raw_commands"]["probe"] = {"stdout": "", "stderr": "命令执行超时"}
+        return result_data
+    except Exception as e:
+        logger.error(f"设备{connect_id}详情探测失败：{str(e)}")
+        result_data["raw_commands"]["probe"] = {"stdout": "", "stderr": str(e)}
+        return result_data
+
+    stdout, boot_id = split_boot_id(result.stdout or "")
+    if not stdout.strip():
+        result_data["raw_commands"]["probe"] = {"stdout": "", "stderr": (result.stderr or "").strip()}
+        return result_data
+
+    if cached is not None and not cache.verify(connect_id, boot_id):
+        # 设备重启过，缓存已失效，重新完整探测一次
+        return probe_device(device, timeout, use_cache=False)
+
+    parsed = parse_probe_output(stdout, cached["props"] if cached else None)
+    if cached is None:
+        cache.store(connect_id, boot_id, parsed["props"])
+    parsed.pop("props")
+    result_data.update(parsed)
+    result_data["serial"] = result_data["serial"] or connect_id
+    result_data["raw_commands"]["probe"] = {"stdout": "", "stderr": (result.stderr or "").strip()}
+    result_data["props_cached"] = cached is not None
+    return result_data
+
+
+def probe_devices(devices, max_workers=None, timeout=None):
+    """并发探测多台设备详情，按传入顺序返回"""
+    devices = [device for device in devices if device.connect_identifier]
+    if not devices:
+        return []
+    max_workers = min(len(devices), max_workers or settings.ADB_BULK_MAX_WORKERS)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda device: probe_device(device, timeout), devices))
@@ -0,0 +1,148 @@
+"""设备在线状态追踪（订阅 adb server 的 host:track-devices-l 推送）
+
+设备接入 / 断开 / 变为 unauthorized、offline 时立即写入 Redis 状态，
+并把状态变化以 JSON 发布到 settings.ADB_DEVICE_EVENT_CHANNEL 频道：
+    {"connect_id": "...", "status": "online", "previous": "offline", "adb_state": "device", "timestamp": 1700000000.0}
+设备列表不变时 adb server 不会推送任何数据，不产生额外的 adb 流量。
+心跳：每 ADB_STATUS_HEARTBEAT_INTERVAL 秒按最近一次快照续期所有设备状态（不发 adb 命令）；
+追踪器停止或与 adb server 断开期间不再续期，状态在 ADB_STATUS_TTL 秒后过期为 stale。
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from .adb_client import AdbError, get_adb_client
+from .device_lease import dispatch_waiting
+from .dir_index import get_directory_index
+from .property_cache import get_property_cache
+from .reconnect_scheduler import get_reconnect_scheduler
+from .status_store import get_status_store
+
+logger = logging.getLogger(__name__)
+
+# adb 设备状态 -> 系统设备状态
+ADB_STATE_MAP = {
+    "device": "online",
+    "unauthorized": "unauthorized",
+    "offline": "offline",
+}
+
+
+def map_adb_state(adb_state):
+    """adb 状态映射为系统状态（未列出的状态如 recovery/sideload 原样保留）"""
+    if adb_state is None:
+        return "offline"
+    return ADB_STATE_MAP.get(adb_state, adb_state)
+
+
+class DeviceTracker:
+    """常驻追踪器：保持 track-devices 长连接，断开后按指数退避重连"""
+
+    def __init__(self, client=None, store=None, max_wait=None):
+        self.client = client or get_adb_client()
+        self.store = store or get_status_store()
+        self.max_wait = max_wait if max_wait is not None else settings.ADB_TRACKER_RECONNECT_MAX_WAIT
+        self.stop_event = threading.Event()
+        # 最近一次快照：{serial: adb_state}
+        self.snapshot = None
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        """阻塞运行，直到调用 stop()"""
+        threading.Thread(target=self._heartbeat_loop, name="device-heartbeat", daemon=True).start()
+        wait = 1
+        while not self.stop_event.is_set():
+            try:
+                for devices in self.client.track_devices(long=True):
+                    wait = 1
+                    self.handle_snapshot({dev["serial"]: dev["status"] for dev in devices})
+                    if self.stop_event.is_set():
+                        return
+                logger.warning("track-devices 连接被 adb server 关闭")
+            except (AdbError, OSError) as e:
+                logger.warning(f"track-devices 连接失败：{str(e)}，{wait}秒后重连")
+            # 重连后重新全量写入，补齐断线期间错过的变化
+            self.snapshot = None
+            self.stop_event.wait(wait)
+            wait = min(wait * 2, self.max_wait)
+
+    def handle_snapshot(self, current):
+        """对比前后两次快照，写入变化的设备状态并发布事件"""
+        previous = self.snapshot
+        if previous is None:
+            # 首次快照（含重连后）：全量写入，数据库中已启用但不在 adb 列表里的设备标记为离线
+            changes = {connect_id: None for connect_id in self._active_connect_ids()}
+            changes.update(current)
+            previous = {}
+        else:
+            changes = {
+                serial: current.get(serial)
+                for serial in set(previous) | set(current)
+                if previous.get(serial) != current.get(serial)
+            }
+        self.snapshot = current
+        if not changes:
+            return {}
+
+        now = time.time()
+        updates, events = {}, []
+        for connect_id, adb_state in changes.items():
+            status = map_adb_state(adb_state)
+            if adb_state is None:
+                message = {"stderr": "设备已断开（adb track-devices）"}
+            else:
+                message = {"stdout": f"adb 状态：{adb_state}", "stderr": ""}
+            updates[connect_id] = {"status": status, **message}
+            events.append({
+                "connect_id": connect_id,
+                "status": status,
+                "previous": map_adb_state(previous[connect_id]) if connect_id in previous else None,
+                "adb_state": adb_state,
+                "timestamp": now,
+            })
+
+        self.store.set_many(updates)
+        # 设备离线/断开（可能是重启）时清除只读属性缓存与目录索引
+        gone = [connect_id for connect_id, adb_state in changes.items() if adb_state != "device"]
+        get_property_cache().invalidate_many(gone)
+        get_directory_index().invalidate_many(gone)
+        # 刚上线的设备清零退避，刚断开的设备下一轮检查即重连（频繁抖动的设备按惩罚值延后）
+        get_reconnect_scheduler().record_many(
+            {connect_id: adb_state == "device" for connect_id, adb_state in changes.items()}, attempted=False
+        )
+        for event in events:
+            self.store.publish(event)
+            logger.info(f"设备状态变化：{event['connect_id']} {event['previous']} -> {event['status']}")
+        return updates
+
+    def heartbeat(self):
+        """按最近一次快照续期设备状态；与 adb server 断开时（没有快照）不续期"""
+        snapshot = self.snapshot
+        if snapshot is None:
+            return {}
+        statuses = {connect_id: "offline" for connect_id in self._active_connect_ids()}
+        statuses.update({serial: map_adb_state(adb_state) for serial, adb_state in snapshot.items()})
+        self.store.heartbeat(statuses)
+        return statuses
+
+    def _heartbeat_loop(self):
+        while not self.stop_event.wait(settings.ADB_STATUS_HEARTBEAT_INTERVAL):
+            try:
+                self.heartbeat()
+                # 执行租约过期（持有任务的进程崩溃）的设备：启动排队中的下一个任务
+                dispatch_waiting()
+            except Exception as e:
+                logger.warning(f"设备状态心跳失败：{str(e)}")
+
+    @staticmethod
+    def _active_connect_ids():
+        from .models import ADBDevice
+        return [
+            device.connect_identifier
+            for device in ADBDevice.objects.filter(is_active=True)
+            if device.connect_identifier
+        ]
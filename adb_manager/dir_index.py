@@ -0,0 +1,228 @@
+"""设备文件浏览器的目录索引（解析后的目录列表短期缓存 + 服务端排序/过滤/分页）
+
+按设备一个 Redis Hash：adb:device:dir:{connect_id}
+    字段 list:{path}   -> {"cached_at", "entries": [...]}，ADB_DIR_INDEX_TTL 秒内直接使用
+    字段 sweep:{path}  -> {"cached_at", "total_size", "file_count", "children": {名称: 字节数}}，
+                          ADB_DIR_SWEEP_TTL 秒内直接使用
+创建/删除/上传文件后删除受影响目录（及其子目录）的缓存；设备离线时整台设备的索引一起删除。
+
+目录大小统计：对整棵子树只执行一次 find -printf，在服务端按第一级子项汇总，
+不再对每个子目录分别执行 ls / du。
+"""
+import json
+import logging
+import posixpath
+import re
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+from .adb_client import quote_shell_arg
+from .status_store import get_status_store
+
+logger = logging.getLogger(__name__)
+
+SORT_FIELDS = ("name", "size", "date")
+# toybox ls -la 的日期格式：2024-01-01 12:00（8列）；旧版 toolbox/busybox：Jan  1 12:00（9列）
+ISO_DATE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def normalize_path(path):
+    """统一目录路径写法（去掉多余的 / 和 .），用作缓存字段"""
+    path = posixpath.normpath(path.strip() or "/")
+    return "/" if path in ("/", "//") else path
+
+
+def parse_ls_output(output):
+    """解析 ls -la 输出为文件列表（兼容 8 列与 9 列两种日期格式）"""
+    entries = []
+    for line in output.splitlines():
+        parts = line.rstrip("\r").split(maxsplit=7)
+        if len(parts) < 8 or parts[0].startswith("total"):
+            continue
+        if ISO_DATE.match(parts[5]):
+            date, name = f"{parts[5]} {parts[6]}", parts[7]
+        else:
+            parts = line.rstrip("\r").split(maxsplit=8)
+            if len(parts) < 9:
+                continue
+            date, name = f"{parts[5]} {parts[6]} {parts[7]}", parts[8]
+        permissions = parts[0]
+        # 符号链接显示为 name -> target
+        if permissions.startswith("l") and " -> " in name:
+            name = name.split(" -> ", 1)[0]
+        if name in (".", ".."):
+            continue
+        entries.append({
+            "name": name,
+            "is_dir": permissions.startswith("d"),
+            "permissions": permissions,
+            "size": int(parts[4]) if parts[4].isdigit() else 0,
+            "date": date,
+            "owner": parts[2],
+            "group": parts[3],
+        })
+    return entries
+
+
+def build_sweep_script(path):
+    """一次 find 输出子树下全部文件的大小与相对路径；不支持 -printf 的旧系统退回 stat"""
+    target = quote_shell_arg(path)
+    return (f"if find /dev/null -maxdepth 0 -printf '' 2>/dev/null; "
+            f"then find -H {target} -type f -printf '%s %P\\n' 2>/dev/null; "
+            f"else find -H {target} -type f -exec stat -c '%s %n' {{}} + 2>/dev/null; fi")
+
+
+def parse_sweep_output(output, path):
+    """按第一级子项汇总文件大小：{"total_size", "file_count", "children": {名称: 字节数}}"""
+    prefix = path.rstrip("/") + "/"
+    total_size, file_count, children = 0, 0, {}
+    for line in output.splitlines():
+        size, _, relative = line.rstrip("\r").partition(" ")
+        if not size.isdigit() or not relative:
+            continue
+        # stat 回退方式输出的是完整路径
+        if relative.startswith(prefix):
+            relative = relative[len(prefix):]
+        size = int(size)
+        total_size += size
+        file_count += 1
+        top = relative.split("/", 1)[0]
+        children[top] = children.get(top, 0) + size
+    return {"total_size": total_size, "file_count": file_count, "children": children}
+
+
+def query_entries(entries, q="", sort="name", order="asc", dirs_first=True):
+    """按名称过滤并排序（目录默认排在文件前面）"""
+    if q:
+        q = q.lower()
+        entries = [entry for entry in entries if q in entry["name"].lower()]
+    if sort == "size":
+        key = lambda entry: entry.get("tree_size", entry["size"])
+    elif sort == "date":
+        key = lambda entry: entry["date"]
+    else:
+        key = lambda entry: entry["name"].lower()
+    entries = sorted(entries, key=key, reverse=(order == "desc"))
+    if dirs_first:
+        entries.sort(key=lambda entry: not entry["is_dir"])
+    return entries
+
+
+class DirectoryIndex:
+    """单台设备的目录列表缓存（Redis Hash）"""
+    KEY_PREFIX = "adb:device:dir:"
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def key(cls, connect_id):
+        return f"{cls.KEY_PREFIX}{connect_id}"
+
+    def _get(self, connect_id, field, ttl):
+        try:
+            raw = self.client.hget(self.key(connect_id), field)
+        except redis.RedisError as e:
+            logger.warning(f"读取目录索引失败（{connect_id}）：{str(e)}")
+            return None
+        if not raw:
+            return None
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            return None
+        return data if time.time() - data.get("cached_at", 0) < ttl else None
+
+    def _set(self, connect_id, field, data):
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hset(self.key(connect_id), field, json.dumps(data, ensure_ascii=False))
+            pipe.expire(self.key(connect_id), max(settings.ADB_DIR_INDEX_TTL, settings.ADB_DIR_SWEEP_TTL))
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"写入目录索引失败（{connect_id}）：{str(e)}")
+
+    def _shell(self, connect_id, script, timeout):
+        from .views import execute_adb_command, get_adb_path
+        return execute_adb_command(
+            [get_adb_path(), "-s", connect_id, "shell", script],
+            shell=False, timeout=timeout
+        )
+
+    def listing(self, connect_id, path, refresh=False, timeout=30):
+        """
+        读取目录列表（缓存未过期时不执行 adb 命令）
+        :return: (entries, cached_at, from_cache)
+        :raises RuntimeError: ls 执行失败
+        """
+        path = normalize_path(path)
+        cached = None if refresh else self._get(connect_id, f"list:{path}", settings.ADB_DIR_INDEX_TTL)
+        if cached is not None:
+            return cached["entries"], cached["cached_at"], True
+
+        # 路径以 / 结尾，符号链接目录（如 /sdcard）也列出其内容
+        target = path if path.endswith("/") else f"{path}/"
+        result = self._shell(connect_id, f"ls -la {quote_shell_arg(target)}", timeout)
+        entries = parse_ls_output(result.stdout or "")
+        if result.returncode != 0 and not entries:
+            raise RuntimeError(result.stderr or result.stdout or "列出目录失败")
+        cached_at = time.time()
+        self._set(connect_id, f"list:{path}", {"cached_at": cached_at, "entries": entries})
+        return entries, cached_at, False
+
+    def sweep(self, connect_id, path, refresh=False, timeout=120):
+        """统计目录下每个子项（递归）的总大小，一次 find 覆盖整棵子树"""
+        path = normalize_path(path)
+        cached = None if refresh else self._get(connect_id, f"sweep:{path}", settings.ADB_DIR_SWEEP_TTL)
+        if cached is not None:
+            return cached
+
+        result = self._shell(connect_id, build_sweep_script(path), timeout)
+        data = {"cached_at": time.time(), **parse_sweep_output(result.stdout or "", path)}
+        self._set(connect_id, f"sweep:{path}", data)
+        return data
+
+    def invalidate(self, connect_id, path):
+        """删除某个路径所在目录及其子目录的缓存（创建/删除/上传后调用）"""
+        path = normalize_path(path)
+        parent = posixpath.dirname(path)
+        try:
+            fields = self.client.hkeys(self.key(connect_id))
+            stale = [
+                field for field in fields
+                if field.split(":", 1)[-1] in (path, parent)
+                or field.split(":", 1)[-1].startswith(path.rstrip("/") + "/")
+                # 上级目录的大小统计也包含了该路径
+                or (field.startswith("sweep:") and path.startswith(field[len("sweep:"):].rstrip("/") + "/"))
+            ]
+            if stale:
+                self.client.hdel(self.key(connect_id), *stale)
+        except redis.RedisError as e:
+            logger.warning(f"删除目录索引失败（{connect_id}）：{str(e)}")
+
+    def invalidate_many(self, connect_ids):
+        connect_ids = [connect_id for connect_id in connect_ids if connect_id]
+        if not connect_ids:
+            return
+        try:
+            self.client.delete(*[self.key(connect_id) for connect_id in connect_ids])
+        except redis.RedisError as e:
+            logger.warning(f"批量删除目录索引失败：{str(e)}")
+
+
+# ===================== 全局单例 =====================
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_directory_index():
+    """获取全局目录索引（复用设备状态存储的Redis连接）"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = DirectoryIndex(get_status_store().client)
+    return _index
@@ -0,0 +1,248 @@
+"""局域网设备发现与批量登记
+
+流程（后台执行，进度通过批量任务通道推送：ws/adb_bulk_job/<job_id>/）：
+1. 扫描：asyncio 并发探测 CIDR 网段内每个 IP 的 ADB 端口（默认 5555，可自定义），
+   并发数 ADB_DISCOVERY_CONCURRENCY，单次探测超时 ADB_DISCOVERY_PROBE_TIMEOUT；
+2. 连接：对端口开放的地址并发执行 adb connect；
+3. 读取型号：每台设备一次 adb shell 读取 getprop（走只读属性缓存，见 property_cache）；
+4. 登记：跳过数据库中已存在的 IP+端口（unique_together），其余 bulk_create 为 ADBDevice。
+"""
+import asyncio
+import ipaddress
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .bulk_jobs import BulkJob
+from .operation_log import write_operation_log
+from .property_cache import get_device_properties
+from .status_store import get_status_store
+
+logger = logging.getLogger(__name__)
+
+DISCOVERY_OPERATION = "discover"
+# 扫描进度推送间隔（探测数）
+PROGRESS_EVERY = 256
+
+
+def host_count(network):
+    """网段内可扫描的地址数（/31、/32 不排除网络地址和广播地址）"""
+    return network.num_addresses - 2 if network.num_addresses > 2 else network.num_addresses
+
+
+def parse_ports(value):
+    """解析端口列表（逗号分隔），默认 5555"""
+    ports = []
+    for item in str(value or "").replace("，", ",").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        port = int(item)
+        if not 0 < port < 65536:
+            raise ValueError(f"端口超出范围：{port}")
+        ports.append(port)
+    return sorted(set(ports)) or [5555]
+
+
+def parse_networks(value):
+    """解析网段列表（逗号/换行分隔，如 192.168.3.0/24），单个 IP 视为 /32"""
+    networks = []
+    for item in str(value or "").replace("，", ",").replace("\n", ",").split(","):
+        item = item.strip()
+        if item:
+            networks.append(ipaddress.ip_network(item, strict=False))
+    if not networks:
+        raise ValueError("请至少填写一个网段")
+    total = sum(host_count(network) for network in networks)
+    if total > settings.ADB_DISCOVERY_MAX_HOSTS:
+        raise ValueError(f"扫描范围过大（{total}个地址），上限为{settings.ADB_DISCOVERY_MAX_HOSTS}个")
+    return networks
+
+
+def iter_targets(networks, ports):
+    for network in networks:
+        hosts = network.hosts() if network.num_addresses > 2 else iter(network)
+        for host in hosts:
+            for port in ports:
+                yield str(host), port
+
+
+# ===================== 1. 扫描 =====================
+async def _probe(host, port, timeout):
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
+
+
+async def scan(targets, total, concurrency, timeout, on_progress=None):
+    """
+    并发探测端口（固定数量的协程从同一个迭代器取目标，不会一次性创建全部任务）
+    :return: 端口开放的 [(host, port)]
+    """
+    targets = iter(targets)
+    responders = []
+    scanned = 0
+
+    async def worker():
+        nonlocal scanned
+        for host, port in targets:
+            if await _probe(host, port, timeout):
+                responders.append((host, port))
+            scanned += 1
+            if on_progress and scanned % PROGRESS_EVERY == 0:
+                on_progress(scanned, total, len(responders))
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, total) or 1)))
+    return sorted(responders, key=lambda item: (ipaddress.ip_address(item[0]), item[1]))
+
+
+# ===================== 2~4. 连接、读取型号、登记 =====================
+def connect_and_probe(address):
+    """adb connect 并读取型号，返回 (success, message, props)"""
+    from .views import execute_adb_command, get_adb_path
+    result = execute_adb_command([get_adb_path(), "connect", address], timeout=10, shell=False, priority=-1)
+    output = (result.stdout or result.stderr or "").strip()
+    if "connected" not in output or "unable" in output or "failed" in output:
+        return False, f"连接失败 - {output}", {}
+    get_status_store().set(address, "online", output, "")
+    return True, "连接成功", get_device_properties(address)
+
+
+def _connect_timed(address):
+    """connect_and_probe 并计时，返回 (success, message, props, latency_ms)"""
+    start = time.monotonic()
+    try:
+        success, message, props = connect_and_probe(address)
+    except Exception as e:
+        success, message, props = False, f"连接异常 - {str(e)}", {}
+    return success, message, props, int((time.monotonic() - start) * 1000)
+
+
+def _registered(model, pairs):
+    """数据库中已登记的 (IP, 端口)"""
+    if not pairs:
+        return set()
+    rows = model.objects.filter(device_ip__in={host for host, _ in pairs}).values_list("device_ip", "device_port")
+    return set(rows) & set(pairs)
+
+
+def device_name_for(host, props):
+    model = props.get("ro.product.model") or "未知设备"
+    return f"{model}-{host}"[:50]
+
+
+def run_discovery(job_id, networks, ports, user_id=None):
+    """执行发现任务（Celery 任务与后台线程共用）；任何阶段出错都会结束任务并记录错误"""
+    from .models import ADBDevice
+    close_old_connections()
+    job = BulkJob(job_id, DISCOVERY_OPERATION, params={"networks": networks, "ports": ports})
+    responders, existing, new_devices = [], set(), []
+    error = None
+
+    def on_progress(scanned, total, found):
+        job.progress(f"正在扫描：{scanned}/{total}，发现{found}个开放端口", scanned=scanned, found=found)
+
+    try:
+        parsed = [ipaddress.ip_network(network, strict=False) for network in networks]
+        total = sum(host_count(network) for network in parsed) * len(ports)
+        job.progress(f"开始扫描{total}个地址端口", scanned=0, found=0)
+        responders = asyncio.run(scan(
+            iter_targets(parsed, ports), total,
+            settings.ADB_DISCOVERY_CONCURRENCY, settings.ADB_DISCOVERY_PROBE_TIMEOUT, on_progress
+        ))
+        job.progress(f"扫描完成：{total}个地址端口中发现{len(responders)}个开放端口，正在连接",
+                     scanned=total, found=len(responders), total=len(responders))
+
+        existing = _registered(ADBDevice, responders)
+        with ThreadPoolExecutor(max_workers=settings.ADB_BULK_MAX_WORKERS) as executor:
+            futures = {
+                executor.submit(_connect_timed, f"{host}:{port}"): (host, port)
+                for host, port in responders if (host, port) not in existing
+            }
+            for host, port in responders:
+                if (host, port) in existing:
+                    # 未执行连接，不计入耗时统计
+                    job.add_result({"device_id": None, "device_name": "", "connect_id": f"{host}:{port}",
+                                    "success": True, "message": "已存在，跳过", "latency_ms": None})
+            for future in as_completed(futures):
+                host, port = futures[future]
+                success, message, props, latency_ms = future.result()
+                if success:
+                    new_devices.append(ADBDevice(
+                        device_name=device_name_for(host, props),
+                        device_ip=host,
+                        device_port=port,
+                        is_active=True,
+                        user_id=user_id,
+                    ))
+                    message = f"{message}（{props.get('ro.product.brand', '')} {props.get('ro.product.model', '')}，序列号：{props.get('ro.serialno', '未知')}）"
+                job.add_result({"device_id": None, "device_name": "", "connect_id": f"{host}:{port}",
+                                "success": success, "message": message, "latency_ms": latency_ms})
+    except Exception as e:
+        # 扫描/连接阶段异常：已连接成功的设备照常登记，任务照常结束（不会一直停留在执行中）
+        error = str(e)
+        logger.error(f"局域网扫描任务异常（{job_id}）：{error}", exc_info=True)
+        job.progress(f"扫描任务异常：{error}", error=error)
+
+    created = 0
+    if new_devices:
+        try:
+            # ignore_conflicts：扫描期间其他人手动添加/导入了同一 IP+端口时不报错；
+            # 被跳过的行 bulk_create 不会报告，按写入前后的已登记地址计算实际新增数
+            pairs = [(device.device_ip, device.device_port) for device in new_devices]
+            before = _registered(ADBDevice, pairs)
+            ADBDevice.objects.bulk_create(new_devices, ignore_conflicts=True)
+            created = len(_registered(ADBDevice, pairs) - before)
+        except Exception as e:
+            logger.error(f"登记发现的设备失败（{job_id}）：{str(e)}", exc_info=True)
+            job.progress(f"登记设备失败：{str(e)}")
+
+    summary = job.finish()
+    details = (f"局域网扫描完成（任务ID：{job_id}）！网段：{','.join(networks)}，端口：{','.join(map(str, ports))}，"
+               f"发现{len(responders)}台，新登记{created}台，已存在{len(existing)}台")
+    if created < len(new_devices):
+        details += f"，{len(new_devices) - created}台在扫描期间已被其他操作登记或登记失败"
+    if error:
+        details += f"，任务异常：{error}"
+    try:
+        write_operation_log(device=None, operation_type="add", user_id=user_id,
+                            operation_result=error is None and created == len(new_devices),
+                            operation_details=details)
+    except Exception as e:
+        logger.warning(f"记录局域网扫描日志失败（{job_id}）：{str(e)}")
+    finally:
+        close_old_connections()
+    logger.info(details)
+    return summary
+
+
+def start_discovery(networks, ports, user=None):
+    """创建发现任务并提交到 Celery（或后台线程），立即返回任务ID"""
+    networks = [str(network) for network in parse_networks(networks)]
+    ports = parse_ports(ports)
+    job = BulkJob(uuid.uuid4().hex, DISCOVERY_OPERATION, params={"networks": networks, "ports": ports})
+    job.init(0)
+    args = (job.job_id, networks, ports, user.id if user else None)
+
+    if hasattr(settings, 'USE_CELERY') and settings.USE_CELERY:
+        from .tasks import run_discovery_task
+        run_discovery_task.delay(*args)
+        logger.info(f"已提交局域网扫描任务到Celery（{job.job_id}）：{networks} 端口{ports}")
+        return job.job_id
+
+    thread = threading.Thread(target=run_discovery, args=args, daemon=True)
+    thread.start()
+    logger.info(f"已启动局域网扫描任务（{job.job_id}）：{networks} 端口{ports}")
+    return job.job_id
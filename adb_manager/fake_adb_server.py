@@ -0,0 +1,410 @@
+"""本地模拟 adb server（用于在没有真实设备的情况下调试/测试 ADB 协议客户端）
+
+用法：
+    python -m adb_manager.fake_adb_server --port 5037 --device emulator-5554 --device 192.168.3.100:5555
+
+实现了协议客户端用到的服务：host:version / host:devices(-l) / host:track-devices(-l) /
+host:connect / host:disconnect / host:transport:<serial> / host-serial:<serial>:* /
+shell: / shell,v2,raw: / exec: / sync:（STAT/RECV/SEND，文件保存在 FakeDevice.files）
+"""
+import argparse
+import shlex
+import socketserver
+import struct
+import threading
+import time
+import uuid
+
+ADB_SERVER_VERSION = 41
+
+
+class FakeDevice:
+    """
+    模拟设备：shell 命令由 handlers（命令前缀 -> 回调/固定输出）应答
+    handler 返回的退出码为 None 时，shell v2 不发送退出码直接断开（模拟执行中掉线）
+    """
+
+    def __init__(self, serial, state="device", properties=None, handlers=None, shell_v2=True, details=None):
+        self.serial = serial
+        self.state = state
+        self.shell_v2 = shell_v2
+        self.details = details or "product:fake model:Fake_Phone device:fake transport_id:1"
+        self.properties = {
+            "ro.product.brand": "Fake",
+            "ro.product.model": "Fake_Phone",
+            "ro.build.version.release": "13",
+            "ro.serialno": serial,
+        }
+        self.properties.update(properties or {})
+        self.handlers = dict(handlers or {})
+        self.files = {}
+        self.reboot()
+
+    def reboot(self):
+        """模拟重启：生成新的 boot_id"""
+        self.files["/proc/sys/kernel/random/boot_id"] = f"{uuid.uuid4()}\n".encode()
+
+    def run(self, script, merge_stderr=False):
+        """
+        执行 shell 脚本（支持以 ; 分隔的多条命令与 $?），返回 (stdout_bytes, stderr_bytes, returncode)
+        :param merge_stderr: 模拟 v1 shell（pty），stderr 按命令顺序并入 stdout
+        """
+        stdout, stderr, returncode = [], [], 0
+        for command in _split_commands(script):
+            command = command.replace("$?", str(returncode))
+            out, err, returncode = self.run_command(command)
+            stdout.append(out)
+            (stdout if merge_stderr else stderr).append(err)
+        return b"".join(stdout), b"".join(stderr), returncode
+
+    def run_command(self, command):
+        """执行单条 shell 命令"""
+        for prefix in sorted(self.handlers, key=len, reverse=True):
+            if command == prefix or command.startswith(prefix + " "):
+                result = self.handlers[prefix]
+                if callable(result):
+                    result = result(command)
+                return _normalize_result(result)
+        try:
+            argv = shlex.split(command)
+        except ValueError:
+            argv = command.split()
+        if not argv:
+            return b"", b"", 0
+        if argv[0] == "echo":
+            return (" ".join(argv[1:]) + "\n").encode(), b"", 0
+        if argv[0] == "getprop":
+            if len(argv) == 1:
+                dump = "".join(f"[{k}]: [{v}]\n" for k, v in sorted(self.properties.items()))
+                return dump.encode(), b"", 0
+            return (self.properties.get(argv[1], "") + "\n").encode(), b"", 0
+        if argv[0] == "tail" and len(argv) == 4 and argv[1] == "-c" and argv[2].startswith("+"):
+            if argv[3] in self.files:
+                return self.files[argv[3]][int(argv[2][1:]) - 1:], b"", 0
+            return b"", f"tail: {argv[3]}: No such file or directory\n".encode(), 1
+        if argv[0] == "cat" and len(argv) == 2:
+            if argv[1] in self.files:
+                return self.files[argv[1]], b"", 0
+            return b"", f"cat: {argv[1]}: No such file or directory\n".encode(), 1
+        return b"", f"/system/bin/sh: {argv[0]}: inaccessible or not found\n".encode(), 127
+
+
+def _split_commands(script):
+    """按顶层 ; 拆分命令（忽略引号内的分号）"""
+    commands, current, quote = [], [], None
+    for ch in script:
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in ("'", '"'):
+            quote = ch
+        elif ch == ";":
+            commands.append("".join(current).strip())
+            current = []
+            continue
+        current.append(ch)
+    commands.append("".join(current).strip())
+    return [c for c in commands if c]
+
+
+def _normalize_result(result):
+    if isinstance(result, (str, bytes)):
+        result = (result, b"", 0)
+    stdout, stderr, returncode = result
+    if isinstance(stdout, str):
+        stdout = stdout.encode()
+    if isinstance(stderr, str):
+        stderr = stderr.encode()
+    return stdout, stderr, returncode
+
+
+class _FakeAdbHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        server = self.server
+        device = None
+        while True:
+            try:
+                service = self._read_request()
+            except ConnectionError:
+                return
+            if service is None:
+                return
+
+            if service == "host:version":
+                return self._okay_payload(f"{ADB_SERVER_VERSION:04x}")
+            if service in ("host:devices", "host:devices-l"):
+                return self._okay_payload(server.format_devices(service.endswith("-l")))
+            if service in ("host:track-devices", "host:track-devices-l"):
+                return self._track_devices(service.endswith("-l"))
+            if service.startswith("host:connect:"):
+                return self._okay_payload(server.connect(service[len("host:connect:"):]))
+            if service.startswith("host:disconnect:"):
+                return self._okay_payload(server.disconnect(service[len("host:disconnect:"):]))
+            if service.startswith("host-serial:"):
+                return self._host_serial(service[len("host-serial:"):])
+            if service.startswith("host:transport:"):
+                device = server.get_device(service[len("host:transport:"):])
+                if device is None or device.state != "device":
+                    return self._fail(f"device '{service[len('host:transport:'):]}' not found")
+                self._send(b"OKAY")
+                continue
+            if service in ("host:transport-any", "host:transport-usb", "host:transport-local"):
+                device = next((d for d in server.devices.values() if d.state == "device"), None)
+                if device is None:
+                    return self._fail("no devices/emulators found")
+                self._send(b"OKAY")
+                continue
+
+            if device is None:
+                return self._fail(f"unknown host service: {service}")
+            if service.startswith("shell,v2,raw:") or service.startswith("shell,v2:"):
+                if not device.shell_v2:
+                    return self._fail("closed")
+                return self._shell_v2(device, service.split(":", 1)[1])
+            if service.startswith("shell:"):
+                stdout, _, _ = device.run(service[len("shell:"):], merge_stderr=True)
+                self._send(b"OKAY" + stdout.replace(b"\n", b"\r\n"))
+                return
+            if service == "sync:":
+                self._send(b"OKAY")
+                return self._sync(device)
+            if service.startswith("exec:"):
+                stdout, _, _ = device.run(service[len("exec:"):])
+                self._send(b"OKAY")
+                for i in range(0, len(stdout), 65536):
+                    self._send(stdout[i:i + 65536])
+                return
+            return self._fail(f"unknown service: {service}")
+
+    # ---------- 协议辅助 ----------
+    def _read_exact(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+    def _read_request(self):
+        header = self._read_exact(4)
+        if header is None:
+            return None
+        payload = self._read_exact(int(header, 16))
+        return payload.decode("utf-8") if payload is not None else None
+
+    def _send(self, data):
+        self.request.sendall(data)
+
+    def _okay_payload(self, text):
+        data = text.encode("utf-8")
+        self._send(b"OKAY" + b"%04x" % len(data) + data)
+
+    def _fail(self, message):
+        data = message.encode("utf-8")
+        self._send(b"FAIL" + b"%04x" % len(data) + data)
+
+    def _host_serial(self, rest):
+        serial, _, command = rest.rpartition(":")
+        device = self.server.get_device(serial)
+        if command == "wait-for-any-device":
+            deadline = time.time() + self.server.wait_timeout
+            while time.time() < deadline:
+                device = self.server.get_device(serial)
+                if device and device.state == "device":
+                    self._send(b"OKAY" + b"OKAY")
+                    return
+                time.sleep(0.05)
+            return
+        if device is None:
+            return self._fail(f"device '{serial}' not found")
+        if command == "get-serialno":
+            return self._okay_payload(device.serial)
+        if command == "get-state":
+            return self._okay_payload(device.state)
+        if command == "features":
+            return self._okay_payload("shell_v2,cmd" if device.shell_v2 else "cmd")
+        return self._fail(f"unknown host-serial service: {command}")
+
+    def _shell_v2(self, device, command):
+        stdout, stderr, returncode = device.run(command)
+        self._send(b"OKAY")
+        if stdout:
+            self._send(struct.pack("<BI", 1, len(stdout)) + stdout)
+        if stderr:
+            self._send(struct.pack("<BI", 2, len(stderr)) + stderr)
+        if returncode is None:
+            # 模拟设备在命令执行中掉线：不发送退出码直接断开
+            return
+        self._send(struct.pack("<BI", 3, 1) + bytes([returncode & 0xFF]))
+
+    def _sync(self, device):
+        while True:
+            try:
+                header = self._read_exact(8)
+            except ConnectionError:
+                # 客户端读取到所需字节后提前关闭连接（Range 下载）
+                return
+            if header is None:
+                return
+            command, length = struct.unpack("<4sI", header)
+            path = self._read_exact(length).decode("utf-8") if length else ""
+            if command == b"QUIT":
+                return
+            if command == b"STAT":
+                if path in device.files:
+                    mode, size = 0o100644, len(device.files[path])
+                elif any(name.startswith(path.rstrip("/") + "/") for name in device.files):
+                    mode, size = 0o040755, 4096
+                else:
+                    mode, size = 0, 0
+                self._send(b"STAT" + struct.pack("<III", mode, size, int(time.time()) if mode else 0))
+            elif command == b"RECV":
+                if path not in device.files:
+                    message = b"No such file or directory"
+                    self._send(b"FAIL" + struct.pack("<I", len(message)) + message)
+                    return
+                data = device.files[path]
+                for i in range(0, len(data), 65536):
+                    self._send(b"DATA" + struct.pack("<I", len(data[i:i + 65536])) + data[i:i + 65536])
+                self._send(b"DONE" + struct.pack("<I", 0))
+            elif command == b"SEND":
+                name = path.rsplit(",", 1)[0]
+                chunks = []
+                while True:
+                    packet_id, size = struct.unpack("<4sI", self._read_exact(8))
+                    if packet_id == b"DONE":
+                        break
+                    chunks.append(self._read_exact(size))
+                device.files[name] = b"".join(chunks)
+                self._send(b"OKAY" + struct.pack("<I", 0))
+            else:
+                message = b"unknown sync command"
+                self._send(b"FAIL" + struct.pack("<I", len(message)) + message)
+                return
+
+    def _track_devices(self, long):
+        server = self.server
+        self._send(b"OKAY")
+        last = None
+        try:
+            while not server.stopped.is_set():
+                with server.changed:
+                    snapshot = server.format_devices(long)
+                    if snapshot == last:
+                        server.changed.wait(timeout=0.5)
+                        snapshot = server.format_devices(long)
+                if snapshot != last:
+                    data = snapshot.encode()
+                    self._send(b"%04x" % len(data) + data)
+                    last = snapshot
+        except OSError:
+            return
+
+
+class FakeAdbServer(socketserver.ThreadingTCPServer):
+    """模拟 adb server（线程模式，后台运行）"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, wait_timeout=5):
+        super().__init__((host, port), _FakeAdbHandler)
+        self.devices = {}
+        self.wait_timeout = wait_timeout
+        self.changed = threading.Condition()
+        self.stopped = threading.Event()
+        # 可 connect 的网络地址（None 表示任何地址都能连上）
+        self.reachable = None
+        self._thread = None
+
+    @property
+    def address(self):
+        return self.server_address[0], self.server_address[1]
+
+    # ---------- 设备管理 ----------
+    def add_device(self, serial, **kwargs):
+        device = FakeDevice(serial, **kwargs)
+        with self.changed:
+            self.devices[serial] = device
+            self.changed.notify_all()
+        return device
+
+    def remove_device(self, serial):
+        with self.changed:
+            self.devices.pop(serial, None)
+            self.changed.notify_all()
+
+    def set_state(self, serial, state):
+        with self.changed:
+            if serial in self.devices:
+                self.devices[serial].state = state
+                self.changed.notify_all()
+
+    def get_device(self, serial):
+        return self.devices.get(serial)
+
+    def format_devices(self, long):
+        lines = []
+        for dev in list(self.devices.values()):
+            line = f"{dev.serial}\t{dev.state}"
+            if long:
+                line = f"{dev.serial:<22} {dev.state} {dev.details}"
+            lines.append(line + "\n")
+        return "".join(lines)
+
+    def connect(self, address):
+        if ":" not in address:
+            address = f"{address}:5555"
+        if address in self.devices and self.devices[address].state == "device":
+            return f"already connected to {address}"
+        if self.reachable is not None and address not in self.reachable:
+            return f"failed to connect to {address}"
+        self.add_device(address)
+        return f"connected to {address}"
+
+    def disconnect(self, address):
+        if address not in self.devices:
+            return f"error: no such device '{address}'"
+        self.remove_device(address)
+        return f"disconnected {address}"
+
+    # ---------- 生命周期 ----------
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        with self.changed:
+            self.changed.notify_all()
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="EasyADB 模拟 adb server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5037)
+    parser.add_argument("--device", action="append", default=[], help="模拟设备序列号，可重复指定")
+    args = parser.parse_args()
+
+    server = FakeAdbServer(args.host, args.port)
+    for serial in args.device or ["emulator-5554"]:
+        server.add_device(serial)
+    print(f"模拟 adb server 已启动：{args.host}:{server.address[1]}，设备：{', '.join(server.devices)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""设备文件流式传输（下载 / 上传，不在内存中缓冲整个文件）
+
+下载：协议客户端用 sync RECV 逐块拉取（每块最大 64KB），未启用协议客户端时读取
+      `adb exec-out cat` 的标准输出；带 Range 的续传请求用 `tail -c +N` 从偏移处开始读取。
+上传：请求体（或上传文件）按块写入 sync SEND，未启用协议客户端时写入 `adb exec-in` 的标准输入。
+多个文件/目录：先用一次 find + stat 列出全部文件及大小，再边拉取边生成 tar 流。
+"""
+import logging
+import posixpath
+import stat as stat_module
+import subprocess
+import tarfile
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+
+from .adb_client import get_adb_client, native_client_enabled, quote_shell_arg, AdbCommandFailed
+from .device_governor import device_slot
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+TAR_BLOCK = tarfile.BLOCKSIZE
+
+
+class FileTransferError(Exception):
+    """文件传输失败（文件不存在、设备拒绝等）"""
+
+
+class RangeNotSatisfiable(Exception):
+    """Range 请求超出文件范围"""
+
+
+def parse_range(header, size):
+    """
+    解析单段 Range 请求头（bytes=start-end / bytes=start- / bytes=-suffix）
+    :return: (start, end)（闭区间），无 Range 或格式不支持时返回 None
+    :raises RangeNotSatisfiable: 范围超出文件大小
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if not start:
+            suffix = int(end)
+            if suffix <= 0:
+                raise RangeNotSatisfiable(header)
+            return max(size - suffix, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        raise RangeNotSatisfiable(header)
+    return start, min(end, size - 1)
+
+
+# ===================== 设备名额 =====================
+def hold_device_slot(connect_id):
+    """
+    占用设备命令名额直到传输结束，返回释放函数
+    名额在发起传输前获取，设备忙时直接抛出 DeviceBusyError（而不是在已开始的响应中途失败）
+    """
+    stack = ExitStack()
+    stack.enter_context(device_slot(connect_id, ttl=settings.ADB_TRANSFER_SLOT_TTL))
+    return stack.close
+
+
+def release_after(chunks, release):
+    """迭代结束、出错或客户端断开（生成器被关闭）时释放设备名额"""
+    try:
+        yield from chunks
+    finally:
+        release()
+
+
+# ===================== 文件信息 =====================
+def stat_file(connect_id, path):
+    """获取文件信息：{"is_dir", "size", "mtime", "mode"}，文件不存在返回 None"""
+    if native_client_enabled():
+        mode, size, mtime = get_adb_client().stat(connect_id, path, timeout=settings.ADB_TRANSFER_TIMEOUT)
+        if not mode:
+            return None
+        # sync STAT 不跟随符号链接（如 /sdcard），符号链接交给 stat -L 解析
+        if not stat_module.S_ISLNK(mode):
+            return {"is_dir": stat_module.S_ISDIR(mode), "size": size, "mtime": mtime, "mode": mode & 0o7777}
+
+    from .views import execute_adb_command, get_adb_path
+    cmd = [get_adb_path(), "-s", connect_id, "shell", f"stat -L -c '%f %s %Y' {quote_shell_arg(path)}"]
+    result = execute_adb_command(cmd, shell=False, timeout=settings.ADB_TRANSFER_TIMEOUT)
+    parts = (result.stdout or "").split()
+    if result.returncode != 0 or len(parts) != 3:
+        return None
+    mode = int(parts[0], 16)
+    return {"is_dir": stat_module.S_ISDIR(mode), "size": int(parts[1]), "mtime": int(parts[2]), "mode": mode & 0o7777}
+
+
+def list_files(connect_id, paths):
+    """
+    一次 adb shell 列出多个路径（目录递归）下的全部普通文件
+    :return: [{"path", "size", "mtime", "mode"}]
+    """
+    from .views import execute_adb_command, get_adb_path
+    targets = " ".join(quote_shell_arg(path) for path in paths)
+    script = f"find -H {targets} -type f -exec stat -c '%s %Y %a %n' {{}} +"
+    result = execute_adb_command(
+        [get_adb_path(), "-s", connect_id, "shell", script],
+        shell=False, timeout=settings.ADB_TRANSFER_TIMEOUT
+    )
+    entries = []
+    for line in (result.stdout or "").splitlines():
+        parts = line.rstrip("\r").split(" ", 3)
+        if len(parts) != 4 or not parts[0].isdigit():
+            continue
+        entries.append({"path": parts[3], "size": int(parts[0]), "mtime": int(parts[1]), "mode": int(parts[2], 8)})
+    if not entries and result.returncode != 0:
+        raise FileTransferError(result.stderr or result.stdout or "列出文件失败")
+    return entries
+
+
+# ===================== 下载 =====================
+def _popen_stream(cmd):
+    """逐块读取 adb 进程的标准输出，迭代结束或中断时结束进程"""
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            chunk = process.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        process.kill()
+        process.wait()
+
+
+def iter_file(connect_id, path, start=0, length=None):
+    """
+    逐块读取设备文件
+    :param start: 起始偏移（Range 续传）
+    :param length: 最多读取的字节数，None 表示读到文件末尾
+    """
+    if start:
+        command = f"tail -c +{start + 1} {quote_shell_arg(path)}"
+    else:
+        command = f"cat {quote_shell_arg(path)}"
+
+    if native_client_enabled():
+        client = get_adb_client()
+        if start:
+            chunks = client.exec_stream(connect_id, command, timeout=settings.ADB_TRANSFER_TIMEOUT, chunk_size=CHUNK_SIZE)
+        else:
+            chunks = client.pull_stream(connect_id, path, timeout=settings.ADB_TRANSFER_TIMEOUT)
+    else:
+        from .views import get_adb_path
+        chunks = _popen_stream([get_adb_path(), "-s", connect_id, "exec-out", command])
+
+    if length is None:
+        yield from chunks
+        return
+    remaining = length
+    try:
+        for chunk in chunks:
+            if len(chunk) >= remaining:
+                yield chunk[:remaining]
+                return
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        chunks.close()
+
+
+def iter_tar(connect_id, entries, base_dir="/"):
+    """
+    边拉取边生成 tar 流（文件名为相对 base_dir 的路径）
+    读取过程中文件变大则截断、变小则补零，保证与 tar 头中的大小一致
+    """
+    for entry in entries:
+        name = posixpath.relpath(entry["path"], base_dir)
+        if name == "." or name.startswith("../"):
+            name = posixpath.basename(entry["path"])
+        info = tarfile.TarInfo(name)
+        info.size = entry["size"]
+        info.mtime = entry["mtime"]
+        info.mode = entry["mode"]
+        yield info.tobuf(format=tarfile.GNU_FORMAT)
+
+        sent = 0
+        try:
+            for chunk in iter_file(connect_id, entry["path"], length=entry["size"]):
+                sent += len(chunk)
+                yield chunk
+        except Exception as e:
+            logger.warning(f"打包文件失败（{connect_id}:{entry['path']}）：{str(e)}")
+        while sent < entry["size"]:
+            padding = min(CHUNK_SIZE, entry["size"] - sent)
+            sent += padding
+            yield b"\0" * padding
+        if entry["size"] % TAR_BLOCK:
+            yield b"\0" * (TAR_BLOCK - entry["size"] % TAR_BLOCK)
+    # tar 结束标记：两个空块
+    yield b"\0" * (TAR_BLOCK * 2)
+
+
+# ===================== 上传 =====================
+def push_file(connect_id, path, chunks, mode=0o644):
+    """
+    将字节块逐块写入设备文件
+    :return: 写入的字节数
+    :raises FileTransferError: 设备写入失败
+    """
+    if native_client_enabled():
+        try:
+            return get_adb_client().push_stream(
+                connect_id, path, chunks, mode=mode, mtime=time.time(), timeout=settings.ADB_TRANSFER_TIMEOUT
+            )
+        except AdbCommandFailed as e:
+            raise FileTransferError(str(e))
+
+    from .views import get_adb_path
+    cmd = [get_adb_path(), "-s", connect_id, "exec-in", f"cat > {quote_shell_arg(path)}"]
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    total = 0
+    try:
+        for chunk in chunks:
+            process.stdin.write(chunk)
+            total += len(chunk)
+        process.stdin.close()
+        _, stderr = process.communicate(timeout=settings.ADB_TRANSFER_TIMEOUT)
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    if process.returncode != 0:
+        raise FileTransferError(stderr.decode("utf-8", errors="ignore") or "写入设备文件失败")
+    return total
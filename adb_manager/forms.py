@@ -62,4 +62,13 @@ class ADBDeviceForm(forms.ModelForm):
         # IP可选（序列号存在时）
         if ip is None and not self.cleaned_data.get("device_serial", "").strip():
             raise forms.ValidationError("设备IP不能为空（未填写序列号时）")
-        return ip
\ No newline at end of file
+        return ip
+
+class ADBDeviceImportForm(ADBDeviceForm):
+    """CSV批量导入用：沿用添加设备的校验规则；唯一性与关联用户由导入流程统一查询，不逐行查库"""
+
+    class Meta(ADBDeviceForm.Meta):
+        fields = ["device_name", "device_ip", "device_port", "device_serial", "is_active"]
+
+    def validate_unique(self):
+        pass
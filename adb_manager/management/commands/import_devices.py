@@ -0,0 +1,45 @@
+# adb_manager/management/commands/import_devices.py
+from django.core.management.base import BaseCommand, CommandError
+from adb_manager.device_import import import_devices
+
+
+class Command(BaseCommand):
+    help = '从 CSV 文件批量导入 ADB 设备（按添加设备表单规则校验，跳过已存在的序列号/IP+端口）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help='CSV 文件路径（表头：device_name,device_ip,device_port,device_serial,is_active,user）')
+        parser.add_argument('--user', help='未填写关联用户列时绑定的用户名')
+        parser.add_argument('--verify', action='store_true', help='导入后并发连接新设备验证连通性')
+        parser.add_argument('--dry-run', action='store_true', help='只校验，不写入数据库')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            from user_auth.models import CustomUser
+            user = CustomUser.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"用户不存在：{options['user']}")
+        try:
+            with open(options['csv_file'], 'rb') as f:
+                result = import_devices(f.read(), user=user, verify=options['verify'], dry_run=options['dry_run'])
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for error in result['errors']:
+            details = "；".join(f"{field}: {', '.join(messages)}" for field, messages in error['errors'].items())
+            self.stdout.write(self.style.ERROR(f"第{error['line']}行：{details}"))
+        for skipped in result['skipped']:
+            self.stdout.write(self.style.WARNING(f"第{skipped['line']}行（{skipped['device']}）跳过：{skipped['reason']}"))
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(
+                f"校验完成：共{result['total']}行，可导入{result['to_create']}台，"
+                f"跳过{len(result['skipped'])}行，错误{len(result['errors'])}行"
+            ))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"导入完成：共{result['total']}行，新增{result['created']}台，"
+            f"跳过{len(result['skipped'])}行，错误{len(result['errors'])}行"
+        ))
+        if result['job_id']:
+            self.stdout.write(f"已提交连通性验证任务：{result['job_id']}（GET bulk-job/{result['job_id']}/ 查看结果）")
@@ -0,0 +1,16 @@
+# adb_manager/management/commands/track_devices.py
+from django.core.management.base import BaseCommand
+from adb_manager.device_tracker import DeviceTracker
+
+
+class Command(BaseCommand):
+    help = '常驻追踪 adb 设备在线状态（订阅 adb track-devices 推送，实时写入 Redis 并发布状态变化）'
+
+    def handle(self, *args, **options):
+        tracker = DeviceTracker()
+        self.stdout.write(self.style.SUCCESS("设备状态追踪已启动，按 Ctrl+C 退出"))
+        try:
+            tracker.run()
+        except KeyboardInterrupt:
+            tracker.stop()
+            self.stdout.write("设备状态追踪已停止")
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.3 on 2026-10-17 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('adb_manager', '0005_adbdevice_adb_manager_is_acti_05b01c_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='adbdeviceoperationlog',
+            name='operation_type',
+            field=models.CharField(choices=[('connect', '连接设备'), ('disconnect', '断开设备'), ('add', '添加设备'), ('edit', '编辑设备'), ('delete', '删除设备'), ('enable_wireless', '开启无线ADB'), ('connect_all', '一键连接所有'), ('disconnect_all', '一键断开所有'), ('refresh_all', '刷新所有状态'), ('batch_shell', '批量执行命令')], max_length=20, verbose_name='操作类型'),
+        ),
+    ]
@@ -3,26 +3,6 @@ from common.models import BaseModel
 from user_auth.models import CustomUser
 from django.db import models
 from django.conf import settings
-import redis
-
-# 初始化Redis（保持不变）
-try:
-    r = redis.Redis(
-        host=settings.REDIS_HOST,
-        port=settings.REDIS_PORT,
-        db=settings.REDIS_DB,
-        decode_responses=True,
-        socket_timeout=2,
-        retry_on_timeout=True
-    )
-    r.ping()
-except Exception as e:
-    class EmptyRedis:
-        def get(self, key, *args, **kwargs):
-            return None
-
-
-    r = EmptyRedis()
 
 
 class ADBDevice(BaseModel):
@@ -100,7 +80,9 @@ class ADBDevice(BaseModel):
         connect_id = self.connect_identifier
         if not connect_id:
             return "invalid"
-        return r.get(f"adb:device:{connect_id}") or "offline"
+        # 列表场景请使用 DeviceStatusStore.get_status_many 批量读取，避免逐台GET
+        from .status_store import get_status_store
+        return get_status_store().get_status(connect_id)
 
 
 
@@ -118,6 +100,7 @@ class ADBDeviceOperationLog(BaseModel):
         ('connect_all', '一键连接所有'),
         ('disconnect_all', '一键断开所有'),
         ('refresh_all', '刷新所有状态'),
+        ('batch_shell', '批量执行命令'),
     )
 
     device = models.ForeignKey(
@@ -0,0 +1,180 @@
+"""设备操作日志的异步批量写入
+
+请求中只把日志放入有界内存队列（不等待数据库写入），由后台线程批量 bulk_create：
+- 累计 ADB_OPLOG_BATCH_SIZE 条或距上次写入超过 ADB_OPLOG_FLUSH_INTERVAL 秒时写入一批；
+- 进程退出时（atexit）写入队列中剩余的日志；
+- 队列已满时丢弃新日志并计入 dropped 指标，不阻塞请求；
+- 某一批写入失败时改为逐条写入，关联的设备/用户在排队期间已被删除的日志按 SET_NULL 去掉关联后写入，
+  只有仍然写入失败的日志计入 failed 指标。
+注意：created_at 为 auto_now_add，记录的是批量写入的时间（与操作时间最多相差一个写入周期）。
+ADB_OPLOG_ASYNC=False 时退回为同步写入。
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class OperationLogWriter:
+    """操作日志批量写入器（有界队列 + 后台写入线程）"""
+
+    def __init__(self, max_size=10000, batch_size=200, flush_interval=1.0):
+        self.queue = queue.Queue(maxsize=max_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {"enqueued": 0, "written": 0, "dropped": 0, "failed": 0, "flushes": 0}
+
+    def _incr(self, name, value=1):
+        with self._metrics_lock:
+            self._metrics[name] += value
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="oplog-writer", daemon=True)
+                self._thread.start()
+
+    def write(self, **fields):
+        """放入一条日志（字段同 ADBDeviceOperationLog），队列已满时丢弃并返回 False"""
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(fields)
+        except queue.Full:
+            self._incr("dropped")
+            logger.warning(f"操作日志队列已满，丢弃日志：{fields.get('operation_type')} {fields.get('operation_details', '')[:100]}")
+            return False
+        self._incr("enqueued")
+        return True
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while not self._stop.is_set():
+            try:
+                batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0.01)))
+            except queue.Empty:
+                pass
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._flush(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+        self._flush(batch + self._drain())
+
+    def _drain(self):
+        items = []
+        while True:
+            try:
+                items.append(self.queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _flush(self, batch):
+        if not batch:
+            return
+        from .models import ADBDeviceOperationLog
+        try:
+            for i in range(0, len(batch), self.batch_size):
+                self._write_chunk(ADBDeviceOperationLog, batch[i:i + self.batch_size])
+            self._incr("flushes")
+        finally:
+            close_old_connections()
+
+    def _write_chunk(self, model, chunk):
+        """写入一批日志：bulk_create 失败时逐条写入，避免一条坏数据连累整批"""
+        try:
+            model.objects.bulk_create([model(**fields) for fields in chunk])
+            self._incr("written", len(chunk))
+            return
+        except Exception as e:
+            logger.warning(f"批量写入操作日志失败（{len(chunk)}条），改为逐条写入：{str(e)}")
+
+        for fields in chunk:
+            try:
+                try:
+                    model.objects.create(**fields)
+                except (IntegrityError, ValueError):
+                    # 外键指向的设备/用户已删除（ValueError：同进程内删除后实例的 pk 已被清空）
+                    model.objects.create(**_detach_missing(model, fields))
+                self._incr("written")
+            except Exception as e:
+                self._incr("failed")
+                logger.error(f"写入操作日志失败：{fields.get('operation_type')} {str(e)}")
+
+    def close(self, timeout=10):
+        """停止写入线程并写入剩余日志（进程退出时调用）"""
+        if self._thread is None or not self._thread.is_alive():
+            remaining = self._drain()
+            if remaining:
+                self._flush(remaining)
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def metrics(self):
+        with self._metrics_lock:
+            return {**self._metrics, "queued": self.queue.qsize()}
+
+
+def _detach_missing(model, fields):
+    """去掉已被删除的设备/用户关联（与外键的 SET_NULL 行为一致）"""
+    fields = dict(fields)
+    for name in ("device", "user"):
+        if name in fields:
+            if fields[name] is None:
+                continue
+            pk = fields[name].pk
+        else:
+            pk = fields.get(f"{name}_id")
+            if pk is None:
+                continue
+        related_model = model._meta.get_field(name).related_model
+        if pk is None or not related_model.objects.filter(pk=pk).exists():
+            fields.pop(name, None)
+            fields.pop(f"{name}_id", None)
+    return fields
+
+
+# ===================== 全局单例 =====================
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_operation_log_writer():
+    """获取全局操作日志写入器（进程退出时自动写入剩余日志）"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = OperationLogWriter(
+                    max_size=settings.ADB_OPLOG_QUEUE_SIZE,
+                    batch_size=settings.ADB_OPLOG_BATCH_SIZE,
+                    flush_interval=settings.ADB_OPLOG_FLUSH_INTERVAL,
+                )
+                atexit.register(_writer.close)
+    return _writer
+
+
+def write_operation_log(**fields):
+    """
+    记录一条设备操作日志（默认异步批量写入）
+    :param fields: ADBDeviceOperationLog 字段：device / operation_type / user（或 user_id）/
+                   operation_result / operation_details
+    """
+    if not settings.ADB_OPLOG_ASYNC:
+        from .models import ADBDeviceOperationLog
+        ADBDeviceOperationLog.objects.create(**fields)
+        return True
+    return get_operation_log_writer().write(**fields)
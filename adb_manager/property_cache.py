@@ -0,0 +1,181 @@
+"""设备只读属性缓存（按开机周期失效）
+
+ro.product.brand / ro.product.model / ro.build.version.release 等属性在设备重启前不会变化，
+按设备缓存在 Redis：adb:device:props:{connect_id} -> {"boot_id", "props", "verified_at"}
+
+失效方式：
+1. 设备重启后 /proc/sys/kernel/random/boot_id 会变化，读取时与缓存的 boot_id 比对；
+2. 缓存在 ADB_PROPERTY_CACHE_REVALIDATE 秒内直接信任（不发任何 adb 命令），超过后用一次
+   cat boot_id 校验；
+3. 设备状态追踪（track_devices）发现设备离线/断开时直接删除缓存（重启必然先断开）。
+"""
+import json
+import logging
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+from .status_store import get_status_store
+
+logger = logging.getLogger(__name__)
+
+BOOT_ID_PATH = "/proc/sys/kernel/random/boot_id"
+BOOT_ID_SENTINEL = "__EASYADB_BOOT_ID__"
+# 只缓存 ro.* 只读属性，其余属性（电量、IP 等）每次实时获取
+IMMUTABLE_PROP_PREFIX = "ro."
+
+
+def immutable_props(props):
+    return {key: value for key, value in props.items() if key.startswith(IMMUTABLE_PROP_PREFIX)}
+
+
+def split_boot_id(output):
+    """从输出中取出 boot_id 段（echo 标记; cat boot_id 必须位于脚本末尾），返回 (其余输出, boot_id)"""
+    head, sep, tail = output.rpartition(BOOT_ID_SENTINEL)
+    if not sep:
+        return output, ""
+    return head, tail.strip().splitlines()[0].strip() if tail.strip() else ""
+
+
+def boot_id_command():
+    return f"echo {BOOT_ID_SENTINEL}; cat {BOOT_ID_PATH}"
+
+
+class DevicePropertyCache:
+    """设备只读属性缓存（Redis Hash）"""
+    KEY_PREFIX = "adb:device:props:"
+
+    def __init__(self, client):
+        self.client = client
+
+    @classmethod
+    def key(cls, connect_id):
+        return f"{cls.KEY_PREFIX}{connect_id}"
+
+    def get_entry(self, connect_id):
+        """读取缓存原始内容：{"boot_id", "props", "verified_at"}，不存在返回 None"""
+        try:
+            data = self.client.hgetall(self.key(connect_id))
+        except redis.RedisError as e:
+            logger.warning(f"读取设备属性缓存失败（{connect_id}）：{str(e)}")
+            return None
+        if not data or not data.get("props"):
+            return None
+        try:
+            props = json.loads(data["props"])
+        except ValueError:
+            return None
+        return {
+            "boot_id": data.get("boot_id", ""),
+            "props": props,
+            "verified_at": float(data.get("verified_at") or 0),
+        }
+
+    def is_fresh(self, entry):
+        return time.time() - entry["verified_at"] < settings.ADB_PROPERTY_CACHE_REVALIDATE
+
+    def store(self, connect_id, boot_id, props):
+        """写入缓存（只保留 ro.* 属性）"""
+        if not connect_id or not boot_id:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hset(self.key(connect_id), mapping={
+                "boot_id": boot_id,
+                "props": json.dumps(immutable_props(props), ensure_ascii=False),
+                "verified_at": time.time(),
+            })
+            pipe.expire(self.key(connect_id), settings.ADB_PROPERTY_CACHE_TTL)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"写入设备属性缓存失败（{connect_id}）：{str(e)}")
+
+    def verify(self, connect_id, boot_id):
+        """
+        用最新的 boot_id 校验缓存：一致则刷新校验时间并返回 True，不一致（设备已重启）则删除缓存
+        """
+        entry = self.get_entry(connect_id)
+        if entry is None or not boot_id:
+            return False
+        if entry["boot_id"] != boot_id:
+            logger.info(f"设备{connect_id}已重启（boot_id变化），清除属性缓存")
+            self.invalidate(connect_id)
+            return False
+        try:
+            self.client.hset(self.key(connect_id), "verified_at", time.time())
+        except redis.RedisError as e:
+            logger.warning(f"更新设备属性缓存失败（{connect_id}）：{str(e)}")
+        return True
+
+    def invalidate(self, connect_id):
+        try:
+            self.client.delete(self.key(connect_id))
+        except redis.RedisError as e:
+            logger.warning(f"删除设备属性缓存失败（{connect_id}）：{str(e)}")
+
+    def invalidate_many(self, connect_ids):
+        connect_ids = [connect_id for connect_id in connect_ids if connect_id]
+        if not connect_ids:
+            return
+        try:
+            self.client.delete(*[self.key(connect_id) for connect_id in connect_ids])
+        except redis.RedisError as e:
+            logger.warning(f"批量删除设备属性缓存失败：{str(e)}")
+
+    # ===================== 读穿透 =====================
+    def get_properties(self, connect_id, timeout=None):
+        """
+        读取设备只读属性：缓存有效时不发任何 adb 命令；需要校验时只读一次 boot_id；
+        未命中时执行一次 getprop + boot_id 并写入缓存
+        """
+        from .views import execute_adb_command, get_adb_path
+        from .device_probe import parse_getprop
+        timeout = timeout or settings.ADB_PROBE_TIMEOUT
+
+        entry = self.get_entry(connect_id)
+        if entry is not None:
+            if self.is_fresh(entry):
+                return entry["props"]
+            result = execute_adb_command(
+                [get_adb_path(), "-s", connect_id, "shell", boot_id_command()],
+                shell=False, timeout=timeout
+            )
+            _, boot_id = split_boot_id(result.stdout or "")
+            if self.verify(connect_id, boot_id):
+                return entry["props"]
+
+        result = execute_adb_command(
+            [get_adb_path(), "-s", connect_id, "shell", f"getprop; {boot_id_command()}"],
+            shell=False, timeout=timeout
+        )
+        output, boot_id = split_boot_id(result.stdout or "")
+        props = parse_getprop(output)
+        if props:
+            self.store(connect_id, boot_id, props)
+        return immutable_props(props)
+
+
+# ===================== 全局单例 =====================
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_property_cache():
+    """获取全局设备属性缓存（复用设备状态存储的Redis连接）"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = DevicePropertyCache(get_status_store().client)
+    return _cache
+
+
+def get_device_properties(connect_id, timeout=None):
+    """读取设备只读属性（带开机周期缓存），失败返回空字典"""
+    try:
+        return get_property_cache().get_properties(connect_id, timeout)
+    except Exception as e:
+        logger.warning(f"获取设备属性失败（{connect_id}）：{str(e)}")
+        return {}
@@ -0,0 +1,180 @@
+"""设备重连调度（按设备指数退避 + 抖动 + 抖动抑制）
+
+长期离线的设备不再每轮检查都执行一次 adb connect（每次最多阻塞 10 秒）：
+- 在线设备：每 ADB_RECONNECT_HEALTHY_INTERVAL 秒才需要逐台探测一次（对账模式下在线状态由
+  adb devices 一次获取，无需探测）；
+- 连接失败的设备：第 n 次失败后等待 ADB_RECONNECT_BACKOFF_BASE * 2^(n-1) 秒
+  （封顶 ADB_RECONNECT_BACKOFF_MAX）再重试；
+- 频繁上下线的设备：每次状态翻转累加惩罚值（按 ADB_RECONNECT_FLAP_HALF_LIFE 半衰期衰减），
+  惩罚值的整数部分计入退避指数，避免反复追着抖动的设备重连；
+- 所有等待时间都加 ±ADB_RECONNECT_JITTER 比例的随机抖动，避免同一批设备同时到期。
+设备状态追踪（track_devices）发现设备上线/断开时会更新调度状态，刚断开的设备下一轮就会重试。
+
+存储：一个 Redis Hash adb:device:reconnect，字段为 connect_id，值为 JSON：
+    {"online", "failures", "penalty", "penalty_at", "next_at", "changed_at"}
+每轮检查一次 HMGET 读取、一次 HSET 写入（只写入有变化的设备）。
+"""
+import json
+import logging
+import random
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+from .status_store import get_status_store
+
+logger = logging.getLogger(__name__)
+
+
+def decayed_penalty(state, now, half_life):
+    """按半衰期衰减后的抖动惩罚值"""
+    penalty = state.get("penalty", 0.0)
+    if not penalty or half_life <= 0:
+        return 0.0
+    return penalty * 0.5 ** (max(now - state.get("penalty_at", now), 0) / half_life)
+
+
+def jittered(delay, jitter):
+    return delay * random.uniform(1 - jitter, 1 + jitter) if jitter > 0 else delay
+
+
+def next_state(state, online, now, attempted=True):
+    """
+    根据一次探测结果（或状态追踪观察到的变化）计算新的调度状态
+    :param state: 原状态（没有记录时为 {}）
+    :param online: 设备是否在线
+    :param attempted: 是否为一次连接尝试；False 表示由状态追踪观察到的变化（不计入失败次数）
+    """
+    penalty = decayed_penalty(state, now, settings.ADB_RECONNECT_FLAP_HALF_LIFE)
+    changed_at = state.get("changed_at", now)
+    if "online" in state and state["online"] != online:
+        penalty += 1
+        changed_at = now
+
+    if online:
+        failures = 0
+        delay = settings.ADB_RECONNECT_HEALTHY_INTERVAL
+    else:
+        failures = state.get("failures", 0) + (1 if attempted else 0)
+        # 半衰期内第一次翻转不抑制，之后每多翻转一次退避时间翻倍
+        exponent = max(failures - 1, 0) + max(int(penalty) - 1, 0)
+        if failures == 0 and exponent == 0:
+            # 刚断开且不频繁抖动的设备立即重试
+            delay = 0
+        else:
+            delay = min(settings.ADB_RECONNECT_BACKOFF_BASE * 2 ** exponent, settings.ADB_RECONNECT_BACKOFF_MAX)
+
+    return {
+        "online": online,
+        "failures": failures,
+        "penalty": round(penalty, 3),
+        "penalty_at": now,
+        "next_at": now + jittered(delay, settings.ADB_RECONNECT_JITTER),
+        "changed_at": changed_at,
+    }
+
+
+class ReconnectScheduler:
+    """设备重连调度状态（Redis Hash）"""
+    KEY = "adb:device:reconnect"
+
+    def __init__(self, client):
+        self.client = client
+
+    def get_states(self, connect_ids):
+        """批量读取调度状态：{connect_id: state}（没有记录的设备为 {}）"""
+        connect_ids = list(connect_ids)
+        if not connect_ids:
+            return {}
+        try:
+            values = self.client.hmget(self.KEY, connect_ids)
+        except redis.RedisError as e:
+            logger.warning(f"读取重连调度状态失败：{str(e)}")
+            values = [None] * len(connect_ids)
+        states = {}
+        for connect_id, value in zip(connect_ids, values):
+            try:
+                states[connect_id] = json.loads(value) if value else {}
+            except ValueError:
+                states[connect_id] = {}
+        return states
+
+    def split_due(self, connect_ids, now=None, force=False):
+        """
+        区分本轮需要探测的设备与仍在退避中的设备
+        :return: (due: [connect_id], deferred: {connect_id: state})
+        """
+        now = now or time.time()
+        states = self.get_states(connect_ids)
+        if force:
+            return list(states), {}
+        due, deferred = [], {}
+        for connect_id, state in states.items():
+            if state.get("next_at", 0) <= now:
+                due.append(connect_id)
+            else:
+                deferred[connect_id] = state
+        return due, deferred
+
+    def record_many(self, results, attempted=True, now=None, states=None):
+        """
+        记录一批探测结果，只写入有变化的设备
+        :param results: {connect_id: 是否在线}
+        :param states: 已读取的原状态（省去一次读取）
+        """
+        results = {connect_id: online for connect_id, online in results.items() if connect_id}
+        if not results:
+            return {}
+        now = now or time.time()
+        states = states if states is not None else self.get_states(results)
+        updates = {}
+        for connect_id, online in results.items():
+            state = states.get(connect_id) or {}
+            # 持续在线且未到下次探测时间：没有新信息，不写入
+            if online and state.get("online") and not state.get("failures") and state.get("next_at", 0) > now:
+                continue
+            updates[connect_id] = next_state(state, online, now, attempted)
+        if updates:
+            try:
+                self.client.hset(self.KEY, mapping={
+                    connect_id: json.dumps(state) for connect_id, state in updates.items()
+                })
+            except redis.RedisError as e:
+                logger.warning(f"写入重连调度状态失败：{str(e)}")
+        return updates
+
+    def record(self, connect_id, online, attempted=True):
+        return self.record_many({connect_id: online}, attempted=attempted).get(connect_id)
+
+    def forget(self, connect_ids):
+        connect_ids = [connect_id for connect_id in connect_ids if connect_id]
+        if not connect_ids:
+            return
+        try:
+            self.client.hdel(self.KEY, *connect_ids)
+        except redis.RedisError as e:
+            logger.warning(f"删除重连调度状态失败：{str(e)}")
+
+
+def describe_deferred(state, now=None):
+    """退避中设备的状态说明"""
+    now = now or time.time()
+    return (f"设备未连接，连续失败{state.get('failures', 0)}次，"
+            f"{max(int(state.get('next_at', now) - now), 0)}秒后重试")
+
+
+# ===================== 全局单例 =====================
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_reconnect_scheduler():
+    """获取全局重连调度器（复用设备状态存储的Redis连接）"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = ReconnectScheduler(get_status_store().client)
+    return _scheduler
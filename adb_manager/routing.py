@@ -0,0 +1,7 @@
+from django.urls import re_path
+from . import consumers
+
+websocket_urlpatterns = [
+    re_path(r'ws/adb_bulk_job/(?P<job_id>[0-9a-f]+)/$', consumers.BulkJobConsumer.as_asgi()),
+    re_path(r'ws/adb_screen/(?P<device_id>\d+)/$', consumers.ScreenStreamConsumer.as_asgi()),
+]
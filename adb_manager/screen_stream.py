@@ -0,0 +1,179 @@
+"""设备屏幕实时画面（每台设备一个截图循环，多个观看者共享）
+
+截图循环：adb exec-out screencap -p，按 ADB_SCREEN_MAX_FPS 限制帧率；安装了 Pillow 时把画面
+缩放到长边不超过 ADB_SCREEN_MAX_SIZE 并转为 JPEG，否则直接转发 PNG。
+每次截图占用一个 interactive 通道名额（低优先级，见 device_governor）；设备的 background 通道被占用
+（正在运行脚本/编排步骤）时帧率降为 ADB_SCREEN_BUSY_FPS，避免截图与自动化脚本争抢设备。
+分发：每个观看者一个长度为 1 的队列，只保留最新一帧；观看者来不及接收时丢弃旧帧（计入 dropped），
+不会拖慢截图循环或其他观看者。最后一个观看者离开后截图循环自动停止。
+观看方式：
+    WebSocket  ws/adb_screen/<device_id>/?fps=N   二进制消息，每条一帧
+    MJPEG      GET screen-stream/?device_id=&fps=N   multipart/x-mixed-replace，可直接用 <img> 展示
+截图循环在当前 ASGI 进程内共享：同一进程内无论多少人观看同一台设备，都只有一个截图循环。
+"""
+import asyncio
+import io
+import logging
+import subprocess
+import time
+
+from django.conf import settings
+
+from .adb_client import get_adb_client, native_client_enabled
+from .device_governor import LANE_INTERACTIVE, DeviceBusyError, device_slot, lane_busy
+
+try:
+    from PIL import Image
+except ImportError:  # 未安装 Pillow 时不缩放，直接转发 PNG
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+
+def capture_frame(connect_id):
+    """截取一帧原始 PNG（阻塞调用，在线程池中执行；名额等待超时抛出 DeviceBusyError）"""
+    timeout = settings.ADB_SCREEN_CAPTURE_TIMEOUT
+    # 优先级低于其他界面操作：设备忙时先让出名额给用户发起的命令
+    with device_slot(connect_id, LANE_INTERACTIVE, priority=-1, wait=timeout, ttl=timeout + 5):
+        if native_client_enabled():
+            return get_adb_client().exec_out(connect_id, "screencap -p", timeout=timeout)
+        from .views import get_adb_path
+        result = subprocess.run(
+            [get_adb_path(), "-s", connect_id, "exec-out", "screencap", "-p"],
+            capture_output=True, timeout=timeout
+        )
+        return result.stdout
+
+
+def encode_frame(png, max_size, quality):
+    """缩放并转为 JPEG，返回 (字节, content_type)；未安装 Pillow 时原样返回 PNG"""
+    if Image is None:
+        return png, "image/png"
+    image = Image.open(io.BytesIO(png))
+    image.thumbnail((max_size, max_size))
+    output = io.BytesIO()
+    image.convert("RGB").save(output, format="JPEG", quality=quality)
+    return output.getvalue(), "image/jpeg"
+
+
+class ScreenProducer:
+    """单台设备的截图循环，把最新一帧分发给所有观看者"""
+
+    def __init__(self, connect_id, hub):
+        self.connect_id = connect_id
+        self.hub = hub
+        self.subscribers = set()
+        self.task = None
+        self.frames = 0
+        self.dropped = 0
+        self.errors = 0
+        self.busy = 0
+        self.content_type = "image/jpeg" if Image is not None else "image/png"
+
+    def subscribe(self):
+        queue = asyncio.Queue(maxsize=1)
+        self.subscribers.add(queue)
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+
+    def _publish(self, frame):
+        for queue in list(self.subscribers):
+            if queue.full():
+                # 观看者还没取走上一帧：丢弃旧帧，只保留最新画面
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(frame)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        logger.info(f"设备{self.connect_id}开始屏幕截图循环")
+        try:
+            while self.subscribers:
+                started = time.monotonic()
+                # 设备正在运行脚本时降低帧率
+                busy = await loop.run_in_executor(None, lane_busy, self.connect_id)
+                fps = min(settings.ADB_SCREEN_BUSY_FPS, settings.ADB_SCREEN_MAX_FPS) if busy else settings.ADB_SCREEN_MAX_FPS
+                interval = 1 / max(fps, 0.1)
+                try:
+                    png = await loop.run_in_executor(None, capture_frame, self.connect_id)
+                    if not png:
+                        raise RuntimeError("截图为空")
+                    frame, self.content_type = await loop.run_in_executor(
+                        None, encode_frame, png, settings.ADB_SCREEN_MAX_SIZE, settings.ADB_SCREEN_JPEG_QUALITY
+                    )
+                    self.frames += 1
+                    self._publish(frame)
+                except DeviceBusyError as e:
+                    # 名额被其他操作占满：跳过这一帧
+                    self.busy += 1
+                    logger.debug(f"设备{self.connect_id}截图跳过：{str(e)}")
+                except Exception as e:
+                    self.errors += 1
+                    logger.warning(f"设备{self.connect_id}截图失败：{str(e)}")
+                    # 截图失败（设备离线等）时降低重试频率
+                    await asyncio.sleep(1)
+                await asyncio.sleep(max(interval - (time.monotonic() - started), 0))
+        finally:
+            logger.info(f"设备{self.connect_id}屏幕截图循环已停止（共{self.frames}帧，丢弃{self.dropped}帧）")
+            self.hub.release(self)
+
+
+class ScreenHub:
+    """当前进程内所有设备的截图循环"""
+
+    def __init__(self):
+        self.producers = {}
+
+    def subscribe(self, connect_id):
+        """开始观看，返回 (producer, queue)"""
+        producer = self.producers.get(connect_id)
+        if producer is None:
+            producer = self.producers[connect_id] = ScreenProducer(connect_id, self)
+        return producer, producer.subscribe()
+
+    def release(self, producer):
+        if self.producers.get(producer.connect_id) is producer and not producer.subscribers:
+            del self.producers[producer.connect_id]
+
+    def metrics(self):
+        return {
+            connect_id: {
+                "viewers": len(producer.subscribers),
+                "frames": producer.frames,
+                "dropped": producer.dropped,
+                "errors": producer.errors,
+                "busy": producer.busy,
+            }
+            for connect_id, producer in self.producers.items()
+        }
+
+
+screen_hub = ScreenHub()
+
+
+def viewer_interval(fps):
+    """观看者请求的帧率（不超过 ADB_SCREEN_MAX_FPS），返回两帧之间的最小间隔秒数"""
+    try:
+        fps = float(fps)
+    except (TypeError, ValueError):
+        fps = settings.ADB_SCREEN_MAX_FPS
+    fps = min(max(fps, 0.1), settings.ADB_SCREEN_MAX_FPS)
+    return 1 / fps
+
+
+async def iter_frames(connect_id, fps=None):
+    """逐帧产出 (frame, content_type)，按观看者帧率限速；迭代结束时自动退出观看"""
+    producer, queue = screen_hub.subscribe(connect_id)
+    interval = viewer_interval(fps)
+    try:
+        while True:
+            started = time.monotonic()
+            frame = await queue.get()
+            yield frame, producer.content_type
+            await asyncio.sleep(max(interval - (time.monotonic() - started), 0))
+    finally:
+        producer.unsubscribe(queue)
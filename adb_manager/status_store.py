@@ -0,0 +1,253 @@
+"""设备状态存储（每台设备一个 Redis Hash，批量读取只需一次往返）
+
+键名：adb:device_state:{connect_id}
+字段：status / stdout / stderr / updated_at（最近写入时间）/ last_seen（最近一次观察到在线的时间）
+每次写入都把键的有效期刷新为 ADB_STATUS_TTL 秒，由心跳（track_devices 或定时任务
+adb_manager.heartbeat_devices）定期续期；检查进程停止后键自动过期，读取时视为 stale（状态未知），
+不会一直显示“在线”。last_seen 超过 ADB_STATUS_TTL 秒的“在线”状态同样视为 stale。
+读取先查进程内 L1 缓存（common.redis_client.get_l1_cache，REDIS_L1_TTL 秒），
+写入/删除后广播失效，其他进程随即丢弃本地副本。
+"""
+import json
+import logging
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+from common.redis_client import get_client, get_l1_cache
+
+logger = logging.getLogger(__name__)
+
+STATUS_FIELDS = ("status", "stdout", "stderr")
+# 状态过期（检查进程停止、心跳中断）时的状态
+STALE_STATUS = "stale"
+
+
+class DeviceStatusStore:
+    """设备状态读写（所有 adb:device 状态的读写都应通过此类）"""
+    KEY_PREFIX = "adb:device_state:"
+
+    def __init__(self, client, cache=None):
+        self.client = client
+        self.cache = cache
+
+    @classmethod
+    def key(cls, connect_id):
+        return f"{cls.KEY_PREFIX}{connect_id}"
+
+    @staticmethod
+    def _connect_id(device):
+        return device if isinstance(device, str) else device.connect_identifier
+
+    @staticmethod
+    def _normalize(data, default_status):
+        data = data or {}
+        last_seen = float(data["last_seen"]) if data.get("last_seen") else None
+        status = data.get("status") or default_status
+        # 在线状态超过有效期未续期：检查进程可能已停止，不再当作在线
+        if status == "online" and (last_seen is None or time.time() - last_seen > settings.ADB_STATUS_TTL):
+            status = STALE_STATUS
+        return {
+            "status": status,
+            "stdout": data.get("stdout") or "",
+            "stderr": data.get("stderr") or "",
+            "last_seen": last_seen,
+            "stale": status == STALE_STATUS,
+        }
+
+    # ===================== 读取 =====================
+    def get(self, device, default_status=STALE_STATUS):
+        """读取单台设备状态：{"status", "stdout", "stderr", "last_seen", "stale"}（键已过期时为 stale）"""
+        connect_id = self._connect_id(device)
+        if not connect_id:
+            return self._normalize(None, "invalid")
+        data = self._cached(connect_id)
+        if data is not None:
+            return self._normalize(data, default_status)
+        try:
+            data = self.client.hgetall(self.key(connect_id))
+        except redis.RedisError as e:
+            logger.warning(f"读取设备状态失败（{connect_id}）：{str(e)}")
+            return self._normalize(None, default_status)
+        self._remember(connect_id, data)
+        return self._normalize(data, default_status)
+
+    def get_status(self, device, default_status=STALE_STATUS):
+        return self.get(device, default_status)["status"]
+
+    def get_many(self, devices, default_status=STALE_STATUS):
+        """
+        批量读取设备状态（pipeline，一次往返）
+        :param devices: ADBDevice 实例或 connect_id 字符串的可迭代对象
+        :return: {connect_id: {"status", "stdout", "stderr", "last_seen", "stale"}}
+        """
+        connect_ids = []
+        for device in devices:
+            connect_id = self._connect_id(device)
+            if connect_id and connect_id not in connect_ids:
+                connect_ids.append(connect_id)
+        if not connect_ids:
+            return {}
+
+        states = {connect_id: self._cached(connect_id) for connect_id in connect_ids}
+        missing = [connect_id for connect_id, data in states.items() if data is None]
+        if missing:
+            try:
+                pipe = self.client.pipeline(transaction=False)
+                for connect_id in missing:
+                    pipe.hgetall(self.key(connect_id))
+                results = pipe.execute()
+            except redis.RedisError as e:
+                logger.warning(f"批量读取设备状态失败：{str(e)}")
+                results = [None] * len(missing)
+            for connect_id, data in zip(missing, results):
+                states[connect_id] = data
+                if data is not None:
+                    self._remember(connect_id, data)
+        return {
+            connect_id: self._normalize(data, default_status)
+            for connect_id, data in states.items()
+        }
+
+    def get_status_many(self, devices, default_status=STALE_STATUS):
+        """批量读取设备在线状态：{connect_id: status}"""
+        return {
+            connect_id: state["status"]
+            for connect_id, state in self.get_many(devices, default_status).items()
+        }
+
+    # ===================== L1 缓存 =====================
+    def _cached(self, connect_id):
+        if self.cache is None:
+            return None
+        data = self.cache.get(self.key(connect_id))
+        return None if data is self.cache.MISSING else data
+
+    def _remember(self, connect_id, data):
+        if self.cache is not None:
+            self.cache.set(self.key(connect_id), data)
+
+    def _invalidate(self, *connect_ids):
+        if self.cache is not None:
+            self.cache.invalidate(*[self.key(connect_id) for connect_id in connect_ids if connect_id])
+
+    # ===================== 写入 =====================
+    @staticmethod
+    def _mapping(status=None, stdout=None, stderr=None):
+        mapping = {}
+        if status is not None:
+            mapping["status"] = status
+            mapping["updated_at"] = time.time()
+            if status == "online":
+                mapping["last_seen"] = mapping["updated_at"]
+        if stdout is not None:
+            mapping["stdout"] = stdout
+        if stderr is not None:
+            mapping["stderr"] = stderr
+        return mapping
+
+    def set(self, device, status=None, stdout=None, stderr=None):
+        """写入设备状态（只更新传入的字段）"""
+        connect_id = self._connect_id(device)
+        mapping = self._mapping(status, stdout, stderr)
+        if not connect_id or not mapping:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hset(self.key(connect_id), mapping=mapping)
+            pipe.expire(self.key(connect_id), settings.ADB_STATUS_TTL)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"写入设备状态失败（{connect_id}）：{str(e)}")
+        self._invalidate(connect_id)
+
+    def set_many(self, updates):
+        """
+        批量写入设备状态（pipeline，一次往返）
+        :param updates: {connect_id: {"status", "stdout", "stderr"}}
+        """
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for connect_id, fields in updates.items():
+                mapping = self._mapping(**{k: fields.get(k) for k in STATUS_FIELDS})
+                if connect_id and mapping:
+                    pipe.hset(self.key(connect_id), mapping=mapping)
+                    pipe.expire(self.key(connect_id), settings.ADB_STATUS_TTL)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"批量写入设备状态失败：{str(e)}")
+        # 一条消息失效全部设备
+        self._invalidate(*updates.keys())
+
+    def heartbeat(self, statuses):
+        """
+        心跳：刷新设备状态与有效期（不改动 stdout/stderr），在线设备同时更新 last_seen
+        :param statuses: {connect_id: status}
+        """
+        statuses = {connect_id: status for connect_id, status in statuses.items() if connect_id and status}
+        if not statuses:
+            return
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for connect_id, status in statuses.items():
+                pipe.hset(self.key(connect_id), mapping=self._mapping(status))
+                pipe.expire(self.key(connect_id), settings.ADB_STATUS_TTL)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f"设备状态心跳写入失败：{str(e)}")
+        self._invalidate(*statuses.keys())
+
+    def delete(self, device):
+        connect_id = self._connect_id(device)
+        if not connect_id:
+            return
+        try:
+            self.client.delete(self.key(connect_id))
+        except redis.RedisError as e:
+            logger.warning(f"删除设备状态失败（{connect_id}）：{str(e)}")
+        self._invalidate(connect_id)
+
+    def rename(self, old_connect_id, new_connect_id):
+        """设备标识变更时迁移状态"""
+        if not old_connect_id or old_connect_id == new_connect_id:
+            return
+        state = self.get(old_connect_id)
+        if new_connect_id:
+            self.set(new_connect_id, **{field: state[field] for field in STATUS_FIELDS})
+        self.delete(old_connect_id)
+
+    # ===================== 状态变化通知 =====================
+    def publish(self, event, channel=None):
+        """发布设备状态变化事件（JSON）到 Redis 频道"""
+        channel = channel or settings.ADB_DEVICE_EVENT_CHANNEL
+        try:
+            self.client.publish(channel, json.dumps(event, ensure_ascii=False))
+        except redis.RedisError as e:
+            logger.warning(f"发布设备状态事件失败：{str(e)}")
+
+
+def describe_unavailable(offline_devices, stale_devices):
+    """派发任务时被过滤设备的说明（离线 / 状态过期）"""
+    parts = []
+    if offline_devices:
+        parts.append(f"离线设备：{','.join(offline_devices)}")
+    if stale_devices:
+        parts.append(f"状态过期设备（超过{settings.ADB_STATUS_TTL}秒未收到心跳）：{','.join(stale_devices)}")
+    return "；".join(parts)
+
+
+# ===================== 全局单例 =====================
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_status_store():
+    """获取全局设备状态存储（共享连接池 + 进程内 L1 缓存）"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = DeviceStatusStore(get_client(), cache=get_l1_cache())
+    return _store
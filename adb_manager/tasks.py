@@ -1,25 +1,45 @@
 import subprocess
 import shlex
-import redis
+import socket
 import threading
 import logging
-from celery import shared_task, group
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from celery import shared_task, chord
+from celery.exceptions import SoftTimeLimitExceeded
 from django.conf import settings
 from django.db import close_old_connections
 
-logger = logging.getLogger(__name__)
+from .adb_client import get_adb_client, native_client_enabled, parse_devices_output, AdbError, AdbCommandFailed
+from .status_store import get_status_store
+from .reconnect_scheduler import describe_deferred, get_reconnect_scheduler
+from .device_lease import dispatch_waiting
 
-# ====================== Redis 初始化（保持不变） ======================
-r = redis.Redis(
-    host=settings.REDIS_HOST,
-    port=settings.REDIS_PORT,
-    db=settings.REDIS_DB,
-    decode_responses=True
-)
+logger = logging.getLogger(__name__)
 
+# 网络设备标识（ip:port），只有这类设备需要 adb connect
+TCP_SERIAL_PATTERN = re.compile(r"^\d{1,3}(\.\d{1,3}){3}:\d{1,5}$")
 
 def safe_adb_connect(device_connect_str):
     """安全执行ADB连接命令（彻底防注入）"""
+    connect_str = device_connect_str.strip()
+    # 优先通过 adb server 协议执行 host:connect，失败再回退到adb可执行文件
+    if native_client_enabled():
+        try:
+            message = get_adb_client().connect(connect_str, timeout=10)
+            return {
+                "success": "connected to" in message.lower(),
+                "stdout": message.strip(),
+                "stderr": ""
+            }
+        except socket.timeout:
+            return {"success": False, "stdout": "", "stderr": "连接超时（10秒）"}
+        except AdbCommandFailed as e:
+            return {"success": False, "stdout": "", "stderr": f"连接失败：{str(e)}"}
+        except (AdbError, OSError) as e:
+            logger.warning(f"ADB协议客户端连接失败，回退到adb可执行文件：{str(e)}")
+
     try:
         cmd = ["adb", "connect"] + shlex.split(device_connect_str.strip())
         result = subprocess.run(
@@ -41,9 +61,50 @@ def safe_adb_connect(device_connect_str):
         return {"success": False, "stdout": "", "stderr": f"连接失败：{str(e)}"}
 
 
+def safe_adb_disconnect(device_connect_str):
+    """断开网络设备（adb disconnect），失败只记录日志"""
+    connect_str = device_connect_str.strip()
+    if native_client_enabled():
+        try:
+            get_adb_client().disconnect(connect_str, timeout=10)
+            return
+        except AdbCommandFailed as e:
+            logger.info(f"断开设备{connect_str}失败：{str(e)}")
+            return
+        except (AdbError, OSError) as e:
+            logger.warning(f"ADB协议客户端断开失败，回退到adb可执行文件：{str(e)}")
+
+    try:
+        subprocess.run(
+            ["adb", "disconnect", connect_str],
+            shell=False,
+            capture_output=True,
+            encoding="utf-8",
+            timeout=10,
+            errors="ignore"
+        )
+    except Exception as e:
+        logger.info(f"断开设备{connect_str}失败：{str(e)}")
+
+
+def reconnect_tcp_device(connect_str, adb_state=None):
+    """
+    重连网络设备：adb 仍以 offline 列出的设备（无线连接断开后最常见）直接 connect 会返回
+    already connected，需要先 disconnect 清掉残留的传输再 connect
+    """
+    if adb_state == "offline":
+        safe_adb_disconnect(connect_str)
+    return safe_adb_connect(connect_str)
+
+
 # ====================== 核心：抽离单个设备检查逻辑（兼容异步/同步） ======================
-def _check_and_reconnect_device_core(device_id):
-    """检查并重连单个设备的核心逻辑（不依赖Celery）"""
+def _check_and_reconnect_device_core(device_id, deadline=None):
+    """
+    检查并重连单个设备的核心逻辑（不依赖Celery）
+    :param deadline: 批量检查的全局截止时间（时间戳），开始执行时已超时则直接跳过
+    """
+    if deadline is not None and time.time() >= deadline:
+        return {"device_id": device_id, "success": False, "error": "检查超时（超过全局截止时间）"}
     try:
         from .models import ADBDevice
         close_old_connections()
@@ -54,10 +115,14 @@ def _check_and_reconnect_device_core(device_id):
             raise ValueError("设备连接字符串为空")
 
         res = safe_adb_connect(connect_str)
+        get_reconnect_scheduler().record(connect_str, res["success"])
 
-        r.set(f"adb:device:{connect_str}", "online" if res["success"] else "offline")
-        r.set(f"adb:device:{connect_str}:stdout", res["stdout"])
-        r.set(f"adb:device:{connect_str}:stderr", res["stderr"])
+        get_status_store().set(
+            connect_str,
+            "online" if res["success"] else "offline",
+            res["stdout"],
+            res["stderr"]
+        )
 
         if res["success"]:
             devices_cmd = ["adb", "devices"]
@@ -84,6 +149,8 @@ def _check_and_reconnect_device_core(device_id):
         return {"device_id": device_id, "success": False, "error": "设备不存在/已禁用"}
     except ValueError as e:
         return {"device_id": device_id, "success": False, "error": f"参数错误：{str(e)}"}
+    except SoftTimeLimitExceeded:
+        raise
     except Exception as e:
         logger.error(f"设备检查异常：{str(e)}", exc_info=True)
         return {"device_id": device_id, "success": False, "error": f"未知错误：{str(e)}"}
@@ -93,9 +160,13 @@ def _check_and_reconnect_device_core(device_id):
 
 # ====================== Celery 异步任务（调用核心逻辑） ======================
 @shared_task(name="adb_manager.check_and_reconnect_device")
-def check_and_reconnect_device(device_id):
+def check_and_reconnect_device(device_id, deadline=None):
     """Celery异步检查并重连单个设备"""
-    return _check_and_reconnect_device_core(device_id)
+    try:
+        return _check_and_reconnect_device_core(device_id, deadline)
+    except SoftTimeLimitExceeded:
+        # 到达全局截止时间：返回超时结果而不是让任务失败，保证 chord 汇总回调一定执行
+        return {"device_id": device_id, "success": False, "error": "检查超时（超过全局截止时间）"}
 
 
 # ====================== 后台线程同步执行（优雅降级） ======================
@@ -110,9 +181,156 @@ def check_and_reconnect_device_sync(device_id):
     logger.info(f"已启动后台同步线程检查设备 - 设备ID：{device_id}")
 
 
+# ====================== 核心：单次扫描对账所有设备 ======================
+def list_adb_devices():
+    """执行一次 adb devices -l，返回 {serial: adb状态}"""
+    if native_client_enabled():
+        try:
+            return {dev["serial"]: dev["status"] for dev in get_adb_client().devices(long=True)}
+        except (AdbError, OSError) as e:
+            logger.warning(f"ADB协议客户端获取设备列表失败，回退到adb可执行文件：{str(e)}")
+
+    result = subprocess.run(
+        ["adb", "devices", "-l"],
+        shell=False,
+        capture_output=True,
+        encoding="utf-8",
+        timeout=10,
+        errors="ignore"
+    )
+    return {dev["serial"]: dev["status"] for dev in parse_devices_output(result.stdout)}
+
+
+def _reconcile_devices_core(force=False):
+    """
+    对账所有启用设备：一次 adb devices -l 获取全部设备状态，
+    只对不在列表中或状态不是 device（offline 等）、且已到重试时间的网络设备（ip:port）重连，
+    最后一次性批量写入Redis
+    :param force: 忽略重连退避，所有未在线的网络设备都立即重连
+    """
+    from .models import ADBDevice
+    close_old_connections()
+
+    active_devices = [d for d in ADBDevice.objects.filter(is_active=True) if d.connect_identifier.strip()]
+    total = len(active_devices)
+    if total == 0:
+        return {"total": 0, "results": [], "message": "无启用的设备"}
+
+    try:
+        adb_states = list_adb_devices()
+    except Exception as e:
+        logger.error(f"获取ADB设备列表失败：{str(e)}", exc_info=True)
+        return {"total": total, "success_count": 0, "fail_count": total, "results": [], "message": f"获取设备列表失败：{str(e)}"}
+
+    # 只有未在线的网络设备需要重连（缺失或仍以 offline 等状态列出）；USB设备 connect 没有意义
+    tcp_ids = {
+        device.connect_identifier.strip() for device in active_devices
+        if TCP_SERIAL_PATTERN.match(device.connect_identifier.strip())
+    }
+    not_online = sorted(connect_str for connect_str in tcp_ids if adb_states.get(connect_str) != "device")
+    # 仍在退避中的设备本轮不重连，长期离线的设备不再每轮占用一次连接超时
+    scheduler = get_reconnect_scheduler()
+    due, deferred = scheduler.split_due(not_online, force=force)
+    connect_results = {}
+    if due:
+        with ThreadPoolExecutor(max_workers=min(len(due), settings.ADB_CLIENT_POOL_SIZE)) as executor:
+            states = [adb_states.get(connect_str) for connect_str in due]
+            connect_results = dict(zip(due, executor.map(reconnect_tcp_device, due, states)))
+        for connect_str, res in connect_results.items():
+            if res["success"]:
+                adb_states[connect_str] = "device"
+    scheduler.record_many({connect_str: adb_states.get(connect_str) == "device" for connect_str in tcp_ids - set(deferred)})
+
+    updates = {}
+
+    results = []
+    for device in active_devices:
+        connect_str = device.connect_identifier.strip()
+        adb_state = adb_states.get(connect_str)
+        success = adb_state == "device"
+        if connect_str in connect_results:
+            res = connect_results[connect_str]
+            stdout, stderr = res["stdout"], res["stderr"]
+        elif connect_str in deferred:
+            stdout, stderr = "", describe_deferred(deferred[connect_str])
+        elif adb_state is None:
+            stdout, stderr = "", "设备未连接（不在 adb devices 列表中）"
+        else:
+            stdout, stderr = f"{connect_str}\t{adb_state}", ""
+        updates[connect_str] = {
+            "status": "online" if success else ("unauthorized" if adb_state == "unauthorized" else "offline"),
+            "stdout": stdout,
+            "stderr": stderr
+        }
+
+        # 网络设备连接成功后同步设备号（与单设备检查逻辑一致）
+        if success and not (device.device_serial and device.device_serial.strip()):
+            device.device_serial = connect_str
+            device.save(update_fields=["device_serial"])
+
+        results.append({
+            "device_id": device.id,
+            "success": success,
+            "connect_str": connect_str,
+            "message": stdout or stderr
+        })
+
+    get_status_store().set_many(updates)
+
+    success_count = sum(1 for res in results if res["success"])
+    return {
+        "total": total,
+        "success_count": success_count,
+        "fail_count": total - success_count,
+        "connect_count": len(connect_results),
+        "deferred_count": len(deferred),
+        "results": results
+    }
+
+
+# ====================== 心跳：续期设备状态 ======================
+def _heartbeat_devices_core():
+    """
+    一次 adb devices 刷新所有设备状态的有效期与 last_seen（不执行 adb connect），
+    并派发执行租约已过期的设备上排队中的任务
+    未运行 track_devices 时由 Celery beat 定期调用，检查进程停止后状态自动过期为 stale
+    """
+    from .models import ADBDevice
+    from .device_tracker import map_adb_state
+    close_old_connections()
+    try:
+        connect_ids = [
+            device.connect_identifier.strip() for device in ADBDevice.objects.filter(is_active=True)
+            if device.connect_identifier.strip()
+        ]
+    finally:
+        close_old_connections()
+    adb_states = list_adb_devices()
+    statuses = {connect_id: map_adb_state(adb_states.get(connect_id)) for connect_id in connect_ids}
+    statuses.update({serial: map_adb_state(adb_state) for serial, adb_state in adb_states.items()})
+    get_status_store().heartbeat(statuses)
+    # 执行租约过期（持有任务的进程崩溃）的设备：启动排队中的下一个任务
+    dispatched = dispatch_waiting()
+    online = sum(1 for status in statuses.values() if status == "online")
+    return {"total": len(statuses), "online": online, "dispatched": dispatched}
+
+
+@shared_task(name="adb_manager.heartbeat_devices")
+def heartbeat_devices():
+    """Celery定时任务：设备状态心跳"""
+    return _heartbeat_devices_core()
+
+
 # ====================== 核心：抽离所有设备检查逻辑（兼容异步/同步） ======================
-def _check_all_devices_core():
-    """检查所有启用设备的核心逻辑（兼容Celery/线程）"""
+def _check_all_devices_core(force=False):
+    """
+    检查所有启用设备的核心逻辑（兼容Celery/线程）
+    :param force: 忽略重连退避，所有设备都立即检查
+    """
+    if settings.ADB_FLEET_RECONCILE:
+        return _reconcile_devices_core(force)
+
+    # 逐台检查模式：每台设备一次 adb connect
     from .models import ADBDevice
     close_old_connections()
 
@@ -121,67 +339,114 @@ def _check_all_devices_core():
     if total == 0:
         return {"total": 0, "results": [], "message": "无启用的设备"}
 
-    results = []
+    # 只检查已到探测时间的设备（在线设备低频探测，离线设备按退避时间重试）
+    devices_by_connect_id = {device.connect_identifier.strip(): device for device in active_devices}
+    due, deferred = get_reconnect_scheduler().split_due(
+        [connect_id for connect_id in devices_by_connect_id if connect_id], force=force
+    )
+    skipped = [
+        {"device_id": devices_by_connect_id[connect_id].id, "success": bool(state.get("online")),
+         "connect_str": connect_id, "skipped": True,
+         "message": "设备在线，未到探测时间" if state.get("online") else describe_deferred(state)}
+        for connect_id, state in deferred.items()
+    ]
+    if not due:
+        return _summarize_results(skipped)
+
+    # 全局截止时间：所有设备的检查总耗时不超过 ADB_CHECK_ALL_DEADLINE 秒
+    deadline = time.time() + settings.ADB_CHECK_ALL_DEADLINE
+    device_ids = [devices_by_connect_id[connect_id].id for connect_id in due]
+
     if hasattr(settings, 'USE_CELERY') and settings.USE_CELERY:  # 【修改】安全判断 settings.USE_CELERY
-        # Celery 模式：并行执行
-        task_group = group(
-            check_and_reconnect_device.s(device.id) for device in active_devices
-        )
-        task_results = task_group.apply_async()
-        results = [res.get(timeout=15) for res in task_results]
-    else:
-        # 线程模式：并行执行（每个设备一个线程）
-        threads = []
-        results_dict = {}
-
-        def thread_worker(device_id):
-            result = _check_and_reconnect_device_core(device_id)
-            results_dict[device_id] = result
-
-        for device in active_devices:
-            t = threading.Thread(
-                target=thread_worker,
-                args=(device.id,),
-                daemon=True
+        # Celery 模式：chord 并行执行，全部完成后由回调任务汇总（不在任务内阻塞等待子任务）
+        # 不设置 expires（过期的任务会让整个 chord 失败、不再汇总）：截止时间后才开始的任务直接返回超时结果；
+        # 已开始的任务到达软超时后返回超时结果。注意软/硬超时依赖信号，solo、threads 池及 Windows 上不生效，
+        # 这些环境下单台设备的检查只受 adb 命令自身的超时限制
+        remaining = max(int(deadline - time.time()), 1)
+        chord(
+            check_and_reconnect_device.s(device_id, deadline).set(
+                soft_time_limit=remaining,
+                # 硬超时只兜底软超时无法打断的阻塞调用
+                time_limit=remaining + 10,
             )
-            threads.append(t)
-            t.start()
+            for device_id in device_ids
+        )(summarize_device_checks.s().on_error(device_checks_failed.s()))
+        return {"total": total, "results": skipped,
+                "message": f"已提交{len(device_ids)}台设备的检查任务（{len(skipped)}台未到重试时间），结果由汇总任务记录"}
 
-        for t in threads:
-            t.join(timeout=15)
+    # 线程模式：固定大小线程池并行执行，超过全局截止时间的设备记为超时
+    executor = ThreadPoolExecutor(max_workers=min(len(device_ids), settings.ADB_BULK_MAX_WORKERS))
+    futures = {
+        executor.submit(_check_and_reconnect_device_core, device_id, deadline): device_id
+        for device_id in device_ids
+    }
+    done, _ = wait(futures, timeout=max(deadline - time.time(), 0))
+    # 未开始的设备直接取消，不再占用线程池
+    executor.shutdown(wait=False, cancel_futures=True)
 
-        results = [
-            results_dict.get(
-                device.id,
-                {"device_id": device.id, "success": False, "error": "线程执行超时"}
-            )
-            for device in active_devices
-        ]
+    results_dict = {futures[future]: future.result() for future in done}
+    results = [
+        results_dict.get(
+            device_id,
+            {"device_id": device_id, "success": False, "error": "检查超时（超过全局截止时间）"}
+        )
+        for device_id in device_ids
+    ]
+    return _summarize_results(results + skipped)
 
-    success_count = sum(1 for res in results if res.get("success", False))
-    fail_count = total - success_count
 
+def _summarize_results(results):
+    success_count = sum(1 for res in results if res.get("success", False))
     return {
-        "total": total,
+        "total": len(results),
         "success_count": success_count,
-        "fail_count": fail_count,
+        "fail_count": len(results) - success_count,
         "results": results
     }
 
 
+@shared_task(name="adb_manager.summarize_device_checks")
+def summarize_device_checks(results):
+    """chord 回调：汇总所有设备的检查结果"""
+    summary = _summarize_results(results)
+    logger.info(f"设备检查完成：共{summary['total']}台，成功{summary['success_count']}台，失败{summary['fail_count']}台")
+    return summary
+
+
+@shared_task(name="adb_manager.device_checks_failed")
+def device_checks_failed(request, exc, traceback):
+    """chord 汇总失败的回调（检查任务被硬超时终止或意外异常；截止时间导致的超时不会走到这里）"""
+    logger.warning(f"设备检查汇总失败（部分检查任务已过期或异常）：{exc}")
+
+
 # ====================== Celery 异步任务（所有设备） ======================
 @shared_task(name="adb_manager.check_all_devices")
-def check_all_devices():
-    """Celery异步检查所有启用的设备"""
-    return _check_all_devices_core()
+def check_all_devices(force=False):
+    """Celery异步检查所有启用的设备（force=True 时忽略重连退避）"""
+    return _check_all_devices_core(force)
 
 
 # ====================== 后台线程同步执行（所有设备） ======================
-def check_all_devices_sync():
+def check_all_devices_sync(force=False):
     """后台线程同步检查所有启用的设备（优雅降级）"""
     thread = threading.Thread(
         target=_check_all_devices_core,
+        args=(force,),
         daemon=True
     )
     thread.start()
-    logger.info("已启动后台同步线程检查所有设备")
\ No newline at end of file
+    logger.info("已启动后台同步线程检查所有设备")
+
+# ====================== Celery 异步任务（批量操作/命令分发） ======================
+@shared_task(name="adb_manager.run_bulk_job")
+def run_bulk_job_task(job_id, operation, device_ids, user_id=None, params=None, timeout=None):
+    """Celery执行批量任务（一键连接/断开、批量执行命令），逐台结果通过 WebSocket 推送"""
+    from .bulk_jobs import run_bulk_job
+    return run_bulk_job(job_id, operation, device_ids, user_id, params, timeout)
+
+
+@shared_task(name="adb_manager.run_discovery")
+def run_discovery_task(job_id, networks, ports, user_id=None):
+    """Celery执行局域网设备发现与批量登记，进度通过批量任务通道推送"""
+    from .discovery import run_discovery
+    return run_discovery(job_id, networks, ports, user_id)
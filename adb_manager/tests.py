@@ -1,3 +1,339 @@
-from django.test import TestCase
+import threading
+import time
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.test import SimpleTestCase, override_settings
+
+from . import device_governor, device_lease
+from .adb_client import AdbClient, AdbCommandFailed
+from .device_governor import LANE_BACKGROUND, LANE_INTERACTIVE, DeviceBusyError, DeviceGovernor
+from .device_lease import PRIORITY_MANUAL, PRIORITY_SCHEDULED, DeviceLease, lease_key, lease_owner
+from .fake_adb_server import FakeAdbServer
+
+try:
+    import fakeredis
+except ImportError:  # 未安装 fakeredis 时跳过依赖 Redis 的测试（Lua 脚本还需要 lupa）
+    fakeredis = None
+
+
+class AdbClientTestCase(SimpleTestCase):
+    """ADB 协议客户端（对接本地模拟 adb server）"""
+
+    def setUp(self):
+        self.server = FakeAdbServer().start()
+        self.addCleanup(self.server.stop)
+        self.device = self.server.add_device("emulator-5554")
+        host, port = self.server.address
+        self.client = AdbClient(host=host, port=port, pool_size=4, max_idle=1)
+        self.addCleanup(self.client.pool.discard_idle)
+
+    # ===================== host 服务 =====================
+    def test_version(self):
+        self.assertEqual(self.client.version(), 41)
+
+    def test_devices(self):
+        self.server.add_device("192.168.3.100:5555", state="offline")
+        devices = {d["serial"]: d["status"] for d in self.client.devices()}
+        self.assertEqual(devices, {"emulator-5554": "device", "192.168.3.100:5555": "offline"})
+
+    def test_connect_and_disconnect(self):
+        self.assertEqual(self.client.connect("192.168.3.101"), "connected to 192.168.3.101:5555")
+        self.assertIn("192.168.3.101:5555", self.server.devices)
+        self.assertEqual(self.client.disconnect("192.168.3.101:5555"), "disconnected 192.168.3.101:5555")
+        self.assertNotIn("192.168.3.101:5555", self.server.devices)
+
+    def test_connect_unreachable(self):
+        self.server.reachable = set()
+        self.assertEqual(self.client.connect("192.168.3.102:5555"), "failed to connect to 192.168.3.102:5555")
+
+    def test_get_state_unknown_device(self):
+        with self.assertRaises(AdbCommandFailed):
+            self.client.get_state("missing-serial")
+
+    # ===================== shell =====================
+    def test_shell_v2(self):
+        self.device.handlers["ls"] = ("a\nb\n", "warn\n", 3)
+        self.assertEqual(self.client.shell("emulator-5554", "ls /sdcard"), (3, b"a\nb\n", b"warn\n"))
+
+    def test_shell_v2_connection_closed_before_exit(self):
+        self.device.handlers["am"] = ("partial", "", None)
+        returncode, stdout, stderr = self.client.shell("emulator-5554", "am instrument")
+        self.assertNotEqual(returncode, 0)
+        self.assertEqual(stdout, b"partial")
+        self.assertIn(b"closed", stderr)
+
+    def test_shell_v1_fallback(self):
+        device = self.server.add_device("old-device", shell_v2=False)
+        device.handlers["ls"] = ("a\n", "", 2)
+        self.assertEqual(self.client.shell("old-device", "ls"), (2, b"a\n", b""))
+        # 不支持 shell_v2 的结果被记住，后续直接走 v1
+        self.assertFalse(self.client._shell_v2_support["old-device"])
+        self.assertEqual(self.client.shell("old-device", "echo hi"), (0, b"hi\n", b""))
+
+    def test_shell_unknown_device(self):
+        with self.assertRaises(AdbCommandFailed):
+            self.client.shell("missing-serial", "ls")
+
+    def test_shell_offline_device(self):
+        self.server.set_state("emulator-5554", "offline")
+        with self.assertRaises(AdbCommandFailed):
+            self.client.shell("emulator-5554", "ls")
+
+    def test_exec_out(self):
+        self.device.files["/sdcard/raw.bin"] = bytes(range(256)) * 1024
+        self.assertEqual(self.client.exec_out("emulator-5554", "cat /sdcard/raw.bin"), bytes(range(256)) * 1024)
+
+    # ===================== sync =====================
+    def test_push_and_pull(self):
+        data = b"x" * 200000
+        written = self.client.push_stream("emulator-5554", "/sdcard/a.bin", [data[:70000], data[70000:]])
+        self.assertEqual(written, len(data))
+        self.assertEqual(self.device.files["/sdcard/a.bin"], data)
+        self.assertEqual(b"".join(self.client.pull_stream("emulator-5554", "/sdcard/a.bin")), data)
+
+    def test_stat(self):
+        self.device.files["/sdcard/a.txt"] = b"hello"
+        mode, size, _ = self.client.stat("emulator-5554", "/sdcard/a.txt")
+        self.assertEqual((mode & 0o170000, size), (0o100000, 5))
+        self.assertEqual(self.client.stat("emulator-5554", "/sdcard/missing")[0], 0)
+
+    def test_pull_missing_file(self):
+        with self.assertRaises(AdbCommandFailed):
+            list(self.client.pull_stream("emulator-5554", "/sdcard/missing"))
+
+    # ===================== adb CLI 参数兼容 =====================
+    def test_run_command(self):
+        self.device.handlers["ls"] = ("a\n", "", 0)
+        result = self.client.run_command(["adb", "-s", "emulator-5554", "shell", "ls"])
+        self.assertEqual((result.returncode, result.stdout), (0, "a\n"))
+
+    def test_run_command_fail(self):
+        result = self.client.run_command(["adb", "-s", "missing-serial", "shell", "ls"])
+        self.assertEqual(result.returncode, 1)
+        self.assertTrue(result.stderr.startswith("error: "))
+
+
+@skipIf(fakeredis is None, "需要安装 fakeredis[lua]")
+@override_settings(
+    ADB_GOVERNOR_ENABLED=True,
+    ADB_GOVERNOR_INTERACTIVE_MAX=2,
+    ADB_GOVERNOR_INTERACTIVE_MAX_WHILE_BUSY=1,
+    ADB_GOVERNOR_BACKGROUND_MAX=1,
+    ADB_GOVERNOR_LEASE_TTL=60,
+)
+class DeviceGovernorTestCase(SimpleTestCase):
+    """单设备命令并发控制（fakeredis）"""
+
+    def setUp(self):
+        self.client = fakeredis.FakeRedis(decode_responses=True)
+        self.governor = DeviceGovernor(self.client)
+        patcher = mock.patch.object(device_governor, "_governor", self.governor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_interactive_limit(self):
+        tokens = [self.governor.acquire("d1", LANE_INTERACTIVE, wait=0) for _ in range(2)]
+        with self.assertRaises(DeviceBusyError):
+            self.governor.acquire("d1", LANE_INTERACTIVE, wait=0)
+        # 不同设备互不影响
+        self.governor.acquire("d2", LANE_INTERACTIVE, wait=0)
+        self.governor.release("d1", LANE_INTERACTIVE, tokens[0])
+        self.governor.acquire("d1", LANE_INTERACTIVE, wait=0)
+
+    def test_background_limit(self):
+        self.governor.acquire("d1", LANE_BACKGROUND, wait=0)
+        with self.assertRaises(DeviceBusyError):
+            self.governor.acquire("d1", LANE_BACKGROUND, wait=0)
+
+    def test_background_busy_lowers_interactive_limit(self):
+        token = self.governor.acquire("d1", LANE_BACKGROUND, wait=0)
+        self.governor.acquire("d1", LANE_INTERACTIVE, wait=0)
+        with self.assertRaises(DeviceBusyError):
+            self.governor.acquire("d1", LANE_INTERACTIVE, wait=0)
+        self.governor.release("d1", LANE_BACKGROUND, token)
+        self.governor.acquire("d1", LANE_INTERACTIVE, wait=0)
+
+    def test_expired_holder_released(self):
+        self.governor.acquire("d1", LANE_BACKGROUND, wait=0, ttl=0.1)
+        time.sleep(0.15)
+        self.governor.acquire("d1", LANE_BACKGROUND, wait=0)
+
+    @override_settings(ADB_GOVERNOR_INTERACTIVE_MAX=1)
+    def test_priority_order(self):
+        token = self.governor.acquire("d1", LANE_INTERACTIVE, wait=0)
+        order = []
+
+        def worker(name, priority):
+            slot = self.governor.acquire("d1", LANE_INTERACTIVE, priority=priority, wait=5)
+            order.append(name)
+            self.governor.release("d1", LANE_INTERACTIVE, slot)
+
+        threads = []
+        for name, priority in (("low", 0), ("high", 5)):
+            thread = threading.Thread(target=worker, args=(name, priority))
+            thread.start()
+            threads.append(thread)
+            time.sleep(0.2)
+        self.governor.release("d1", LANE_INTERACTIVE, token)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(order, ["high", "low"])
+
+    def test_timeout_metrics(self):
+        self.governor.acquire("d1", LANE_BACKGROUND, wait=0)
+        with self.assertRaises(DeviceBusyError):
+            self.governor.acquire("d1", LANE_BACKGROUND, wait=0.2)
+        metrics = self.governor.metrics()[LANE_BACKGROUND]
+        self.assertEqual((metrics["acquired"], metrics["timeouts"]), (1, 1))
+        self.assertGreaterEqual(metrics["wait_ms_max"], 200)
+        # 超时的等待者已移出队列，不影响后续获取
+        self.assertEqual(self.client.zcard(device_governor.lane_key("d1", LANE_BACKGROUND, "waiters")), 0)
+
+    def test_lane_busy(self):
+        self.assertFalse(device_governor.lane_busy("d1"))
+        with device_governor.device_slot("d1", LANE_BACKGROUND, wait=0):
+            self.assertEqual(self.governor.holders("d1", LANE_BACKGROUND), 1)
+            self.assertTrue(device_governor.lane_busy("d1"))
+            self.assertFalse(device_governor.lane_busy("d1", LANE_INTERACTIVE))
+        self.assertFalse(device_governor.lane_busy("d1"))
+        with override_settings(ADB_GOVERNOR_ENABLED=False):
+            self.assertIsNone(device_governor.acquire_slot("d1", LANE_BACKGROUND))
+
+
+@skipIf(fakeredis is None, "需要安装 fakeredis[lua]")
+@override_settings(ADB_LEASE_ENABLED=True)
+class DeviceLeaseTestCase(SimpleTestCase):
+    """设备执行租约与等待队列（fakeredis，派发函数替换为记录调用）"""
+
+    def setUp(self):
+        self.client = fakeredis.FakeRedis(decode_responses=True)
+        self.lease = DeviceLease(self.client, ttl=60)
+        # 派发函数返回值：pk -> 是否启动成功 / 抛出的异常（默认启动成功）
+        self.results = {}
+        self.dispatched = []
+        for patcher in (
+            mock.patch.object(device_lease, "_lease", self.lease),
+            mock.patch.object(device_lease, "import_string", return_value=self._dispatch),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _dispatch(self, pk, payload):
+        self.dispatched.append((pk, payload))
+        result = self.results.get(pk, True)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def request(self, pk, priority=PRIORITY_MANUAL, device="d1"):
+        return device_lease.request_lease(device, lease_owner("script", pk), priority, {"pk": pk})
+
+    def test_acquire_and_queue(self):
+        self.assertEqual(self.request(1), 0)
+        # 持有者再次申请视为续期
+        self.assertEqual(self.request(1), 0)
+        self.assertEqual(self.request(2, PRIORITY_SCHEDULED), 1)
+        self.assertEqual(self.request(3, PRIORITY_SCHEDULED), 2)
+        # 手动提交排在定时任务之前
+        self.assertEqual(self.request(4), 1)
+        owners = [("d1", lease_owner("script", pk)) for pk in (1, 2, 3, 4)]
+        self.assertEqual(device_lease.queue_positions(owners), {owners[3]: 1, owners[1]: 2, owners[2]: 3})
+        self.assertEqual(self.lease.waiting_devices(), {"d1"})
+
+    def test_release_hands_over_to_queue_head(self):
+        self.request(1)
+        self.request(2)
+        device_lease.release_lease("d1", lease_owner("script", 1))
+        self.assertEqual(self.dispatched, [(2, {"pk": 2})])
+        self.assertEqual(self.lease.holder("d1"), "script:2")
+        # 队列已空：设备从等待集合移除
+        self.assertEqual(self.lease.waiting_devices(), set())
+        device_lease.release_lease("d1", lease_owner("script", 2))
+        self.assertIsNone(self.lease.holder("d1"))
+
+    def test_release_by_other_owner_ignored(self):
+        self.request(1)
+        self.request(2)
+        device_lease.release_lease("d1", lease_owner("script", 3))
+        self.assertEqual(self.dispatched, [])
+        self.assertEqual(self.lease.holder("d1"), "script:1")
+
+    def test_renew_only_by_holder(self):
+        self.request(1)
+        self.client.pexpire(lease_key("d1"), 1000)
+        self.assertFalse(self.lease.renew("d1", lease_owner("script", 2)))
+        self.assertLessEqual(self.client.pttl(lease_key("d1")), 1000)
+        self.assertTrue(self.lease.renew("d1", lease_owner("script", 1)))
+        self.assertGreater(self.client.pttl(lease_key("d1")), 1000)
+
+    def test_failed_dispatch_passes_lease_on(self):
+        self.request(1)
+        for pk in (2, 3, 4):
+            self.request(pk)
+        self.results = {2: False, 3: RuntimeError("dispatch failed")}
+        with self.assertLogs(device_lease.logger, "ERROR"):
+            device_lease.release_lease("d1", lease_owner("script", 1))
+        self.assertEqual([pk for pk, _ in self.dispatched], [2, 3, 4])
+        self.assertEqual(self.lease.holder("d1"), "script:4")
+
+    def test_failed_dispatch_without_waiters_releases(self):
+        self.request(1)
+        self.request(2)
+        self.results = {2: False}
+        device_lease.release_lease("d1", lease_owner("script", 1))
+        self.assertIsNone(self.lease.holder("d1"))
+        self.assertEqual(self.lease.waiting_devices(), set())
+
+    def test_expired_lease_handed_over_on_request(self):
+        self.request(1)
+        self.request(2)
+        # 持有者崩溃，租约过期
+        self.client.delete(lease_key("d1"))
+        self.assertEqual(self.request(3), 1)
+        self.assertEqual(self.dispatched, [(2, {"pk": 2})])
+        self.assertEqual(self.lease.holder("d1"), "script:2")
+
+    def test_expired_lease_requester_at_head(self):
+        self.request(1)
+        self.request(2)
+        self.client.delete(lease_key("d1"))
+        # 队首就是申请者：直接持有，不经派发函数
+        self.assertEqual(self.request(2), 0)
+        self.assertEqual(self.dispatched, [])
+        self.assertEqual(self.lease.holder("d1"), "script:2")
+
+    def test_dispatch_waiting(self):
+        self.request(1)
+        self.request(2)
+        self.assertEqual(device_lease.dispatch_waiting(), 0)
+        self.client.delete(lease_key("d1"))
+        self.assertEqual(device_lease.dispatch_waiting(), 1)
+        self.assertEqual(self.lease.holder("d1"), "script:2")
+
+    def test_cancel_while_queued(self):
+        self.request(1)
+        self.request(2)
+        self.assertTrue(device_lease.cancel_lease_wait("d1", lease_owner("script", 2)))
+        self.assertEqual(device_lease.queue_positions([("d1", lease_owner("script", 2))]), {})
+        device_lease.release_lease("d1", lease_owner("script", 1))
+        self.assertEqual(self.dispatched, [])
+        self.assertIsNone(self.lease.holder("d1"))
+        self.assertEqual(self.lease.waiting_devices(), set())
+
+    def test_cancel_racing_handover(self):
+        self.request(1)
+        self.request(2)
+        self.request(3)
+        # 停止排队任务 2 之前租约已交给它：取消失败，派发时发现已停止（返回 False），租约交给下一个
+        self.lease.handover("d1", lease_owner("script", 1))
+        self.assertFalse(device_lease.cancel_lease_wait("d1", lease_owner("script", 2)))
+        self.results = {2: False}
+        device_lease.release_lease("d1", lease_owner("script", 2))
+        self.assertEqual(self.dispatched, [(3, {"pk": 3})])
+        self.assertEqual(self.lease.holder("d1"), "script:3")
+
+    @override_settings(ADB_LEASE_ENABLED=False)
+    def test_disabled(self):
+        self.assertEqual(self.request(1), 0)
+        self.assertEqual(self.request(2), 0)
+        self.assertIsNone(self.lease.holder("d1"))
@@ -15,16 +15,27 @@ urlpatterns = [
     path("refresh-all/", views.RefreshAllDevicesView.as_view(), name="refresh_all"),
     path("connect-all/", views.ConnectAllDevicesView.as_view(), name="connect_all"),
     path("disconnect-all/", views.DisconnectAllDevicesView.as_view(), name="disconnect_all"),
+    path("discover/", views.DiscoverDevicesView.as_view(), name="discover_devices"),
+    path("import-devices/", views.ImportDevicesView.as_view(), name="import_devices"),
+    path("fan-out/", views.FanOutShellView.as_view(), name="fan_out_shell"),
+    path("bulk-job/<str:job_id>/", views.BulkJobStatusView.as_view(), name="bulk_job_status"),
     path("status/", views.ADBDeviceStatusView.as_view(), name="device_status"),
+    path("governor-metrics/", views.DeviceGovernorMetricsView.as_view(), name="governor_metrics"),
+    path("oplog-metrics/", views.OperationLogMetricsView.as_view(), name="oplog_metrics"),
     path("csrf-token/", views.CSRFTokenView.as_view(), name="csrf_token"),
     path("list-devices/", views.ADBDevicesListView.as_view(), name="list_devices"),
     path("detail-device/", views.ADBDeviceDetailView.as_view(), name="detail_device"),
+    path("detail-devices/", views.ADBDevicesDetailView.as_view(), name="detail_devices"),
     path("enable-wireless/", views.ADBDeviceEnableWirelessView.as_view(), name="enable_wireless"),
     path('logs/', views.ADBOperationLogView.as_view(), name='operation_logs'),
     # 新增：文件管理路由
     path("list-dir/", views.ADBDeviceListDirView.as_view(), name="list_dir"),
     path("create-dir/", views.ADBDeviceCreateDirView.as_view(), name="create_dir"),
     path("delete-file/", views.ADBDeviceDeleteFileView.as_view(), name="delete_file"),
+    path("pull-file/", views.ADBDevicePullFileView.as_view(), name="pull_file"),
+    path("push-file/", views.ADBDevicePushFileView.as_view(), name="push_file"),
+    path("screen-stream/", views.ADBDeviceScreenStreamView.as_view(), name="screen_stream"),
+    path("screen-metrics/", views.ScreenStreamMetricsView.as_view(), name="screen_metrics"),
     # 新增：应用管理路由
     path("list-apps/", views.ADBDeviceListAppsView.as_view(), name="list_apps"),
     path("launch-app/", views.ADBDeviceLaunchAppView.as_view(), name="launch_app"),
@@ -1,9 +1,10 @@
 """ADB设备管理视图（添加日志记录功能）"""
 from django.conf import settings
-import redis
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views import View
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date
 from django.middleware.csrf import get_token
 from django.urls import reverse
 from urllib.parse import quote
@@ -11,10 +12,29 @@ from .models import ADBDevice, ADBDeviceOperationLog  # 导入新模型
 from .forms import ADBDeviceForm
 import logging
 import subprocess
+import socket
 import os
+import posixpath
 import re
 
-from .tasks import check_all_devices_sync
+from .tasks import check_all_devices, check_all_devices_sync
+from .adb_client import get_adb_client, native_client_enabled, AdbError, AdbUnsupportedCommand
+from .status_store import get_status_store
+from .reconnect_scheduler import get_reconnect_scheduler
+from common.redis_client import get_redis
+from .bulk_jobs import OPERATION_NAMES, start_bulk_job, get_job_state
+from .device_import import import_devices
+from .discovery import start_discovery
+from .device_probe import probe_device, probe_devices
+from .app_inventory import AppInventoryCollector
+from .device_governor import LANE_INTERACTIVE, device_slot, get_governor
+from .operation_log import get_operation_log_writer, write_operation_log
+from .screen_stream import iter_frames, screen_hub
+from .dir_index import SORT_FIELDS, get_directory_index, query_entries
+from .file_transfer import (
+    CHUNK_SIZE as TRANSFER_CHUNK_SIZE, RangeNotSatisfiable, hold_device_slot, release_after,
+    stat_file, list_files, iter_file, iter_tar, parse_range, push_file
+)
 
 # 初始化日志
 logger = logging.getLogger(__name__)
@@ -30,43 +50,41 @@ def get_adb_path():
 
 
 def get_redis_client():
-    """获取Redis客户端"""
-    try:
-        r = redis.Redis(
-            host=settings.REDIS_HOST,
-            port=settings.REDIS_PORT,
-            db=settings.REDIS_DB,
-            decode_responses=True,
-            socket_timeout=2,
-            retry_on_timeout=True
-        )
-        r.ping()
-        logger.info("Redis连接成功")
-        return r
-    except Exception as e:
-        logger.error(f"Redis连接失败：{e}")
-
-        # 空实现，保证代码不报错
-        class EmptyRedis:
-            def get(self, key, *args, **kwargs):
-                return None
-
-            def set(self, key, value, *args, **kwargs):
-                return None
-
-            def delete(self, key, *args, **kwargs):
-                return None
+    """获取Redis客户端（共享连接池；Redis不可用时返回进程内存降级存储）"""
+    return get_redis()
 
-        return EmptyRedis()
 
-
-def execute_adb_command(cmd, timeout=None, shell=True):
-    """执行ADB命令的公共方法"""
+def execute_adb_command(cmd, timeout=None, shell=True, lane=LANE_INTERACTIVE, priority=0):
+    """
+    执行ADB命令的公共方法
+    :param lane: 设备命令通道（interactive/background），带 -s 的设备命令会先获取该设备的命令名额
+    :param priority: 同一通道内的排队优先级
+    """
     if timeout is None:
         timeout = int(os.getenv("ADB_COMMAND_TIMEOUT", 10))
 
     cmd_str = ' '.join(cmd) if isinstance(cmd, list) else cmd
     logger.info(f"执行ADB命令：{cmd_str}")
+
+    # 同一设备的命令并发受控（避免界面操作与正在运行的脚本争抢设备）
+    serial = cmd[cmd.index("-s") + 1] if isinstance(cmd, list) and "-s" in cmd[:-1] else None
+    with device_slot(serial, lane=lane, priority=priority):
+        return _run_adb_command(cmd, cmd_str, timeout, shell)
+
+
+def _run_adb_command(cmd, cmd_str, timeout, shell):
+    # 优先通过 adb server 协议客户端执行（避免fork adb进程），不支持/不可用时回退到subprocess
+    if not shell and isinstance(cmd, list) and native_client_enabled():
+        try:
+            return get_adb_client().run_command(cmd, timeout=timeout)
+        except socket.timeout:
+            logger.error(f"ADB命令执行超时：{cmd_str}")
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        except AdbUnsupportedCommand:
+            pass
+        except (AdbError, OSError) as e:
+            logger.warning(f"ADB协议客户端执行失败，回退到adb可执行文件：{str(e)}")
+
     try:
         result = subprocess.run(
             cmd,
@@ -132,7 +150,8 @@ def log_device_operation(request, device, operation_type, result=True, details="
     """
     user = request.user if request.user.is_authenticated else None
 
-    ADBDeviceOperationLog.objects.create(
+    # 放入队列由后台线程批量写入，请求不等待数据库
+    write_operation_log(
         device=device,
         operation_type=operation_type,
         user=user,
@@ -146,8 +165,8 @@ def log_device_operation(request, device, operation_type, result=True, details="
     logger.info(f"{username} {operation_type} {device_name} {'成功' if result else '失败'}: {details}")
 
 
-# 初始化Redis客户端
-r = get_redis_client()
+# 设备状态存储（每台设备一个Hash，支持批量读取）
+status_store = get_status_store()
 
 
 # ===================== 视图函数/类 =====================
@@ -165,14 +184,18 @@ def index(request):
     logger.info(f"数据库设备详情：{[str(dev) for dev in devices_queryset]}")
 
     device_list = []
+    devices_queryset = list(devices_queryset)
+    # 一次往返批量读取所有设备状态
+    states = status_store.get_many(devices_queryset)
     for dev in devices_queryset:
         try:
             connect_id = dev.connect_identifier
             logger.info(f"处理设备：{connect_id}")
 
-            status = r.get(f"adb:device:{connect_id}") or "offline"
-            stdout = r.get(f"adb:device:{connect_id}:stdout") or ""
-            stderr = r.get(f"adb:device:{connect_id}:stderr") or ""
+            state = states.get(connect_id) or status_store.get(connect_id)
+            status = state["status"]
+            stdout = state["stdout"]
+            stderr = state["stderr"]
 
             device_item = {
                 "id": dev.id,
@@ -184,7 +207,8 @@ def index(request):
                 "is_active": dev.is_active,
                 "status": status,
                 "stdout": stdout,
-                "stderr": stderr
+                "stderr": stderr,
+                "last_seen": state["last_seen"]
             }
             device_list.append(device_item)
             logger.info(f"设备{connect_id}组装后数据：{device_item}")
@@ -204,13 +228,15 @@ class ADBDeviceStatusView(View):
     """获取所有设备状态接口（保持不变）"""
     def get(self, request):
         try:
-            devices = ADBDevice.objects.all()
+            devices = list(ADBDevice.objects.all())
+            states = status_store.get_many(devices)
             device_list = []
             for dev in devices:
                 connect_id = dev.connect_identifier
-                status = r.get(f"adb:device:{connect_id}") or "unknown"
-                stdout = r.get(f"adb:device:{connect_id}:stdout") or ""
-                stderr = r.get(f"adb:device:{connect_id}:stderr") or ""
+                state = states.get(connect_id) or status_store.get(connect_id)
+                status = state["status"]
+                stdout = state["stdout"]
+                stderr = state["stderr"]
                 dev_dict = {
                     "id": dev.id,
                     "device_name": dev.device_name,
@@ -221,7 +247,8 @@ class ADBDeviceStatusView(View):
                     "is_active": dev.is_active,
                     "status": status,
                     "stdout": stdout,
-                    "stderr": stderr
+                    "stderr": stderr,
+                    "last_seen": state["last_seen"]
                 }
                 device_list.append(dev_dict)
             return JsonResponse({
@@ -272,17 +299,14 @@ class ADBDeviceConnectView(View):
             # 结果判断
             success_keywords = ["connected to", "connected", "echo connected"]
             if any(kw in result.stdout for kw in success_keywords) or result.returncode == 0:
-                r.set(f"adb:device:{connect_id}", "online")
-                r.set(f"adb:device:{connect_id}:stdout", result.stdout or f"设备{connect_id}连接成功")
-                r.set(f"adb:device:{connect_id}:stderr", "")
+                status_store.set(connect_id, "online", result.stdout or f"设备{connect_id}连接成功", "")
                 success_msg = f"设备{connect_id}连接成功！"
                 log_device_operation(
                     request, device, 'connect', True,
                     success_msg + f" 输出: {result.stdout[:100]}"
                 )
             else:
-                r.set(f"adb:device:{connect_id}", "offline")
-                r.set(f"adb:device:{connect_id}:stderr", result.stderr or result.stdout or "连接失败")
+                status_store.set(connect_id, "offline", stderr=result.stderr or result.stdout or "连接失败")
                 success_msg = f"设备{connect_id}连接失败：{result.stderr or result.stdout}"
                 log_device_operation(
                     request, device, 'connect', False,
@@ -337,17 +361,14 @@ class ADBDeviceDisconnectView(View):
 
             # 更新状态
             if "disconnected" in result.stdout or result.returncode == 0:
-                r.set(f"adb:device:{connect_id}", "offline")
-                r.set(f"adb:device:{connect_id}:stdout", result.stdout)
-                r.set(f"adb:device:{connect_id}:stderr", "")
+                status_store.set(connect_id, "offline", result.stdout, "")
                 success_msg = f"设备{connect_id}断开连接成功！"
                 log_device_operation(
                     request, device, 'disconnect', True,
                     success_msg + f" 输出: {result.stdout[:100]}"
                 )
             else:
-                r.set(f"adb:device:{connect_id}", "error")
-                r.set(f"adb:device:{connect_id}:stderr", result.stderr or result.stdout)
+                status_store.set(connect_id, "error", stderr=result.stderr or result.stdout)
                 success_msg = f"设备{connect_id}断开连接失败：{result.stderr or result.stdout}"
                 log_device_operation(
                     request, device, 'disconnect', False,
@@ -373,7 +394,7 @@ class ADBDeviceDisconnectView(View):
 
 class RefreshAllDevicesView(View):
     """刷新所有设备状态（异步执行 + 优雅降级）"""
-    def post(self, request, check_all_devices=None):
+    def post(self, request):
         try:
             devices = ADBDevice.objects.filter(is_active=True)
             if not devices.exists():
@@ -385,11 +406,13 @@ class RefreshAllDevicesView(View):
                 return redirect(f"{reverse('adb_manager:index')}?msg={error_msg}")
 
             # 【核心修改】根据配置选择 Celery 或 后台线程
+            # force=1：忽略重连退避，立即重连所有离线设备
+            force = request.POST.get("force") in ("1", "true", "on")
             if hasattr(settings, 'USE_CELERY') and settings.USE_CELERY:
-                check_all_devices.delay()
+                check_all_devices.delay(force)
                 success_msg = "已提交 Celery 异步任务刷新设备状态，请稍后查看结果"
             else:
-                check_all_devices_sync()
+                check_all_devices_sync(force)
                 success_msg = "已启动后台线程刷新设备状态，请稍后查看结果"
 
             log_device_operation(
@@ -480,18 +503,7 @@ class EditDeviceView(View):
 
             # 迁移Redis状态
             if old_connect_id != new_connect_id and old_connect_id:
-                status = r.get(f"adb:device:{old_connect_id}") or "offline"
-                stdout = r.get(f"adb:device:{old_connect_id}:stdout") or ""
-                stderr = r.get(f"adb:device:{old_connect_id}:stderr") or ""
-
-                if new_connect_id:
-                    r.set(f"adb:device:{new_connect_id}", status)
-                    r.set(f"adb:device:{new_connect_id}:stdout", stdout)
-                    r.set(f"adb:device:{new_connect_id}:stderr", stderr)
-
-                r.delete(f"adb:device:{old_connect_id}")
-                r.delete(f"adb:device:{old_connect_id}:stdout")
-                r.delete(f"adb:device:{old_connect_id}:stderr")
+                status_store.rename(old_connect_id, new_connect_id)
 
             success_msg = f"设备【{updated_device.device_name}】修改成功！"
             log_device_operation(
@@ -535,9 +547,8 @@ class DeleteDeviceView(View):
                 execute_adb_command(cmd, shell=False, timeout=5)
 
                 # 删除Redis状态
-                r.delete(f"adb:device:{connect_id}")
-                r.delete(f"adb:device:{connect_id}:stdout")
-                r.delete(f"adb:device:{connect_id}:stderr")
+                status_store.delete(connect_id)
+                get_reconnect_scheduler().forget([connect_id])
 
             # 删除数据库记录
             device.delete()
@@ -567,145 +578,222 @@ class DeleteDeviceView(View):
             return redirect(f"{reverse('adb_manager:index')}?msg={quote(error_msg)}")
 
 
+def _start_bulk_operation(request, operation, devices, empty_msg):
+    """提交批量设备操作任务，立即返回任务ID（AJAX返回JSON，表单提交则重定向回首页）"""
+    operation_name = OPERATION_NAMES[operation]
+    wants_json = request.headers.get("x-requested-with") == "XMLHttpRequest"
+    try:
+        if not devices.exists():
+            log_device_operation(
+                request, None, operation, True,
+                f"{operation_name}所有设备：{empty_msg}"
+            )
+            if wants_json:
+                return JsonResponse({"code": 200, "msg": empty_msg, "data": None})
+            return redirect(f"{reverse('adb_manager:index')}?msg={quote(empty_msg)}")
+
+        user = request.user if request.user.is_authenticated else None
+        job_id = start_bulk_job(operation, devices, user=user)
+        success_msg = f"已提交{operation_name}任务（共{devices.count()}台设备），结果将逐台实时更新"
+        log_device_operation(
+            request, None, operation, True,
+            f"{success_msg}，任务ID：{job_id}"
+        )
+        if wants_json:
+            return JsonResponse({"code": 200, "msg": success_msg, "data": {"job_id": job_id}})
+        return redirect(f"{reverse('adb_manager:index')}?msg={quote(success_msg)}&job_id={job_id}")
+
+    except Exception as e:
+        logger.error(f"{operation_name}全部设备失败：{str(e)}", exc_info=True)
+        error_msg = f"{operation_name}失败：{str(e)}"
+        log_device_operation(
+            request, None, operation, False,
+            error_msg
+        )
+        if wants_json:
+            return JsonResponse({"code": 500, "msg": error_msg, "data": None})
+        return redirect(f"{reverse('adb_manager:index')}?msg={quote(error_msg)}")
+
+
 class ConnectAllDevicesView(View):
-    """一键连接所有设备（添加日志记录）"""
+    """一键连接所有设备（后台线程池并发执行，立即返回任务ID）"""
     def post(self, request):
-        try:
-            devices = ADBDevice.objects.filter(is_active=True)
-            if not devices.exists():
-                error_msg = quote("暂无启用的设备，无需连接！")
-                log_device_operation(
-                    request, None, 'connect_all', True,
-                    "一键连接所有设备：暂无启用的设备"
-                )
-                return redirect(f"{reverse('adb_manager:index')}?msg={error_msg}")
+        devices = ADBDevice.objects.filter(is_active=True)
+        return _start_bulk_operation(request, "connect_all", devices, "暂无启用的设备，无需连接！")
 
-            adb_path = get_adb_path()
 
-            success_count = 0
-            fail_count = 0
-            result_logs = []
-
-            for device in devices:
-                connect_id = device.connect_identifier
-                if not connect_id:
-                    fail_count += 1
-                    result_logs.append(f"⚠️ {device.device_name}：未配置序列号/IP+端口")
-                    continue
-
-                try:
-                    if ":" in connect_id:
-                        cmd = [adb_path, "connect", connect_id]
-                    else:
-                        cmd = [adb_path, "-s", connect_id, "wait-for-device", "shell", "echo", "connected"]
-
-                    result = execute_adb_command(cmd, shell=False)
-
-                    if any(kw in result.stdout for kw in
-                           ["connected to", "connected", "echo connected"]) or result.returncode == 0:
-                        r.set(f"adb:device:{connect_id}", "online")
-                        r.set(f"adb:device:{connect_id}:stdout", result.stdout)
-                        r.set(f"adb:device:{connect_id}:stderr", "")
-                        success_count += 1
-                        result_logs.append(f"✅ {connect_id}：连接成功")
-                    else:
-                        r.set(f"adb:device:{connect_id}", "offline")
-                        r.set(f"adb:device:{connect_id}:stderr", result.stderr or result.stdout)
-                        fail_count += 1
-                        result_logs.append(f"❌ {connect_id}：连接失败 - {result.stderr or result.stdout}")
-
-                except Exception as e:
-                    logger.error(f"一键连接 - 设备{connect_id}异常：{str(e)}")
-                    r.set(f"adb:device:{connect_id}", "error")
-                    r.set(f"adb:device:{connect_id}:stderr", str(e))
-                    fail_count += 1
-                    result_logs.append(f"⚠️ {connect_id}：操作异常 - {str(e)}")
-
-            success_msg = f"一键连接完成！成功{success_count}台，失败{fail_count}台。详情：{' | '.join(result_logs)}"
-            log_device_operation(
-                request, None, 'connect_all', True,
-                success_msg
-            )
-            return redirect(f"{reverse('adb_manager:index')}?msg={quote(success_msg)}")
+class DisconnectAllDevicesView(View):
+    """一键断开所有设备（后台线程池并发执行，立即返回任务ID）"""
+    def post(self, request):
+        devices = ADBDevice.objects.all()
+        return _start_bulk_operation(request, "disconnect_all", devices, "暂无设备，无需断开！")
+
 
+class DiscoverDevicesView(View):
+    """
+    扫描局域网网段，自动连接并登记开放 ADB 端口的设备（后台执行，立即返回任务ID）
+    POST 参数：networks（网段，逗号/换行分隔，如 192.168.3.0/24）、ports（端口，逗号分隔，默认 5555）
+    """
+    def post(self, request):
+        wants_json = request.headers.get("x-requested-with") == "XMLHttpRequest"
+        try:
+            user = request.user if request.user.is_authenticated else None
+            job_id = start_discovery(request.POST.get("networks", ""), request.POST.get("ports", ""), user=user)
+            success_msg = "已提交局域网扫描任务，扫描进度与登记结果将实时更新"
+            if wants_json:
+                return JsonResponse({"code": 200, "msg": success_msg, "data": {"job_id": job_id}})
+            return redirect(f"{reverse('adb_manager:index')}?msg={quote(success_msg)}&job_id={job_id}")
+        except ValueError as e:
+            error_msg = f"参数错误：{str(e)}"
+            if wants_json:
+                return JsonResponse({"code": 400, "msg": error_msg, "data": None})
+            return redirect(f"{reverse('adb_manager:index')}?msg={quote(error_msg)}")
         except Exception as e:
-            logger.error(f"一键连接全部设备失败：{str(e)}", exc_info=True)
-            error_msg = f"一键连接失败：{str(e)}"
-            log_device_operation(
-                request, None, 'connect_all', False,
-                error_msg
-            )
+            logger.error(f"提交局域网扫描任务失败：{str(e)}", exc_info=True)
+            error_msg = f"局域网扫描失败：{str(e)}"
+            if wants_json:
+                return JsonResponse({"code": 500, "msg": error_msg, "data": None})
             return redirect(f"{reverse('adb_manager:index')}?msg={quote(error_msg)}")
 
 
-class DisconnectAllDevicesView(View):
-    """一键断开所有设备（添加日志记录）"""
+class ImportDevicesView(View):
+    """
+    CSV批量导入设备（一次校验、一次去重查询、bulk_create 批量写入）
+    POST 参数：
+        file     CSV 文件（或 csv 字段直接提交文本）
+        verify   1 表示导入后并发连接新设备验证连通性（返回批量任务ID）
+        dry_run  1 表示只校验不写入
+    """
     def post(self, request):
+        wants_json = request.headers.get("x-requested-with") == "XMLHttpRequest"
+        upload = request.FILES.get("file")
+        content = upload.read() if upload else request.POST.get("csv", "")
+        if not content:
+            error_msg = "参数错误：请上传CSV文件"
+            if wants_json:
+                return JsonResponse({"code": 400, "msg": error_msg, "data": None})
+            return redirect(f"{reverse('adb_manager:index')}?msg={quote(error_msg)}")
+
         try:
-            devices = ADBDevice.objects.all()
-            if not devices.exists():
-                error_msg = quote("暂无设备，无需断开！")
-                log_device_operation(
-                    request, None, 'disconnect_all', True,
-                    "一键断开所有设备：暂无设备"
-                )
-                return redirect(f"{reverse('adb_manager:index')}?msg={error_msg}")
+            user = request.user if request.user.is_authenticated else None
+            result = import_devices(
+                content, user=user,
+                verify=request.POST.get("verify") in ("1", "true", "on"),
+                dry_run=request.POST.get("dry_run") in ("1", "true", "on"),
+            )
+        except ValueError as e:
+            error_msg = f"导入失败：{str(e)}"
+            if wants_json:
+                return JsonResponse({"code": 400, "msg": error_msg, "data": None})
+            return redirect(f"{reverse('adb_manager:index')}?msg={quote(error_msg)}")
+        except Exception as e:
+            logger.error(f"批量导入设备失败：{str(e)}", exc_info=True)
+            error_msg = f"导入失败：{str(e)}"
+            log_device_operation(request, None, 'add', False, error_msg)
+            if wants_json:
+                return JsonResponse({"code": 500, "msg": error_msg, "data": None})
+            return redirect(f"{reverse('adb_manager:index')}?msg={quote(error_msg)}")
+
+        success_msg = (f"导入完成：共{result['total']}行，新增{result['created']}台，"
+                       f"跳过{len(result['skipped'])}行，错误{len(result['errors'])}行")
+        if result["errors"]:
+            success_msg += "（错误行：" + "、".join(str(error["line"]) for error in result["errors"][:20]) + "）"
+        if result["created"]:
+            log_device_operation(request, None, 'add', True, f"CSV批量导入设备，{success_msg}")
+        if wants_json:
+            return JsonResponse({"code": 200, "msg": success_msg, "data": result})
+        job_param = f"&job_id={result['job_id']}" if result["job_id"] else ""
+        return redirect(f"{reverse('adb_manager:index')}?msg={quote(success_msg)}{job_param}")
 
-            adb_path = get_adb_path()
 
-            success_count = 0
-            fail_count = 0
-            result_logs = []
-
-            for device in devices:
-                connect_id = device.connect_identifier
-                if not connect_id:
-                    fail_count += 1
-                    result_logs.append(f"⚠️ {device.device_name}：未配置序列号/IP+端口")
-                    continue
-
-                try:
-                    if ":" in connect_id:
-                        cmd = [adb_path, "disconnect", connect_id]
-                    else:
-                        cmd = [adb_path, "-s", connect_id, "disconnect"]
-
-                    result = execute_adb_command(cmd, shell=False)
-
-                    if "disconnected" in result.stdout or result.returncode == 0:
-                        r.set(f"adb:device:{connect_id}", "offline")
-                        r.set(f"adb:device:{connect_id}:stdout", result.stdout)
-                        r.set(f"adb:device:{connect_id}:stderr", "")
-                        success_count += 1
-                        result_logs.append(f"✅ {connect_id}：断开成功")
-                    else:
-                        r.set(f"adb:device:{connect_id}", "error")
-                        r.set(f"adb:device:{connect_id}:stderr", result.stderr or result.stdout)
-                        fail_count += 1
-                        result_logs.append(f"❌ {connect_id}：断开失败 - {result.stderr or result.stdout}")
-
-                except Exception as e:
-                    logger.error(f"一键断开 - 设备{connect_id}异常：{str(e)}")
-                    r.set(f"adb:device:{connect_id}", "error")
-                    r.set(f"adb:device:{connect_id}:stderr", str(e))
-                    fail_count += 1
-                    result_logs.append(f"⚠️ {connect_id}：操作异常 - {str(e)}")
-
-            success_msg = f"一键断开完成！成功{success_count}台，失败{fail_count}台。详情：{' | '.join(result_logs)}"
+class FanOutShellView(View):
+    """
+    在多台设备上并发执行同一条 shell 命令（后台任务，立即返回任务ID）
+    POST 参数：
+        command    要执行的 shell 命令（必填）
+        device_ids 逗号分隔的设备ID；不传时按 selector 选择设备
+        selector   all（全部）/ active（启用的，默认）/ online（当前在线的）
+        q          按设备名称过滤（可选）
+        timeout    单台设备超时秒数（可选）
+    逐台结果推送到 ws/adb_bulk_job/<job_id>/，结束时推送成功/失败数、耗时分位数与输出分组
+    """
+    SELECTORS = ("all", "active", "online")
+
+    def post(self, request):
+        command = request.POST.get("command", "").strip()
+        if not command:
+            return JsonResponse({"code": 400, "msg": "参数错误：command不能为空", "data": None})
+
+        device_ids = [i.strip() for i in request.POST.get("device_ids", "").split(",") if i.strip()]
+        selector = request.POST.get("selector", "active")
+        if any(not i.isdigit() for i in device_ids):
+            return JsonResponse({"code": 400, "msg": "参数错误：device_ids必须为逗号分隔的数字", "data": None})
+        if not device_ids and selector not in self.SELECTORS:
+            return JsonResponse({"code": 400, "msg": f"参数错误：selector只能为{'/'.join(self.SELECTORS)}", "data": None})
+
+        timeout = request.POST.get("timeout", "")
+        if timeout and not timeout.isdigit():
+            return JsonResponse({"code": 400, "msg": "参数错误：timeout必须为数字", "data": None})
+        timeout = min(int(timeout or settings.ADB_FANOUT_DEVICE_TIMEOUT), settings.ADB_FANOUT_MAX_TIMEOUT)
+
+        try:
+            if device_ids:
+                devices = ADBDevice.objects.filter(id__in=device_ids)
+            elif selector == "all":
+                devices = ADBDevice.objects.all()
+            else:
+                devices = ADBDevice.objects.filter(is_active=True)
+            keyword = request.POST.get("q", "").strip()
+            if keyword:
+                devices = devices.filter(device_name__icontains=keyword)
+            devices = list(devices)
+            if not device_ids and selector == "online":
+                states = status_store.get_status_many(devices)
+                devices = [device for device in devices if states.get(device.connect_identifier) == "online"]
+            if not devices:
+                return JsonResponse({"code": 200, "msg": "没有符合条件的设备", "data": None})
+
+            user = request.user if request.user.is_authenticated else None
+            job_id = start_bulk_job("batch_shell", devices, user=user, params={"command": command}, timeout=timeout)
+            success_msg = f"已提交批量执行命令任务（共{len(devices)}台设备），结果将逐台实时更新"
             log_device_operation(
-                request, None, 'disconnect_all', True,
-                success_msg
+                request, None, "batch_shell", True,
+                f"{success_msg}，命令：{command}，任务ID：{job_id}"
             )
-            return redirect(f"{reverse('adb_manager:index')}?msg={quote(success_msg)}")
+            return JsonResponse({"code": 200, "msg": success_msg, "data": {"job_id": job_id, "total": len(devices)}})
+        except Exception as e:
+            logger.error(f"批量执行命令失败：{str(e)}", exc_info=True)
+            log_device_operation(request, None, "batch_shell", False, f"批量执行命令失败：{str(e)}")
+            return JsonResponse({"code": 500, "msg": f"批量执行命令失败：{str(e)}", "data": None})
+
 
+class BulkJobStatusView(View):
+    """查询批量任务（一键连接/断开、批量执行命令）的进度与逐台结果"""
+    def get(self, request, job_id):
+        try:
+            state = get_job_state(job_id)
         except Exception as e:
-            logger.error(f"一键断开全部设备失败：{str(e)}", exc_info=True)
-            error_msg = f"一键断开失败：{str(e)}"
-            log_device_operation(
-                request, None, 'disconnect_all', False,
-                error_msg
-            )
-            return redirect(f"{reverse('adb_manager:index')}?msg={quote(error_msg)}")
+            logger.error(f"查询批量任务失败：{str(e)}", exc_info=True)
+            return JsonResponse({"code": 500, "msg": f"查询失败：{str(e)}", "data": None})
+        if state is None:
+            return JsonResponse({"code": 404, "msg": "任务不存在或已过期", "data": None})
+        return JsonResponse({"code": 200, "msg": "查询成功", "data": state})
+
+
+class DeviceGovernorMetricsView(View):
+    """设备命令并发控制的排队指标"""
+    def get(self, request):
+        try:
+            return JsonResponse({"code": 200, "msg": "查询成功", "data": get_governor().metrics()})
+        except Exception as e:
+            logger.error(f"查询排队指标失败：{str(e)}", exc_info=True)
+            return JsonResponse({"code": 500, "msg": f"查询失败：{str(e)}", "data": {}})
+
+
+class OperationLogMetricsView(View):
+    """操作日志批量写入的指标（当前进程）：入队/写入/丢弃/失败条数、写入批次、队列长度"""
+    def get(self, request):
+        return JsonResponse({"code": 200, "msg": "查询成功", "data": get_operation_log_writer().metrics()})
 
 
 class CSRFTokenView(View):
@@ -777,7 +865,7 @@ class ADBDevicesListView(View):
 
 
 class ADBDeviceDetailView(View):
-    """获取指定设备的详细信息（保持不变）"""
+    """获取指定设备的详细信息（一次往返批量探测）"""
     def get(self, request):
         try:
             device_id = request.GET.get("device_id")
@@ -798,138 +886,8 @@ class ADBDeviceDetailView(View):
                     "data": {}
                 })
 
-            adb_path = get_adb_path()
-            default_timeout = int(os.getenv("ADB_COMMAND_TIMEOUT", 15))
-
-            # 定义需要执行的ADB命令列表
-            commands = {
-                "brand": [adb_path, "-s", connect_id, "shell", "getprop", "ro.product.brand"],  # 厂商
-                "model": [adb_path, "-s", connect_id, "shell", "getprop", "ro.product.model"],  # 型号
-                "system_version": [adb_path, "-s", connect_id, "shell", "getprop", "ro.build.version.release"],  # 系统版本
-                "serial": [adb_path, "-s", connect_id, "get-serialno"],  # 设备序列号
-                "battery": [adb_path, "-s", connect_id, "shell", "dumpsys", "battery"],  # 电池信息
-                "battery_level_backup": [adb_path, "-s", connect_id, "shell", "getprop", "status.battery.level"],
-                "battery_health_backup": [adb_path, "-s", connect_id, "shell", "getprop", "status.battery.health"],
-                "battery_status_backup": [adb_path, "-s", connect_id, "shell", "getprop", "status.battery.state"],
-                "wifi_ip": [adb_path, "-s", connect_id, "shell", "ip", "addr", "show", "wlan0"]  # WiFi IP
-            }
-
-            # 执行所有命令并解析结果
-            result_data = {
-                "device_name": device.device_name,
-                "connect_id": connect_id,
-                "brand": "",
-                "model": "",
-                "system_version": "",
-                "serial": "",
-                "battery_level": "",
-                "battery_health": "",
-                "battery_status": "",
-                "wifi_ip": "",
-                "raw_commands": {}  # 保存原始命令输出（用于调试）
-            }
-
-            # 执行每个命令
-            for cmd_key, cmd in commands.items():
-                try:
-                    result = execute_adb_command(cmd, shell=False, timeout=default_timeout)
-                    stdout = result.stdout.strip()
-                    stderr = result.stderr.strip()
-                    result_data["raw_commands"][cmd_key] = {"stdout": stdout, "stderr": stderr}
-
-                    # 解析不同命令的结果
-                    if cmd_key == "brand":
-                        result_data["brand"] = stdout or "未知"
-                    elif cmd_key == "model":
-                        result_data["model"] = stdout or "未知"
-                    elif cmd_key == "system_version":
-                        result_data["system_version"] = stdout or "未知"
-                    elif cmd_key == "serial":
-                        result_data["serial"] = stdout or "未知"
-                    elif cmd_key == "battery":
-                        # 解析电池信息
-                        battery_info = stdout
-                        if not battery_info:
-                            result_data["battery_level"] = "未知"
-                            result_data["battery_health"] = "未知"
-                            result_data["battery_status"] = "未知"
-                            continue
-
-                        try:
-                            # 正则匹配
-                            level_match = re.search(r"level:\s*(\d+)", battery_info, re.IGNORECASE)
-                            health_match = re.search(r"health:\s*(\d+|\w+)", battery_info, re.IGNORECASE)
-                            status_match = re.search(r"status:\s*(\d+|\w+)", battery_info, re.IGNORECASE)
-
-                            # 电量解析
-                            if level_match and level_match.group(1):
-                                result_data["battery_level"] = f"{level_match.group(1)}%"
-                            else:
-                                result_data["battery_level"] = "未知"
-
-                            # 健康度解析
-                            health_val = health_match.group(1).upper() if (health_match and health_match.group(1)) else ""
-                            health_num_map = {
-                                "1": "未知", "2": "良好", "3": "过热", "4": "损坏",
-                                "5": "过压", "6": "未知故障", "7": "过冷"
-                            }
-                            health_str_map = {
-                                "GOOD": "良好", "OVERHEAT": "过热", "DEAD": "损坏",
-                                "OVER_VOLTAGE": "过压", "UNSPECIFIED_FAILURE": "未知故障",
-                                "COLD": "过冷", "UNKNOWN": "未知"
-                            }
-                            result_data["battery_health"] = health_num_map.get(health_val,
-                                                                               health_str_map.get(health_val, "未知"))
-
-                            # 状态解析
-                            status_val = status_match.group(1).upper() if (status_match and status_match.group(1)) else ""
-                            status_num_map = {
-                                "1": "未知", "2": "充电中", "3": "放电中",
-                                "4": "未充电", "5": "已充满"
-                            }
-                            status_str_map = {
-                                "CHARGING": "充电中", "DISCHARGING": "放电中",
-                                "NOT_CHARGING": "未充电", "FULL": "已充满",
-                                "UNKNOWN": "未知", "CONNECTED": "已连接电源（未充电）"
-                            }
-                            result_data["battery_status"] = status_num_map.get(status_val,
-                                                                               status_str_map.get(status_val, "未知"))
-
-                        except Exception as e:
-                            logger.error(f"解析电池信息失败：{str(e)}")
-                            result_data["battery_level"] = "未知"
-                            result_data["battery_health"] = "未知"
-                            result_data["battery_status"] = "未知"
-                    # 备用电池信息解析
-                    elif cmd_key == "battery_level_backup":
-                        if not result_data["battery_level"] or result_data["battery_level"] == "未知":
-                            result_data["battery_level"] = f"{stdout}%" if stdout else "未知"
-                    elif cmd_key == "battery_health_backup":
-                        if not result_data["battery_health"] or result_data["battery_health"] == "未知":
-                            health_map = {"good": "良好", "bad": "损坏", "unknown": "未知"}
-                            result_data["battery_health"] = health_map.get(stdout.lower(), stdout or "未知")
-                    elif cmd_key == "battery_status_backup":
-                        if not result_data["battery_status"] or result_data["battery_status"] == "未知":
-                            status_map = {"charging": "充电中", "discharging": "放电中", "full": "已充满",
-                                          "not_charging": "未充电"}
-                            result_data["battery_status"] = status_map.get(stdout.lower(), stdout or "未知")
-                    elif cmd_key == "wifi_ip":
-                        # 解析WiFi IP
-                        ip_lines = stdout.splitlines()
-                        for line in ip_lines:
-                            if "inet " in line and not "127.0.0.1" in line:
-                                ip_part = line.split("inet ")[1].split("/")[0].strip()
-                                result_data["wifi_ip"] = ip_part
-                                break
-                        if not result_data["wifi_ip"]:
-                            result_data["wifi_ip"] = "未连接WiFi/无IP"
-
-                except subprocess.TimeoutExpired:
-                    result_data["raw_commands"][cmd_key] = {"stdout": "", "stderr": "命令执行超时"}
-                    logger.error(f"设备{connect_id}执行{cmd_key}命令超时")
-                except Exception as e:
-                    result_data["raw_commands"][cmd_key] = {"stdout": "", "stderr": str(e)}
-                    logger.error(f"设备{connect_id}执行{cmd_key}命令失败：{str(e)}")
+            # 一次 adb shell 获取 getprop / 电池 / WiFi IP，统一解析
+            result_data = probe_device(device)
 
             return JsonResponse({
                 "code": 200,
@@ -952,6 +910,27 @@ class ADBDeviceDetailView(View):
             })
 
 
+class ADBDevicesDetailView(View):
+    """并发获取所有在线设备的详细信息"""
+    def get(self, request):
+        try:
+            devices = [d for d in ADBDevice.objects.filter(is_active=True) if d.connect_identifier]
+            statuses = status_store.get_status_many(devices)
+            online_devices = [d for d in devices if statuses.get(d.connect_identifier) == "online"]
+            return JsonResponse({
+                "code": 200,
+                "msg": f"获取{len(online_devices)}台在线设备详情成功",
+                "data": probe_devices(online_devices)
+            })
+        except Exception as e:
+            logger.error(f"批量获取设备详情失败：{str(e)}", exc_info=True)
+            return JsonResponse({
+                "code": 500,
+                "msg": f"获取失败：{str(e)}",
+                "data": []
+            })
+
+
 class ADBDeviceEnableWirelessView(View):
     """开启设备无线ADB功能（添加日志记录）"""
     def post(self, request):
@@ -972,7 +951,7 @@ class ADBDeviceEnableWirelessView(View):
                 return redirect(f"{reverse('adb_manager:index')}?msg={error_msg}")
 
             # 检查设备是否在线
-            status = r.get(f"adb:device:{connect_id}") or "offline"
+            status = status_store.get_status(connect_id)
             if status != "online":
                 error_msg = quote(f"设备{connect_id}当前不在线，无法开启无线ADB")
                 log_device_operation(
@@ -1031,8 +1010,7 @@ class ADBDeviceEnableWirelessView(View):
             ]
             if any(kw in result.stdout for kw in success_keywords) or result.returncode == 0:
                 # 更新Redis状态
-                r.set(f"adb:device:{connect_id}:stdout", result.stdout or f"设备{connect_id}开启无线ADB成功")
-                r.set(f"adb:device:{connect_id}:stderr", "")
+                status_store.set(connect_id, stdout=result.stdout or f"设备{connect_id}开启无线ADB成功", stderr="")
 
                 # 根据数据库检查结果决定是否保存
                 if need_save:
@@ -1051,7 +1029,7 @@ class ADBDeviceEnableWirelessView(View):
                 )
             else:
                 # 端口操作失败
-                r.set(f"adb:device:{connect_id}:stderr", result.stderr or result.stdout or "开启无线ADB失败")
+                status_store.set(connect_id, stderr=result.stderr or result.stdout or "开启无线ADB失败")
                 success_msg = f"设备{connect_id}开启无线ADB失败：{result.stderr or result.stdout}"
                 log_device_operation(
                     request, device, 'enable_wireless', False,
@@ -1146,13 +1124,26 @@ class ADBOperationLogView(View):
 
 # ===================== 新增：文件管理视图 =====================
 class ADBDeviceListDirView(View):
-    """列出设备指定目录"""
+    """
+    列出设备指定目录（解析结果短期缓存，服务端过滤/排序/分页）
+    POST 参数：device_id、path、q（名称过滤）、sort（name/size/date）、order（asc/desc）、
+             page、page_size、refresh=1（跳过缓存）、sizes=1（附带子目录递归大小）
+    """
     def post(self, request):
         try:
             device_id = request.POST.get("device_id")
-            path = request.POST.get("path", "/sdcard/").strip()
+            path = request.POST.get("path", "/sdcard/").strip() or "/sdcard/"
             if not device_id or not device_id.isdigit():
                 return JsonResponse({"code": 400, "msg": "参数错误：device_id必须为数字", "data": {}})
+            sort = request.POST.get("sort", "name")
+            order = request.POST.get("order", "asc")
+            if sort not in SORT_FIELDS or order not in ("asc", "desc"):
+                return JsonResponse({"code": 400, "msg": "参数错误：sort/order取值无效", "data": {}})
+            page = request.POST.get("page", "1")
+            page_size = request.POST.get("page_size", str(settings.ADB_DIR_PAGE_SIZE))
+            if not page.isdigit() or not page_size.isdigit() or int(page) < 1 or int(page_size) < 1:
+                return JsonResponse({"code": 400, "msg": "参数错误：page/page_size必须为正整数", "data": {}})
+            page, page_size = int(page), min(int(page_size), settings.ADB_DIR_PAGE_SIZE_MAX)
 
             device = get_object_or_404(ADBDevice, id=device_id)
             connect_id = device.connect_identifier
@@ -1160,54 +1151,42 @@ class ADBDeviceListDirView(View):
                 return JsonResponse({"code": 400, "msg": "设备未配置序列号/IP+端口", "data": {}})
 
             # 检查设备状态
-            status = r.get(f"adb:device:{connect_id}") or "offline"
+            status = status_store.get_status(connect_id)
             if status != "online":
                 return JsonResponse({"code": 400, "msg": "设备不在线", "data": {}})
 
-            adb_path = get_adb_path()
-            cmd = [adb_path, "-s", connect_id, "shell", "ls", "-la", path]
-            result = execute_adb_command(cmd, shell=False)
-
-            if result.returncode == 0:
-                # 解析ls -la的输出
-                lines = result.stdout.strip().splitlines()
-                file_list = []
-                # 跳过第一行（total ...）
-                for line in lines[1:]:
-                    parts = line.split(maxsplit=8)
-                    if len(parts) >= 9:
-                        permissions = parts[0]
-                        links = parts[1]
-                        owner = parts[2]
-                        group = parts[3]
-                        size = parts[4]
-                        date = f"{parts[5]} {parts[6]} {parts[7]}"
-                        name = parts[8]
-                        is_dir = permissions.startswith('d')
-                        file_list.append({
-                            "name": name,
-                            "is_dir": is_dir,
-                            "permissions": permissions,
-                            "size": size,
-                            "date": date,
-                            "owner": owner,
-                            "group": group
-                        })
-                return JsonResponse({
-                    "code": 200,
-                    "msg": "获取成功",
-                    "data": {
-                        "path": path,
-                        "files": file_list,
-                        "raw_output": result.stdout
-                    }
-                })
-            else:
-                return JsonResponse({
-                    "code": 500,
-                    "msg": f"执行失败：{result.stderr or result.stdout}",
-                    "data": {}
-                })
+            index = get_directory_index()
+            refresh = request.POST.get("refresh") == "1"
+            try:
+                entries, cached_at, from_cache = index.listing(connect_id, path, refresh=refresh)
+            except RuntimeError as e:
+                return JsonResponse({"code": 500, "msg": f"执行失败：{str(e)}", "data": {}})
+
+            sweep = None
+            if request.POST.get("sizes") == "1":
+                sweep = index.sweep(connect_id, path, refresh=refresh)
+                entries = [
+                    {**entry, "tree_size": sweep["children"].get(entry["name"], 0)} if entry["is_dir"] else entry
+                    for entry in entries
+                ]
+
+            entries = query_entries(entries, request.POST.get("q", "").strip(), sort, order)
+            total = len(entries)
+            offset = (page - 1) * page_size
+            data = {
+                "path": path,
+                "files": entries[offset:offset + page_size],
+                "total": total,
+                "page": page,
+                "page_size": page_size,
+                "pages": (total + page_size - 1) // page_size,
+                "cached": from_cache,
+                "cached_at": cached_at,
+            }
+            if sweep is not None:
+                data["total_size"] = sweep["total_size"]
+                data["file_count"] = sweep["file_count"]
+            return JsonResponse({"code": 200, "msg": "获取成功", "data": data})
         except Exception as e:
             logger.error(f"列出目录失败：{str(e)}", exc_info=True)
             return JsonResponse({
@@ -1233,7 +1212,7 @@ class ADBDeviceCreateDirView(View):
             if not connect_id:
                 return JsonResponse({"code": 400, "msg": "设备未配置序列号/IP+端口", "data": {}})
 
-            status = r.get(f"adb:device:{connect_id}") or "offline"
+            status = status_store.get_status(connect_id)
             if status != "online":
                 return JsonResponse({"code": 400, "msg": "设备不在线", "data": {}})
 
@@ -1242,6 +1221,7 @@ class ADBDeviceCreateDirView(View):
             result = execute_adb_command(cmd, shell=False)
 
             if result.returncode == 0:
+                get_directory_index().invalidate(connect_id, path)
                 log_device_operation(
                     request, device, 'create_dir', True,
                     f"创建文件夹：{path}"
@@ -1286,7 +1266,7 @@ class ADBDeviceDeleteFileView(View):
             if not connect_id:
                 return JsonResponse({"code": 400, "msg": "设备未配置序列号/IP+端口", "data": {}})
 
-            status = r.get(f"adb:device:{connect_id}") or "offline"
+            status = status_store.get_status(connect_id)
             if status != "online":
                 return JsonResponse({"code": 400, "msg": "设备不在线", "data": {}})
 
@@ -1295,6 +1275,7 @@ class ADBDeviceDeleteFileView(View):
             result = execute_adb_command(cmd, shell=False)
 
             if result.returncode == 0:
+                get_directory_index().invalidate(connect_id, path)
                 log_device_operation(
                     request, device, 'delete_file', True,
                     f"删除：{path}"
@@ -1323,6 +1304,159 @@ class ADBDeviceDeleteFileView(View):
             })
 
 
+class ADBDevicePullFileView(View):
+    """
+    下载设备文件（流式传输，支持 Range 续传）
+    GET 参数：device_id、path（可传多个；传多个或传目录时打包为 tar 流下载）
+    """
+    def get(self, request):
+        device_id = request.GET.get("device_id", "")
+        paths = [path.strip() for path in request.GET.getlist("path") if path.strip()]
+        if not device_id.isdigit():
+            return JsonResponse({"code": 400, "msg": "参数错误：device_id必须为数字", "data": {}})
+        if not paths:
+            return JsonResponse({"code": 400, "msg": "路径不能为空", "data": {}})
+
+        device = get_object_or_404(ADBDevice, id=device_id)
+        connect_id = device.connect_identifier
+        if not connect_id:
+            return JsonResponse({"code": 400, "msg": "设备未配置序列号/IP+端口", "data": {}})
+        if status_store.get_status(connect_id) != "online":
+            return JsonResponse({"code": 400, "msg": "设备不在线", "data": {}})
+
+        try:
+            info = stat_file(connect_id, paths[0]) if len(paths) == 1 else None
+            if len(paths) == 1 and info is None:
+                return JsonResponse({"code": 404, "msg": f"文件不存在：{paths[0]}", "data": {}})
+            if info is not None and not info["is_dir"]:
+                return self._file_response(request, connect_id, paths[0], info)
+
+            entries = list_files(connect_id, paths)
+            # 打包目录或多个文件：文件名相对于公共父目录
+            base_dir = posixpath.dirname(posixpath.commonpath([path.rstrip("/") or "/" for path in paths]))
+            release = hold_device_slot(connect_id)
+            response = StreamingHttpResponse(
+                release_after(iter_tar(connect_id, entries, base_dir), release),
+                content_type="application/x-tar"
+            )
+            name = posixpath.basename(paths[0].rstrip("/")) if len(paths) == 1 else device.device_name
+            response["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(name or 'files')}.tar"
+            logger.info(f"设备{connect_id}打包下载：{paths}，共{len(entries)}个文件")
+            return response
+        except Exception as e:
+            logger.error(f"下载文件失败：{str(e)}", exc_info=True)
+            return JsonResponse({"code": 500, "msg": f"下载失败：{str(e)}", "data": {}})
+
+    @staticmethod
+    def _file_response(request, connect_id, path, info):
+        size = info["size"]
+        try:
+            byte_range = parse_range(request.headers.get("Range"), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+        start, end = byte_range or (0, size - 1)
+        release = hold_device_slot(connect_id)
+        response = StreamingHttpResponse(
+            release_after(iter_file(connect_id, path, start=start, length=end - start + 1), release),
+            status=206 if byte_range else 200,
+            content_type="application/octet-stream"
+        )
+        response["Content-Length"] = str(max(end - start + 1, 0))
+        response["Accept-Ranges"] = "bytes"
+        response["Last-Modified"] = http_date(info["mtime"])
+        if byte_range:
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(posixpath.basename(path))}"
+        return response
+
+
+class ADBDevicePushFileView(View):
+    """
+    上传文件到设备（请求体按块写入设备，不在内存中缓冲整个文件）
+    POST ?device_id=&path=<设备上的目标文件路径>
+    请求体为文件原始内容（application/octet-stream）；也兼容 multipart 表单的 file 字段
+    """
+    def post(self, request):
+        device_id = request.GET.get("device_id", "")
+        path = request.GET.get("path", "").strip()
+        if not device_id.isdigit():
+            return JsonResponse({"code": 400, "msg": "参数错误：device_id必须为数字", "data": {}})
+        if not path or path.endswith("/"):
+            return JsonResponse({"code": 400, "msg": "目标路径不能为空且必须为文件路径", "data": {}})
+
+        device = get_object_or_404(ADBDevice, id=device_id)
+        connect_id = device.connect_identifier
+        if not connect_id:
+            return JsonResponse({"code": 400, "msg": "设备未配置序列号/IP+端口", "data": {}})
+        if status_store.get_status(connect_id) != "online":
+            return JsonResponse({"code": 400, "msg": "设备不在线", "data": {}})
+
+        try:
+            if request.content_type == "multipart/form-data":
+                upload = request.FILES.get("file")
+                if upload is None:
+                    return JsonResponse({"code": 400, "msg": "未上传文件", "data": {}})
+                chunks = upload.chunks(TRANSFER_CHUNK_SIZE)
+            else:
+                chunks = iter(lambda: request.read(TRANSFER_CHUNK_SIZE), b"")
+
+            release = hold_device_slot(connect_id)
+            try:
+                size = push_file(connect_id, path, chunks)
+            finally:
+                release()
+            get_directory_index().invalidate(connect_id, path)
+            log_device_operation(request, device, 'push_file', True, f"上传文件：{path}（{size}字节）")
+            return JsonResponse({"code": 200, "msg": "上传成功", "data": {"path": path, "size": size}})
+        except Exception as e:
+            logger.error(f"上传文件失败：{str(e)}", exc_info=True)
+            log_device_operation(request, device, 'push_file', False, f"上传文件失败：{path}，错误：{str(e)}")
+            return JsonResponse({"code": 500, "msg": f"上传失败：{str(e)}", "data": {}})
+
+
+class ADBDeviceScreenStreamView(View):
+    """
+    设备屏幕实时画面（MJPEG，multipart/x-mixed-replace，可直接作为 <img> 的 src）
+    GET 参数：device_id、fps（不超过 ADB_SCREEN_MAX_FPS）
+    需要以 ASGI 方式运行（daphne/uvicorn），同一台设备的观看者共享一个截图循环
+    """
+    BOUNDARY = "easyadbframe"
+
+    async def get(self, request):
+        device_id = request.GET.get("device_id", "")
+        if not device_id.isdigit():
+            return JsonResponse({"code": 400, "msg": "参数错误：device_id必须为数字", "data": {}})
+        device = await sync_to_async(ADBDevice.objects.filter(id=device_id).first)()
+        if device is None or not device.connect_identifier:
+            return JsonResponse({"code": 404, "msg": "设备不存在或未配置序列号/IP+端口", "data": {}})
+        connect_id = device.connect_identifier
+        if await sync_to_async(status_store.get_status)(connect_id) != "online":
+            return JsonResponse({"code": 400, "msg": "设备不在线", "data": {}})
+
+        async def stream():
+            frames = iter_frames(connect_id, request.GET.get("fps"))
+            try:
+                async for frame, content_type in frames:
+                    yield (f"--{self.BOUNDARY}\r\nContent-Type: {content_type}\r\n"
+                           f"Content-Length: {len(frame)}\r\n\r\n").encode() + frame + b"\r\n"
+            finally:
+                # 客户端断开时立即退出观看（最后一个观看者离开后截图循环停止）
+                await frames.aclose()
+
+        response = StreamingHttpResponse(stream(), content_type=f"multipart/x-mixed-replace; boundary={self.BOUNDARY}")
+        response["Cache-Control"] = "no-cache"
+        return response
+
+
+class ScreenStreamMetricsView(View):
+    """当前进程内各设备截图循环的观看人数、帧数、丢帧数"""
+    def get(self, request):
+        return JsonResponse({"code": 200, "msg": "查询成功", "data": screen_hub.metrics()})
+
+
 # ===================== 新增：应用管理视图 =====================
 class ADBDeviceListAppsView(View):
     """获取设备已安装应用列表（带Redis缓存）"""
@@ -1342,7 +1476,7 @@ class ADBDeviceListAppsView(View):
                 return JsonResponse({"code": 400, "msg": "设备未配置序列号/IP+端口", "data": {}})
 
             # 检查设备状态
-            status = r.get(f"adb:device:{connect_id}") or "offline"
+            status = status_store.get_status(connect_id)
             if status != "online":
                 return JsonResponse({"code": 400, "msg": "设备不在线", "data": {}})
 
@@ -1353,7 +1487,7 @@ class ADBDeviceListAppsView(View):
 
             # 1. 尝试从 Redis 获取缓存 (如果不是强制刷新)
             if not force_refresh:
-                cached_data = r.get(cache_key)
+                cached_data = get_redis_client().get(cache_key)
                 if cached_data:
                     try:
                         import json
@@ -1374,83 +1508,21 @@ class ADBDeviceListAppsView(View):
                 logger.info(f"强制刷新应用列表：{connect_id}")
             # ===================== 缓存逻辑结束 =====================
 
-            adb_path = get_adb_path()
-
-            # 1. 获取所有第三方应用包名
-            cmd_packages = [adb_path, "-s", connect_id, "shell", "pm", "list", "packages", "-3"]
-            result_packages = execute_adb_command(cmd_packages, shell=False)
-
-            if result_packages.returncode != 0:
+            # 一次 adb shell 获取包列表（含版本号）与全部启动Activity，应用名按包增量解析
+            collector = AppInventoryCollector(connect_id, status_store.client, execute_adb_command, get_adb_path())
+            try:
+                app_list, stats = collector.collect()
+            except RuntimeError as e:
                 return JsonResponse({
                     "code": 500,
-                    "msg": f"获取应用列表失败：{result_packages.stderr or result_packages.stdout}",
+                    "msg": f"获取应用列表失败：{str(e)}",
                     "data": {}
                 })
 
-            # 解析包名
-            package_lines = result_packages.stdout.strip().splitlines()
-            packages = []
-            for line in package_lines:
-                if line.startswith("package:"):
-                    packages.append(line.split(":", 1)[1].strip())
-
-            app_list = []
-            for package_name in packages:
-                try:
-                    # 2. 获取应用名称
-                    cmd_label = [adb_path, "-s", connect_id, "shell", "dumpsys", "package", package_name]
-                    result_label = execute_adb_command(cmd_label, shell=False, timeout=5)
-
-                    app_name = package_name
-                    if result_label.returncode == 0:
-                        # 尝试从dumpsys输出中解析应用名
-                        label_match = re.search(r"ApplicationInfo.*labelRes=0x[0-9a-f]+ nonLocalizedLabel=\"([^\"]+)\"",
-                                                result_label.stdout)
-                        if label_match:
-                            app_name = label_match.group(1)
-                        else:
-                            # 备选方案：使用pm dump
-                            alt_match = re.search(r"package=" + re.escape(package_name) + r".*?label=\"([^\"]+)\"",
-                                                  result_label.stdout, re.DOTALL)
-                            if alt_match:
-                                app_name = alt_match.group(1)
-
-                    # 3. 获取启动Activity
-                    cmd_launcher = [adb_path, "-s", connect_id, "shell", "cmd", "package", "resolve-activity",
-                                    "--brief", package_name]
-                    result_launcher = execute_adb_command(cmd_launcher, shell=False, timeout=5)
-
-                    launcher_activity = ""
-                    if result_launcher.returncode == 0:
-                        lines = result_launcher.stdout.strip().splitlines()
-                        if len(lines) > 1:
-                            full_component = lines[1].strip()
-                            if "/" in full_component:
-                                activity_part = full_component.split("/", 1)[1]
-                                launcher_activity = activity_part
-                            else:
-                                launcher_activity = full_component
-
-                    app_list.append({
-                        "package_name": package_name,
-                        "app_name": app_name,
-                        "launcher_activity": launcher_activity
-                    })
-                except Exception as e:
-                    logger.warning(f"获取应用 {package_name} 信息失败：{str(e)}")
-                    app_list.append({
-                        "package_name": package_name,
-                        "app_name": package_name,
-                        "launcher_activity": ""
-                    })
-
-            # 按应用名排序
-            app_list.sort(key=lambda x: x["app_name"].lower())
-
             # ===================== 写入缓存 =====================
             try:
                 import json
-                r.setex(cache_key, CACHE_EXPIRE, json.dumps(app_list))
+                get_redis_client().setex(cache_key, CACHE_EXPIRE, json.dumps(app_list))
                 # 【修复】这里的 connect_key 改为 connect_id
                 logger.info(f"已更新应用列表缓存：{connect_id}，过期时间：{CACHE_EXPIRE}秒")
             except Exception as e:
@@ -1494,7 +1566,7 @@ class ADBDeviceLaunchAppView(View):
             if not connect_id:
                 return JsonResponse({"code": 400, "msg": "设备未配置序列号/IP+端口", "data": {}})
 
-            status = r.get(f"adb:device:{connect_id}") or "offline"
+            status = status_store.get_status(connect_id)
             if status != "online":
                 return JsonResponse({"code": 400, "msg": "设备不在线", "data": {}})
 
@@ -1584,7 +1656,7 @@ class ADBDeviceStopAppView(View):
             if not connect_id:
                 return JsonResponse({"code": 400, "msg": "设备未配置序列号/IP+端口", "data": {}})
 
-            status = r.get(f"adb:device:{connect_id}") or "offline"
+            status = status_store.get_status(connect_id)
             if status != "online":
                 return JsonResponse({"code": 400, "msg": "设备不在线", "data": {}})
 
@@ -1639,7 +1711,7 @@ class ADBDeviceClearAppDataView(View):
             if not connect_id:
                 return JsonResponse({"code": 400, "msg": "设备未配置序列号/IP+端口", "data": {}})
 
-            status = r.get(f"adb:device:{connect_id}") or "offline"
+            status = status_store.get_status(connect_id)
             if status != "online":
                 return JsonResponse({"code": 400, "msg": "设备不在线", "data": {}})
 
@@ -0,0 +1,387 @@
+"""执行输出的追加式存储（脚本执行日志、编排日志、步骤日志共用）
+
+日志记录只保存输出位置（output_ref）与字节数/行数，输出内容按块追加到存储中，
+追加的开销与已有日志长度无关；读取时按块迭代，可从任意字节偏移开始。
+
+两种后端（EXEC_LOG_BACKEND，创建日志时选择，写入 output_ref 前缀）：
+- file：本地磁盘追加写分段文件 EXEC_LOG_ROOT/<kind>/<id>/<stdout|stderr>.<序号>.log，
+        单个分段超过 EXEC_LOG_SEGMENT_BYTES 后写入下一个分段；
+- redis：运行期间写入 Redis Stream（EXEC_LOG_REDIS_PREFIX<kind>/<id>:<stream>），
+         执行结束时压缩（compact）到与 file 后端相同的分段文件，并删除已转存的条目；
+         未压缩的 Stream 在最后一次追加 EXEC_LOG_REDIS_TTL 秒后过期（执行进程异常退出的日志）。
+redis 后端读取时先读磁盘分段、再读 Stream 中尚未压缩的部分（按压缩标记对齐，读取期间压缩也不会遗漏或重复）；
+Redis 不可用时新日志自动使用 file 后端。
+"""
+import codecs
+import logging
+import os
+import shutil
+import threading
+
+import redis
+from django.conf import settings
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+STREAMS = ("stdout", "stderr")
+# 读取分段文件的块大小（字节）
+READ_CHUNK_BYTES = 64 * 1024
+# Redis Stream 每次读取的条目数
+STREAM_BATCH = 500
+
+
+def split_ref(ref):
+    """output_ref -> (backend, key)，如 "file:script/12" -> ("file", "script/12")"""
+    backend, _, key = (ref or "").partition(":")
+    return backend, key
+
+
+# ===================== 磁盘分段文件 =====================
+class FileChunkStore:
+    """追加写分段文件（同一日志可由多个进程追加，每次追加都重新确认当前分段）"""
+    name = "file"
+
+    def __init__(self, root, segment_bytes=4 * 1024 * 1024):
+        self.root = str(root)
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        # (key, stream) -> 当前分段序号；只是提示，追加前会检查是否已有更新的分段
+        self._tails = {}
+
+    def _dir(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def _path(self, key, stream, index):
+        return os.path.join(self._dir(key), f"{stream}.{index:04d}.log")
+
+    def _segments(self, key, stream):
+        """按顺序返回已有分段路径"""
+        try:
+            names = os.listdir(self._dir(key))
+        except FileNotFoundError:
+            return []
+        prefix = f"{stream}."
+        return [os.path.join(self._dir(key), name) for name in sorted(names)
+                if name.startswith(prefix) and name.endswith(".log")]
+
+    def append(self, key, stream, data):
+        """追加一块输出（str 或 bytes），返回写入的字节数"""
+        if isinstance(data, str):
+            data = data.encode("utf-8", errors="replace")
+        if not data:
+            return 0
+        with self.lock:
+            index = self._tails.get((key, stream))
+            if index is None or os.path.exists(self._path(key, stream, index + 1)):
+                # 首次写入或其他进程已切换到新分段
+                index = max(len(self._segments(key, stream)) - 1, 0)
+            path = self._path(key, stream, index)
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                os.makedirs(self._dir(key), exist_ok=True)
+                size = 0
+            if size and size + len(data) > self.segment_bytes:
+                index += 1
+                path = self._path(key, stream, index)
+            with open(path, "ab") as f:
+                f.write(data)
+            self._tails[(key, stream)] = index
+        return len(data)
+
+    def size(self, key, stream):
+        return sum(os.path.getsize(path) for path in self._segments(key, stream))
+
+    def iter_chunks(self, key, stream, since=0, end=None):
+        """从字节偏移 since 开始按块迭代原始字节（指定 end 时只读到 end 之前）"""
+        offset = 0
+        for path in self._segments(key, stream):
+            if end is not None and offset >= end:
+                return
+            size = os.path.getsize(path)
+            if offset + size <= since:
+                offset += size
+                continue
+            remaining = None if end is None else end - max(since, offset)
+            with open(path, "rb") as f:
+                if since > offset:
+                    f.seek(since - offset)
+                while True:
+                    block = f.read(READ_CHUNK_BYTES if remaining is None else min(READ_CHUNK_BYTES, remaining))
+                    if not block:
+                        break
+                    if remaining is not None:
+                        remaining -= len(block)
+                    yield block
+            offset += size
+
+    def truncate(self, key, stream, size):
+        """截断到 size 字节（删除之后的内容与分段）"""
+        with self.lock:
+            offset = 0
+            for path in self._segments(key, stream):
+                length = os.path.getsize(path)
+                if offset + length > size:
+                    if size > offset:
+                        os.truncate(path, size - offset)
+                    else:
+                        os.remove(path)
+                offset += length
+            self._tails.pop((key, stream), None)
+
+    def release(self, key):
+        with self.lock:
+            for stream in STREAMS:
+                self._tails.pop((key, stream), None)
+
+    def delete(self, key):
+        self.release(key)
+        shutil.rmtree(self._dir(key), ignore_errors=True)
+
+
+# ===================== Redis Stream =====================
+# Stream 为空时删除（与 XADD 互斥，不会删掉刚追加的条目）
+_DELETE_IF_EMPTY = """
+if redis.call('XLEN', KEYS[1]) == 0 then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisStreamStore:
+    """
+    运行中日志写入 Redis Stream，结束后压缩到磁盘分段文件
+    压缩每转存一批条目，都在同一个事务中删除这些条目并更新压缩标记（<stream>:compacted =
+    "最后转存的条目ID 转存后的磁盘字节数"），读取方据此把磁盘内容与 Stream 条目对齐。
+    Stream 与标记每次追加都续期 ttl 秒：执行进程异常退出、从未压缩的日志不会永久留在 Redis 中。
+    """
+    name = "redis"
+
+    def __init__(self, client, files, prefix="execlog:", ttl=7 * 24 * 3600):
+        self.client = client
+        self.files = files
+        self.prefix = prefix
+        self.ttl = ttl
+        self._delete_if_empty = client.register_script(_DELETE_IF_EMPTY)
+
+    def _stream(self, key, stream):
+        return f"{self.prefix}{key}:{stream}"
+
+    def _marker(self, key, stream):
+        return f"{self._stream(key, stream)}:compacted"
+
+    @staticmethod
+    def _parse_marker(marker):
+        """压缩标记 -> (最后转存的条目ID, 转存后的磁盘字节数)"""
+        entry_id, _, size = (marker or "").partition(" ")
+        return (entry_id or "0-0"), int(size or 0)
+
+    def append(self, key, stream, data):
+        if isinstance(data, bytes):
+            data = data.decode("utf-8", errors="replace")
+        if not data:
+            return 0
+        pipe = self.client.pipeline(transaction=False)
+        pipe.xadd(self._stream(key, stream), {"d": data})
+        pipe.expire(self._stream(key, stream), self.ttl)
+        pipe.expire(self._marker(key, stream), self.ttl)
+        pipe.execute()
+        return len(data.encode("utf-8", errors="replace"))
+
+    def _iter_entries(self, key, stream):
+        """按顺序迭代 (entry_id, 文本)；Redis 不可用时只记录警告"""
+        start = "-"
+        try:
+            while True:
+                entries = self.client.xrange(self._stream(key, stream), min=start, count=STREAM_BATCH)
+                if not entries:
+                    return
+                for entry_id, fields in entries:
+                    yield entry_id, fields.get("d", "")
+                if len(entries) < STREAM_BATCH:
+                    return
+                start = f"({entries[-1][0]}"
+        except redis.RedisError as e:
+            logger.warning(f"读取日志Stream {key}:{stream} 失败：{str(e)}")
+
+    def iter_chunks(self, key, stream, since=0):
+        """
+        先读已压缩到磁盘的部分，再读 Stream 中的新条目
+        每批条目与压缩标记在同一个事务中读取：读取期间发生压缩时，从磁盘补读被转存的部分，不会遗漏或重复
+        """
+        offset, last_id = 0, "0-0"
+        while True:
+            pipe = self.client.pipeline(transaction=True)
+            pipe.get(self._marker(key, stream))
+            pipe.xrange(self._stream(key, stream), min=f"({last_id}", count=STREAM_BATCH)
+            try:
+                marker, entries = pipe.execute()
+            except redis.RedisError as e:
+                logger.warning(f"读取日志Stream {key}:{stream} 失败：{str(e)}")
+                return
+            if marker is None and not entries:
+                # 从未写入 Stream，或已全部压缩且标记已过期：剩余内容都在磁盘上
+                yield from self.files.iter_chunks(key, stream, max(since, offset))
+                return
+            compacted_id, compacted_bytes = self._parse_marker(marker)
+            if compacted_bytes > offset:
+                # 已读位置之后的条目已转存到磁盘
+                yield from self.files.iter_chunks(key, stream, max(since, offset), compacted_bytes)
+                offset, last_id = compacted_bytes, compacted_id
+            for entry_id, fields in entries:
+                data = fields.get("d", "").encode("utf-8", errors="replace")
+                if offset + len(data) > since:
+                    yield data[max(since - offset, 0):]
+                offset += len(data)
+                last_id = entry_id
+            if len(entries) < STREAM_BATCH:
+                return
+
+    def compact(self, key):
+        """把 Stream 中的条目转存到磁盘分段文件（同一日志同时只有一个进程压缩）"""
+        lock_key = f"{self.prefix}lock:{key}"
+        if not self.client.set(lock_key, "1", nx=True, ex=300):
+            return False
+        try:
+            for stream in STREAMS:
+                marker = self.client.get(self._marker(key, stream))
+                if marker is None:
+                    compacted = self.files.size(key, stream)
+                else:
+                    compacted = self._parse_marker(marker)[1]
+                    if self.files.size(key, stream) > compacted:
+                        # 上次压缩在写入磁盘后、删除条目前中断：去掉未记录的部分，避免重复
+                        self.files.truncate(key, stream, compacted)
+                moved, buffer = [], []
+                for entry_id, text in self._iter_entries(key, stream):
+                    moved.append(entry_id)
+                    buffer.append(text)
+                    if len(moved) >= STREAM_BATCH:
+                        compacted = self._move(key, stream, moved, buffer, compacted)
+                        moved, buffer = [], []
+                if moved:
+                    compacted = self._move(key, stream, moved, buffer, compacted)
+                # 标记保留到过期：压缩完成后仍在读取的一方需要用它对齐磁盘内容
+                self._delete_if_empty(keys=[self._stream(key, stream)])
+            self.files.release(key)
+            return True
+        finally:
+            self.client.delete(lock_key)
+
+    def _move(self, key, stream, entry_ids, texts, compacted):
+        """转存一批条目，返回转存后的磁盘字节数"""
+        data = "".join(texts)
+        self.files.append(key, stream, data)
+        compacted += len(data.encode("utf-8", errors="replace"))
+        pipe = self.client.pipeline(transaction=True)
+        pipe.xdel(self._stream(key, stream), *entry_ids)
+        pipe.set(self._marker(key, stream), f"{entry_ids[-1]} {compacted}", ex=self.ttl)
+        pipe.execute()
+        return compacted
+
+    def delete(self, key):
+        self.files.delete(key)
+        self.client.delete(*(name for stream in STREAMS
+                             for name in (self._stream(key, stream), self._marker(key, stream))))
+
+
+# ===================== 统一入口 =====================
+class LogStore:
+    """按 output_ref 选择后端"""
+
+    def __init__(self, files, redis_prefix="execlog:", backend="file", redis_ttl=7 * 24 * 3600):
+        self.files = files
+        self.redis_prefix = redis_prefix
+        self.backend = backend
+        self.redis_ttl = redis_ttl
+
+    def _redis_store(self):
+        client = get_redis(fallback=False)
+        if client is None:
+            return None
+        return RedisStreamStore(client, self.files, self.redis_prefix, self.redis_ttl)
+
+    def _store(self, ref):
+        backend, key = split_ref(ref)
+        if backend == RedisStreamStore.name:
+            return self._redis_store(), key
+        return self.files, key
+
+    def new_ref(self, kind, pk):
+        backend = self.backend
+        if backend == RedisStreamStore.name and self._redis_store() is None:
+            logger.warning(f"Redis不可用，日志{kind}/{pk}改用磁盘存储")
+            backend = FileChunkStore.name
+        return f"{backend}:{kind}/{pk}"
+
+    def append(self, ref, stream, text):
+        store, key = self._store(ref)
+        if store is None:
+            raise redis.ConnectionError(f"Redis不可用，无法写入日志{key}")
+        return store.append(key, stream, text)
+
+    def iter_chunks(self, ref, stream, since=0):
+        """从字节偏移 since 开始按块迭代文本（跨块的多字节字符会正确拼接）"""
+        store, key = self._store(ref)
+        if store is None:
+            # Redis 不可用：只能读取已压缩到磁盘的部分
+            store = self.files
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        for block in store.iter_chunks(key, stream, since):
+            text = decoder.decode(block)
+            if text:
+                yield text
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+
+    def char_boundary(self, ref, stream, offset):
+        """offset 落在多字节字符中间时，返回下一个字符的起始偏移"""
+        store, key = self._store(ref)
+        for block in (store or self.files).iter_chunks(key, stream, offset):
+            skip = 0
+            while skip < min(len(block), 3) and block[skip] & 0xC0 == 0x80:
+                skip += 1
+            return offset + skip
+        return offset
+
+    def compact(self, ref):
+        store, key = self._store(ref)
+        if isinstance(store, RedisStreamStore):
+            try:
+                return store.compact(key)
+            except redis.RedisError as e:
+                logger.warning(f"压缩日志{key}到磁盘失败：{str(e)}")
+                return False
+        self.files.release(key)
+        return True
+
+    def delete(self, ref):
+        store, key = self._store(ref)
+        try:
+            (store or self.files).delete(key)
+        except redis.RedisError as e:
+            logger.warning(f"删除日志{key}失败：{str(e)}")
+            self.files.delete(key)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_log_store():
+    """获取全局执行输出存储"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = LogStore(
+                    FileChunkStore(settings.EXEC_LOG_ROOT, settings.EXEC_LOG_SEGMENT_BYTES),
+                    redis_prefix=settings.EXEC_LOG_REDIS_PREFIX,
+                    backend=settings.EXEC_LOG_BACKEND,
+                    redis_ttl=settings.EXEC_LOG_REDIS_TTL,
+                )
+    return _store
@@ -9,3 +9,136 @@ class BaseModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class ExecutionOutputModel(models.Model):
+    """
+    执行输出（stdout/stderr）存放在追加式日志存储中的执行日志（抽象类，见 common.log_store）
+    - 记录只保存输出位置 output_ref 与字节数/行数，追加时计数用 F() 原子更新（同时确定本段的起始偏移），不需要再 save；
+    - log.stdout / log.stderr 读取完整输出，iter_output 按块读取（可从字节偏移开始），
+      页面展示用 output_tail 只读取末尾；
+    - 子类的 legacy_stdout / legacy_stderr 为升级前保存在记录中的输出，读取时排在存储内容之前。
+    """
+    OUTPUT_KIND = ""
+    OUTPUT_FIELDS = ("output_ref", "stdout_bytes", "stdout_lines", "stderr_bytes", "stderr_lines")
+
+    output_ref = models.CharField("输出存储位置", max_length=200, blank=True, default='')
+    stdout_bytes = models.BigIntegerField("标准输出字节数", default=0)
+    stdout_lines = models.BigIntegerField("标准输出行数", default=0)
+    stderr_bytes = models.BigIntegerField("错误输出字节数", default=0)
+    stderr_lines = models.BigIntegerField("错误输出行数", default=0)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        # 输出计数只由 append_output 原子更新，整条保存时不覆盖（避免旧实例写回过期计数）
+        if not self._state.adding and kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            deferred = self.get_deferred_fields()
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in self.OUTPUT_FIELDS
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+    def _legacy_output(self, stream):
+        return getattr(self, f"legacy_{stream}", None) or ""
+
+    def append_output(self, text, stream="stdout"):
+        """
+        追加一段输出（O(1)：存储追加一块 + 一条 UPDATE）
+        :return: 这段输出在完整输出中的起始字节偏移（多个进程同时追加时也准确）；text 为空时返回 None
+        """
+        from django.db import transaction
+        from django.db.models import F
+        from .log_store import get_log_store
+        if not text:
+            return None
+        store = get_log_store()
+        manager = type(self)._default_manager
+        if not self.output_ref:
+            ref = store.new_ref(self.OUTPUT_KIND, self.pk)
+            # 多个实例/进程同时首次写入时以先写入的位置为准
+            if not manager.filter(pk=self.pk, output_ref="").update(output_ref=ref):
+                ref = manager.filter(pk=self.pk).values_list("output_ref", flat=True).first() or ref
+            self.output_ref = ref
+        size = len(text.encode("utf-8", errors="replace"))
+        lines = text.count("\n")
+        with transaction.atomic(using=manager.db):
+            # 先增加计数再追加到存储：UPDATE 取得的行锁持有到提交，同一日志的追加按计数顺序串行写入存储，
+            # 增加后的字节数减去本段长度就是本段实际写入的起始位置（等同 UPDATE … RETURNING）
+            manager.filter(pk=self.pk).update(**{
+                f"{stream}_bytes": F(f"{stream}_bytes") + size,
+                f"{stream}_lines": F(f"{stream}_lines") + lines,
+            })
+            total, total_lines = manager.filter(pk=self.pk).values_list(
+                f"{stream}_bytes", f"{stream}_lines").get()
+            store.append(self.output_ref, stream, text)
+        setattr(self, f"{stream}_bytes", total)
+        setattr(self, f"{stream}_lines", total_lines)
+        return len(self._legacy_output(stream).encode("utf-8")) + total - size
+
+    def iter_output(self, stream="stdout", since=0):
+        """从字节偏移 since 开始按块迭代输出文本"""
+        from .log_store import get_log_store
+        legacy = self._legacy_output(stream).encode("utf-8")
+        if since < len(legacy):
+            yield legacy[since:].decode("utf-8", errors="replace")
+        if self.output_ref:
+            yield from get_log_store().iter_chunks(self.output_ref, stream, max(since - len(legacy), 0))
+
+    def output_size(self, stream="stdout"):
+        """输出总字节数（含升级前的旧输出）"""
+        return len(self._legacy_output(stream).encode("utf-8")) + getattr(self, f"{stream}_bytes")
+
+    def output_boundary(self, stream, offset):
+        """把字节偏移调整到字符边界（用于从日志末尾截取时的起点）"""
+        legacy = self._legacy_output(stream).encode("utf-8")
+        if offset < len(legacy):
+            while offset < len(legacy) and legacy[offset] & 0xC0 == 0x80:
+                offset += 1
+            return offset
+        if not self.output_ref:
+            return offset
+        from .log_store import get_log_store
+        return len(legacy) + get_log_store().char_boundary(self.output_ref, stream, offset - len(legacy))
+
+    def output_tail(self, stream="stdout", max_bytes=262144):
+        """
+        输出末尾最多 max_bytes 字节（页面首屏与 WebSocket 快照用，避免读取完整输出）
+        :return: {"offset": 起始偏移, "text": 文本, "truncated": 是否省略了前面的内容, "end": 结束偏移}
+        """
+        start = max(self.output_size(stream) - max_bytes, 0)
+        truncated = start > 0
+        if truncated:
+            start = self.output_boundary(stream, start)
+        return self.output_since(stream, start, truncated)
+
+    def output_since(self, stream, offset, truncated=False):
+        """从字节偏移 offset 到当前末尾的输出，格式同 output_tail"""
+        text = "".join(self.iter_output(stream, offset))
+        return {"offset": offset, "text": text, "truncated": truncated,
+                "end": offset + len(text.encode("utf-8"))}
+
+    def read_output(self, stream="stdout"):
+        return "".join(self.iter_output(stream))
+
+    @property
+    def stdout(self):
+        return self.read_output("stdout")
+
+    @property
+    def stderr(self):
+        return self.read_output("stderr")
+
+    def finish_output(self):
+        """执行结束：redis 后端的输出压缩到磁盘"""
+        from .log_store import get_log_store
+        if self.output_ref:
+            get_log_store().compact(self.output_ref)
+
+    def delete_output(self):
+        from .log_store import get_log_store
+        if self.output_ref:
+            get_log_store().delete(self.output_ref)
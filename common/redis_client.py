@@ -0,0 +1,417 @@
+"""统一的 Redis 访问层（全项目共用一个连接池）
+
+- get_client()：共享连接池上的客户端，不做连通性检查；适合自行捕获 RedisError 的长期持有者
+  （设备状态存储、属性缓存、并发控制等单例）。连接断开时按指数退避自动重试命令。
+- get_redis()：取客户端前先检查 Redis 是否可用；不可用时返回进程内存降级存储（MemoryRedis），
+  fallback=False 时返回 None。连接失败后按指数退避（REDIS_RETRY_BACKOFF_MAX 封顶）重新探测，
+  不可用期间不会每次调用都尝试连接；可用时最多每 REDIS_HEALTH_CHECK_INTERVAL 秒 ping 一次。
+- get_l1_cache()：进程内短 TTL 缓存（REDIS_L1_TTL 秒），用于设备状态等读多写少的热点键；
+  写入方通过 Redis 频道 REDIS_L1_CHANNEL 广播失效，所有进程收到后删除本地副本。
+注意：降级存储只在当前进程内有效，Redis 恢复后其中的数据不会写回 Redis。
+"""
+import fnmatch
+import json
+import logging
+import threading
+import time
+
+import redis
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# 连接失败后首次重新探测的间隔（秒），之后每次失败翻倍
+RETRY_BACKOFF_MIN = 0.5
+
+
+# ===================== 连接池 =====================
+_client = None
+_client_lock = threading.RLock()
+
+
+def get_client():
+    """获取共享连接池上的 Redis 客户端（创建时不连接 Redis）"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                pool = redis.ConnectionPool(
+                    host=settings.REDIS_HOST,
+                    port=settings.REDIS_PORT,
+                    db=settings.REDIS_DB,
+                    decode_responses=True,
+                    socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                    socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                    health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+                    retry=Retry(ExponentialBackoff(cap=1, base=0.05), 2),
+                    retry_on_error=[redis.ConnectionError, redis.TimeoutError],
+                )
+                _client = redis.Redis(connection_pool=pool)
+    return _client
+
+
+# ===================== 可用性检查 =====================
+class RedisHealth:
+    """Redis 可用性（失败后按指数退避重新探测）"""
+
+    def __init__(self, client, check_interval=30, max_backoff=30):
+        self.client = client
+        self.check_interval = check_interval
+        self.max_backoff = max_backoff
+        self.available = None
+        self.failures = 0
+        self.next_check = 0
+        self.lock = threading.Lock()
+
+    def is_available(self):
+        if time.monotonic() < self.next_check:
+            return bool(self.available)
+        # 同一时间只有一个线程去探测，其他线程沿用上次结果；
+        # 首次探测完成前还没有结果，其他线程等待探测结束（最多一个 socket 超时），不能按不可用处理
+        if not self.lock.acquire(blocking=self.available is None):
+            return bool(self.available)
+        try:
+            if self.available is not None and time.monotonic() < self.next_check:
+                # 等待期间其他线程已完成探测
+                return bool(self.available)
+            self.client.ping()
+        except redis.RedisError as e:
+            self.mark_down(e)
+        else:
+            if self.available is False:
+                logger.info(f"Redis已恢复（此前连续失败{self.failures}次）")
+            self.available = True
+            self.failures = 0
+            self.next_check = time.monotonic() + self.check_interval
+        finally:
+            self.lock.release()
+        return bool(self.available)
+
+    def mark_down(self, error):
+        """记录一次连接失败（调用方执行命令失败时也可调用，立即进入降级模式）"""
+        self.failures += 1
+        backoff = min(RETRY_BACKOFF_MIN * 2 ** (self.failures - 1), self.max_backoff)
+        self.next_check = time.monotonic() + backoff
+        if self.available is not False:
+            logger.error(f"Redis连接失败，切换到本地内存降级模式：{str(error)}")
+        self.available = False
+
+
+# ===================== 内存降级存储 =====================
+class MemoryRedis:
+    """
+    Redis 不可用时的进程内存实现（线程安全，支持过期时间）
+    覆盖项目中用到的字符串 / Hash / List 命令与 pipeline；publish 只返回 0。
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.lock = threading.RLock()
+
+    def __bool__(self):
+        return True
+
+    def _alive(self, key):
+        expire_at = self.expires.get(key)
+        if expire_at is not None and time.monotonic() >= expire_at:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _set_expire(self, key, seconds):
+        if seconds is None:
+            self.expires.pop(key, None)
+        else:
+            self.expires[key] = time.monotonic() + float(seconds)
+
+    def ping(self):
+        return True
+
+    # 字符串
+    def get(self, key):
+        with self.lock:
+            return self.data.get(key) if self._alive(key) else None
+
+    def set(self, key, value, ex=None, px=None, nx=False, xx=False):
+        with self.lock:
+            exists = self._alive(key)
+            if (nx and exists) or (xx and not exists):
+                return None
+            self.data[key] = str(value)
+            self._set_expire(key, ex if px is None else px / 1000)
+            return True
+
+    def setex(self, key, seconds, value):
+        return self.set(key, value, ex=seconds)
+
+    def incr(self, key, amount=1):
+        with self.lock:
+            value = int(self.data.get(key) or 0) + amount if self._alive(key) else amount
+            self.data[key] = str(value)
+            return value
+
+    # 通用
+    def delete(self, *keys):
+        with self.lock:
+            count = 0
+            for key in keys:
+                if self._alive(key):
+                    count += 1
+                self.data.pop(key, None)
+                self.expires.pop(key, None)
+            return count
+
+    def exists(self, *keys):
+        with self.lock:
+            return sum(1 for key in keys if self._alive(key))
+
+    def expire(self, key, seconds):
+        with self.lock:
+            if not self._alive(key):
+                return False
+            self._set_expire(key, seconds)
+            return True
+
+    def keys(self, pattern="*"):
+        with self.lock:
+            return [key for key in list(self.data) if self._alive(key) and fnmatch.fnmatchcase(key, pattern)]
+
+    # Hash
+    def _hash(self, key, create=False):
+        if not self._alive(key):
+            if not create:
+                return {}
+            self.data[key] = {}
+        return self.data[key]
+
+    def hget(self, key, field):
+        with self.lock:
+            return self._hash(key).get(field)
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        with self.lock:
+            items = dict(mapping or {})
+            if field is not None:
+                items[field] = value
+            target = self._hash(key, create=True)
+            added = sum(1 for name in items if name not in target)
+            target.update({name: str(item) for name, item in items.items()})
+            return added
+
+    def hmget(self, key, fields, *args):
+        with self.lock:
+            target = self._hash(key)
+            return [target.get(name) for name in list(fields) + list(args)]
+
+    def hgetall(self, key):
+        with self.lock:
+            return dict(self._hash(key))
+
+    def hkeys(self, key):
+        with self.lock:
+            return list(self._hash(key))
+
+    def hdel(self, key, *fields):
+        with self.lock:
+            target = self._hash(key)
+            return sum(1 for name in fields if target.pop(name, None) is not None)
+
+    def hincrby(self, key, field, amount=1):
+        with self.lock:
+            target = self._hash(key, create=True)
+            target[field] = str(int(target.get(field) or 0) + amount)
+            return int(target[field])
+
+    # List
+    def rpush(self, key, *values):
+        with self.lock:
+            if not self._alive(key):
+                self.data[key] = []
+            self.data[key].extend(str(value) for value in values)
+            return len(self.data[key])
+
+    def lrange(self, key, start, end):
+        with self.lock:
+            items = self.data.get(key, []) if self._alive(key) else []
+            return items[start:None if end == -1 else end + 1]
+
+    # 发布订阅（降级模式下没有订阅者）
+    def publish(self, channel, message):
+        return 0
+
+    def pipeline(self, transaction=False):
+        return MemoryPipeline(self)
+
+
+class MemoryPipeline:
+    """MemoryRedis 的 pipeline：缓存命令，execute 时依次执行"""
+
+    def __init__(self, store):
+        self.store = store
+        self.commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.store, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self.store.lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
+# ===================== 获取客户端 =====================
+_health = None
+_memory = MemoryRedis()
+
+
+def get_health():
+    global _health
+    if _health is None:
+        with _client_lock:
+            if _health is None:
+                _health = RedisHealth(
+                    get_client(),
+                    check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+                    max_backoff=settings.REDIS_RETRY_BACKOFF_MAX,
+                )
+    return _health
+
+
+def get_redis(fallback=True):
+    """
+    获取 Redis 客户端（连接池复用，不再每次新建连接并 ping）
+    :param fallback: Redis 不可用时返回内存降级存储（True）还是 None（False）
+    """
+    if get_health().is_available():
+        return get_client()
+    return _memory if fallback else None
+
+
+# ===================== 进程内 L1 缓存 =====================
+_MISSING = object()
+
+
+class L1Cache:
+    """
+    进程内短 TTL 缓存，通过 Redis 频道广播失效
+    消息内容为 JSON 数组（失效的键名列表）；订阅断开期间无法收到失效消息，重新订阅时清空本地缓存。
+    """
+    MISSING = _MISSING
+
+    def __init__(self, client, ttl=1.0, channel="adb:l1:invalidate", max_keys=10000):
+        self.client = client
+        self.ttl = ttl
+        self.channel = channel
+        self.max_keys = max_keys
+        self.data = {}
+        self.lock = threading.Lock()
+        self._listener = None
+        self.metrics = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def get(self, key):
+        if not self.enabled:
+            return _MISSING
+        self._ensure_listener()
+        with self.lock:
+            item = self.data.get(key)
+            if item is None or item[0] <= time.monotonic():
+                self.metrics["misses"] += 1
+                return _MISSING
+            self.metrics["hits"] += 1
+            return item[1]
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            if len(self.data) >= self.max_keys:
+                now = time.monotonic()
+                self.data = {k: v for k, v in self.data.items() if v[0] > now}
+                if len(self.data) >= self.max_keys:
+                    self.data.clear()
+            self.data[key] = (time.monotonic() + self.ttl, value)
+
+    def _discard(self, keys):
+        with self.lock:
+            for key in keys:
+                self.data.pop(key, None)
+            self.metrics["invalidations"] += len(keys)
+
+    def invalidate(self, *keys):
+        """删除本进程副本并通知其他进程"""
+        if not self.enabled or not keys:
+            return
+        self._discard(keys)
+        try:
+            self.client.publish(self.channel, json.dumps(keys, ensure_ascii=False))
+        except redis.RedisError as e:
+            logger.warning(f"广播缓存失效失败：{str(e)}")
+
+    def _ensure_listener(self):
+        if self._listener is not None and self._listener.is_alive():
+            return
+        with self.lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name="redis-l1-invalidate", daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        failures = 0
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                # 订阅前可能错过了失效消息
+                with self.lock:
+                    self.data.clear()
+                failures = 0
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message.get("type") == "message":
+                        try:
+                            self._discard(json.loads(message["data"]))
+                        except (TypeError, ValueError):
+                            continue
+            except redis.RedisError as e:
+                failures += 1
+                with self.lock:
+                    self.data.clear()
+                backoff = min(RETRY_BACKOFF_MIN * 2 ** (failures - 1), settings.REDIS_RETRY_BACKOFF_MAX)
+                logger.warning(f"缓存失效订阅断开，{backoff}秒后重试：{str(e)}")
+                time.sleep(backoff)
+            finally:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
+
+_l1 = None
+
+
+def get_l1_cache():
+    """获取全局进程内 L1 缓存（REDIS_L1_TTL<=0 时不缓存）"""
+    global _l1
+    if _l1 is None:
+        with _client_lock:
+            if _l1 is None:
+                _l1 = L1Cache(
+                    get_client(),
+                    ttl=settings.REDIS_L1_TTL,
+                    channel=settings.REDIS_L1_CHANNEL,
+                    max_keys=settings.REDIS_L1_MAX_KEYS,
+                )
+    return _l1
@@ -1,3 +1,162 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from . import log_store
+from .log_store import FileChunkStore, LogStore, RedisStreamStore
+
+try:
+    import fakeredis
+except ImportError:  # 未安装 fakeredis 时跳过依赖 Redis 的测试（Lua 脚本还需要 lupa）
+    fakeredis = None
+
+KEY = "script/1"
+
+
+def read(store, since=0, end=None, key=KEY, stream="stdout"):
+    if end is None:
+        return b"".join(store.iter_chunks(key, stream, since))
+    return b"".join(store.iter_chunks(key, stream, since, end))
+
+
+class FileChunkStoreTestCase(SimpleTestCase):
+    """磁盘分段文件"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.store = FileChunkStore(self.root, segment_bytes=10)
+
+    def append(self, *texts):
+        for text in texts:
+            self.store.append(KEY, "stdout", text)
+        return "".join(texts).encode("utf-8")
+
+    def test_segment_rollover(self):
+        data = self.append("aaaaaa", "bbbbbb", "cc", "dddddddddddd")
+        self.assertEqual(len(self.store._segments(KEY, "stdout")), 3)
+        self.assertEqual(self.store.size(KEY, "stdout"), len(data))
+        self.assertEqual(read(self.store), data)
+        # 另一个实例（其他进程）继续追加到最新分段
+        other = FileChunkStore(self.root, segment_bytes=10)
+        other.append(KEY, "stdout", "e")
+        self.assertEqual(read(self.store), data + b"e")
+        self.assertEqual(read(self.store, stream="stderr"), b"")
+
+    def test_iter_chunks_range(self):
+        data = self.append("aaaaaa", "bbbbbb", "cc", "dddddddddddd")
+        for since in (0, 3, 6, 7, 14, len(data)):
+            self.assertEqual(read(self.store, since), data[since:])
+            for end in (since, since + 1, 12, len(data)):
+                self.assertEqual(read(self.store, since, end), data[since:max(end, since)])
+
+    def test_truncate(self):
+        data = self.append("aaaaaa", "bbbbbb", "cc", "dddddddddddd")
+        self.store.truncate(KEY, "stdout", 8)
+        self.assertEqual(read(self.store), data[:8])
+        self.assertEqual(len(self.store._segments(KEY, "stdout")), 2)
+        self.store.append(KEY, "stdout", "x")
+        self.assertEqual(read(self.store), data[:8] + b"x")
+
+    def test_delete(self):
+        self.append("abc")
+        self.store.delete(KEY)
+        self.assertFalse(os.path.exists(self.store._dir(KEY)))
+        self.assertEqual(read(self.store), b"")
+
+
+@skipIf(fakeredis is None, "需要安装 fakeredis[lua]")
+class RedisStreamStoreTestCase(SimpleTestCase):
+    """Redis Stream 与压缩到磁盘（fakeredis，每批 3 条便于覆盖分批读取）"""
+
+    def setUp(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+        self.client = fakeredis.FakeRedis(decode_responses=True)
+        self.files = FileChunkStore(root, segment_bytes=10)
+        self.store = RedisStreamStore(self.client, self.files, ttl=100)
+        patcher = mock.patch.object(log_store, "STREAM_BATCH", 3)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.data = b""
+
+    def append(self, count):
+        for _ in range(count):
+            text = f"行{len(self.data)}\n"
+            self.store.append(KEY, "stdout", text)
+            self.data += text.encode("utf-8")
+
+    def test_append_sets_ttl(self):
+        self.append(1)
+        self.assertGreater(self.client.ttl(self.store._stream(KEY, "stdout")), 0)
+        self.store.compact(KEY)
+        self.assertGreater(self.client.ttl(self.store._marker(KEY, "stdout")), 0)
+
+    def test_iter_chunks_since(self):
+        self.append(10)
+        for since in (0, 5, 7, len(self.data)):
+            self.assertEqual(read(self.store, since), self.data[since:])
+
+    def test_compact(self):
+        self.append(10)
+        self.store.append(KEY, "stderr", "错误\n")
+        self.assertTrue(self.store.compact(KEY))
+        self.assertEqual(self.files.size(KEY, "stdout"), len(self.data))
+        self.assertEqual(read(self.files, stream="stderr"), "错误\n".encode("utf-8"))
+        # Stream 已清空并删除，标记保留到过期
+        self.assertFalse(self.client.exists(self.store._stream(KEY, "stdout")))
+        self.assertEqual(read(self.store), self.data)
+        self.append(2)
+        self.assertEqual(read(self.store, 3), self.data[3:])
+
+    def test_compact_during_read(self):
+        self.append(10)
+        chunks = self.store.iter_chunks(KEY, "stdout")
+        head = next(chunks) + next(chunks)
+        self.store.compact(KEY)
+        self.assertEqual(head + b"".join(chunks), self.data)
+
+        # 压缩后再追加、再压缩：磁盘部分与新条目仍然首尾相接
+        self.append(5)
+        chunks = self.store.iter_chunks(KEY, "stdout")
+        head = next(chunks)
+        self.store.compact(KEY)
+        self.assertEqual(head + b"".join(chunks), self.data)
+
+    def test_compact_repairs_interrupted_move(self):
+        self.append(4)
+        self.store.compact(KEY)
+        self.append(2)
+        # 上次压缩写入磁盘后、删除条目前中断：磁盘上多出未记录的内容
+        self.files.append(KEY, "stdout", "DUP")
+        self.store.compact(KEY)
+        self.assertEqual(read(self.store), self.data)
+
+    def test_compact_locked(self):
+        self.append(2)
+        self.client.set(f"{self.store.prefix}lock:{KEY}", "1")
+        self.assertFalse(self.store.compact(KEY))
+        self.assertEqual(self.files.size(KEY, "stdout"), 0)
+        self.assertEqual(read(self.store), self.data)
+
+    def test_delete_if_empty(self):
+        self.append(1)
+        name = self.store._stream(KEY, "stdout")
+        self.assertEqual(self.store._delete_if_empty(keys=[name]), 0)
+        self.client.xtrim(name, maxlen=0)
+        self.assertEqual(self.store._delete_if_empty(keys=[name]), 1)
+        self.assertFalse(self.client.exists(name))
+
+    def test_log_store_decodes_split_characters(self):
+        store = LogStore(self.files, backend="redis")
+        with mock.patch.object(log_store, "get_redis", return_value=self.client):
+            ref = store.new_ref("script", 1)
+            self.assertTrue(ref.startswith("redis:"))
+            self.append(3)
+            # 从多字节字符中间开始读取：调整到下一个字符
+            offset = store.char_boundary(ref, "stdout", 1)
+            self.assertEqual(offset, 3)
+            self.assertEqual("".join(store.iter_chunks(ref, "stdout", offset)), self.data[3:].decode("utf-8"))
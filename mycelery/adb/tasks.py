@@ -1,16 +1,11 @@
 import subprocess
-import redis
-from django.conf import settings
 from celery import shared_task
 from adb_manager.models import ADBDevice
+from adb_manager.status_store import get_status_store
+from adb_manager.reconnect_scheduler import get_reconnect_scheduler
 
-# 初始化Redis（复用Django配置）
-r = redis.Redis(
-    host=settings.REDIS_HOST,
-    port=settings.REDIS_PORT,
-    db=settings.REDIS_DB,
-    decode_responses=True  # 自动解码为字符串，避免b''前缀
-)
+# 设备状态存储（复用adb_manager的Hash状态存储）
+status_store = get_status_store()
 
 
 def check_and_reconnect(device: ADBDevice):
@@ -46,23 +41,19 @@ def check_and_reconnect(device: ADBDevice):
                 device.device_serial = safe_connect_str
                 device.save()  # 更新到Django模型
 
-            r.set(f"adb:device:{safe_connect_str}", "online")
-            r.set(f"adb:device:{safe_connect_str}:stdout", result.stdout)
+            status_store.set(safe_connect_str, "online", stdout=result.stdout)
             print(f"设备 {safe_connect_str} 连接成功")
             return True
         else:
-            r.set(f"adb:device:{safe_connect_str}", "offline")
-            r.set(f"adb:device:{safe_connect_str}:stderr", result.stderr)
+            status_store.set(safe_connect_str, "offline", stderr=result.stderr)
             print(f"设备 {safe_connect_str} 连接失败：{result.stderr}")
             return False
     except subprocess.TimeoutExpired:
-        r.set(f"adb:device:{safe_connect_str}", "offline")
-        r.set(f"adb:device:{safe_connect_str}:stderr", "ADB连接超时")
+        status_store.set(safe_connect_str, "offline", stderr="ADB连接超时")
         print(f"设备 {safe_connect_str} 连接超时")
         return False
     except Exception as e:
-        r.set(f"adb:device:{safe_connect_str}", "error")
-        r.set(f"adb:device:{safe_connect_str}:stderr", str(e))
+        status_store.set(safe_connect_str, "error", stderr=str(e))
         print(f"设备 {safe_connect_str} 连接异常：{str(e)}")
         return False
 
@@ -72,11 +63,13 @@ def check_and_reconnect_all_devices():
     """
     Celery定时任务：检查所有启用的ADB设备，尝试重连
     """
-    # 从Django模型获取所有启用的设备
-    active_devices = ADBDevice.objects.filter(is_active=True)
-    for device in active_devices:
-        check_and_reconnect(device)
-    return f"已检查 {active_devices.count()} 台设备"
+    # 从Django模型获取所有启用的设备，只重连已到重试时间的设备（离线设备按退避时间重试）
+    active_devices = {device.adb_connect_str: device for device in ADBDevice.objects.filter(is_active=True)}
+    scheduler = get_reconnect_scheduler()
+    due, deferred = scheduler.split_due([connect_str for connect_str in active_devices if connect_str])
+    results = {connect_str: check_and_reconnect(active_devices[connect_str]) for connect_str in due}
+    scheduler.record_many(results)
+    return f"已检查 {len(due)} 台设备（{len(deferred)} 台未到重试时间）"
 
 
 @shared_task(name="connect_specified_device")
@@ -91,7 +84,7 @@ def connect_specified_device(device_id: int):
         return {
             "success": result,
             "device": device.adb_connect_str,
-            "status": r.get(f"adb:device:{device.adb_connect_str}")
+            "status": status_store.get_status(device.adb_connect_str, default_status=None)
         }
     except ADBDevice.DoesNotExist:
         return {"success": False, "error": "设备不存在"}
\ No newline at end of file
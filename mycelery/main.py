@@ -33,6 +33,11 @@ app.conf.beat_schedule = {
         'task': 'task_scheduler.check_and_execute_schedules',
         'schedule': 60.0,
     },
+    # 设备状态心跳（续期状态有效期，检查进程停止后状态自动过期为 stale）
+    'adb-device-status-heartbeat': {
+        'task': 'adb_manager.heartbeat_devices',
+        'schedule': float(settings.ADB_STATUS_HEARTBEAT_INTERVAL),
+    },
 }
 
 # 调试任务
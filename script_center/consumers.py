@@ -1,52 +1,119 @@
 # script_center/consumers.py
+"""
+脚本执行日志实时推送（按字节偏移的增量协议，stdout/stderr 各自独立计算偏移）
+
+连接：ws/script_log/<log_id>/[?since=<stdout偏移>&stderr_since=<stderr偏移>]
+服务端消息：
+    log_snapshot  {"stdout": {"offset", "text", "truncated"}, "stderr": {...}, "status"}
+                  连接后发送一次：未指定偏移时为每个输出流最后 SCRIPT_LOG_WS_TAIL_BYTES 字节，
+                  指定偏移（断线重连）时为该偏移之后的全部内容
+    log_append    {"stdout": {"offset", "text"}, "stderr": {...}, "status"}  只包含新增内容
+    log_status    {"status"}  执行状态变化
+同一连接内每个输出流的 offset 严格递增且首尾相接：offset 等于上一条消息的 offset + text 的 UTF-8 字节数。
+客户端记录每个流的下一个偏移，重连时通过 since / stderr_since 续传。
+"""
 import json
+from urllib.parse import parse_qs
+
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
+
 from .models import TaskExecutionLog
 
+STREAMS = ("stdout", "stderr")
+SINCE_PARAMS = {"stdout": "since", "stderr": "stderr_since"}
+
+
+def _parse_offset(value):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
 class ScriptLogConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.log_id = self.scope['url_route']['kwargs']['log_id']
         self.log_group_name = f'script_log_{self.log_id}'
+        # 每个输出流已发送到的字节偏移
+        self.offsets = {}
 
-        # 加入日志分组（正确）
+        # 先加入分组再读取快照：快照期间到达的增量按偏移去重
         await self.channel_layer.group_add(
             self.log_group_name,
             self.channel_name
         )
         await self.accept()  # 必须先accept，否则连接失败
-        # 连接成功后，主动推送一次最新日志
-        log_data = await self.get_log_data()
-        await self.send_log(log_data)
+
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        since = {stream: _parse_offset(params.get(name, [None])[0]) for stream, name in SINCE_PARAMS.items()}
+        snapshot = await self.read_snapshot(since)
+        if 'error' not in snapshot:
+            for stream in STREAMS:
+                chunk = snapshot[stream]
+                self.offsets[stream] = chunk['offset'] + len(chunk['text'].encode('utf-8'))
+        await self.send_message('log_snapshot', snapshot)
 
     async def disconnect(self, close_code):
-        # 修复：group_discard参数顺序（正确是 group_name, channel_name）
         await self.channel_layer.group_discard(
             self.log_group_name,
             self.channel_name
         )
 
-    # 接收分组消息并推送给前端（原有逻辑保留）
-    async def log_update(self, event):
-        log_data = event['data']
-        await self.send_log(log_data)
+    async def log_append(self, event):
+        data = event['data']
+        payload = {'status': data.get('status')}
+        for stream in STREAMS:
+            chunk = data.get(stream)
+            if not chunk or stream not in self.offsets:
+                continue
+            offset, text = chunk['offset'], chunk['text']
+            raw = text.encode('utf-8')
+            sent = self.offsets[stream]
+            if offset is None or offset > sent:
+                # 中间有未收到的内容（如其他进程追加）：从存储补读
+                offset, text = sent, await self.read_since(stream, sent)
+                raw = text.encode('utf-8')
+            elif offset + len(raw) <= sent:
+                # 已包含在快照中
+                continue
+            elif offset < sent:
+                raw = raw[sent - offset:]
+                offset, text = sent, raw.decode('utf-8', errors='replace')
+            if not text:
+                continue
+            payload[stream] = {'offset': offset, 'text': text}
+            self.offsets[stream] = offset + len(raw)
+        if len(payload) > 1:
+            await self.send_message('log_append', payload)
+
+    async def log_status(self, event):
+        await self.send_message('log_status', event['data'])
 
-    # 封装发送日志的函数（复用）
-    async def send_log(self, log_data):
+    async def send_message(self, message_type, data):
         await self.send(text_data=json.dumps({
-            'type': 'log_update',
-            'data': log_data
+            'type': message_type,
+            'data': data
         }))
 
-    # 异步查询日志（原有逻辑保留）
     @database_sync_to_async
-    def get_log_data(self):
+    def read_snapshot(self, since):
         try:
             log = TaskExecutionLog.objects.get(id=self.log_id)
-            return {
-                'stdout': log.stdout,
-                'stderr': log.stderr,
-                'status': log.exec_status
-            }
         except TaskExecutionLog.DoesNotExist:
-            return {'error': '日志不存在'}
\ No newline at end of file
+            return {'error': '日志不存在'}
+        snapshot = {'status': log.exec_status}
+        for stream in STREAMS:
+            start = since[stream]
+            if start is None or start > log.output_size(stream):
+                chunk = log.output_tail(stream, settings.SCRIPT_LOG_WS_TAIL_BYTES)
+            else:
+                chunk = log.output_since(stream, start)
+            snapshot[stream] = {key: chunk[key] for key in ('offset', 'text', 'truncated')}
+        return snapshot
+
+    @database_sync_to_async
+    def read_since(self, stream, offset):
+        log = TaskExecutionLog.objects.filter(id=self.log_id).first()
+        return "".join(log.iter_output(stream, offset)) if log else ""
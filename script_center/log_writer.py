@@ -0,0 +1,164 @@
+"""脚本执行日志的合并写入（stdout/stderr 两个读取线程共用一个写入器）
+
+读取线程只把输出行放入内存缓冲区；后台刷新线程每 SCRIPT_LOG_FLUSH_INTERVAL_MS 毫秒、
+或缓冲区累计超过 SCRIPT_LOG_FLUSH_BYTES 字节时，把新增内容一次性追加到日志对象：
+- 存储：log.append_output 追加到执行输出存储（见 common.log_store），只原子更新字节数/行数；
+- WebSocket：每次刷新只推送一次 log_append（script_log_<log_id> 组），只包含新增内容及其字节偏移。
+执行期间写入器是该日志输出的唯一推送方；写入器关闭后的输出（结束/超时/停止提示）通过 append_and_publish
+追加并推送，执行结束时由 publish_log_status 推送最终状态。
+threaded=False 时不启动刷新线程，由调用方（执行监督进程的事件循环）定期调用 flush。
+所有输出都由刷新线程按写入顺序追加，两个读取线程不会互相覆盖对方的内容。
+写入器关闭（close）前，其他线程需要追加输出时调用 write，不要直接调用 log.append_output。
+"""
+import logging
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+
+class CoalescingLogWriter:
+    """按时间窗口 / 大小窗口合并写入执行日志"""
+
+    def __init__(self, log, group_name=None, interval_ms=None, max_bytes=None, threaded=True):
+        self.log = log
+        self.group_name = group_name or f"script_log_{log.id}"
+        self.interval = (interval_ms if interval_ms is not None else settings.SCRIPT_LOG_FLUSH_INTERVAL_MS) / 1000
+        self.max_bytes = max_bytes if max_bytes is not None else settings.SCRIPT_LOG_FLUSH_BYTES
+        self.pending = {True: [], False: []}
+        self.pending_bytes = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.metrics = {"lines": 0, "flushes": 0, "dropped": 0}
+        # 同一时间只有一次刷新，保证输出按顺序追加
+        self.flush_lock = threading.Lock()
+        self._flusher = None
+        if threaded:
+            self._flusher = threading.Thread(target=self._run, name=f"log-writer-{log.id}", daemon=True)
+            self._flusher.start()
+
+    def write(self, text, is_stdout=True):
+        """追加一段输出（线程安全，不访问数据库）"""
+        if not text:
+            return
+        with self.condition:
+            if self.closed:
+                # 子进程已结束、写入器已关闭后读取线程才读到的内容
+                self.metrics["dropped"] += 1
+                return
+            self.pending[is_stdout].append(text)
+            self.pending_bytes += len(text.encode("utf-8", errors="replace"))
+            self.metrics["lines"] += 1
+            if self.pending_bytes >= self.max_bytes:
+                self.condition.notify()
+
+    @property
+    def due(self):
+        """缓冲区已超过大小上限"""
+        return self.pending_bytes >= self.max_bytes
+
+    def flush(self):
+        """立即写入缓冲区内容"""
+        with self.flush_lock:
+            with self.condition:
+                stdout, stderr = self._take()
+            self._flush(stdout, stderr)
+
+    def _take(self):
+        """取出缓冲区内容：(stdout, stderr)"""
+        stdout, stderr = "".join(self.pending[True]), "".join(self.pending[False])
+        self.pending = {True: [], False: []}
+        self.pending_bytes = 0
+        return stdout, stderr
+
+    def _append(self, stdout, stderr):
+        """把一次刷新的内容追加到存储，返回 log_append 推送的数据"""
+        data = {'status': self.log.exec_status}
+        for stream, text in (("stdout", stdout), ("stderr", stderr)):
+            if text:
+                data[stream] = {'offset': self.log.append_output(text, stream), 'text': text}
+        return data
+
+    def _flush(self, stdout, stderr):
+        if not stdout and not stderr:
+            return
+        try:
+            data = self._append(stdout, stderr)
+        except Exception as e:
+            logger.error(f"保存脚本日志{self.log.id}输出失败：{str(e)}")
+            return
+        self.metrics["flushes"] += 1
+        try:
+            async_to_sync(get_channel_layer().group_send)(
+                self.group_name,
+                {'type': 'log_append', 'data': data}
+            )
+        except Exception as e:
+            logger.warning(f"推送脚本日志{self.log.id}更新失败：{str(e)}")
+
+    def _run(self):
+        try:
+            while True:
+                with self.condition:
+                    deadline = time.monotonic() + self.interval
+                    # 等到时间窗口结束、缓冲区超过大小上限或写入器关闭
+                    while not self.closed and self.pending_bytes < self.max_bytes:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                    closed = self.closed
+                self.flush()
+                if closed:
+                    return
+        finally:
+            # 刷新线程独占的数据库连接
+            connection.close()
+
+    def close(self, timeout=10):
+        """写入剩余内容并停止刷新线程（可重复调用）；返回后调用方可以直接修改日志对象"""
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        if self._flusher is None:
+            self.flush()
+            return
+        self._flusher.join(timeout=timeout)
+        if self._flusher.is_alive():
+            logger.warning(f"脚本日志{self.log.id}刷新线程{timeout}秒内未结束")
+        logger.debug(f"脚本日志{self.log.id}合并写入：{self.metrics}")
+
+
+def append_and_publish(log, text, stream="stdout"):
+    """
+    追加一段输出并推送 log_append（没有写入器或写入器已关闭时使用，如执行结束/超时/停止的提示）
+    偏移取自 append_output 的返回值（按数据库计数原子确定），与其他进程写入器推送的增量不会重叠
+    """
+    if not text:
+        return
+    offset = log.append_output(text, stream)
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            f"script_log_{log.id}",
+            {'type': 'log_append', 'data': {'status': log.exec_status, stream: {'offset': offset, 'text': text}}}
+        )
+    except Exception as e:
+        logger.warning(f"推送脚本日志{log.id}更新失败：{str(e)}")
+
+
+def publish_log_status(log):
+    """推送执行状态变化（不含输出内容）"""
+    try:
+        async_to_sync(get_channel_layer().group_send)(
+            f"script_log_{log.id}",
+            {'type': 'log_status', 'data': {'status': log.exec_status}}
+        )
+    except Exception as e:
+        logger.warning(f"推送脚本日志{log.id}状态失败：{str(e)}")
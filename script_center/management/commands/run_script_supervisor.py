@@ -0,0 +1,22 @@
+# script_center/management/commands/run_script_supervisor.py
+from django.core.management.base import BaseCommand
+from script_center.supervisor import ScriptSupervisor
+
+
+class Command(BaseCommand):
+    help = '常驻脚本执行监督进程（从 Redis 队列领取脚本任务，一个事件循环同时执行大量脚本）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-runs', type=int, help='最多同时执行的脚本数（默认 SCRIPT_SUPERVISOR_MAX_RUNS）')
+        parser.add_argument('--threads', type=int, help='数据库/Redis 阻塞调用线程数（默认 SCRIPT_SUPERVISOR_THREADS）')
+
+    def handle(self, *args, **options):
+        supervisor = ScriptSupervisor(max_runs=options['max_runs'], threads=options['threads'])
+        self.stdout.write(self.style.SUCCESS(
+            f"脚本执行监督进程已启动（最多同时执行{supervisor.max_runs}个脚本），按 Ctrl+C 退出"
+        ))
+        try:
+            supervisor.run()
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write("脚本执行监督进程已停止")
@@ -0,0 +1,18 @@
+# 设备执行租约：设备被占用时提交的任务进入等待队列（queued）
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('script_center', '0011_taskexecutionlog_output_store'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='taskexecutionlog',
+            name='exec_status',
+            field=models.CharField(choices=[('queued', '排队中'), ('running', '执行中'), ('success', '执行成功'), ('failed', '执行失败'), ('timeout', '执行超时'), ('error', '执行异常')], default='running', max_length=20, verbose_name='执行状态'),
+        ),
+    ]
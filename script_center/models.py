@@ -2,6 +2,7 @@ from django.db import models
 from adb_manager.models import ADBDevice
 from django.utils import timezone
 from django.conf import settings
+from common.models import ExecutionOutputModel
 import os
 
 class ScriptTask(models.Model):
@@ -55,8 +56,12 @@ class ScriptTask(models.Model):
         return os.path.exists(self.python_path)
 
 
-class TaskExecutionLog(models.Model):
+class TaskExecutionLog(ExecutionOutputModel):
+    """脚本执行日志（输出内容见 ExecutionOutputModel）"""
+    OUTPUT_KIND = "script"
+
     EXEC_STATUS = (
+        ("queued", "排队中"),
         ("running", "执行中"),
         ("success", "执行成功"),
         ("failed", "执行失败"),
@@ -67,8 +72,9 @@ class TaskExecutionLog(models.Model):
     device = models.ForeignKey(ADBDevice, on_delete=models.CASCADE, verbose_name="执行设备")
     exec_status = models.CharField("执行状态", max_length=20, choices=EXEC_STATUS, default="running")
     exec_command = models.TextField("执行命令", blank=True, default='')
-    stdout = models.TextField("标准输出", blank=True, default='')
-    stderr = models.TextField("错误输出", blank=True, default='')
+    # 升级前保存在记录中的输出（新日志为空）
+    legacy_stdout = models.TextField("标准输出（旧版）", blank=True, default='')
+    legacy_stderr = models.TextField("错误输出（旧版）", blank=True, default='')
     start_time = models.DateTimeField("开始时间", default=timezone.now)
     end_time = models.DateTimeField("结束时间", blank=True, null=True)
     exec_duration = models.FloatField("执行耗时(秒)", blank=True, null=True)
@@ -0,0 +1,558 @@
+"""脚本执行监督进程（一个进程、一个事件循环同时管理大量脚本）
+
+后台线程 / Celery 执行方式下，每个脚本占用一个 Celery worker 名额（最长 SCRIPT_EXECUTION_TIMEOUT 秒）
+和两个读取线程。开启 SCRIPT_SUPERVISOR_ENABLED 后，_execute_script_core 只把任务放入 Redis 队列
+SCRIPT_SUPERVISOR_QUEUE 后立即返回，由常驻的监督进程（python manage.py run_script_supervisor）执行：
+- asyncio.create_subprocess_exec 启动脚本，所有子进程的 stdout/stderr 管道在同一个事件循环中读取；
+- 输出交给 CoalescingLogWriter（threaded=False），由事件循环每 SCRIPT_LOG_FLUSH_INTERVAL_MS 毫秒
+  或缓冲区超过 SCRIPT_LOG_FLUSH_BYTES 字节时刷新；
+- 超时由事件循环定时器（loop.call_later）触发：发送停止信号，等待脚本优雅退出后终止进程；
+- 数据库、Redis、设备并发控制等阻塞调用放到线程池（SCRIPT_SUPERVISOR_THREADS 个线程）执行；
+- 同时执行的脚本数不超过 SCRIPT_SUPERVISOR_MAX_RUNS，超出的任务留在队列中等待；
+- 执行期间持有设备执行租约（见 adb_manager.device_lease），结束后释放并启动该设备的下一个排队任务。
+监督进程每 SCRIPT_SUPERVISOR_HEARTBEAT 秒写入状态 Hash SCRIPT_SUPERVISOR_STATE_KEY（带过期时间）；
+没有存活的监督进程或 Redis 不可用时，enqueue_script_run 返回 False，调用方在本进程执行。
+队列消息（JSON）：{"task_id", "device_id", "log_id", "python_path", "celery_task_id"}
+
+任务至少交付一次（BLMOVE 需要 Redis 6.2+）：
+- 领取时用 BLMOVE 把消息原子地移到本监督进程的处理中列表 <队列>:processing:<监督进程ID>，
+  执行结束（或转入设备等待队列）后才 LREM；
+- 每个监督进程在 <队列>:supervisors 中登记，并用 <队列>:alive:<监督进程ID> 心跳；
+- 启动时及每次心跳检查已登记但心跳过期的监督进程（崩溃/被强制结束），接管其处理中列表：
+  尚未启动脚本的任务放回队首，脚本执行中被中断的任务日志标记为执行异常。
+"""
+import asyncio
+import codecs
+import functools
+import json
+import logging
+import os
+import signal
+import socket
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import redis
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from adb_manager.device_governor import LANE_BACKGROUND, DeviceBusyError, acquire_slot, release_slot
+from adb_manager.device_lease import get_lease_renewer, lease_owner, release_lease, request_lease
+from adb_manager.models import ADBDevice
+from common.redis_client import get_redis
+from .log_writer import CoalescingLogWriter, append_and_publish, publish_log_status
+from .models import TaskExecutionLog
+from .tasks import (
+    _graceful_terminate_process,
+    _mark_device_busy,
+    _mark_queued,
+    _prepare_script_run,
+    _script_log_header,
+    get_redis_conn,
+)
+
+logger = logging.getLogger(__name__)
+
+# 每次从管道读取的最大字节数
+READ_CHUNK_BYTES = 64 * 1024
+# BLMOVE 等待秒数（需小于 REDIS_SOCKET_TIMEOUT）
+POP_TIMEOUT = 1
+
+
+def _processing_key(supervisor_id):
+    return f"{settings.SCRIPT_SUPERVISOR_QUEUE}:processing:{supervisor_id}"
+
+
+def _alive_key(supervisor_id):
+    return f"{settings.SCRIPT_SUPERVISOR_QUEUE}:alive:{supervisor_id}"
+
+
+def _registry_key():
+    return f"{settings.SCRIPT_SUPERVISOR_QUEUE}:supervisors"
+
+
+def _blocking(func, *args, **kwargs):
+    """线程池中执行的阻塞调用（先关闭超时的数据库连接）"""
+    close_old_connections()
+    return func(*args, **kwargs)
+
+
+def _device_serial(device_id):
+    device = ADBDevice.objects.filter(id=device_id).first()
+    return device.adb_connect_str if device else ""
+
+
+def _stop_flag_key(device_serial):
+    return f"{settings.SCRIPT_REDIS_STOP_FLAG_PREFIX}{device_serial}"
+
+
+def _register_process(log_id, job, pid, device_serial):
+    """写入运行中进程信息（停止任务时按 pid 终止进程）"""
+    r = get_redis_conn()
+    r.hset(settings.SCRIPT_REDIS_PROCESS_HASH, log_id, json.dumps({
+        "pid": pid,
+        "device_serial": device_serial,
+        "log_id": log_id,
+        "task_id": job["task_id"],
+        "celery_task_id": job.get("celery_task_id"),
+    }))
+    logger.info(f"脚本任务{log_id}进程{pid}已存入Redis（执行监督进程）")
+
+
+def _send_timeout_signal(device_serial):
+    r = get_redis_conn()
+    r.set(_stop_flag_key(device_serial), "True", ex=getattr(settings, "SCRIPT_REDIS_STOP_FLAG_EXPIRE", 60))
+
+
+def _finish_run(log, device_serial, pid, return_code, duration, timed_out):
+    """进程结束后保存执行结果并清理 Redis 键"""
+    r = get_redis_conn()
+    # 停止任务视图会删除停止标志并先把日志标记为 stopped
+    stopped = r.get(_stop_flag_key(device_serial)) == "True" or \
+        TaskExecutionLog.objects.filter(id=log.id, exec_status="stopped").exists()
+    log.return_code = return_code
+    log.exec_duration = duration
+    if timed_out:
+        log.exec_status = "timeout"
+        append_and_publish(log, f"\n\n【执行超时】进程{pid}已终止，总耗时：{settings.SCRIPT_EXECUTION_TIMEOUT}秒", "stderr")
+        log.exec_duration = settings.SCRIPT_EXECUTION_TIMEOUT
+    elif stopped:
+        log.exec_status = "stopped"
+        append_and_publish(log, f"\n\n【任务停止】收到手动停止信号，进程{pid}已终止，设备：{device_serial}", "stderr")
+    elif return_code == 0:
+        log.exec_status = "success"
+        append_and_publish(log, f"\n\n【执行完成】返回码：0，耗时：{duration:.2f}秒")
+    else:
+        log.exec_status = "failed"
+        append_and_publish(log, f"\n\n【执行失败】返回码：{return_code}，耗时：{duration:.2f}秒")
+    log.end_time = timezone.now()
+    log.save()
+    log.finish_output()
+    publish_log_status(log)
+    _cleanup_run(log.id, device_serial)
+
+
+def _fail_run(log_id, error):
+    """启动或监督过程中出现异常：日志标记为执行异常"""
+    log = TaskExecutionLog.objects.filter(id=log_id).first()
+    if not log:
+        return
+    log.exec_status = "error"
+    append_and_publish(log, f"\n\n【系统异常】{type(error).__name__}：{str(error)}", "stderr")
+    log.end_time = timezone.now()
+    log.save()
+    log.finish_output()
+    publish_log_status(log)
+
+
+def _cleanup_run(log_id, device_serial):
+    r = get_redis_conn()
+    r.delete(_stop_flag_key(device_serial))
+    r.hdel(settings.SCRIPT_REDIS_PROCESS_HASH, log_id)
+
+
+def _fail_orphan(log_id, process_info):
+    """监督进程在脚本执行中退出：日志标记为执行异常，清理进程信息并释放设备租约"""
+    device_serial = process_info.get("device_serial") or ""
+    log = TaskExecutionLog.objects.filter(id=log_id, exec_status="running").first()
+    if log:
+        log.exec_status = "error"
+        append_and_publish(
+            log, f"\n\n【系统异常】执行监督进程异常退出，脚本（进程{process_info.get('pid')}）执行中断", "stderr"
+        )
+        log.end_time = timezone.now()
+        log.save()
+        log.finish_output()
+        publish_log_status(log)
+    _cleanup_run(log_id, device_serial)
+    if device_serial:
+        release_lease(device_serial, lease_owner("script", log_id))
+
+
+class ScriptSupervisor:
+    """常驻执行监督进程"""
+
+    def __init__(self, max_runs=None, threads=None):
+        self.max_runs = max_runs or settings.SCRIPT_SUPERVISOR_MAX_RUNS
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads or settings.SCRIPT_SUPERVISOR_THREADS,
+            thread_name_prefix="script-supervisor"
+        )
+        self.host = socket.gethostname()
+        self.started_at = time.time()
+        self.supervisor_id = f"{self.host}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.processing_key = _processing_key(self.supervisor_id)
+        self.stopping = False
+        self.loop = None
+        self.stop_event = None
+        self.semaphore = None
+        # log_id -> 子进程 / 写入器
+        self.processes = {}
+        self.writers = {}
+        # 正在刷新的写入器（同一写入器同时只安排一次刷新）
+        self.flushing = set()
+        self.runs = set()
+        self.metrics = {"started": 0, "finished": 0, "timeouts": 0, "errors": 0}
+
+    # ===================== 生命周期 =====================
+    def run(self):
+        """阻塞运行，直到调用 stop() 或收到 SIGINT/SIGTERM"""
+        asyncio.run(self._main())
+
+    def stop(self):
+        """停止领取新任务并终止正在执行的脚本（可在其他线程调用）"""
+        if self.loop is not None and self.stop_event is not None:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        self.semaphore = asyncio.Semaphore(self.max_runs)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self.loop.add_signal_handler(sig, self.stop_event.set)
+            except (NotImplementedError, RuntimeError):
+                # Windows 事件循环不支持信号处理，由 KeyboardInterrupt 退出
+                pass
+        logger.info(f"脚本执行监督进程已启动（{self.supervisor_id}）：最多同时执行{self.max_runs}个脚本")
+        try:
+            await self._call(self._write_state)
+        except redis.RedisError as e:
+            logger.warning(f"写入执行监督进程状态失败：{str(e)}")
+        await self._recover_dead()
+        fetcher = self.loop.create_task(self._fetch_loop())
+        loops = [self.loop.create_task(self._flush_loop()), self.loop.create_task(self._heartbeat_loop())]
+        try:
+            await self.stop_event.wait()
+        finally:
+            self.stopping = True
+            self._terminate_all()
+            # 领取循环最多等待一次 BLMOVE，不直接取消，停止期间领取的任务由 _requeue 放回队列
+            await asyncio.gather(fetcher, return_exceptions=True)
+            while self.runs:
+                # 停止前已领取、尚未启动的任务启动后同样终止
+                self._terminate_all()
+                await asyncio.wait(list(self.runs), timeout=1)
+            for task in loops:
+                task.cancel()
+            await self._call(self._clear_state)
+            self.executor.shutdown(wait=False)
+            logger.info(f"脚本执行监督进程已停止：{self.metrics}")
+
+    def _terminate_all(self):
+        for process in list(self.processes.values()):
+            if process.returncode is None:
+                self.loop.run_in_executor(self.executor, _graceful_terminate_process, process.pid, 1)
+
+    async def _call(self, func, *args, **kwargs):
+        """在线程池中执行阻塞调用"""
+        return await self.loop.run_in_executor(self.executor, functools.partial(_blocking, func, *args, **kwargs))
+
+    # ===================== 领取任务 =====================
+    def _pop(self):
+        """领取一个任务：原子地移到本进程的处理中列表（执行结束后由 _ack 删除）"""
+        client = get_redis(fallback=False)
+        if client is None:
+            time.sleep(POP_TIMEOUT)
+            return None
+        return client.blmove(settings.SCRIPT_SUPERVISOR_QUEUE, self.processing_key, POP_TIMEOUT, "LEFT", "RIGHT")
+
+    def _ack(self, raw):
+        """任务处理完毕，从处理中列表删除"""
+        client = get_redis(fallback=False)
+        if client is None:
+            logger.error(f"Redis不可用，脚本任务未从处理中列表删除：{raw}")
+            return
+        client.lrem(self.processing_key, 1, raw)
+
+    def _requeue(self, raw):
+        """把处理中的任务放回队首，交给其他监督进程（停止期间领取的任务、接管的未启动任务）"""
+        client = get_redis(fallback=False)
+        if client is None:
+            # 任务仍在处理中列表，由其他监督进程接管
+            logger.error(f"Redis不可用，脚本任务未放回队列：{raw}")
+            return
+        pipe = client.pipeline(transaction=True)
+        pipe.lrem(self.processing_key, 1, raw)
+        pipe.lpush(settings.SCRIPT_SUPERVISOR_QUEUE, raw)
+        pipe.execute()
+
+    async def _recover_dead(self):
+        try:
+            await self._call(self._recover)
+        except Exception as e:
+            logger.error(f"接管异常退出的执行监督进程的任务失败：{str(e)}", exc_info=True)
+
+    def _recover(self):
+        """接管心跳已过期的监督进程的处理中任务，返回接管的任务数"""
+        client = get_redis(fallback=False)
+        if client is None:
+            return 0
+        recovered = 0
+        for supervisor_id in client.smembers(_registry_key()):
+            if supervisor_id == self.supervisor_id or client.exists(_alive_key(supervisor_id)):
+                continue
+            # 逐条移到本进程的处理中列表再处理，接管过程中本进程退出也不会丢失
+            while True:
+                raw = client.lmove(_processing_key(supervisor_id), self.processing_key, "LEFT", "RIGHT")
+                if raw is None:
+                    break
+                self._recover_job(client, raw)
+                recovered += 1
+            client.srem(_registry_key(), supervisor_id)
+            logger.warning(f"执行监督进程{supervisor_id}已异常退出，接管其处理中的脚本任务")
+        return recovered
+
+    def _recover_job(self, client, raw):
+        try:
+            job = json.loads(raw)
+        except ValueError:
+            logger.error(f"丢弃无法解析的脚本任务：{raw}")
+            client.lrem(self.processing_key, 1, raw)
+            return
+        log_id = job["log_id"]
+        process_info = client.hget(settings.SCRIPT_REDIS_PROCESS_HASH, log_id)
+        if process_info:
+            # 脚本已启动：子进程随监督进程中断，无法继续监督
+            _fail_orphan(log_id, json.loads(process_info))
+            client.lrem(self.processing_key, 1, raw)
+            logger.warning(f"脚本任务{log_id}执行中监督进程异常退出，已标记为执行异常")
+        else:
+            self._requeue(raw)
+            logger.info(f"脚本任务{log_id}尚未启动，已重新放回队列")
+
+    async def _fetch_loop(self):
+        while not self.stopping:
+            await self.semaphore.acquire()
+            try:
+                raw = await self._call(self._pop)
+                if raw is not None and self.stopping:
+                    await self._call(self._requeue, raw)
+                    raw = None
+                job = json.loads(raw) if raw is not None else None
+            except ValueError as e:
+                self.semaphore.release()
+                logger.error(f"丢弃无法解析的脚本任务：{raw}（{str(e)}）")
+                await self._call(self._ack, raw)
+                continue
+            except redis.RedisError as e:
+                self.semaphore.release()
+                logger.warning(f"领取脚本任务失败：{str(e)}")
+                await asyncio.sleep(POP_TIMEOUT)
+                continue
+            if job is None:
+                self.semaphore.release()
+                continue
+            task = self.loop.create_task(self._supervise(job, raw))
+            self.runs.add(task)
+            task.add_done_callback(self.runs.discard)
+
+    # ===================== 执行脚本 =====================
+    async def _supervise(self, job, raw):
+        log_id = job["log_id"]
+        owner = lease_owner("script", log_id)
+        device_serial = ""
+        held = False
+        try:
+            device_serial = await self._call(_device_serial, job["device_id"])
+            # 执行期间持有设备租约（由进程内续期线程续期），结束后自动启动该设备排队中的下一个任务
+            position = await self._call(
+                request_lease, device_serial, owner, payload={"python_path": job.get("python_path")}
+            )
+            if position:
+                await self._call(_mark_queued, log_id, position)
+                return
+            held = True
+            get_lease_renewer().add(device_serial, owner)
+            # 脚本运行期间占用设备的 background 通道，界面发起的adb命令会被限流
+            try:
+                token = await self._call(
+                    acquire_slot,
+                    device_serial,
+                    lane=LANE_BACKGROUND,
+                    wait=settings.ADB_GOVERNOR_BACKGROUND_WAIT,
+                    ttl=settings.SCRIPT_EXECUTION_TIMEOUT + 120
+                )
+            except DeviceBusyError as e:
+                await self._call(_mark_device_busy, log_id, e)
+                return
+            try:
+                await self._run(job, device_serial)
+            finally:
+                await self._call(release_slot, device_serial, LANE_BACKGROUND, token)
+        except Exception as e:
+            self.metrics["errors"] += 1
+            logger.error(f"脚本任务{log_id}执行失败：{str(e)}", exc_info=True)
+            try:
+                await self._call(_fail_run, log_id, e)
+            except Exception as err:
+                logger.error(f"保存脚本任务{log_id}异常状态失败：{str(err)}")
+        finally:
+            if held:
+                try:
+                    await self._call(release_lease, device_serial, owner)
+                except Exception as e:
+                    logger.error(f"释放脚本任务{log_id}设备租约失败：{str(e)}")
+            try:
+                await self._call(self._ack, raw)
+            except redis.RedisError as e:
+                logger.error(f"脚本任务{log_id}从处理中列表删除失败：{str(e)}")
+            self.semaphore.release()
+
+    async def _run(self, job, device_serial):
+        log_id = job["log_id"]
+        log = await self._call(TaskExecutionLog.objects.get, id=log_id)
+        run = await self._call(_prepare_script_run, job["task_id"], job["device_id"], job.get("python_path"))
+        process = await asyncio.create_subprocess_exec(
+            *run["argv"],
+            cwd=run["script_dir"],
+            env=run["env"],
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        self.processes[log_id] = process
+        self.metrics["started"] += 1
+        writer = CoalescingLogWriter(log, f"script_log_{log_id}", threaded=False)
+        self.writers[log_id] = writer
+        timed_out = False
+        timer = None
+        try:
+            await self._call(_register_process, log_id, job, process.pid, device_serial)
+            writer.write(_script_log_header(run, process.pid, job.get("celery_task_id")))
+            start_time = time.time()
+
+            def on_timeout():
+                nonlocal timed_out
+                timed_out = True
+                self.loop.create_task(self._timeout(log_id, process, writer, device_serial))
+
+            timer = self.loop.call_later(settings.SCRIPT_EXECUTION_TIMEOUT, on_timeout)
+            await asyncio.gather(
+                self._pump(process.stdout, writer, True),
+                self._pump(process.stderr, writer, False)
+            )
+            return_code = await process.wait()
+        except BaseException:
+            if process.returncode is None:
+                await self._call(_graceful_terminate_process, process.pid, 1)
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            self.processes.pop(log_id, None)
+            self.writers.pop(log_id, None)
+            await self._call(writer.close)
+
+        duration = time.time() - start_time
+        await self._call(_finish_run, log, device_serial, process.pid, return_code, duration, timed_out)
+        self.metrics["finished"] += 1
+
+    async def _pump(self, stream, writer, is_stdout):
+        """读取一个输出管道直到关闭（跨块的多字节字符会正确拼接）"""
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        while True:
+            data = await stream.read(READ_CHUNK_BYTES)
+            if not data:
+                writer.write(decoder.decode(b"", final=True), is_stdout)
+                return
+            writer.write(decoder.decode(data), is_stdout)
+            if writer.due:
+                self._schedule_flush(writer)
+
+    async def _timeout(self, log_id, process, writer, device_serial):
+        """执行超时：发送停止信号，等待脚本优雅退出后终止进程"""
+        self.metrics["timeouts"] += 1
+        logger.info(f"任务{log_id}执行超时（{settings.SCRIPT_EXECUTION_TIMEOUT}秒），发送停止信号...")
+        writer.write(f"\n\n【执行超时】超过{settings.SCRIPT_EXECUTION_TIMEOUT}秒，已发送停止信号，等待脚本优雅退出...", is_stdout=False)
+        try:
+            await self._call(_send_timeout_signal, device_serial)
+        except redis.RedisError as e:
+            logger.warning(f"发送任务{log_id}停止信号失败：{str(e)}")
+        await self._call(_graceful_terminate_process, process.pid)
+
+    # ===================== 刷新与心跳 =====================
+    def _schedule_flush(self, writer):
+        if writer in self.flushing:
+            return
+        self.flushing.add(writer)
+        future = self.loop.run_in_executor(self.executor, _blocking, writer.flush)
+        future.add_done_callback(lambda _: self.flushing.discard(writer))
+
+    async def _flush_loop(self):
+        interval = settings.SCRIPT_LOG_FLUSH_INTERVAL_MS / 1000
+        while True:
+            await asyncio.sleep(interval)
+            for writer in list(self.writers.values()):
+                if writer.pending_bytes:
+                    self._schedule_flush(writer)
+
+    def _write_state(self):
+        client = get_redis(fallback=False)
+        if client is None:
+            return
+        key = settings.SCRIPT_SUPERVISOR_STATE_KEY
+        pipe = client.pipeline(transaction=False)
+        pipe.hset(key, mapping={
+            "pid": os.getpid(),
+            "host": self.host,
+            "running": len(self.processes),
+            "max_runs": self.max_runs,
+            "started_at": self.started_at,
+            "updated_at": time.time(),
+        })
+        pipe.expire(key, settings.SCRIPT_SUPERVISOR_HEARTBEAT * 3)
+        pipe.set(_alive_key(self.supervisor_id), self.host, ex=settings.SCRIPT_SUPERVISOR_HEARTBEAT * 3)
+        pipe.sadd(_registry_key(), self.supervisor_id)
+        pipe.execute()
+
+    def _clear_state(self):
+        client = get_redis(fallback=False)
+        if client is not None:
+            client.delete(settings.SCRIPT_SUPERVISOR_STATE_KEY, _alive_key(self.supervisor_id))
+            # 处理中列表还有任务（如放回队列失败）时保留登记，由其他监督进程接管
+            if not client.llen(self.processing_key):
+                client.srem(_registry_key(), self.supervisor_id)
+
+    async def _heartbeat_loop(self):
+        while True:
+            try:
+                await self._call(self._write_state)
+            except redis.RedisError as e:
+                logger.warning(f"写入执行监督进程状态失败：{str(e)}")
+            await self._recover_dead()
+            await asyncio.sleep(settings.SCRIPT_SUPERVISOR_HEARTBEAT)
+
+
+# ===================== 提交任务 =====================
+def supervisor_alive(client=None):
+    """是否有存活的执行监督进程（心跳未过期）"""
+    client = client or get_redis(fallback=False)
+    if client is None:
+        return False
+    try:
+        return bool(client.exists(settings.SCRIPT_SUPERVISOR_STATE_KEY))
+    except redis.RedisError as e:
+        logger.warning(f"读取执行监督进程状态失败：{str(e)}")
+        return False
+
+
+def enqueue_script_run(task_id, device_id, log_id, python_path, celery_task_id=None):
+    """把脚本任务交给执行监督进程；没有存活的监督进程或 Redis 不可用时返回 False"""
+    client = get_redis(fallback=False)
+    if not supervisor_alive(client):
+        return False
+    try:
+        client.rpush(settings.SCRIPT_SUPERVISOR_QUEUE, json.dumps({
+            "task_id": task_id,
+            "device_id": device_id,
+            "log_id": log_id,
+            "python_path": python_path,
+            "celery_task_id": celery_task_id,
+        }))
+    except redis.RedisError as e:
+        logger.warning(f"提交脚本任务{log_id}到执行监督进程失败：{str(e)}")
+        return False
+    logger.info(f"脚本任务{log_id}已提交到执行监督进程")
+    return True
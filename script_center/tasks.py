@@ -3,7 +3,6 @@ import sys
 import time
 import psutil
 import os
-import redis
 import json
 import threading
 from celery import shared_task
@@ -11,6 +10,11 @@ from django.utils import timezone
 from django.conf import settings  # 【新增】导入Django settings
 from .models import ScriptTask, TaskExecutionLog
 from adb_manager.models import ADBDevice
+from adb_manager.property_cache import get_device_properties
+from adb_manager.device_governor import LANE_BACKGROUND, DeviceBusyError, device_slot
+from adb_manager.device_lease import hold_lease, lease_owner
+from common.redis_client import get_redis
+from .log_writer import CoalescingLogWriter, append_and_publish, publish_log_status
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,52 +22,13 @@ logger = logging.getLogger(__name__)
 stdout_buffer = {}
 stderr_buffer = {}
 
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 
-# ====================== 优化：全局 Redis 连接池（使用settings配置） ======================
-REDIS_POOL = None
-
-
-def read_stream(stream, buffer_key, log, is_stdout=True):
-    """实时读取子进程输出流（线程执行）+ 推送WebSocket"""
-    global stdout_buffer, stderr_buffer
-    buffer = []
-    channel_layer = get_channel_layer()
+def read_stream(stream, buffer_key, writer, is_stdout=True):
+    """实时读取子进程输出流（线程执行），交给合并写入器按时间/大小窗口保存并推送WebSocket"""
     try:
         for line in iter(stream.readline, ''):
             if line:
-                buffer.append(line)
-                if is_stdout:
-                    log.stdout += line
-                else:
-                    log.stderr += line
-                log.save()
-                async_to_sync(channel_layer.group_send)(
-                    f'script_log_{log.id}',
-                    {
-                        'type': 'log_update',
-                        'data': {
-                            'stdout': log.stdout,
-                            'stderr': log.stderr,
-                            'status': log.exec_status
-                        }
-                    }
-                )
-                sys.stdout.flush()
-        if buffer:
-            log.save()
-            async_to_sync(channel_layer.group_send)(
-                f'script_log_{log.id}',
-                {
-                    'type': 'log_update',
-                    'data': {
-                        'stdout': log.stdout,
-                        'stderr': log.stderr,
-                        'status': log.exec_status
-                    }
-                }
-            )
+                writer.write(line, is_stdout)
     except Exception as e:
         logger.error(f"读取子进程{buffer_key}流失败：{str(e)}")
     finally:
@@ -71,23 +36,8 @@ def read_stream(stream, buffer_key, log, is_stdout=True):
 
 
 def get_redis_conn():
-    """优化：使用连接池 + settings配置"""
-    global REDIS_POOL
-    if REDIS_POOL is None:
-        REDIS_POOL = redis.ConnectionPool(
-            host=settings.REDIS_HOST,  # 【修改】使用settings
-            port=settings.REDIS_PORT,  # 【修改】使用settings
-            db=settings.REDIS_DB,      # 【修改】使用settings
-            decode_responses=True,
-            socket_timeout=settings.REDIS_SOCKET_TIMEOUT  # 【修改】使用settings
-        )
-    try:
-        r = redis.Redis(connection_pool=REDIS_POOL)
-        r.ping()
-        return r
-    except Exception as e:
-        logger.error(f"Redis连接失败：{str(e)}")
-        return None
+    """获取Redis连接（共享连接池；Redis不可用时返回进程内存降级存储）"""
+    return get_redis()
 
 
 def _graceful_terminate_process(pid: int, wait_time: int = None):
@@ -126,50 +76,143 @@ def _graceful_terminate_process(pid: int, wait_time: int = None):
 
 
 # ====================== 核心：抽离执行逻辑（兼容异步/同步） ======================
+def _prepare_script_run(task_id, device_id, python_path):
+    """
+    准备脚本执行参数（后台线程/Celery 与执行监督进程共用）
+    :return: {"task", "device", "device_serial", "device_info", "real_python_path", "script_dir", "command", "argv", "env"}
+    """
+    task = ScriptTask.objects.get(id=task_id)
+    device = ADBDevice.objects.get(id=device_id)
+    device_serial = device.adb_connect_str
+
+    input_python_path = python_path or task.python_path
+
+    real_python_path = input_python_path
+    if settings.SCRIPT_PYTHON_WARNING_KEYWORD in input_python_path:  # 【修改】使用settings（你原有配置里有这个）
+        possible_paths = settings.PYTHON_FALLBACK_PATHS  # 【修改】使用settings
+        for path in possible_paths:
+            if os.path.exists(path):
+                real_python_path = path
+                logger.info(f"替换Python路径：{input_python_path} → {real_python_path}")
+                break
+
+    if not os.path.exists(real_python_path):
+        raise Exception(f"Python路径无效：{real_python_path}（原始传入路径：{input_python_path}）")
+    logger.info(f"使用Python路径：{real_python_path}，是否存在：{os.path.exists(real_python_path)}")
+
+    # 执行前读取设备信息（只读属性走开机周期缓存，命中时不发adb命令）
+    props = get_device_properties(device_serial) if device_serial else {}
+    device_info = " ".join(filter(None, [
+        props.get("ro.product.brand"),
+        props.get("ro.product.model"),
+        f"Android {props['ro.build.version.release']}" if props.get("ro.build.version.release") else ""
+    ])) or "未知"
+
+    env = os.environ.copy()
+    env.update({
+        'PYTHONIOENCODING': 'utf-8',
+        'PYTHONLEGACYWINDOWSSTDIO': 'utf-8',
+        'LC_ALL': 'en_US.UTF-8',
+        'LANG': 'en_US.UTF-8'
+    })
+    return {
+        "task": task,
+        "device": device,
+        "device_serial": device_serial,
+        "device_info": device_info,
+        "real_python_path": real_python_path,
+        "script_dir": os.path.dirname(task.script_path),
+        "command": f'"{real_python_path}" -X utf8 "{task.script_path}" "{device_serial}"',
+        "argv": [real_python_path, "-X", "utf8", task.script_path, device_serial],
+        "env": env,
+    }
+
+
+def _script_log_header(run, pid, celery_task_id=None):
+    return f"""【执行环境信息】
+工作目录：{run["script_dir"]}
+Python路径：{run["real_python_path"]}
+Python路径是否存在：{os.path.exists(run["real_python_path"])}
+执行命令：{run["command"]}
+系统编码：{sys.getfilesystemencoding()}
+Python IO编码：{os.environ.get('PYTHONIOENCODING', '未设置')}
+进程ID：{pid}
+设备：{run["device_serial"]}（{run["device_info"]}）
+Celery任务ID：{celery_task_id or '同步执行（无）'}
+
+【执行日志】
+任务启动时间：{timezone.now()}
+"""
+
+
+def _mark_device_busy(log_id, error):
+    """设备 background 通道排队超时：日志标记为执行异常"""
+    logger.warning(f"脚本任务{log_id}未执行：{str(error)}")
+    TaskExecutionLog.objects.filter(id=log_id).update(exec_status="error", end_time=timezone.now())
+    log = TaskExecutionLog.objects.filter(id=log_id).first()
+    if log:
+        append_and_publish(log, f"【设备忙】{str(error)}，设备正在执行其他脚本任务", "stderr")
+        publish_log_status(log)
+
+
+def _mark_queued(log_id, position):
+    """启动时设备租约已被其他任务持有（租约过期后被接手）：日志重新标记为排队中，设备空闲后自动启动"""
+    logger.warning(f"脚本任务{log_id}未执行：设备正被其他任务占用，已重新排队（第{position}位）")
+    TaskExecutionLog.objects.filter(id=log_id).update(exec_status="queued")
+    log = TaskExecutionLog.objects.filter(id=log_id).first()
+    if log:
+        append_and_publish(log, f"\n【排队中】设备正在执行其他任务，已重新加入等待队列（第{position}位），设备空闲后自动开始\n")
+        publish_log_status(log)
+
+
 def _execute_script_core(task_id, device_id, log_id, python_path, celery_task_id=None):
     """核心执行逻辑（被 Celery 任务 和 后台线程 共同调用）"""
+    if settings.SCRIPT_SUPERVISOR_ENABLED:
+        # 交给执行监督进程后立即返回，不再占用 worker 名额
+        from .supervisor import enqueue_script_run
+        if enqueue_script_run(task_id, device_id, log_id, python_path, celery_task_id):
+            return {"status": "queued", "log_id": log_id}
+        logger.warning(f"执行监督进程不可用，脚本任务{log_id}在当前进程执行")
+    device = ADBDevice.objects.filter(id=device_id).first()
+    device_serial = device.adb_connect_str if device else ""
+    # 执行期间持有设备租约，结束后自动启动该设备排队中的下一个任务
+    with hold_lease(device_serial, lease_owner("script", log_id), payload={"python_path": python_path}) as position:
+        if position:
+            _mark_queued(log_id, position)
+            return {"status": "queued", "log_id": log_id}
+        # 脚本运行期间占用设备的 background 通道，界面发起的adb命令会被限流
+        try:
+            with device_slot(
+                device_serial,
+                lane=LANE_BACKGROUND,
+                wait=settings.ADB_GOVERNOR_BACKGROUND_WAIT,
+                ttl=settings.SCRIPT_EXECUTION_TIMEOUT + 120
+            ):
+                return _run_script(task_id, device_id, log_id, python_path, celery_task_id)
+        except DeviceBusyError as e:
+            _mark_device_busy(log_id, e)
+            return {"status": "error", "msg": str(e)}
+
+
+def _run_script(task_id, device_id, log_id, python_path, celery_task_id=None):
     log = None
     device_serial = ""
     r = get_redis_conn()
     process = None
     stdout_thread = None
     stderr_thread = None
+    writer = None
     try:
-        task = ScriptTask.objects.get(id=task_id)
-        device = ADBDevice.objects.get(id=device_id)
         log = TaskExecutionLog.objects.get(id=log_id)
-        device_serial = device.adb_connect_str
-
-        input_python_path = python_path or task.python_path
-
-        real_python_path = input_python_path
-        if settings.SCRIPT_PYTHON_WARNING_KEYWORD in input_python_path:  # 【修改】使用settings（你原有配置里有这个）
-            possible_paths = settings.PYTHON_FALLBACK_PATHS  # 【修改】使用settings
-            for path in possible_paths:
-                if os.path.exists(path):
-                    real_python_path = path
-                    logger.info(f"替换Python路径：{input_python_path} → {real_python_path}")
-                    break
-
-        if not os.path.exists(real_python_path):
-            raise Exception(f"Python路径无效：{real_python_path}（原始传入路径：{input_python_path}）")
-        logger.info(f"使用Python路径：{real_python_path}，是否存在：{os.path.exists(real_python_path)}")
-
-        script_dir = os.path.dirname(task.script_path)
-        command = f'"{real_python_path}" -X utf8 "{task.script_path}" "{device_serial}"'
-        env = os.environ.copy()
-        env.update({
-            'PYTHONIOENCODING': 'utf-8',
-            'PYTHONLEGACYWINDOWSSTDIO': 'utf-8',
-            'LC_ALL': 'en_US.UTF-8',
-            'LANG': 'en_US.UTF-8'
-        })
+        run = _prepare_script_run(task_id, device_id, python_path)
+        device_serial = run["device_serial"]
+        script_dir, command = run["script_dir"], run["command"]
 
         process = subprocess.Popen(
             command,
             shell=True,
             cwd=script_dir,
-            env=env,
+            env=run["env"],
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             encoding="utf-8",
@@ -191,43 +234,18 @@ def _execute_script_core(task_id, device_id, log_id, python_path, celery_task_id
 
         # 移除 Celery 专属的 update_state（同步时不需要）
         start_time = time.time()
-        log.stdout = log.stdout or ''
-        log_header = f"""【执行环境信息】
-工作目录：{script_dir}
-Python路径：{real_python_path}
-Python路径是否存在：{os.path.exists(real_python_path)}
-执行命令：{command}
-系统编码：{sys.getfilesystemencoding()}
-Python IO编码：{os.environ.get('PYTHONIOENCODING', '未设置')}
-进程ID：{process.pid}
-Celery任务ID：{celery_task_id or '同步执行（无）'}
-
-【执行日志】
-任务启动时间：{timezone.now()}
-"""
-        log.stdout += log_header
-        log.save()
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f'script_log_{log_id}',
-            {
-                'type': 'log_update',
-                'data': {
-                    'stdout': log.stdout,
-                    'stderr': log.stderr,
-                    'status': log.exec_status
-                }
-            }
-        )
-
+        log_header = _script_log_header(run, process.pid, celery_task_id)
+        # 两个读取线程共用一个写入器；写入器关闭前只通过 writer.write 追加输出
+        writer = CoalescingLogWriter(log, f'script_log_{log_id}')
+        writer.write(log_header)
         stdout_thread = threading.Thread(
             target=read_stream,
-            args=(process.stdout, f"stdout_{process.pid}", log, True),
+            args=(process.stdout, f"stdout_{process.pid}", writer, True),
             daemon=True
         )
         stderr_thread = threading.Thread(
             target=read_stream,
-            args=(process.stderr, f"stderr_{process.pid}", log, False),
+            args=(process.stderr, f"stderr_{process.pid}", writer, False),
             daemon=True
         )
         stdout_thread.start()
@@ -237,6 +255,7 @@ Celery任务ID：{celery_task_id or '同步执行（无）'}
             process.wait(timeout=settings.SCRIPT_EXECUTION_TIMEOUT)  # 【修改】使用settings
             stdout_thread.join(timeout=5)
             stderr_thread.join(timeout=5)
+            writer.close()
 
             return_code = process.returncode
             log.return_code = return_code
@@ -244,10 +263,10 @@ Celery任务ID：{celery_task_id or '同步执行（无）'}
 
             if return_code == 0:
                 log.exec_status = "success"
-                log.stdout += f"\n\n【执行完成】返回码：0，耗时：{log.exec_duration:.2f}秒"
+                append_and_publish(log, f"\n\n【执行完成】返回码：0，耗时：{log.exec_duration:.2f}秒")
             else:
                 log.exec_status = "failed"
-                log.stdout += f"\n\n【执行失败】返回码：{return_code}，耗时：{log.exec_duration:.2f}秒"
+                append_and_publish(log, f"\n\n【执行失败】返回码：{return_code}，耗时：{log.exec_duration:.2f}秒")
 
         except subprocess.TimeoutExpired:
             logger.info(f"任务{log_id}执行超时（{settings.SCRIPT_EXECUTION_TIMEOUT}秒），发送停止信号...")  # 【修改】使用settings
@@ -257,14 +276,14 @@ Celery任务ID：{celery_task_id or '同步执行（无）'}
                     "True",
                     ex=settings.SCRIPT_REDIS_STOP_FLAG_EXPIRE  # 【修改】使用你原有配置
                 )
-                log.stderr += f"\n\n【执行超时】超过{settings.SCRIPT_EXECUTION_TIMEOUT}秒，已发送停止信号，等待脚本优雅退出..."  # 【修改】使用settings
-                log.save()
+                writer.write(f"\n\n【执行超时】超过{settings.SCRIPT_EXECUTION_TIMEOUT}秒，已发送停止信号，等待脚本优雅退出...", is_stdout=False)  # 【修改】使用settings
 
             time.sleep(settings.SCRIPT_STOP_WAIT_TIME)  # 【修改】使用你原有配置
             _graceful_terminate_process(process.pid, wait_time=settings.SCRIPT_PROCESS_TERMINATE_WAIT)  # 【修改】使用你原有配置
+            writer.close()
 
             log.exec_status = "timeout"
-            log.stderr += f"\n\n【执行超时】进程{process.pid}已终止，总耗时：{settings.SCRIPT_EXECUTION_TIMEOUT}秒"  # 【修改】使用settings
+            append_and_publish(log, f"\n\n【执行超时】进程{process.pid}已终止，总耗时：{settings.SCRIPT_EXECUTION_TIMEOUT}秒", "stderr")  # 【修改】使用settings
             log.exec_duration = settings.SCRIPT_EXECUTION_TIMEOUT  # 【修改】使用settings
 
         except Exception as e:
@@ -275,18 +294,22 @@ Celery任务ID：{celery_task_id or '同步执行（无）'}
                 stderr_thread.join(timeout=3)
 
                 _graceful_terminate_process(process.pid, wait_time=settings.SCRIPT_PROCESS_TERMINATE_WAIT)  # 【修改】使用你原有配置
+                writer.close()
 
                 log.exec_status = "stopped"
-                log.stderr += f"\n\n【任务停止】收到手动停止信号，进程{process.pid}已终止，设备：{device_serial}"
+                append_and_publish(log, f"\n\n【任务停止】收到手动停止信号，进程{process.pid}已终止，设备：{device_serial}", "stderr")
             else:
                 logger.error(f"任务{log_id}执行异常：{str(e)}")
                 _graceful_terminate_process(process.pid, wait_time=1)  # 紧急终止保持1秒（可根据需要新增配置）
+                writer.close()
                 log.exec_status = "error"
-                log.stderr += f"\n\n【执行异常】{type(e).__name__}：{str(e)}，已终止进程{process.pid}"
+                append_and_publish(log, f"\n\n【执行异常】{type(e).__name__}：{str(e)}，已终止进程{process.pid}", "stderr")
             log.exec_duration = time.time() - start_time
 
         log.end_time = timezone.now()
         log.save()
+        log.finish_output()
+        publish_log_status(log)
 
         if r:
             r.delete(f"{settings.SCRIPT_REDIS_STOP_FLAG_PREFIX}{device_serial}")  # 【修改】使用settings
@@ -296,12 +319,15 @@ Celery任务ID：{celery_task_id or '同步执行（无）'}
 
     except Exception as e:
         logger.error(f"脚本任务执行失败：{str(e)}", exc_info=True)
+        if writer:
+            writer.close()
         if log:
             log.exec_status = "error"
-            current_stderr = log.stderr or ''
-            log.stderr = current_stderr + f"\n\n【系统异常】{type(e).__name__}：{str(e)}"
+            append_and_publish(log, f"\n\n【系统异常】{type(e).__name__}：{str(e)}", "stderr")
             log.end_time = timezone.now()
             log.save()
+            log.finish_output()
+            publish_log_status(log)
         if r:
             r.delete(f"{settings.SCRIPT_REDIS_STOP_FLAG_PREFIX}{device_serial}")  # 【修改】使用settings
             r.hdel(settings.SCRIPT_REDIS_PROCESS_HASH, log_id)  # 【修改】使用settings
@@ -1,3 +1,87 @@
-from django.test import TestCase
+import json
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from . import supervisor
+
+try:
+    import fakeredis
+except ImportError:  # 未安装 fakeredis 时跳过依赖 Redis 的测试
+    fakeredis = None
+
+
+@skipIf(fakeredis is None, "需要安装 fakeredis")
+class ScriptSupervisorQueueTestCase(SimpleTestCase):
+    """执行监督进程的任务队列：领取、确认、放回与接管异常退出的监督进程（fakeredis）"""
+
+    def setUp(self):
+        self.client = fakeredis.FakeRedis(decode_responses=True)
+        patcher = mock.patch.object(supervisor, "get_redis", return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.supervisor = supervisor.ScriptSupervisor(max_runs=1, threads=1)
+        self.addCleanup(self.supervisor.executor.shutdown, wait=False)
+        self.queue = settings.SCRIPT_SUPERVISOR_QUEUE
+
+    def job(self, log_id):
+        return json.dumps({"task_id": 1, "device_id": 1, "log_id": log_id, "python_path": None,
+                           "celery_task_id": None})
+
+    def register_dead(self, supervisor_id, jobs):
+        self.client.sadd(supervisor._registry_key(), supervisor_id)
+        if jobs:
+            self.client.rpush(supervisor._processing_key(supervisor_id), *jobs)
+
+    # ===================== 提交与领取 =====================
+    def test_enqueue_requires_alive_supervisor(self):
+        self.assertFalse(supervisor.enqueue_script_run(1, 1, 10, None))
+        self.assertEqual(self.client.llen(self.queue), 0)
+        self.client.hset(settings.SCRIPT_SUPERVISOR_STATE_KEY, "pid", 1)
+        self.assertTrue(supervisor.enqueue_script_run(1, 1, 10, None))
+        self.assertEqual(json.loads(self.client.lindex(self.queue, 0))["log_id"], 10)
+
+    def test_pop_keeps_job_until_ack(self):
+        self.client.rpush(self.queue, self.job(1), self.job(2))
+        raw = self.supervisor._pop()
+        self.assertEqual(raw, self.job(1))
+        self.assertEqual(self.client.lrange(self.supervisor.processing_key, 0, -1), [raw])
+        self.assertEqual(self.client.lrange(self.queue, 0, -1), [self.job(2)])
+        self.supervisor._ack(raw)
+        self.assertEqual(self.client.llen(self.supervisor.processing_key), 0)
+
+    def test_requeue_puts_job_at_head(self):
+        self.client.rpush(self.queue, self.job(1), self.job(2))
+        raw = self.supervisor._pop()
+        self.supervisor._requeue(raw)
+        self.assertEqual(self.client.lrange(self.queue, 0, -1), [self.job(1), self.job(2)])
+        self.assertEqual(self.client.llen(self.supervisor.processing_key), 0)
+
+    # ===================== 接管 =====================
+    @mock.patch.object(supervisor, "_fail_orphan")
+    def test_recover_dead_supervisor(self, fail_orphan):
+        process_info = {"pid": 123, "device_serial": "dev1"}
+        self.client.hset(settings.SCRIPT_REDIS_PROCESS_HASH, "2", json.dumps(process_info))
+        self.register_dead("dead", [self.job(1), self.job(2), "not json"])
+
+        self.assertEqual(self.supervisor._recover(), 3)
+        # 未启动的任务放回队列，执行中的任务标记为执行异常，无法解析的任务丢弃
+        self.assertEqual(self.client.lrange(self.queue, 0, -1), [self.job(1)])
+        fail_orphan.assert_called_once_with(2, process_info)
+        self.assertEqual(self.client.llen(self.supervisor.processing_key), 0)
+        self.assertEqual(self.client.llen(supervisor._processing_key("dead")), 0)
+        self.assertEqual(self.client.smembers(supervisor._registry_key()), set())
+
+    @mock.patch.object(supervisor, "_fail_orphan")
+    def test_recover_skips_alive_supervisors(self, fail_orphan):
+        self.register_dead("alive", [self.job(1)])
+        self.client.set(supervisor._alive_key("alive"), 1)
+        self.client.sadd(supervisor._registry_key(), self.supervisor.supervisor_id)
+        self.client.rpush(self.supervisor.processing_key, self.job(2))
+
+        self.assertEqual(self.supervisor._recover(), 0)
+        self.assertEqual(self.client.lrange(supervisor._processing_key("alive"), 0, -1), [self.job(1)])
+        self.assertEqual(self.client.lrange(self.supervisor.processing_key, 0, -1), [self.job(2)])
+        self.assertEqual(self.client.smembers(supervisor._registry_key()), {"alive", self.supervisor.supervisor_id})
+        fail_orphan.assert_not_called()
@@ -4,7 +4,7 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.views import View
 from django.urls import reverse
 from urllib.parse import quote
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, Http404
 import logging
 import os
 import subprocess
@@ -14,7 +14,6 @@ import sys
 import locale
 import signal
 import psutil
-import redis
 import json
 from datetime import datetime
 from django.utils import timezone
@@ -26,9 +25,13 @@ from .tasks import (
     _graceful_terminate_process,
     execute_script_sync
 )
+from .log_writer import append_and_publish, publish_log_status
 from .models import ScriptTask, TaskExecutionLog, ScriptTaskManagementLog
 from .forms import ScriptTaskForm
+from common.redis_client import get_redis
 from adb_manager.models import ADBDevice
+from adb_manager.status_store import STALE_STATUS, describe_unavailable, get_status_store
+from adb_manager.device_lease import cancel_lease_wait, lease_owner, queue_positions, request_lease
 
 from django.conf import settings
 
@@ -51,10 +54,6 @@ from django.utils.cache import patch_response_headers
 import hashlib
 
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-# ====================== 优化：全局 Redis 连接池 ======================
-REDIS_POOL = None
-
-
 def scan_builtin_scripts():
     """扫描内置脚本目录，返回脚本列表 [(脚本名称, 脚本绝对路径), ...]"""
     # 新增：检查 settings 配置，如果设置为不显示，直接返回空列表
@@ -105,23 +104,8 @@ os.environ['PYTHONLEGACYWINDOWSSTDIO'] = 'utf-8'
 
 
 def get_redis_conn():
-    """优化：使用连接池"""
-    global REDIS_POOL
-    if REDIS_POOL is None:
-        REDIS_POOL = redis.ConnectionPool(
-            host=get_env_config("REDIS_HOST", "127.0.0.1"),
-            port=get_env_config("REDIS_PORT", 6379, int),
-            db=get_env_config("REDIS_DB", 0, int),
-            decode_responses=True,
-            socket_timeout=2
-        )
-    try:
-        r = redis.Redis(connection_pool=REDIS_POOL)
-        r.ping()
-        return r
-    except Exception as e:
-        logger.error(f"Redis连接失败：{str(e)}")
-        return None
+    """获取Redis连接（共享连接池；Redis不可用时返回进程内存降级存储）"""
+    return get_redis()
 
 
 def save_celery_task(log_id, celery_task_id):
@@ -163,6 +147,59 @@ def send_redis_stop_signal(device_serial, log_id):
         except Exception as e:
             logger.error(f"发送Redis停止信号失败：{str(e)}")
 
+def start_script_run(task_id, device_id, log_id, python_path):
+    """派发脚本执行：优先 Celery 异步，失败则降级到后台线程同步"""
+    try:
+        if settings.USE_CELERY:
+            celery_task = execute_script_task.delay(task_id, device_id, log_id, python_path)
+            save_celery_task(log_id, celery_task.id)
+            logger.info(f"提交Celery任务 - 日志ID：{log_id}，任务ID：{celery_task.id}")
+        else:
+            # 配置关闭 Celery，直接用后台线程
+            logger.info(f"配置USE_CELERY=False，使用后台线程同步执行 - 日志ID：{log_id}")
+            execute_script_sync(task_id, device_id, log_id, python_path)
+    except Exception as celery_err:
+        # Celery 提交失败，优雅降级到后台线程
+        logger.warning(f"Celery任务提交失败，优雅降级到后台线程 - 日志ID：{log_id}，错误：{str(celery_err)}")
+        execute_script_sync(task_id, device_id, log_id, python_path)
+
+
+def queue_script_run(log, device, python_path):
+    """
+    申请设备执行租约：设备空闲时立即派发，否则日志标记为排队中
+    :return: 排队位置（0 表示已派发）
+    """
+    position = request_lease(device.adb_connect_str, lease_owner("script", log.id), payload={"python_path": python_path})
+    if position:
+        log.exec_status = "queued"
+        log.save(update_fields=["exec_status"])
+        append_and_publish(log, f"\n【排队中】设备{device.adb_connect_str}正在执行其他任务，已加入等待队列（第{position}位），设备空闲后自动开始\n")
+        logger.info(f"脚本任务排队 - 日志ID：{log.id}，设备：{device.adb_connect_str}，位置：{position}")
+    else:
+        start_script_run(log.task_id, device.id, log.id, python_path)
+    return position
+
+
+def start_queued_run(log_id, payload):
+    """设备租约交给排队中的脚本任务后启动执行（见 adb_manager.device_lease）；日志已停止或删除时返回 False"""
+    if not TaskExecutionLog.objects.filter(id=log_id, exec_status="queued").update(
+            exec_status="running", start_time=timezone.now()):
+        return False
+    log = TaskExecutionLog.objects.get(id=log_id)
+    append_and_publish(log, f"设备已空闲，开始执行 - 时间：{timezone.now()}\n")
+    publish_log_status(log)
+    start_script_run(log.task_id, log.device_id, log.id, payload.get("python_path") or sys.executable)
+    return True
+
+
+def attach_queue_positions(logs):
+    """为排队中的日志附加排队位置（log.queue_position）"""
+    queued = [log for log in logs if log.exec_status == "queued"]
+    positions = queue_positions((log.device.adb_connect_str, lease_owner("script", log.id)) for log in queued)
+    for log in queued:
+        log.queue_position = positions.get((log.device.adb_connect_str, lease_owner("script", log.id)))
+
+
 def format_duration(duration):
     if duration:
         return f"{duration:.2f}秒"
@@ -358,11 +395,11 @@ class ExecuteTaskView(View):
         # 因为 device_status 是 @property，不是数据库列
         devices = ADBDevice.objects.filter(is_active=True).only('id', 'device_name', 'device_ip', 'device_port',
                                                                 'device_serial')
-        device_list = []
-        for dev in devices:
-            # 这里可以正常调用 @property dev.device_status
-            dev.status = dev.device_status
-            device_list.append(dev)
+        device_list = list(devices)
+        # 批量读取设备状态（一次Redis往返，替代逐台 dev.device_status）
+        statuses = get_status_store().get_status_many(device_list)
+        for dev in device_list:
+            dev.status = statuses.get(dev.connect_identifier, "invalid")
 
         # ====================== 新增：分页获取最近执行日志 ======================
         page = request.GET.get('page', 1)
@@ -387,9 +424,10 @@ class ExecuteTaskView(View):
             tasks_query = tasks_query.filter(task_name__icontains=search_query)
         tasks = tasks_query
 
-        # 修改：兼容同步：只要状态是 running 就算运行中
+        # 修改：兼容同步：只要状态是 running 就算运行中（排队中的任务同样可以停止）
+        attach_queue_positions(recent_logs)
         for log in recent_logs:
-            log.is_running = log.exec_status == "running"
+            log.is_running = log.exec_status in ("running", "queued")
             logger.info(f"日志ID：{log.id}，状态：{log.exec_status}，是否运行中：{log.is_running}")
 
         context = {
@@ -426,24 +464,32 @@ class ExecuteTaskView(View):
                 return redirect(f"{reverse('script_center:execute_task')}?msg={error_msg}")
 
             offline_devices = []
+            stale_devices = []
             valid_device_ids = []
+            selected_devices = {str(dev.id): dev for dev in ADBDevice.objects.filter(id__in=device_ids)}
+            statuses = get_status_store().get_status_many(selected_devices.values())
             for device_id in device_ids:
-                device = get_object_or_404(ADBDevice, id=device_id)
-                # 修复：这里直接调用 @property
-                current_status = device.device_status
+                device = selected_devices.get(str(device_id))
+                if device is None:
+                    raise Http404(f"设备不存在：{device_id}")
+                current_status = statuses.get(device.connect_identifier, "invalid")
                 logger.info(f"检查设备状态 - ID：{device_id}，名称：{device.device_name}，状态：{current_status}")
 
-                if current_status != "online":
+                # 状态过期（超过有效期未收到心跳）的设备可能已断开，不派发任务
+                if current_status == STALE_STATUS:
+                    stale_devices.append(device.device_name)
+                elif current_status != "online":
                     offline_devices.append(device.device_name)
                 else:
                     valid_device_ids.append(device_id)
 
             if not valid_device_ids:
-                error_msg = quote(f"所选设备均离线！离线设备：{','.join(offline_devices)}")
+                error_msg = quote(f"所选设备均不可用！{describe_unavailable(offline_devices, stale_devices)}")
                 logger.error(error_msg)
                 return redirect(f"{reverse('script_center:execute_task')}?msg={error_msg}")
 
             python_warning = get_python_warning(python_path)
+            queued_count = 0
             for device_id in valid_device_ids:
                 device = get_object_or_404(ADBDevice, id=device_id)
                 log = TaskExecutionLog.objects.create(
@@ -451,32 +497,22 @@ class ExecuteTaskView(View):
                     device=device,
                     exec_status="running",
                     exec_command=f"准备执行：{python_path} {task.script_path} {device.adb_connect_str}",
-                    stdout=f"任务启动中（{'Celery异步' if settings.USE_CELERY else '后台线程同步'}执行）{python_warning}",
                     start_time=timezone.now()
                 )
+                append_and_publish(log, f"任务启动中（{'Celery异步' if settings.USE_CELERY else '后台线程同步'}执行）{python_warning}")
                 logger.info(f"创建执行日志 - ID：{log.id}，设备：{device.device_name}")
 
-                try:
-                    # ====================== 核心：异步/同步降级逻辑 ======================
-                    if settings.USE_CELERY:
-                        # 优先尝试 Celery 异步
-                        celery_task = execute_script_task.delay(task.id, device.id, log.id, python_path)
-                        save_celery_task(log.id, celery_task.id)
-                        logger.info(f"提交Celery任务 - 日志ID：{log.id}，任务ID：{celery_task.id}")
-                    else:
-                        # 配置关闭 Celery，直接用后台线程
-                        logger.info(f"配置USE_CELERY=False，使用后台线程同步执行 - 日志ID：{log.id}")
-                        execute_script_sync(task.id, device.id, log.id, python_path)
-                except Exception as celery_err:
-                    # Celery 提交失败，优雅降级到后台线程
-                    logger.warning(f"Celery任务提交失败，优雅降级到后台线程 - 日志ID：{log.id}，错误：{str(celery_err)}")
-                    execute_script_sync(task.id, device.id, log.id, python_path)
-
-            success_msg = quote(
-                f"任务【{task.task_name}】已启动！共{len(valid_device_ids)}个在线设备执行中{python_warning}"
-            )
-            if offline_devices:
-                success_msg = quote(f"{success_msg}（离线设备已过滤：{','.join(offline_devices)}）")
+                # ====================== 核心：设备租约 + 异步/同步降级逻辑 ======================
+                if queue_script_run(log, device, python_path):
+                    queued_count += 1
+
+            started_count = len(valid_device_ids) - queued_count
+            success_msg = f"任务【{task.task_name}】已启动！共{started_count}个在线设备执行中{python_warning}"
+            if queued_count:
+                success_msg = f"{success_msg}，{queued_count}个设备正忙已排队，空闲后自动开始"
+            if offline_devices or stale_devices:
+                success_msg = f"{success_msg}（已过滤{describe_unavailable(offline_devices, stale_devices)}）"
+            success_msg = quote(success_msg)
             logger.info(success_msg)
             return redirect(f"{reverse('script_center:execute_task')}?msg={success_msg}")
 
@@ -493,6 +529,8 @@ class StopTaskView(View):
         try:
             logger.info(f"接收到停止任务请求 - 日志ID：{log_id}")
             log = get_object_or_404(TaskExecutionLog.objects.select_related('task', 'device'), id=log_id)
+            if log.exec_status == "queued":
+                return self._cancel_queued(log)
             if log.exec_status != "running":
                 error_msg = quote(f"任务【{log.task.task_name}】未在运行中！当前状态：{log.exec_status}")
                 logger.warning(error_msg)
@@ -541,14 +579,17 @@ class StopTaskView(View):
                         r.delete(f"airtest_stop_flag_{device_serial}")
 
             log.exec_status = "stopped"
-            log.stderr = f"""任务已手动停止（优雅退出）
+            append_and_publish(log, f"""
+任务已手动停止（优雅退出）
 - 停止时间：{timezone.now()}
 - 设备序列号：{device_serial or '未知'}
 - Celery任务ID：{celery_task_id or '同步执行（无）'}
 - 终止日志ID：{log_id}
-- 已等待{stop_wait_time}秒让脚本完成清理和日志输出"""
+- 已等待{stop_wait_time}秒让脚本完成清理和日志输出""", "stderr")
             log.end_time = timezone.now()
             log.save()
+            log.finish_output()
+            publish_log_status(log)
 
             success_msg = quote(f"任务【{log.task.task_name}】已发送停止信号，脚本已优雅退出！")
             logger.info(success_msg)
@@ -560,14 +601,35 @@ class StopTaskView(View):
             return redirect(f"{reverse('script_center:execute_task')}?msg={error_msg}")
 
 
+    def _cancel_queued(self, log):
+        """停止排队中的任务：移出设备等待队列（已开始执行时需重新停止）"""
+        if not TaskExecutionLog.objects.filter(id=log.id, exec_status="queued").update(
+                exec_status="stopped", end_time=timezone.now()):
+            error_msg = quote(f"任务【{log.task.task_name}】已开始执行，请刷新后重新停止")
+            return redirect(f"{reverse('script_center:execute_task')}?msg={error_msg}")
+        cancel_lease_wait(log.device.adb_connect_str, lease_owner("script", log.id))
+        log.exec_status = "stopped"
+        append_and_publish(log, f"\n任务已在排队中取消 - 取消时间：{timezone.now()}", "stderr")
+        log.finish_output()
+        publish_log_status(log)
+        success_msg = quote(f"任务【{log.task.task_name}】已取消排队！")
+        logger.info(success_msg)
+        return redirect(f"{reverse('script_center:execute_task')}?msg={success_msg}")
+
+
 class LogDetailView(View):
     def get(self, request, log_id):
         # 优化：select_related
         log = get_object_or_404(TaskExecutionLog.objects.select_related('task', 'device'), id=log_id)
         log.exec_duration_str = format_duration(log.exec_duration)
+        attach_queue_positions([log])
         context = {
             "page_title": f"执行日志 - {log.task.task_name}",
-            "log": log
+            "log": log,
+            # 只渲染输出末尾（完整输出可能有几十MB），执行中的后续内容由 WebSocket 从末尾偏移续传
+            "output": {stream: log.output_tail(stream, settings.SCRIPT_LOG_WS_TAIL_BYTES)
+                       for stream in ("stdout", "stderr")},
+            "tail_kb": settings.SCRIPT_LOG_WS_TAIL_BYTES // 1024,
         }
         return render(request, "script_center/log_detail.html", context)
 
@@ -846,18 +908,11 @@ class BuiltinScriptDetailView(View):
             device=device,
             exec_status="running",
             exec_command=f"准备执行内置脚本: {script.name}",
-            stdout="任务启动中...",
             start_time=timezone.now()
         )
+        append_and_publish(log, "任务启动中...")
 
-        # 3. 调用 Celery
-        from .tasks import execute_script_task
-        celery_task = execute_script_task.delay(temp_task.id, device.id, log.id, sys.executable)
-
-        # 4. 保存 Redis
-        try:
-            save_celery_task(log.id, celery_task.id)
-        except:
-            pass
+        # 3. 申请设备租约并派发（设备正忙时排队，空闲后自动开始）
+        queue_script_run(log, device, sys.executable)
 
         return redirect(reverse('script_center:log_detail', args=[log.id]))
@@ -1,7 +1,8 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import OrchestrationLog, StepExecutionLog
+from .models import OrchestrationLog
+from .signals import build_log_update
 
 
 class OrchestrationLogConsumer(AsyncWebsocketConsumer):
@@ -23,33 +24,24 @@ class OrchestrationLogConsumer(AsyncWebsocketConsumer):
         )
 
     async def log_update(self, event):
+        # 状态与各输出的字节数（不含输出内容，见 signals.build_log_update）
         log_data = event['data']
         await self.send(text_data=json.dumps({
             'type': 'log_update',
             'data': log_data
         }))
 
+    async def log_append(self, event):
+        # 增量输出：{"step_log_id"（编排日志自身的输出没有）, "status",
+        #           "stdout": {"offset"（步骤日志中的偏移）, "orch_offset"（编排日志中的偏移）, "text"}, "stderr": {...}}
+        await self.send(text_data=json.dumps({
+            'type': 'log_append',
+            'data': event['data']
+        }))
+
     @database_sync_to_async
     def get_log_data(self):
         try:
-            orch_log = OrchestrationLog.objects.get(id=self.log_id)
-            step_logs = StepExecutionLog.objects.filter(
-                orchestration_log=orch_log
-            ).order_by('step__execution_order')  # 修正排序字段
-
-            # 核心修改：返回step_log.id，匹配前端元素ID
-            step_data = [{
-                'step_log_id': step.id,  # 步骤日志ID（前端元素ID）
-                'order': step.step.execution_order,  # 步骤序号
-                'stdout': step.stdout,
-                'stderr': step.stderr
-            } for step in step_logs]
-
-            return {
-                'stdout': orch_log.stdout,
-                'stderr': orch_log.stderr,
-                'status': orch_log.exec_status,
-                'step_data': step_data
-            }
+            return build_log_update(OrchestrationLog.objects.get(id=self.log_id))
         except OrchestrationLog.DoesNotExist:
-            return {'error': '日志不存在'}
\ No newline at end of file
+            return {'error': '日志不存在'}
@@ -0,0 +1,104 @@
+# 执行输出改为追加式日志存储（common.log_store）：原 stdout/stderr 列保留为 legacy_*，
+# 记录中只新增输出位置与字节数/行数
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task_orchestration', '0006_orchestrationmanagementlog_original_task_id'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='orchestrationlog',
+            old_name='stdout',
+            new_name='legacy_stdout',
+        ),
+        migrations.AlterField(
+            model_name='orchestrationlog',
+            name='legacy_stdout',
+            field=models.TextField(blank=True, null=True, verbose_name='标准输出（旧版）'),
+        ),
+        migrations.RenameField(
+            model_name='orchestrationlog',
+            old_name='stderr',
+            new_name='legacy_stderr',
+        ),
+        migrations.AlterField(
+            model_name='orchestrationlog',
+            name='legacy_stderr',
+            field=models.TextField(blank=True, null=True, verbose_name='错误输出（旧版）'),
+        ),
+        migrations.AddField(
+            model_name='orchestrationlog',
+            name='output_ref',
+            field=models.CharField(blank=True, default='', max_length=200, verbose_name='输出存储位置'),
+        ),
+        migrations.AddField(
+            model_name='orchestrationlog',
+            name='stdout_bytes',
+            field=models.BigIntegerField(default=0, verbose_name='标准输出字节数'),
+        ),
+        migrations.AddField(
+            model_name='orchestrationlog',
+            name='stdout_lines',
+            field=models.BigIntegerField(default=0, verbose_name='标准输出行数'),
+        ),
+        migrations.AddField(
+            model_name='orchestrationlog',
+            name='stderr_bytes',
+            field=models.BigIntegerField(default=0, verbose_name='错误输出字节数'),
+        ),
+        migrations.AddField(
+            model_name='orchestrationlog',
+            name='stderr_lines',
+            field=models.BigIntegerField(default=0, verbose_name='错误输出行数'),
+        ),
+        migrations.RenameField(
+            model_name='stepexecutionlog',
+            old_name='stdout',
+            new_name='legacy_stdout',
+        ),
+        migrations.AlterField(
+            model_name='stepexecutionlog',
+            name='legacy_stdout',
+            field=models.TextField(blank=True, null=True, verbose_name='标准输出（旧版）'),
+        ),
+        migrations.RenameField(
+            model_name='stepexecutionlog',
+            old_name='stderr',
+            new_name='legacy_stderr',
+        ),
+        migrations.AlterField(
+            model_name='stepexecutionlog',
+            name='legacy_stderr',
+            field=models.TextField(blank=True, null=True, verbose_name='错误输出（旧版）'),
+        ),
+        migrations.AddField(
+            model_name='stepexecutionlog',
+            name='output_ref',
+            field=models.CharField(blank=True, default='', max_length=200, verbose_name='输出存储位置'),
+        ),
+        migrations.AddField(
+            model_name='stepexecutionlog',
+            name='stdout_bytes',
+            field=models.BigIntegerField(default=0, verbose_name='标准输出字节数'),
+        ),
+        migrations.AddField(
+            model_name='stepexecutionlog',
+            name='stdout_lines',
+            field=models.BigIntegerField(default=0, verbose_name='标准输出行数'),
+        ),
+        migrations.AddField(
+            model_name='stepexecutionlog',
+            name='stderr_bytes',
+            field=models.BigIntegerField(default=0, verbose_name='错误输出字节数'),
+        ),
+        migrations.AddField(
+            model_name='stepexecutionlog',
+            name='stderr_lines',
+            field=models.BigIntegerField(default=0, verbose_name='错误输出行数'),
+        ),
+    ]
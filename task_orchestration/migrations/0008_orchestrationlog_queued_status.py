@@ -0,0 +1,18 @@
+# 设备执行租约：设备被占用时提交的编排任务进入等待队列（queued）
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('task_orchestration', '0007_execution_output_store'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orchestrationlog',
+            name='exec_status',
+            field=models.CharField(choices=[('queued', '排队中'), ('running', '执行中'), ('completed', '已完成'), ('part_failed', '部分失败'), ('failed', '执行失败'), ('stopped', '手动停止')], default='running', max_length=20, verbose_name='执行状态'),
+        ),
+    ]
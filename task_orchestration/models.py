@@ -2,6 +2,7 @@ from django.db import models
 from django.utils import timezone
 from script_center.models import ScriptTask
 from adb_manager.models import ADBDevice
+from common.models import ExecutionOutputModel
 
 class OrchestrationTask(models.Model):
     """编排任务主表（包含多个子任务步骤）"""
@@ -50,9 +51,11 @@ class TaskStep(models.Model):
     def __str__(self):
         return f"{self.orchestration.name} - 步骤{self.execution_order} - {self.script_task.task_name}"
 
-class OrchestrationLog(models.Model):
-    """编排任务执行日志（补充详细字段）"""
+class OrchestrationLog(ExecutionOutputModel):
+    """编排任务执行日志（补充详细字段；输出内容见 ExecutionOutputModel）"""
+    OUTPUT_KIND = "orch"
     EXEC_STATUS = (
+        ("queued", "排队中"),
         ("running", "执行中"),
         ("completed", "已完成"),
         ("part_failed", "部分失败"),
@@ -73,8 +76,9 @@ class OrchestrationLog(models.Model):
     )
     exec_status = models.CharField("执行状态", max_length=20, choices=EXEC_STATUS, default="running")
     exec_command = models.TextField("执行命令", blank=True, null=True)
-    stdout = models.TextField("标准输出", blank=True, null=True)
-    stderr = models.TextField("错误输出", blank=True, null=True)
+    # 升级前保存在记录中的输出（新日志为空）
+    legacy_stdout = models.TextField("标准输出（旧版）", blank=True, null=True)
+    legacy_stderr = models.TextField("错误输出（旧版）", blank=True, null=True)
     exec_duration = models.FloatField("执行耗时(秒)", blank=True, null=True)
     total_steps = models.PositiveIntegerField("总步骤数")
     completed_steps = models.PositiveIntegerField("已完成步骤数", default=0)
@@ -90,8 +94,9 @@ class OrchestrationLog(models.Model):
     def __str__(self):
         return f"{self.orchestration.name} - {self.device.device_name} - {self.exec_status}"
 
-class StepExecutionLog(models.Model):
-    """子任务步骤执行日志（补充详细字段）"""
+class StepExecutionLog(ExecutionOutputModel):
+    """子任务步骤执行日志（补充详细字段；输出内容见 ExecutionOutputModel）"""
+    OUTPUT_KIND = "step"
     EXEC_STATUS = (
         ("pending", "待执行"),
         ("running", "执行中"),
@@ -114,8 +119,9 @@ class StepExecutionLog(models.Model):
     )
     exec_status = models.CharField("执行状态", max_length=20, choices=EXEC_STATUS, default="pending")
     exec_command = models.TextField("执行命令", blank=True, null=True)
-    stdout = models.TextField("标准输出", blank=True, null=True)
-    stderr = models.TextField("错误输出", blank=True, null=True)
+    # 升级前保存在记录中的输出（新日志为空）
+    legacy_stdout = models.TextField("标准输出（旧版）", blank=True, null=True)
+    legacy_stderr = models.TextField("错误输出（旧版）", blank=True, null=True)
     return_code = models.IntegerField("返回码", blank=True, null=True)
     exec_duration = models.FloatField("执行耗时(秒)", blank=True, null=True)
     error_msg = models.TextField("步骤错误信息", blank=True, null=True)
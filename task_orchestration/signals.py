@@ -1,40 +1,44 @@
-import json
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
 from .models import OrchestrationLog, StepExecutionLog
 
 
-@receiver(post_save, sender=OrchestrationLog)
-def notify_orchestration_update(sender, instance, **kwargs):
-    """编排日志更新时，通过WebSocket推送最新日志"""
-    channel_layer = get_channel_layer()
-
-    # 核心修正1：排序字段改为 TaskStep 的 execution_order（关联查询）
+def build_log_update(orch_log):
+    """
+    log_update 推送的数据：状态与各输出的字节数（不含输出内容）
+    输出内容由 log_append 增量推送，页面发现字节数与已显示的偏移对不上时再拉取末尾
+    """
     step_logs = StepExecutionLog.objects.filter(
-        orchestration_log=instance
-    ).order_by('step__execution_order')  # 替换原错误的 order_by('order')
+        orchestration_log=orch_log
+    ).select_related('step').order_by('step__execution_order')
 
-    # 核心修正2：step_data 中增加 step_log_id（匹配前端元素ID）
     step_data = [{
         'step_log_id': step.id,  # 步骤日志ID（前端元素ID）
         'order': step.step.execution_order,  # StepExecutionLog -> TaskStep -> execution_order
-        'stdout': step.stdout,
-        'stderr': step.stderr
+        'status': step.exec_status,
+        'stdout_bytes': step.output_size('stdout'),
+        'stderr_bytes': step.output_size('stderr'),
     } for step in step_logs]
 
-    # 推送日志到 WebSocket 分组
+    return {
+        'status': orch_log.exec_status,
+        'stdout_bytes': orch_log.output_size('stdout'),
+        'stderr_bytes': orch_log.output_size('stderr'),
+        'step_data': step_data
+    }
+
+
+@receiver(post_save, sender=OrchestrationLog)
+def notify_orchestration_update(sender, instance, **kwargs):
+    """编排日志更新时，通过WebSocket推送状态与输出字节数"""
+    channel_layer = get_channel_layer()
     async_to_sync(channel_layer.group_send)(
         f'orchestration_log_{instance.id}',
         {
             'type': 'log_update',
-            'data': {
-                'stdout': instance.stdout,
-                'stderr': instance.stderr,
-                'status': instance.exec_status,
-                'step_data': step_data
-            }
+            'data': build_log_update(instance)
         }
     )
 
@@ -42,4 +46,11 @@ def notify_orchestration_update(sender, instance, **kwargs):
 @receiver(post_save, sender=StepExecutionLog)
 def notify_step_update(sender, instance, **kwargs):
     """步骤日志更新时，触发编排日志的推送（保证步骤日志实时更新）"""
-    notify_orchestration_update(OrchestrationLog, instance.orchestration_log)
\ No newline at end of file
+    notify_orchestration_update(OrchestrationLog, instance.orchestration_log)
+
+
+@receiver(post_delete, sender=OrchestrationLog)
+@receiver(post_delete, sender=StepExecutionLog)
+def delete_log_output(sender, instance, **kwargs):
+    """删除日志时同时删除存储中的输出"""
+    instance.delete_output()
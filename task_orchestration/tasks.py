@@ -11,28 +11,20 @@ from django.conf import settings  # 【优化】顶部导入Settings
 from .models import OrchestrationLog, StepExecutionLog, TaskStep
 from script_center.models import ScriptTask
 from adb_manager.models import ADBDevice
+from adb_manager.device_governor import LANE_BACKGROUND, DeviceBusyError, device_slot
+from common.redis_client import get_redis
+from script_center.log_writer import CoalescingLogWriter
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 import logging
-import redis
 
 logger = logging.getLogger(__name__)
 
 
 # ===================== Redis操作工具函数（支持本地降级，复用Settings） =====================
 def get_redis_conn():
-    """获取Redis连接（失败返回None）"""
-    try:
-        r = redis.Redis(
-            host=settings.REDIS_HOST,  # 【优化】复用Settings
-            port=settings.REDIS_PORT,  # 【优化】复用Settings
-            db=settings.REDIS_DB,  # 【优化】复用Settings
-            decode_responses=True,
-            socket_timeout=settings.REDIS_SOCKET_TIMEOUT  # 【优化】复用Settings
-        )
-        r.ping()
-        return r
-    except Exception as e:
-        logger.warning(f"Redis连接失败，将使用本地存储：{str(e)}")
-        return None
+    """获取Redis连接（共享连接池，失败后按退避间隔重新探测；不可用时返回None，使用本地存储）"""
+    return get_redis(fallback=False)
 
 
 # 本地备份存储（Redis不可用时使用）
@@ -95,6 +87,31 @@ def _execute_step_core(step_id, orch_log_id, device_data, task_id=None):
     执行单个步骤的核心逻辑（无Celery依赖）
     :param task_id: Celery任务ID（本地执行时为None）
     """
+    # 步骤运行期间占用设备的 background 通道，界面发起的adb命令会被限流
+    device = ADBDevice.objects.filter(id=device_data['id']).first()
+    step = TaskStep.objects.filter(id=step_id).first()
+    try:
+        with device_slot(
+            device.adb_connect_str if device else "",
+            lane=LANE_BACKGROUND,
+            wait=settings.ADB_GOVERNOR_BACKGROUND_WAIT,
+            ttl=(step.run_duration if step else 0) + settings.ORCH_STEP_TIMEOUT_BUFFER + 60
+        ):
+            return _run_step(step_id, orch_log_id, device_data, task_id)
+    except DeviceBusyError as e:
+        logger.warning(f"步骤{step_id}未执行：{str(e)}")
+        if step:
+            StepExecutionLog.objects.create(
+                orchestration_log_id=orch_log_id,
+                step=step,
+                exec_status="error",
+                error_msg=f"设备忙：{str(e)}",
+                end_time=timezone.now()
+            )
+        return {"status": "error", "msg": str(e)}
+
+
+def _run_step(step_id, orch_log_id, device_data, task_id=None):
     try:
         # 获取任务实例
         step = TaskStep.objects.get(id=step_id)
@@ -169,23 +186,22 @@ def _execute_step_core(step_id, orch_log_id, device_data, task_id=None):
         save_running_process(process_key, process_info)
         logger.info(f"进程{process.pid}已存储，KEY={process_key}，本地执行={task_id is None}")
 
-        # 实时读取输出
+        # 实时读取输出（按时间/大小窗口合并写入步骤日志与编排日志，每次刷新推送一次新增内容）
         step_start_time = time.time()
-        stdout_buffer = []
-        stderr_buffer = []
         return_code = None
+        writer = StepLogWriter(step_log, orch_log)
 
         try:
             # 并行读取stdout和stderr
             import threading
             stdout_thread = threading.Thread(
                 target=_read_stream,
-                args=(process.stdout, stdout_buffer, step_log, orch_log, 'stdout'),
+                args=(process.stdout, writer, 'stdout'),
                 daemon=True
             )
             stderr_thread = threading.Thread(
                 target=_read_stream,
-                args=(process.stderr, stderr_buffer, step_log, orch_log, 'stderr'),
+                args=(process.stderr, writer, 'stderr'),
                 daemon=True
             )
 
@@ -204,9 +220,7 @@ def _execute_step_core(step_id, orch_log_id, device_data, task_id=None):
 
             return_code = process.returncode
 
-            # 更新步骤日志最终状态
-            step_log.stdout = ''.join(stdout_buffer)
-            step_log.stderr = ''.join(stderr_buffer)
+            # 更新步骤日志最终状态（输出已由读取线程实时追加）
             step_log.return_code = return_code
             step_log.exec_duration = time.time() - step_start_time
 
@@ -223,9 +237,7 @@ def _execute_step_core(step_id, orch_log_id, device_data, task_id=None):
             step_log.exec_status = "timeout"
             step_log.error_msg = f"执行超时（{step.run_duration}秒）"
             step_log.exec_duration = step.run_duration
-            stderr_msg = f"进程超时被终止（{step.run_duration}秒）"
-            stderr_buffer.append(stderr_msg)
-            step_log.stderr = ''.join(stderr_buffer) + stderr_msg
+            writer.write(f"进程超时被终止（{step.run_duration}秒）\n", is_stdout=False)
 
         except Exception as e:
             if process:
@@ -235,17 +247,14 @@ def _execute_step_core(step_id, orch_log_id, device_data, task_id=None):
 描述：{str(e)}"""
             step_log.exec_status = "error"
             step_log.error_msg = error_detail
-            step_log.stderr = ''.join(stderr_buffer) + error_detail
+            writer.write(f"{error_detail}\n", is_stdout=False)
             step_log.exec_duration = time.time() - step_start_time
 
-        # 最终保存步骤日志
+        # 写入剩余输出后再保存步骤日志（步骤输出已同步追加到编排日志）
+        writer.close()
         step_log.end_time = timezone.now()
         step_log.save()
-
-        # 实时更新编排日志
-        orch_log.stdout = f"{orch_log.stdout}\n{step_log.stdout}"
-        orch_log.stderr = f"{orch_log.stderr}\n{step_log.stderr}"
-        orch_log.save()
+        step_log.finish_output()
 
         # 清理进程信息
         remove_running_process(process_key)
@@ -258,6 +267,7 @@ def _execute_step_core(step_id, orch_log_id, device_data, task_id=None):
             step_log.error_msg = f"任务执行异常：{str(e)}"
             step_log.end_time = timezone.now()
             step_log.save()
+            step_log.finish_output()
         logger.error(f"步骤执行失败：{str(e)}", exc_info=True)
         return {"status": "error", "msg": str(e)}
 
@@ -270,22 +280,52 @@ def execute_step_task(self, step_id, orch_log_id, device_data):
 
 
 # ===================== 辅助函数（去硬编码，复用配置） =====================
-def _read_stream(stream, buffer, step_log, orch_log, stream_type):
-    """实时读取进程输出并更新日志"""
+def append_orchestration_output(orch_log, text, stream="stdout"):
+    """
+    追加编排日志自身的输出（进度、停止/取消提示等）并推送 log_append
+    推送内容不含 step_log_id，orch_offset 为这段输出在编排日志中的起始偏移
+    """
+    if not text:
+        return
+    offset = orch_log.append_output(text, stream)
     try:
-        for line in iter(stream.readline, ''):
-            buffer.append(line)
-            if stream_type == 'stdout':
-                step_log.stdout = ''.join(buffer)
-            else:
-                step_log.stderr = ''.join(buffer)
-            step_log.save()
+        async_to_sync(get_channel_layer().group_send)(
+            f"orchestration_log_{orch_log.id}",
+            {'type': 'log_append', 'data': {'status': orch_log.exec_status,
+                                            stream: {'orch_offset': offset, 'text': text}}}
+        )
+    except Exception as e:
+        logger.warning(f"推送编排日志{orch_log.id}更新失败：{str(e)}")
 
-            if stream_type == 'stdout':
-                orch_log.stdout = f"{orch_log.stdout}\n{line}"
-            else:
-                orch_log.stderr = f"{orch_log.stderr}\n{line}"
-            orch_log.save()
+
+class StepLogWriter(CoalescingLogWriter):
+    """
+    步骤输出合并写入：每次刷新把新增内容同时追加到步骤日志与编排日志，
+    并向 orchestration_log_<id> 组推送一次 log_append（只含新增内容，不再重读完整日志）：
+    offset 为步骤日志中的偏移，orch_offset 为编排日志中的偏移
+    """
+
+    def __init__(self, step_log, orch_log, **kwargs):
+        self.orch_log = orch_log
+        super().__init__(step_log, group_name=f"orchestration_log_{orch_log.id}", **kwargs)
+
+    def _append(self, stdout, stderr):
+        data = {'status': self.orch_log.exec_status, 'step_log_id': self.log.id}
+        for stream, text in (("stdout", stdout), ("stderr", stderr)):
+            if text:
+                data[stream] = {
+                    'offset': self.log.append_output(text, stream),
+                    'orch_offset': self.orch_log.append_output(text, stream),
+                    'text': text,
+                }
+        return data
+
+
+def _read_stream(stream, writer, stream_type):
+    """实时读取进程输出，放入合并写入器（由写入器按窗口追加到步骤日志与编排日志）"""
+    try:
+        for line in iter(stream.readline, ''):
+            writer.write(line, is_stdout=stream_type == 'stdout')
     except Exception as e:
         logger.error(f"读取{stream_type}失败：{str(e)}")
 
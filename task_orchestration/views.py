@@ -1,7 +1,7 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.views import View
 from django.urls import reverse
-from django.http import JsonResponse
+from django.http import JsonResponse, Http404
 from django.utils import timezone
 from urllib.parse import quote
 import logging
@@ -17,10 +17,18 @@ from django.conf import settings
 
 # 导入模型、表单和核心逻辑
 from adb_manager.models import ADBDevice
+from adb_manager.status_store import STALE_STATUS, describe_unavailable, get_status_store
+from adb_manager.device_lease import (
+    PRIORITY_MANUAL, PRIORITY_SCHEDULED, cancel_lease_wait, hold_lease, lease_owner, queue_positions, request_lease
+)
 from .models import OrchestrationTask, TaskStep, OrchestrationLog, StepExecutionLog, OrchestrationManagementLog
 from .forms import OrchestrationTaskForm, TaskStepForm, TaskStepEditForm
 from script_center.models import ScriptTask, TaskExecutionLog
-from .tasks import _execute_step_core, kill_redis_process, get_running_process, remove_running_process, get_redis_conn
+from .tasks import (
+    _execute_step_core, append_orchestration_output, kill_redis_process, get_running_process, remove_running_process,
+    get_redis_conn
+)
+from .signals import notify_orchestration_update
 
 from celery.result import AsyncResult
 
@@ -120,6 +128,52 @@ def execute_task_async(step_id, orch_log_id, device_data, process_key):
     thread.start()
     return 'local', thread
 
+def _append_lines(orch_log, stdout_lines, stderr_lines):
+    """把累积的进度行追加到编排日志输出（并推送 log_append）后清空列表"""
+    if stdout_lines:
+        append_orchestration_output(orch_log, "\n".join(stdout_lines) + "\n")
+        stdout_lines.clear()
+    if stderr_lines:
+        append_orchestration_output(orch_log, "\n".join(stderr_lines) + "\n", "stderr")
+        stderr_lines.clear()
+
+
+def queue_orchestration_run(orch_log, steps, device, priority=PRIORITY_MANUAL):
+    """
+    申请设备执行租约：设备空闲时立即启动执行线程，否则编排日志标记为排队中
+    :return: 排队位置（0 表示已启动）
+    """
+    position = request_lease(device.adb_connect_str, lease_owner("orch", orch_log.id), priority)
+    if position:
+        orch_log.exec_status = "queued"
+        orch_log.save(update_fields=["exec_status"])
+        append_orchestration_output(orch_log, f"【排队中】设备{device.adb_connect_str}正在执行其他任务，已加入等待队列（第{position}位），设备空闲后自动开始\n")
+        logger.info(f"编排任务排队 - 日志ID：{orch_log.id}，设备：{device.adb_connect_str}，位置：{position}")
+    else:
+        threading.Thread(
+            target=ExecuteOrchestrationAPIView()._run_orchestration,
+            args=(orch_log, steps, device),
+            daemon=True
+        ).start()
+    return position
+
+
+def start_queued_run(log_id, payload):
+    """设备租约交给排队中的编排任务后启动执行（见 adb_manager.device_lease）；日志已停止或删除时返回 False"""
+    if not OrchestrationLog.objects.filter(id=log_id, exec_status="queued").update(
+            exec_status="running", start_time=timezone.now()):
+        return False
+    orch_log = OrchestrationLog.objects.select_related("orchestration", "device").get(id=log_id)
+    append_orchestration_output(orch_log, f"设备已空闲，开始执行 - 时间：{timezone.now()}\n")
+    notify_orchestration_update(OrchestrationLog, orch_log)
+    threading.Thread(
+        target=ExecuteOrchestrationAPIView()._run_orchestration,
+        args=(orch_log, orch_log.orchestration.steps.order_by("execution_order").all(), orch_log.device),
+        daemon=True
+    ).start()
+    return True
+
+
 def wait_task_completion(task_type, task_handle, step, orch_log, process_key):
     """
     统一等待任务完成接口
@@ -367,9 +421,10 @@ class ExecuteOrchestrationAPIView(View):
 
         # 查找可用设备
         device = None
-        active_devices = ADBDevice.objects.filter(is_active=True)
+        active_devices = list(ADBDevice.objects.filter(is_active=True))
+        statuses = get_status_store().get_status_many(active_devices)
         for dev in active_devices:
-            if dev.device_status == "online":
+            if statuses.get(dev.connect_identifier) == "online":
                 device = dev
                 break
 
@@ -386,27 +441,36 @@ class ExecuteOrchestrationAPIView(View):
             total_steps=steps.count(),
             exec_status="running",
             exec_command=f"编排任务启动：{orchestration.name} - 设备：{device.adb_connect_str}",
-            stdout=f"编排任务启动中 - 时间：{timezone.now()}",
             start_time=timezone.now()
         )
+        append_orchestration_output(orch_log, f"编排任务启动中 - 时间：{timezone.now()}\n")
 
-        # 启动执行线程
-        threading.Thread(
-            target=self._run_orchestration,
-            args=(orch_log, steps, device),
-            daemon=True
-        ).start()
+        # 申请设备租约并启动执行线程（设备正忙时排队；定时任务优先级低于手动执行）
+        user = getattr(request, "user", None)
+        priority = PRIORITY_MANUAL if user is not None and user.is_authenticated else PRIORITY_SCHEDULED
+        position = queue_orchestration_run(orch_log, steps, device, priority)
 
         return JsonResponse({
             "status": "success",
-            "msg": "编排任务已启动",
+            "msg": f"设备正忙，编排任务已排队（第{position}位）" if position else "编排任务已启动",
             "log_id": orch_log.id
         })
 
     def _run_orchestration(self, orch_log, steps, device):
+        """执行编排任务（执行期间持有设备租约，结束后自动启动该设备排队中的下一个任务）"""
+        with hold_lease(device.adb_connect_str, lease_owner("orch", orch_log.id)) as position:
+            if position:
+                # 启动前租约已过期并被其他任务接手
+                OrchestrationLog.objects.filter(id=orch_log.id).update(exec_status="queued")
+                append_orchestration_output(orch_log, f"【排队中】设备正在执行其他任务，已重新加入等待队列（第{position}位）\n")
+                return
+            self._run_steps(orch_log, steps, device)
+
+    def _run_steps(self, orch_log, steps, device):
         """执行编排任务核心逻辑（使用优雅降级执行器）"""
         start_total_time = time.time()
-        orch_log_stdout = [orch_log.stdout]
+        # 尚未写入编排日志的进度行（_append_lines 追加后清空）
+        orch_log_stdout = []
         orch_log_stderr = []
 
         try:
@@ -435,8 +499,8 @@ class ExecuteOrchestrationAPIView(View):
                 orch_log_stdout.append(f"超时设置：{step.run_duration}秒")
                 orch_log_stdout.append(f"进程KEY：{process_key}")
 
-                orch_log.stdout = "\n".join(orch_log_stdout)
-                orch_log.save(update_fields=['stdout'])
+                _append_lines(orch_log, orch_log_stdout, orch_log_stderr)
+                notify_orchestration_update(OrchestrationLog, orch_log)
 
                 # 使用统一执行器提交任务
                 try:
@@ -466,8 +530,7 @@ class ExecuteOrchestrationAPIView(View):
                         end_time=timezone.now()
                     )
 
-                    orch_log.stdout = "\n".join(orch_log_stdout)
-                    orch_log.stderr = "\n".join(orch_log_stderr)
+                    _append_lines(orch_log, orch_log_stdout, orch_log_stderr)
                     orch_log.save()
                     continue
 
@@ -544,9 +607,7 @@ class ExecuteOrchestrationAPIView(View):
                         del running_tasks[process_key]
 
                 # 实时更新日志
-                orch_log.stdout = "\n".join(orch_log_stdout)
-                if orch_log_stderr:
-                    orch_log.stderr = "\n".join(orch_log_stderr)
+                _append_lines(orch_log, orch_log_stdout, orch_log_stderr)
                 orch_log.save()
 
             # 所有步骤完成
@@ -561,30 +622,28 @@ class ExecuteOrchestrationAPIView(View):
             if failed_steps > 0:
                 orch_log.exec_status = "part_failed"
                 orch_log.error_msg = f"{failed_steps}个步骤执行异常（超时/失败/错误）"
-                orch_log.stderr = "\n".join(orch_log_stderr)
             else:
                 orch_log.exec_status = "completed"
 
         except Exception as e:
             orch_log.exec_status = "failed"
             orch_log.error_msg = str(e)
-            orch_log.stderr = "\n".join(orch_log_stderr) + f"\n\n编排任务全局错误：{str(e)}"
+            orch_log_stderr.append(f"\n编排任务全局错误：{str(e)}")
             orch_log.exec_duration = time.time() - start_total_time
             orch_log.end_time = timezone.now()
 
         finally:
-            orch_log.stdout = "\n".join(orch_log_stdout)
-            orch_log.stderr = "\n".join(orch_log_stderr)
+            _append_lines(orch_log, orch_log_stdout, orch_log_stderr)
             orch_log.save()
+            orch_log.finish_output()
 
 class OrchestrationExecuteView(View):
     """新版执行页面（添加分页功能）"""
     def get(self, request):
-        devices = ADBDevice.objects.filter(is_active=True)
-        device_list = []
-        for dev in devices:
-            dev.status = dev.device_status
-            device_list.append(dev)
+        device_list = list(ADBDevice.objects.filter(is_active=True))
+        statuses = get_status_store().get_status_many(device_list)
+        for dev in device_list:
+            dev.status = statuses.get(dev.connect_identifier, "invalid")
 
         # 分页处理：获取所有日志并分页
         all_logs = OrchestrationLog.objects.all().order_by("-id")
@@ -601,8 +660,12 @@ class OrchestrationExecuteView(View):
             recent_logs_page = paginator.page(paginator.num_pages)
 
         # 给当前页的日志添加运行状态标记
+        # 排队中的任务同样可以停止
+        queued = [log for log in recent_logs_page if log.exec_status == "queued"]
+        positions = queue_positions((log.device.adb_connect_str, lease_owner("orch", log.id)) for log in queued)
         for log in recent_logs_page:
-            log.is_running = log.exec_status == "running"
+            log.is_running = log.exec_status in ("running", "queued")
+            log.queue_position = positions.get((log.device.adb_connect_str, lease_owner("orch", log.id)))
 
         context = {
             "page_title": "执行编排任务",
@@ -633,19 +696,29 @@ class OrchestrationExecuteView(View):
 
             # 校验设备
             offline_devices = []
+            stale_devices = []
             valid_device_ids = []
+            selected_devices = {str(dev.id): dev for dev in ADBDevice.objects.filter(id__in=device_ids)}
+            statuses = get_status_store().get_status_many(selected_devices.values())
             for device_id in device_ids:
-                device = get_object_or_404(ADBDevice, id=device_id)
-                if device.device_status != "online":
+                device = selected_devices.get(str(device_id))
+                if device is None:
+                    raise Http404(f"设备不存在：{device_id}")
+                # 状态过期（超过有效期未收到心跳）的设备可能已断开，不派发任务
+                current_status = statuses.get(device.connect_identifier)
+                if current_status == STALE_STATUS:
+                    stale_devices.append(device.device_name)
+                elif current_status != "online":
                     offline_devices.append(device.device_name)
                 else:
                     valid_device_ids.append(device_id)
 
             if not valid_device_ids:
-                error_msg = quote(f"所选设备均离线！离线设备：{','.join(offline_devices)}")
+                error_msg = quote(f"所选设备均不可用！{describe_unavailable(offline_devices, stale_devices)}")
                 return redirect(f"{reverse('task_orchestration:execute_orchestration')}?msg={error_msg}")
 
             # 执行每个设备
+            queued_count = 0
             for device_id in valid_device_ids:
                 device = get_object_or_404(ADBDevice, id=device_id)
                 orch_log = OrchestrationLog.objects.create(
@@ -654,19 +727,19 @@ class OrchestrationExecuteView(View):
                     total_steps=steps.count(),
                     exec_status="running",
                     exec_command=f"编排任务批量执行：{orchestration.name} - 设备：{device.adb_connect_str}",
-                    stdout=f"批量执行启动中 - 时间：{timezone.now()}",
                     start_time=timezone.now()
                 )
+                append_orchestration_output(orch_log, f"批量执行启动中 - 时间：{timezone.now()}\n")
 
-                threading.Thread(
-                    target=self._run_orchestration,
-                    args=(orch_log, steps, device),
-                    daemon=True
-                ).start()
+                if queue_orchestration_run(orch_log, steps, device):
+                    queued_count += 1
 
-            success_msg = quote(f"编排任务【{orchestration.name}】已启动！共{len(valid_device_ids)}个设备执行中")
-            if offline_devices:
-                success_msg = quote(f"{success_msg}（离线设备已过滤：{','.join(offline_devices)}）")
+            success_msg = f"编排任务【{orchestration.name}】已启动！共{len(valid_device_ids) - queued_count}个设备执行中"
+            if queued_count:
+                success_msg = f"{success_msg}，{queued_count}个设备正忙已排队，空闲后自动开始"
+            if offline_devices or stale_devices:
+                success_msg = f"{success_msg}（已过滤{describe_unavailable(offline_devices, stale_devices)}）"
+            success_msg = quote(success_msg)
             return redirect(f"{reverse('task_orchestration:execute_orchestration')}?msg={success_msg}")
 
         except Exception as e:
@@ -685,6 +758,8 @@ class StopOrchestrationView(View):
     def get(self, request, log_id):
         try:
             orch_log = get_object_or_404(OrchestrationLog, id=log_id)
+            if orch_log.exec_status == "queued":
+                return self._cancel_queued(orch_log)
             if orch_log.exec_status != "running":
                 error_msg = quote(f"编排任务未在运行中！当前状态：{orch_log.exec_status}")
                 return redirect(f"{reverse('task_orchestration:execute_orchestration')}?msg={error_msg}")
@@ -754,7 +829,7 @@ class StopOrchestrationView(View):
 
             # 更新日志状态
             orch_log.exec_status = "stopped"
-            orch_log.stderr = f"{orch_log.stderr}\n\n任务已手动停止 - 时间：{timezone.now()}"
+            append_orchestration_output(orch_log, f"\n任务已手动停止 - 时间：{timezone.now()}\n", "stderr")
             orch_log.end_time = timezone.now()
             orch_log.save()
 
@@ -776,6 +851,20 @@ class StopOrchestrationView(View):
             error_msg = quote(f"停止失败：{str(e)}")
             return redirect(f"{reverse('task_orchestration:execute_orchestration')}?msg={error_msg}")
 
+    def _cancel_queued(self, orch_log):
+        """停止排队中的编排任务：移出设备等待队列（已开始执行时需重新停止）"""
+        if not OrchestrationLog.objects.filter(id=orch_log.id, exec_status="queued").update(
+                exec_status="stopped", end_time=timezone.now()):
+            error_msg = quote(f"编排任务【{orch_log.orchestration.name}】已开始执行，请刷新后重新停止")
+            return redirect(f"{reverse('task_orchestration:execute_orchestration')}?msg={error_msg}")
+        cancel_lease_wait(orch_log.device.adb_connect_str, lease_owner("orch", orch_log.id))
+        orch_log.exec_status = "stopped"
+        append_orchestration_output(orch_log, f"\n任务已在排队中取消 - 时间：{timezone.now()}\n", "stderr")
+        orch_log.finish_output()
+        notify_orchestration_update(OrchestrationLog, orch_log)
+        success_msg = quote(f"编排任务【{orch_log.orchestration.name}】已取消排队！")
+        return redirect(f"{reverse('task_orchestration:execute_orchestration')}?msg={success_msg}")
+
 class StepDeleteView(View):
     """删除步骤（保持不变）"""
     def get(self, request, step_id):
@@ -785,49 +874,69 @@ class StepDeleteView(View):
         return redirect(reverse("task_orchestration:edit_steps", args=[task_id]))
 
 class OrchestrationLogDetailView(View):
-    """编排日志详情（保持不变）"""
+    """编排日志详情（每个输出只渲染末尾 ORCH_LOG_TAIL_BYTES 字节）"""
     def get(self, request, log_id):
         orch_log = get_object_or_404(OrchestrationLog, id=log_id)
-        step_logs = orch_log.step_logs.all().order_by("step__execution_order")
+        step_logs = list(orch_log.step_logs.select_related("step__script_task").order_by("step__execution_order"))
 
         if orch_log.exec_duration:
             orch_log.exec_duration_str = f"{orch_log.exec_duration:.2f}秒"
         else:
             orch_log.exec_duration_str = "未知"
 
+        for log in [orch_log] + step_logs:
+            log.output = _output_tails(log)
+
         context = {
             "page_title": f"编排执行日志 - {orch_log.orchestration.name}",
             "orch_log": orch_log,
-            "step_logs": step_logs
+            "step_logs": step_logs,
+            "tail_kb": settings.ORCH_LOG_TAIL_BYTES // 1024,
         }
         return render(request, "task_orchestration/log_detail.html", context)
 
+
+def _output_tails(log):
+    """stdout/stderr 末尾（见 ExecutionOutputModel.output_tail）"""
+    return {stream: log.output_tail(stream, settings.ORCH_LOG_TAIL_BYTES) for stream in ("stdout", "stderr")}
+
+
 class OrchestrationLogStatusView(View):
-    """AJAX获取日志状态（保持不变）"""
+    """
+    AJAX获取日志状态：默认只返回状态与各输出的字节数，
+    ?tail=1 时附带每个输出的末尾（output：{"stdout": {"offset", "text", "truncated", "end"}, "stderr": ...}）
+    """
     def get(self, request, log_id):
         try:
             orch_log = get_object_or_404(OrchestrationLog, id=log_id)
-            step_logs = orch_log.step_logs.all().order_by("step__execution_order")
+            with_tail = request.GET.get("tail") == "1"
+            step_logs = orch_log.step_logs.select_related("step").order_by("step__execution_order")
             step_data = []
             for sl in step_logs:
-                step_data.append({
+                item = {
                     "step_log_id": sl.id,
                     "order": sl.step.execution_order,
                     "status": sl.exec_status,
-                    "stdout": sl.stdout,
-                    "stderr": sl.stderr,
+                    "stdout_bytes": sl.output_size("stdout"),
+                    "stderr_bytes": sl.output_size("stderr"),
                     "duration": sl.exec_duration,
                     "return_code": sl.return_code
-                })
+                }
+                if with_tail:
+                    item["output"] = _output_tails(sl)
+                step_data.append(item)
 
-            return JsonResponse({
+            data = {
                 "code": 200,
                 "status": orch_log.exec_status,
-                "stdout": orch_log.stdout,
-                "stderr": orch_log.stderr,
+                "stdout_bytes": orch_log.output_size("stdout"),
+                "stderr_bytes": orch_log.output_size("stderr"),
                 "duration": orch_log.exec_duration,
                 "step_data": step_data
-            })
+            }
+            if with_tail:
+                data["output"] = _output_tails(orch_log)
+            return JsonResponse(data)
         except Exception as e:
             return JsonResponse({
                 "code": 500,